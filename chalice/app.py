@@ -13,12 +13,14 @@ from requests_http_signature import HTTPSignatureAuth
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "chalicelib"))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
+from matrix.common.aws.cloudwatch_handler import CloudwatchHandler
 from matrix.common.aws.redshift_handler import RedshiftHandler
 from matrix.common.aws.sqs_handler import SQSHandler
 from matrix.common.config import MatrixInfraConfig
 
 ecs_client = boto3.client("ecs", region_name=os.environ['AWS_DEFAULT_REGION'])
 redshift_handler = RedshiftHandler()
+cloudwatch_handler = CloudwatchHandler()
 
 
 def create_app():
@@ -38,14 +40,18 @@ def get_chalice_app(flask_app):
         uri_params = app.current_request.uri_params or {}
         path = app.current_request.context["resourcePath"].format(**uri_params)
         req_body = app.current_request.raw_body if app.current_request._body is not None else None
-        with flask_app.test_request_context(path=path,
-                                            base_url="https://{}".format(app.current_request.headers["host"]),
-                                            query_string=app.current_request.query_params,
-                                            method=app.current_request.method,
-                                            headers=list(app.current_request.headers.items()),
-                                            data=req_body,
-                                            environ_base=app.current_request.stage_vars):
-            flask_res = flask_app.full_dispatch_request()
+        try:
+            with flask_app.test_request_context(path=path,
+                                                base_url="https://{}".format(app.current_request.headers["host"]),
+                                                query_string=app.current_request.query_params,
+                                                method=app.current_request.method,
+                                                headers=list(app.current_request.headers.items()),
+                                                data=req_body,
+                                                environ_base=app.current_request.stage_vars):
+                flask_res = flask_app.full_dispatch_request()
+        finally:
+            # Metric datapoints buffered by the request are sent before the Lambda execution environment is frozen
+            cloudwatch_handler.flush()
         res_headers = dict(flask_res.headers)
         # API Gateway/Cloudfront adds a duplicate Content-Length with a different value (not sure why)
         res_headers.pop("Content-Length", None)
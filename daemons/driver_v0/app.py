@@ -1,3 +1,4 @@
+from matrix.common.aws.cloudwatch_handler import CloudwatchHandler
 from matrix.lambdas.daemons.v0.driver import Driver
 
 
@@ -6,4 +7,7 @@ def driver_handler(event, context):
             and 'bundle_fqids_url' in event)
     assert bool(event["bundle_fqids"]) != bool(event["bundle_fqids_url"])  # xor these
     driver = Driver(event['request_id'])
-    driver.run(event['bundle_fqids'], event["bundle_fqids_url"], event['format'], event['genus_species'])
+    try:
+        driver.run(event['bundle_fqids'], event["bundle_fqids_url"], event['format'], event['genus_species'])
+    finally:
+        CloudwatchHandler().flush()
@@ -1,3 +1,4 @@
+from matrix.common.aws.cloudwatch_handler import CloudwatchHandler
 from matrix.lambdas.daemons.v1.driver import Driver
 
 
@@ -5,4 +6,7 @@ def driver_handler(event, context):
     assert ('request_id' in event and 'feature' in event and 'fields' in event
             and 'filter' in event)
     driver = Driver(event['request_id'])
-    driver.run(event["filter"], event["fields"], event["feature"], event["genus_species"])
+    try:
+        driver.run(event["filter"], event["fields"], event["feature"], event["genus_species"])
+    finally:
+        CloudwatchHandler().flush()
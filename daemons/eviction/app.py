@@ -0,0 +1,10 @@
+from matrix.common.aws.cloudwatch_handler import CloudwatchHandler
+from matrix.lambdas.daemons.eviction import EvictionHandler
+
+
+def eviction_handler(event, context):
+    eviction_handler = EvictionHandler()
+    try:
+        eviction_handler.run()
+    finally:
+        CloudwatchHandler().flush()
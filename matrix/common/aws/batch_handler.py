@@ -6,6 +6,7 @@ from tenacity import retry, stop_after_attempt, wait_fixed
 from matrix.common.aws.dynamo_handler import DynamoTable
 from matrix.common.aws.cloudwatch_handler import CloudwatchHandler, MetricName
 from matrix.common.logging import Logging
+from matrix.common.query.manifest_service import ManifestService
 
 logger = Logging.get_logger(__name__)
 
@@ -35,9 +36,9 @@ class BatchHandler:
                              request_id,
                              format])
 
-        source_expression_manifest = f"s3://{self.s3_query_results_bucket}/{request_id}/expression_manifest"
-        source_cell_manifest = f"s3://{self.s3_query_results_bucket}/{request_id}/cell_metadata_manifest"
-        source_gene_manifest = f"s3://{self.s3_query_results_bucket}/{request_id}/gene_metadata_manifest"
+        source_expression_manifest = ManifestService.request_manifest_url(request_id, "expression")
+        source_cell_manifest = ManifestService.request_manifest_url(request_id, "cell")
+        source_gene_manifest = ManifestService.request_manifest_url(request_id, "feature")
         target_path = f"s3://{self.s3_results_bucket}/{s3_results_key}"
         working_dir = f"/data/{request_id}"
         command = ['python3',
@@ -54,7 +55,9 @@ class BatchHandler:
             'DEPLOYMENT_STAGE': self.deployment_stage,
             'DYNAMO_DATA_VERSION_TABLE_NAME': DynamoTable.DATA_VERSION_TABLE.value,
             'DYNAMO_DEPLOYMENT_TABLE_NAME': DynamoTable.DEPLOYMENT_TABLE.value,
-            'DYNAMO_REQUEST_TABLE_NAME': DynamoTable.REQUEST_TABLE.value
+            'DYNAMO_REQUEST_TABLE_NAME': DynamoTable.REQUEST_TABLE.value,
+            'DYNAMO_QUERY_CACHE_TABLE_NAME': DynamoTable.QUERY_CACHE_TABLE.value,
+            'DYNAMO_RESULT_CACHE_TABLE_NAME': DynamoTable.RESULT_CACHE_TABLE.value
         }
 
         batch_job_id = self._enqueue_batch_job(job_name=job_name,
@@ -1,9 +1,26 @@
+import atexit
+import calendar
+import datetime
+import json
 import os
+import threading
 import typing
 from enum import Enum
 
 import boto3
 
+from matrix.common.logging import Logging
+
+logger = Logging.get_logger(__name__)
+
+
+class MetricsFormat(Enum):
+    """
+    Formats in which metric datapoints are put (see CloudwatchHandler).
+    """
+    API = "api"
+    EMF = "emf"
+
 
 class MetricName(Enum):
     """
@@ -16,12 +33,36 @@ class MetricName(Enum):
     CONVERSION_COMPLETION = "Matrix Conversion Completion"
     CACHE_HIT = "Matrix Cache Hit"
     CACHE_MISS = "Matrix Cache Miss"
+    CACHE_EVICTION = "Matrix Cache Eviction"
+    CACHE_EVICTED_BYTES = "Matrix Cache Evicted Bytes"
     DURATION = "Matrix Request Duration"
+    QUERY_QUEUE_TIME = "Matrix Query Queue Time"
+    QUERY_EXECUTION_TIME = "Matrix Query Execution Time"
+    QUERY_ROWS_UNLOADED = "Matrix Query Rows Unloaded"
+    QUERY_BYTES_UNLOADED = "Matrix Query Bytes Unloaded"
+    QUERY_BYTES_SCANNED = "Matrix Query Bytes Scanned"
 
 
 class CloudwatchHandler:
-    def __init__(self):
+    """
+    Puts the custom metric datapoints of this process in batches.
+
+    Datapoints are buffered per process and sent in PutMetricData requests of up to MAX_BATCH_SIZE
+    datapoints once the buffer is full, FLUSH_INTERVAL_SECONDS after the first datapoint was buffered,
+    when flush is called, which Lambda handlers do before returning, or at exit of the process.
+    With MATRIX_METRICS_FORMAT=emf, datapoints are instead written to stdout in the CloudWatch embedded
+    metric format, from which CloudWatch Logs extracts them without any API request.
+    """
+    MAX_BATCH_SIZE = 20
+    FLUSH_INTERVAL_SECONDS = 10
+
+    _buffer = []
+    _lock = threading.Lock()
+    _timer = None
+
+    def __init__(self, metrics_format: str = None):
         self.namespace = f"dcp-matrix-service-{os.environ['DEPLOYMENT_STAGE']}"
+        self.metrics_format = metrics_format or os.getenv("MATRIX_METRICS_FORMAT", MetricsFormat.API.value)
         self._client = boto3.client("cloudwatch", region_name=os.environ['AWS_DEFAULT_REGION'])
 
     def put_metric_data(self,
@@ -37,9 +78,69 @@ class CloudwatchHandler:
         """
         metric_data = {
             'MetricName': metric_name.value,
-            'Value': metric_value
+            'Value': metric_value,
+            'Timestamp': datetime.datetime.utcnow()
         }
         if metric_dimensions:
             metric_data['Dimensions'] = metric_dimensions
 
-        self._client.put_metric_data(MetricData=[metric_data], Namespace=self.namespace)
+        if self.metrics_format == MetricsFormat.EMF.value:
+            self._write_embedded_metric(metric_data)
+            return
+
+        with CloudwatchHandler._lock:
+            CloudwatchHandler._buffer.append(metric_data)
+            is_full = len(CloudwatchHandler._buffer) >= CloudwatchHandler.MAX_BATCH_SIZE
+            if not is_full and CloudwatchHandler._timer is None:
+                CloudwatchHandler._timer = threading.Timer(CloudwatchHandler.FLUSH_INTERVAL_SECONDS,
+                                                           self._flush_on_timer)
+                CloudwatchHandler._timer.daemon = True
+                CloudwatchHandler._timer.start()
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the buffered datapoints of this process.
+        """
+        with CloudwatchHandler._lock:
+            metric_data, CloudwatchHandler._buffer = CloudwatchHandler._buffer, []
+            if CloudwatchHandler._timer is not None:
+                CloudwatchHandler._timer.cancel()
+                CloudwatchHandler._timer = None
+
+        for i in range(0, len(metric_data), CloudwatchHandler.MAX_BATCH_SIZE):
+            self._client.put_metric_data(MetricData=metric_data[i:i + CloudwatchHandler.MAX_BATCH_SIZE],
+                                         Namespace=self.namespace)
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to put buffered metric data with error {e}")
+
+    def _write_embedded_metric(self, metric_data: dict):
+        """
+        Writes a datapoint to stdout as a log event in the CloudWatch embedded metric format.
+        :param metric_data: Datapoint as put by put_metric_data
+        """
+        dimensions = {dimension['Name']: dimension['Value'] for dimension in metric_data.get('Dimensions', [])}
+        event = {
+            '_aws': {
+                'Timestamp': calendar.timegm(metric_data['Timestamp'].utctimetuple()) * 1000,
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': metric_data['MetricName']}],
+                }],
+            },
+            metric_data['MetricName']: metric_data['Value'],
+            **dimensions
+        }
+        print(json.dumps(event), flush=True)
+
+
+@atexit.register
+def _flush_at_exit():
+    if CloudwatchHandler._buffer:
+        CloudwatchHandler().flush()
@@ -1,4 +1,5 @@
 import os
+import threading
 import time
 import typing
 from enum import Enum
@@ -6,12 +7,11 @@ from enum import Enum
 import boto3
 import botocore
 import requests
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
 
 from matrix.common import date
 from matrix.common.constants import DEFAULT_FEATURE, DEFAULT_FIELDS, GenusSpecies, SUPPORTED_METADATA_SCHEMA_VERSIONS
 from matrix.common.exceptions import MatrixException
-from matrix.common.v1_api_handler import V1ApiHandler
 
 
 class DynamoTable(Enum):
@@ -21,6 +21,8 @@ class DynamoTable(Enum):
     DATA_VERSION_TABLE = os.getenv("DYNAMO_DATA_VERSION_TABLE_NAME")
     DEPLOYMENT_TABLE = os.getenv("DYNAMO_DEPLOYMENT_TABLE_NAME")
     REQUEST_TABLE = os.getenv("DYNAMO_REQUEST_TABLE_NAME")
+    QUERY_CACHE_TABLE = os.getenv("DYNAMO_QUERY_CACHE_TABLE_NAME")
+    RESULT_CACHE_TABLE = os.getenv("DYNAMO_RESULT_CACHE_TABLE_NAME")
 
 
 class TableField(Enum):
@@ -43,6 +45,7 @@ class DeploymentTableField(TableField):
     """
     DEPLOYMENT = "Deployment"
     CURRENT_DATA_VERSION = "CurrentDataVersion"
+    DATA_MODIFICATION_DATE = "DataModificationDate"
 
 
 class RequestTableField(TableField):
@@ -51,6 +54,7 @@ class RequestTableField(TableField):
     """
     REQUEST_ID = "RequestId"
     REQUEST_HASH = "RequestHash"
+    QUERY_HASH = "QueryHash"
     DATA_VERSION = "DataVersion"
     CREATION_DATE = "CreationDate"
     GENUS_SPECIES = "GenusSpecies"
@@ -63,16 +67,58 @@ class RequestTableField(TableField):
     COMPLETED_DRIVER_EXECUTIONS = "CompletedDriverExecutions"
     EXPECTED_QUERY_EXECUTIONS = "ExpectedQueryExecutions"
     COMPLETED_QUERY_EXECUTIONS = "CompletedQueryExecutions"
+    NUM_EXPRESSION_SHARDS = "NumExpressionShards"
+    LEADER_REQUEST_ID = "LeaderRequestId"
+    RESULT_ALIAS = "ResultAlias"
+    QUERY_STATS = "QueryStats"
     EXPECTED_CONVERTER_EXECUTIONS = "ExpectedConverterExecutions"
     COMPLETED_CONVERTER_EXECUTIONS = "CompletedConverterExecutions"
     BATCH_JOB_ID = "BatchJobId"
     ERROR_MESSAGE = "ErrorMessage"
 
 
+class QueryCacheTableField(TableField):
+    """
+    Field names for Query Cache table in DynamoDB.
+    """
+    QUERY_HASH = "QueryHash"
+    REQUEST_ID = "RequestId"
+    DATA_VERSION = "DataVersion"
+    CREATION_DATE = "CreationDate"
+    IN_FLIGHT_REQUEST_ID = "InFlightRequestId"
+
+
+class ResultCacheTableField(TableField):
+    """
+    Field names for Result Cache table in DynamoDB.
+    """
+    CACHE_KEY = "CacheKey"
+    DATA_VERSION = "DataVersion"
+    REQUEST_HASH = "RequestHash"
+    FORMAT = "Format"
+    S3_KEY = "S3Key"
+    SIZE = "Size"
+    CREATION_DATE = "CreationDate"
+    LAST_ACCESS_DATE = "LastAccessDate"
+    HIT_COUNT = "HitCount"
+    REF_COUNT = "RefCount"
+    EXPIRATION_TIME = "ExpirationTime"
+
+
 class DynamoHandler:
     """
     Interface for interacting with DynamoDB Tables.
     """
+    # Global secondary index of the request table keyed by (RequestHash, DataVersion)
+    REQUEST_HASH_INDEX = "RequestHashIndex"
+
+    # Process-wide cache of the deployment's current data version, read on every request initialization.
+    # set_current_data_version invalidates it in the calling process; other processes see a new version
+    # once their cached one is older than CURRENT_DATA_VERSION_TTL_SECONDS.
+    CURRENT_DATA_VERSION_TTL_SECONDS = 60
+    _current_data_version = None
+    _current_data_version_expiration = 0.0
+    _current_data_version_lock = threading.Lock()
 
     def __init__(self):
         self._dynamo = boto3.resource("dynamodb", region_name=os.environ['AWS_DEFAULT_REGION'])
@@ -88,6 +134,14 @@ class DynamoHandler:
             DynamoTable.REQUEST_TABLE: {
                 'primary_key': RequestTableField.REQUEST_ID.value,
                 'resource': self._dynamo.Table(DynamoTable.REQUEST_TABLE.value)
+            },
+            DynamoTable.QUERY_CACHE_TABLE: {
+                'primary_key': QueryCacheTableField.QUERY_HASH.value,
+                'resource': self._dynamo.Table(DynamoTable.QUERY_CACHE_TABLE.value)
+            },
+            DynamoTable.RESULT_CACHE_TABLE: {
+                'primary_key': ResultCacheTableField.CACHE_KEY.value,
+                'resource': self._dynamo.Table(DynamoTable.RESULT_CACHE_TABLE.value)
             }
         }
 
@@ -111,16 +165,14 @@ class DynamoHandler:
         """
         return self.tables[dynamo_table]['primary_key']
 
-    def create_data_version_table_entry(self, version: int):
+    def create_data_version_table_entry(self, version: int, project_cell_counts: dict):
         """
         Put a new item in the Data Version table responsible for describing the current and
         previous Redshift data versions for a deployment.
         If the new version already exists, it will be overwritten by the new entry.
         :param version: Version number to create
+        :param project_cell_counts: Number of cells per project in the data version
         """
-        api_handler = V1ApiHandler()
-        project_cell_counts = api_handler.describe_filter("project.provenance.document_id")['cell_counts']
-
         metadata_schema_versions = {}
         for schema_name in SUPPORTED_METADATA_SCHEMA_VERSIONS:
             metadata_schema_versions[schema_name.value] = SUPPORTED_METADATA_SCHEMA_VERSIONS[schema_name]
@@ -139,7 +191,9 @@ class DynamoHandler:
                                    fmt: str,
                                    metadata_fields: list = DEFAULT_FIELDS,
                                    feature: str = DEFAULT_FEATURE,
-                                   genus_species: GenusSpecies = GenusSpecies.HUMAN):
+                                   genus_species: GenusSpecies = GenusSpecies.HUMAN,
+                                   query_hash: str = "N/A",
+                                   data_version: int = None):
         """
         Put a new item in the Request table responsible for tracking the inputs, task execution progress and errors
         of a Matrix Request.
@@ -148,34 +202,377 @@ class DynamoHandler:
         :param fmt: User requested output file format of final expression matrix.
         :param metadata_fields: User requested metadata fields to include in the expression matrix.
         :param feature: User requested feature type of final expression matrix (gene|transcript).
+        :param genus_species: Genus/species the request is generated for.
+        :param query_hash: Hash of the request's canonical query parameters (see query_constructor.create_query_hash).
+        :param data_version: Data version the request is generated on. Defaults to the current data version.
         """
-        data_version = \
-            self.get_table_item(table=DynamoTable.DEPLOYMENT_TABLE,
-                                key=os.environ['DEPLOYMENT_STAGE'])[DeploymentTableField.CURRENT_DATA_VERSION.value]
+        if data_version is None:
+            data_version = self.get_current_data_version()
 
         self._get_dynamo_table_resource_from_enum(DynamoTable.REQUEST_TABLE).put_item(
+            Item=self._request_table_item(request_id,
+                                          fmt,
+                                          metadata_fields,
+                                          feature,
+                                          genus_species,
+                                          query_hash,
+                                          data_version)
+        )
+
+    def create_request_table_entries(self, entries: typing.List[dict], data_version: int = None):
+        """
+        Put new items in the Request table for several Matrix Requests in batch writes.
+        See create_request_table_entry.
+
+        :param entries: Keyword arguments of create_request_table_entry (request_id, fmt, metadata_fields, feature,
+                        genus_species, query_hash) for each request.
+        :param data_version: Data version the requests are generated on. Defaults to the current data version.
+        """
+        if data_version is None:
+            data_version = self.get_current_data_version()
+
+        with self._get_dynamo_table_resource_from_enum(DynamoTable.REQUEST_TABLE).batch_writer() as batch:
+            for entry in entries:
+                batch.put_item(Item=self._request_table_item(data_version=data_version, **entry))
+
+    @staticmethod
+    def _request_table_item(request_id: str,
+                            fmt: str,
+                            metadata_fields: list = DEFAULT_FIELDS,
+                            feature: str = DEFAULT_FEATURE,
+                            genus_species: GenusSpecies = GenusSpecies.HUMAN,
+                            query_hash: str = "N/A",
+                            data_version: int = 0) -> dict:
+        # The request hash is only set once it is known, so that requests without one are left out of
+        # the RequestHashIndex rather than all sharing a single hot partition of it
+        return {
+            RequestTableField.REQUEST_ID.value: request_id,
+            RequestTableField.QUERY_HASH.value: query_hash,
+            RequestTableField.DATA_VERSION.value: data_version,
+            RequestTableField.CREATION_DATE.value: date.get_datetime_now(as_string=True),
+            RequestTableField.GENUS_SPECIES.value: genus_species.value,
+            RequestTableField.FORMAT.value: fmt,
+            RequestTableField.METADATA_FIELDS.value: metadata_fields,
+            RequestTableField.FEATURE.value: feature,
+            RequestTableField.NUM_BUNDLES.value: -1,
+            RequestTableField.ROW_COUNT.value: 0,
+            RequestTableField.EXPECTED_DRIVER_EXECUTIONS.value: 1,
+            RequestTableField.COMPLETED_DRIVER_EXECUTIONS.value: 0,
+            RequestTableField.EXPECTED_QUERY_EXECUTIONS.value: 3,
+            RequestTableField.COMPLETED_QUERY_EXECUTIONS.value: 0,
+            RequestTableField.NUM_EXPRESSION_SHARDS.value: 1,
+            RequestTableField.LEADER_REQUEST_ID.value: "N/A",
+            RequestTableField.RESULT_ALIAS.value: "N/A",
+            RequestTableField.QUERY_STATS.value: {},
+            RequestTableField.EXPECTED_CONVERTER_EXECUTIONS.value: 1,
+            RequestTableField.COMPLETED_CONVERTER_EXECUTIONS.value: 0,
+            RequestTableField.BATCH_JOB_ID.value: "N/A",
+            RequestTableField.ERROR_MESSAGE.value: 0
+        }
+
+    def create_query_cache_table_entry(self, query_hash: str, request_id: str, data_version: int):
+        """
+        Put a new item in the Query Cache table pointing requests with the given query hash
+        to the completed request serving them. An existing entry is overwritten, releasing
+        the query hash's in-flight request.
+        :param query_hash: Hash of the request's canonical query parameters
+        :param request_id: UUID of the completed matrix service request
+        :param data_version: Redshift data version the request was generated on
+        """
+        self._get_dynamo_table_resource_from_enum(DynamoTable.QUERY_CACHE_TABLE).put_item(
             Item={
-                RequestTableField.REQUEST_ID.value: request_id,
-                RequestTableField.REQUEST_HASH.value: "N/A",
-                RequestTableField.DATA_VERSION.value: data_version,
-                RequestTableField.CREATION_DATE.value: date.get_datetime_now(as_string=True),
-                RequestTableField.GENUS_SPECIES.value: genus_species.value,
-                RequestTableField.FORMAT.value: fmt,
-                RequestTableField.METADATA_FIELDS.value: metadata_fields,
-                RequestTableField.FEATURE.value: feature,
-                RequestTableField.NUM_BUNDLES.value: -1,
-                RequestTableField.ROW_COUNT.value: 0,
-                RequestTableField.EXPECTED_DRIVER_EXECUTIONS.value: 1,
-                RequestTableField.COMPLETED_DRIVER_EXECUTIONS.value: 0,
-                RequestTableField.EXPECTED_QUERY_EXECUTIONS.value: 3,
-                RequestTableField.COMPLETED_QUERY_EXECUTIONS.value: 0,
-                RequestTableField.EXPECTED_CONVERTER_EXECUTIONS.value: 1,
-                RequestTableField.COMPLETED_CONVERTER_EXECUTIONS.value: 0,
-                RequestTableField.BATCH_JOB_ID.value: "N/A",
-                RequestTableField.ERROR_MESSAGE.value: 0
+                QueryCacheTableField.QUERY_HASH.value: query_hash,
+                QueryCacheTableField.REQUEST_ID.value: request_id,
+                QueryCacheTableField.DATA_VERSION.value: data_version,
+                QueryCacheTableField.CREATION_DATE.value: date.get_datetime_now(as_string=True)
             }
         )
 
+    def claim_in_flight_query(self, query_hash: str, request_id: str, stale_request_id: str = None) -> str:
+        """
+        Records a request as the in-flight request of a query hash in the Query Cache table,
+        unless another request already is.
+        :param query_hash: Hash of the request's canonical query parameters
+        :param request_id: UUID of the request claiming the query hash
+        :param stale_request_id: UUID of a failed in-flight request to take the claim over from
+        :return: str UUID of the in-flight request of the query hash, "" if the claim was released meanwhile
+        """
+        field = QueryCacheTableField.IN_FLIGHT_REQUEST_ID.value
+        if stale_request_id is None:
+            condition = f"attribute_not_exists({field})"
+            values = {":r": request_id}
+        else:
+            condition = f"{field} = :s"
+            values = {":r": request_id, ":s": stale_request_id}
+
+        try:
+            self._get_dynamo_table_resource_from_enum(DynamoTable.QUERY_CACHE_TABLE).update_item(
+                Key={QueryCacheTableField.QUERY_HASH.value: query_hash},
+                UpdateExpression=f"SET {field} = :r",
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            return request_id
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+
+        try:
+            item = self.get_table_item(DynamoTable.QUERY_CACHE_TABLE, key=query_hash)
+        except MatrixException:
+            return ""
+        return item.get(field, "")
+
+    def release_in_flight_query(self, query_hash: str, request_id: str):
+        """
+        Removes a request as the in-flight request of a query hash, if it still is.
+        :param query_hash: Hash of the request's canonical query parameters
+        :param request_id: UUID of the in-flight request
+        """
+        field = QueryCacheTableField.IN_FLIGHT_REQUEST_ID.value
+        try:
+            self._get_dynamo_table_resource_from_enum(DynamoTable.QUERY_CACHE_TABLE).update_item(
+                Key={QueryCacheTableField.QUERY_HASH.value: query_hash},
+                UpdateExpression=f"REMOVE {field}",
+                ConditionExpression=f"{field} = :r",
+                ExpressionAttributeValues={":r": request_id}
+            )
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+
+    @staticmethod
+    def result_cache_key(data_version: int, request_hash: str, format: str) -> str:
+        """
+        The key of the Result Cache table entry of matrices with the given parameters.
+        :param data_version: Redshift data version the matrix was generated on
+        :param request_hash: Request hash of the matrix
+        :param format: Format of the matrix
+        :return: str Result cache key
+        """
+        return f"{data_version}/{request_hash}/{format}"
+
+    def put_result_cache_table_entry(self,
+                                     data_version: int,
+                                     request_hash: str,
+                                     format: str,
+                                     s3_key: str,
+                                     size: int,
+                                     expiration_time: int):
+        """
+        Points the Result Cache table entry of matrices with the given parameters at a converted matrix
+        in a single update, referenced by the request that produced it. The hit count of an existing entry is kept.
+        :param data_version: Redshift data version the matrix was generated on
+        :param request_hash: Request hash of the matrix
+        :param format: Format of the matrix
+        :param s3_key: S3 key of the matrix in the results bucket
+        :param size: Size of the matrix in bytes
+        :param expiration_time: Epoch time in seconds at which the matrix expires from the results bucket
+        """
+        now = date.get_datetime_now(as_string=True)
+        self._get_dynamo_table_resource_from_enum(DynamoTable.RESULT_CACHE_TABLE).update_item(
+            Key={ResultCacheTableField.CACHE_KEY.value: self.result_cache_key(data_version, request_hash, format)},
+            UpdateExpression="SET #dv = :dv, #rh = :rh, #f = :f, #k = :k, #s = :s, #cd = :now, #la = :now, "
+                             "#e = :e, #r = :one, #h = if_not_exists(#h, :zero)",
+            ExpressionAttributeNames={
+                "#dv": ResultCacheTableField.DATA_VERSION.value,
+                "#rh": ResultCacheTableField.REQUEST_HASH.value,
+                "#f": ResultCacheTableField.FORMAT.value,
+                "#k": ResultCacheTableField.S3_KEY.value,
+                "#s": ResultCacheTableField.SIZE.value,
+                "#cd": ResultCacheTableField.CREATION_DATE.value,
+                "#la": ResultCacheTableField.LAST_ACCESS_DATE.value,
+                "#e": ResultCacheTableField.EXPIRATION_TIME.value,
+                "#h": ResultCacheTableField.HIT_COUNT.value,
+                "#r": ResultCacheTableField.REF_COUNT.value,
+            },
+            ExpressionAttributeValues={
+                ":dv": data_version,
+                ":rh": request_hash,
+                ":f": format,
+                ":k": s3_key,
+                ":s": size,
+                ":now": now,
+                ":e": expiration_time,
+                ":one": 1,
+                ":zero": 0,
+            }
+        )
+
+    def record_result_cache_hit(self, cache_key: str) -> dict:
+        """
+        Counts a hit of a Result Cache table entry and updates its last access date.
+        :param cache_key: Result cache key of the entry (see result_cache_key)
+        :return: dict The entry after the update, None if the entry does not exist or has expired
+        """
+        now = date.get_datetime_now()
+        try:
+            item = self._get_dynamo_table_resource_from_enum(DynamoTable.RESULT_CACHE_TABLE).update_item(
+                Key={ResultCacheTableField.CACHE_KEY.value: cache_key},
+                UpdateExpression="SET #la = :now ADD #h :one",
+                ConditionExpression="attribute_exists(#k)",
+                ExpressionAttributeNames={
+                    "#h": ResultCacheTableField.HIT_COUNT.value,
+                    "#la": ResultCacheTableField.LAST_ACCESS_DATE.value,
+                    "#k": ResultCacheTableField.CACHE_KEY.value,
+                },
+                ExpressionAttributeValues={":one": 1, ":now": date.to_string(now)},
+                ReturnValues="ALL_NEW"
+            )['Attributes']
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+            return None
+
+        # DynamoDB removes expired entries up to days after their expiration time
+        if item[ResultCacheTableField.EXPIRATION_TIME.value] <= date.to_timestamp(now):
+            return None
+        return item
+
+    def add_result_cache_reference(self, cache_key: str, s3_key: str, min_expiration_time: int) -> bool:
+        """
+        Counts a reference to the matrix of a Result Cache table entry, if the entry still points at
+        the matrix and the matrix does not expire before the given time.
+        :param cache_key: Result cache key of the entry (see result_cache_key)
+        :param s3_key: S3 key of the matrix in the results bucket
+        :param min_expiration_time: Epoch time in seconds the matrix must not expire before
+        :return: bool True if the reference was counted, else False
+        """
+        try:
+            self._get_dynamo_table_resource_from_enum(DynamoTable.RESULT_CACHE_TABLE).update_item(
+                Key={ResultCacheTableField.CACHE_KEY.value: cache_key},
+                UpdateExpression="ADD #r :one",
+                ConditionExpression="#k = :k AND #e >= :min",
+                ExpressionAttributeNames={
+                    "#r": ResultCacheTableField.REF_COUNT.value,
+                    "#k": ResultCacheTableField.S3_KEY.value,
+                    "#e": ResultCacheTableField.EXPIRATION_TIME.value,
+                },
+                ExpressionAttributeValues={":one": 1, ":k": s3_key, ":min": min_expiration_time}
+            )
+            return True
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+        return False
+
+    def release_result_cache_reference(self, cache_key: str, s3_key: str) -> typing.Optional[int]:
+        """
+        Releases a reference to the matrix of a Result Cache table entry, if the entry still points at the matrix.
+        :param cache_key: Result cache key of the entry (see result_cache_key)
+        :param s3_key: S3 key of the matrix in the results bucket
+        :return: Number of remaining references to the matrix, None if the entry does not point at the matrix
+        """
+        try:
+            return self._get_dynamo_table_resource_from_enum(DynamoTable.RESULT_CACHE_TABLE).update_item(
+                Key={ResultCacheTableField.CACHE_KEY.value: cache_key},
+                UpdateExpression="ADD #r :minus_one",
+                ConditionExpression="#k = :k",
+                ExpressionAttributeNames={
+                    "#r": ResultCacheTableField.REF_COUNT.value,
+                    "#k": ResultCacheTableField.S3_KEY.value,
+                },
+                ExpressionAttributeValues={":minus_one": -1, ":k": s3_key},
+                ReturnValues="UPDATED_NEW"
+            )['Attributes'][ResultCacheTableField.REF_COUNT.value]
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+        return None
+
+    def expire_result_cache_table_entry(self, cache_key: str, s3_key: str):
+        """
+        Expires a Result Cache table entry if it still points at the given matrix.
+        The entry is then no longer hit and removed by DynamoDB.
+        :param cache_key: Result cache key of the entry (see result_cache_key)
+        :param s3_key: S3 key of the matrix in the results bucket
+        """
+        try:
+            self._get_dynamo_table_resource_from_enum(DynamoTable.RESULT_CACHE_TABLE).update_item(
+                Key={ResultCacheTableField.CACHE_KEY.value: cache_key},
+                UpdateExpression=f"SET {ResultCacheTableField.EXPIRATION_TIME.value} = :zero",
+                ConditionExpression=f"{ResultCacheTableField.S3_KEY.value} = :k",
+                ExpressionAttributeValues={":zero": 0, ":k": s3_key}
+            )
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+
+    def get_live_result_cache_table_entries(self) -> typing.List[dict]:
+        """
+        Scans the Result Cache table for the entries that have not expired.
+        :return: list of dynamodb items
+        """
+        dynamo_table = self._get_dynamo_table_resource_from_enum(DynamoTable.RESULT_CACHE_TABLE)
+        filter_expr = Attr(ResultCacheTableField.EXPIRATION_TIME.value).gt(date.to_timestamp(date.get_datetime_now()))
+
+        resp = dynamo_table.scan(FilterExpression=filter_expr)
+        items = resp['Items']
+        while 'LastEvaluatedKey' in resp:
+            resp = dynamo_table.scan(FilterExpression=filter_expr,
+                                     ExclusiveStartKey=resp['LastEvaluatedKey'])
+            items.extend(resp['Items'])
+
+        return items
+
+    def get_current_data_version(self) -> int:
+        """
+        Retrieves the Redshift data version currently served by this deployment.
+        The version is cached for CURRENT_DATA_VERSION_TTL_SECONDS.
+        :return: int Data version
+        """
+        with DynamoHandler._current_data_version_lock:
+            if time.monotonic() < DynamoHandler._current_data_version_expiration:
+                return DynamoHandler._current_data_version
+
+        data_version = self.get_table_item(
+            table=DynamoTable.DEPLOYMENT_TABLE,
+            key=os.environ['DEPLOYMENT_STAGE'])[DeploymentTableField.CURRENT_DATA_VERSION.value]
+
+        with DynamoHandler._current_data_version_lock:
+            DynamoHandler._current_data_version = data_version
+            DynamoHandler._current_data_version_expiration = \
+                time.monotonic() + DynamoHandler.CURRENT_DATA_VERSION_TTL_SECONDS
+        return data_version
+
+    def set_current_data_version(self, version: int):
+        """
+        Sets the Redshift data version served by this deployment and invalidates the cached current data version.
+        :param version: Data version to serve
+        """
+        self.set_table_field_with_value(table=DynamoTable.DEPLOYMENT_TABLE,
+                                        key=os.environ['DEPLOYMENT_STAGE'],
+                                        field_enum=DeploymentTableField.CURRENT_DATA_VERSION,
+                                        field_value=version)
+        DynamoHandler.invalidate_current_data_version()
+
+    def get_data_modification_date(self) -> typing.Optional[str]:
+        """
+        Retrieves the date bundle notifications last modified the data of the current data version.
+        :return: str Modification date, None if the data has not been modified since the deployment was created
+        """
+        item = self.get_table_item(table=DynamoTable.DEPLOYMENT_TABLE, key=os.environ['DEPLOYMENT_STAGE'])
+        return item.get(DeploymentTableField.DATA_MODIFICATION_DATE.value)
+
+    def set_data_modification_date(self):
+        """
+        Records that the data of the current data version was modified now, e.g. by a bundle notification,
+        without bumping the data version.
+        """
+        self.set_table_field_with_value(table=DynamoTable.DEPLOYMENT_TABLE,
+                                        key=os.environ['DEPLOYMENT_STAGE'],
+                                        field_enum=DeploymentTableField.DATA_MODIFICATION_DATE,
+                                        field_value=date.get_datetime_now(as_string=True))
+
+    @staticmethod
+    def invalidate_current_data_version():
+        """
+        Drops the cached current data version, so that the next lookup reads the Deployment table.
+        """
+        with DynamoHandler._current_data_version_lock:
+            DynamoHandler._current_data_version = None
+            DynamoHandler._current_data_version_expiration = 0.0
+
     def get_table_item(self, table: DynamoTable, key: typing.Union[str, int] = ""):
         """Retrieves dynamobdb item corresponding with primary key in the specified table.
 
@@ -210,12 +607,7 @@ class DynamoHandler:
         """
         dynamo_table = self._get_dynamo_table_resource_from_enum(table)
 
-        filter_expr = None
-        for attr_key in attrs:
-            if not filter_expr:
-                filter_expr = Attr(attr_key).eq(attrs[attr_key])
-            else:
-                filter_expr = filter_expr & Attr(attr_key).eq(attrs[attr_key])
+        filter_expr = self._equality_filter_expression(attrs)
 
         resp = dynamo_table.scan(FilterExpression=filter_expr)
         items = resp['Items']
@@ -226,6 +618,36 @@ class DynamoHandler:
 
         return items
 
+    def query_by_request_hash(self, request_hash: str, data_version: int = None, attrs: dict = None):
+        """
+        Queries the request table's request hash index for the requests with the provided request hash,
+        without scanning the table.
+        :param request_hash: Request hash of the requests
+        :param data_version: Optional data version of the requests. Defaults to all data versions.
+        :param attrs: Optional dict KVPs of attribute names and values specifying further equality conditions.
+        :return: list of dynamodb items
+        """
+        dynamo_table = self._get_dynamo_table_resource_from_enum(DynamoTable.REQUEST_TABLE)
+
+        key_condition_expr = Key(RequestTableField.REQUEST_HASH.value).eq(request_hash)
+        if data_version is not None:
+            key_condition_expr = key_condition_expr & Key(RequestTableField.DATA_VERSION.value).eq(data_version)
+        query_kwargs = {
+            'IndexName': DynamoHandler.REQUEST_HASH_INDEX,
+            'KeyConditionExpression': key_condition_expr,
+        }
+
+        if attrs:
+            query_kwargs['FilterExpression'] = self._equality_filter_expression(attrs)
+
+        resp = dynamo_table.query(**query_kwargs)
+        items = resp['Items']
+        while 'LastEvaluatedKey' in resp:
+            resp = dynamo_table.query(ExclusiveStartKey=resp['LastEvaluatedKey'], **query_kwargs)
+            items.extend(resp['Items'])
+
+        return items
+
     def increment_table_field(self, table: DynamoTable, key: str, field_enum: TableField, increment_size: int):
         """Increment value in dynamo table
         Args:
@@ -236,10 +658,27 @@ class DynamoHandler:
         Returns:
             start_value, end_value: The values before and after incrementing
         """
+        item = self.increment_table_field_and_get_item(table, key, field_enum, increment_size)
+        end_value = item[field_enum.value]
+        return end_value - increment_size, end_value
+
+    def increment_table_field_and_get_item(self,
+                                           table: DynamoTable,
+                                           key: str,
+                                           field_enum: TableField,
+                                           increment_size: int) -> dict:
+        """Increment value in dynamo table and retrieve the updated item in the same request
+        Args:
+            table: DynamoTable enum
+            key: primary key in table
+            field_enum: field enum to increment
+            increment_size: Amount by which to increment the field.
+        Returns:
+            item: dynamodb item after incrementing
+        """
         dynamo_table = self._get_dynamo_table_resource_from_enum(table)
         key_dict = {self._get_dynamo_table_primary_key_from_enum(table): key}
-        start_value, end_value = self._increment_field(dynamo_table, key_dict, field_enum, increment_size)
-        return start_value, end_value
+        return self._increment_field(dynamo_table, key_dict, field_enum, increment_size)
 
     def set_table_field_with_value(self,
                                    table: DynamoTable,
@@ -258,6 +697,45 @@ class DynamoHandler:
         key_dict = {self._get_dynamo_table_primary_key_from_enum(table): key}
         self._set_field(dynamo_table, key_dict, field_enum, field_value)
 
+    def set_table_map_field_entry(self,
+                                  table: DynamoTable,
+                                  key: str,
+                                  field_enum: TableField,
+                                  entry_key: str,
+                                  entry_value: typing.Any):
+        """
+        Set an entry of a map field in dynamo table. The map field must exist.
+        Args:
+            table: DynamoTable enum
+            key: primary key in table
+            field_enum: field enum of the map field
+            entry_key: Key of the entry in the map
+            entry_value: Value to set for the entry
+        """
+        dynamo_table = self._get_dynamo_table_resource_from_enum(table)
+        key_dict = {self._get_dynamo_table_primary_key_from_enum(table): key}
+        dynamo_table.update_item(
+            Key=key_dict,
+            UpdateExpression=f"SET {field_enum.value}.#k = :v",
+            ExpressionAttributeNames={"#k": entry_key},
+            ExpressionAttributeValues={":v": entry_value}
+        )
+
+    @staticmethod
+    def _equality_filter_expression(attrs: dict):
+        """
+        Builds a filter expression of equality conditions on the provided Attribute values.
+        :param attrs: dict KVPs of attribute names and values specifying equality conditions.
+        :return: boto3 filter expression
+        """
+        filter_expr = None
+        for attr_key in attrs:
+            if not filter_expr:
+                filter_expr = Attr(attr_key).eq(attrs[attr_key])
+            else:
+                filter_expr = filter_expr & Attr(attr_key).eq(attrs[attr_key])
+        return filter_expr
+
     def _set_field(self, table, key_dict: dict, field_enum: TableField, field_value: typing.Union[str, int]):
         """
         Set a value in a dynamo table.
@@ -274,9 +752,10 @@ class DynamoHandler:
             ExpressionAttributeValues={":n": field_value}
         )
 
-    def _increment_field(self, table, key_dict: dict, field_enum: TableField, increment_size: int):
-        """Increment a value in a dynamo table safely.
-        Makes sure distributed table updates don't clobber each other. For example,
+    def _increment_field(self, table, key_dict: dict, field_enum: TableField, increment_size: int) -> dict:
+        """Increment a value in a dynamo table atomically.
+        Distributed table updates don't clobber each other, and each caller sees the value
+        resulting from its own increment. For example,
         increment_field(dynamo_table_obj, {"id": id_}, "Counts", 5)
         will increment the Counts value in the item keyed by {"id": id_} in table
         "my_table" by 5.
@@ -286,31 +765,21 @@ class DynamoHandler:
           field_value: Name of the field to increment
           increment_size: Amount by which to increment the field.
         Returns:
-          start_value, end_value: The values before and after incrementing
+          item: The item after incrementing
         """
         field_value = field_enum.value
-        while True:
-            db_response = table.get_item(
+        try:
+            return table.update_item(
                 Key=key_dict,
-                ConsistentRead=True
-            )
-            item = db_response['Item']
-            start_value = item[field_value]
-            new_value = start_value + increment_size
-
-            try:
-                table.update_item(
-                    Key=key_dict,
-                    UpdateExpression=f"SET {field_value} = :n",
-                    ConditionExpression=f"{field_value} = :s",
-                    ExpressionAttributeValues={":n": new_value, ":s": start_value}
-                )
-                break
-            except botocore.exceptions.ClientError as exc:
-                if exc.response['Error']['Code'] == "ConditionalCheckFailedException":
-                    pass
-                else:
-                    raise
-            time.sleep(.5)
-
-        return start_value, new_value
+                UpdateExpression="ADD #f :n",
+                ConditionExpression="attribute_exists(#f)",
+                ExpressionAttributeNames={"#f": field_value},
+                ExpressionAttributeValues={":n": increment_size},
+                ReturnValues="ALL_NEW"
+            )['Attributes']
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] == "ConditionalCheckFailedException":
+                raise MatrixException(status=requests.codes.not_found,
+                                      title=f"Unable to find field {field_value} of table item with key "
+                                      f"{key_dict} from DynamoDb Table {table.name}.")
+            raise
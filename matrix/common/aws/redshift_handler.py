@@ -1,8 +1,16 @@
+import collections
+import re
+import threading
+import time
 import psycopg2 as pg
+import psycopg2.extensions
 import typing
 from enum import Enum
 
 from matrix.common.config import MatrixRedshiftConfig
+from matrix.common.logging import Logging
+
+logger = Logging.get_logger(__name__)
 
 
 class TableName(Enum):
@@ -23,6 +31,93 @@ class TableName(Enum):
     WRITE_LOCK = "write_lock"
 
 
+# Execution statistics of a completed query, read from the Redshift system tables. Times are in milliseconds
+# and only user tables count towards the bytes scanned.
+QUERY_STATS_QUERIES = [
+    ("SELECT total_queue_time / 1000, total_exec_time / 1000 FROM stl_wlm_query WHERE query = {query_id};",
+     ["queue_time_ms", "exec_time_ms"]),
+    ("SELECT COALESCE(SUM(line_count), 0), COALESCE(SUM(transfer_size), 0) FROM stl_unload_log "
+     "WHERE query = {query_id};",
+     ["rows_unloaded", "bytes_unloaded"]),
+    ("SELECT COALESCE(SUM(bytes), 0) FROM stl_scan WHERE query = {query_id} AND type = 2;",
+     ["bytes_scanned"]),
+]
+
+TEMP_TABLE_PATTERN = re.compile(r"CREATE\s+TEMP(?:ORARY)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+class RedshiftConnectionPool:
+    """
+    Thread-safe pool of idle connections to a Redshift database.
+
+    Connections are validated when checked out and replaced if they were closed, e.g. by the
+    cluster or by a network timeout while a lambda was frozen. Connections idle for longer than
+    VALIDATION_INTERVAL_SECONDS are checked with a round trip before being reused. The number of
+    connections checked out at once is bounded by the callers, not by the pool.
+    """
+    MAX_IDLE_CONNECTIONS = 8
+    VALIDATION_INTERVAL_SECONDS = 60
+
+    def __init__(self, database_uri: str):
+        self.database_uri = database_uri
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        """
+        Checks out a valid connection, reusing the most recently returned idle connection if possible.
+        :return: psycopg2 connection
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if self._is_valid(conn, returned_at):
+                return conn
+            conn.close()
+
+        return pg.connect(self.database_uri)
+
+    def putconn(self, conn, discard: bool = False):
+        """
+        Returns a checked out connection to the pool.
+        :param conn: psycopg2 connection
+        :param discard: Close the connection instead of keeping it for reuse
+        """
+        if not discard and not conn.closed:
+            with self._lock:
+                if len(self._idle) < RedshiftConnectionPool.MAX_IDLE_CONNECTIONS:
+                    self._idle.append((conn, time.monotonic()))
+                    return
+        conn.close()
+
+    def closeall(self):
+        """
+        Closes all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, collections.deque()
+        for conn, _ in idle:
+            conn.close()
+
+    @staticmethod
+    def _is_valid(conn, returned_at: float) -> bool:
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - returned_at < RedshiftConnectionPool.VALIDATION_INTERVAL_SECONDS:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchall()
+            conn.rollback()
+            return True
+        except pg.Error:
+            return False
+
+
 class RedshiftHandler:
     """
     Interface for interacting with redshift cluster.
@@ -41,6 +136,13 @@ class RedshiftHandler:
         TableName.EXPRESSION: "cellkey",
     }
 
+    # Maximum number of keys per multi-row INSERT when staging key sets
+    KEY_SET_INSERT_BATCH_SIZE = 1000
+
+    # Connection pools per database uri, shared by all handlers of a process and kept across warm lambda invocations
+    _pools = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self):
         self.redshift_config = MatrixRedshiftConfig()
 
@@ -52,17 +154,127 @@ class RedshiftHandler:
     def readonly_database_uri(self):
         return self.redshift_config.readonly_database_uri
 
-    def transaction(self, queries: typing.List[str], return_results=False, read_only=False):
-        if read_only:
-            conn = pg.connect(self.readonly_database_uri)
-        else:
-            conn = pg.connect(self.database_uri)
-        results = []
-        cursor = conn.cursor()
-        for query in queries:
-            cursor.execute(query)
-        if return_results:
-            results = cursor.fetchall()
-        conn.commit()
-        conn.close()
+    def transaction(self, queries: typing.List[str], return_results=False, read_only=False, collect_stats=False):
+        """
+        Runs queries in a single transaction on a pooled connection. Temporary tables created by
+        the queries are dropped before the transaction commits, so they do not outlive the transaction
+        in the pooled session.
+        :param queries: Queries to run
+        :param return_results: Fetch and return the results of the last query
+        :param read_only: Run the queries as the read-only user
+        :param collect_stats: Also return the execution statistics of the last query (see query_stats)
+        :return: List of result rows if return_results, else []. If collect_stats, a tuple of the results
+                 and the statistics dict.
+        """
+        pool = self._get_pool(self.readonly_database_uri if read_only else self.database_uri)
+        conn = pool.getconn()
+        try:
+            results = []
+            cursor = conn.cursor()
+            for query in queries:
+                cursor.execute(query)
+            if return_results:
+                results = cursor.fetchall()
+            if collect_stats:
+                cursor.execute("SELECT PG_LAST_QUERY_ID();")
+                query_id = cursor.fetchone()[0]
+            for temp_table in RedshiftHandler._temp_tables(queries):
+                cursor.execute(f"DROP TABLE IF EXISTS {temp_table};")
+            conn.commit()
+        except Exception:
+            # the session may be left in an aborted transaction, so it is not reused
+            pool.putconn(conn, discard=True)
+            raise
+
+        if collect_stats:
+            stats = RedshiftHandler.query_stats(conn, query_id)
+            pool.putconn(conn)
+            return results, stats
+
+        pool.putconn(conn)
         return results
+
+    @staticmethod
+    def query_stats(conn, query_id: int) -> dict:
+        """
+        Reads the execution statistics of a completed query from the Redshift system tables, which
+        only show the queries of the connected user. Statistics that cannot be read are omitted.
+        :param conn: psycopg2 connection of the user that ran the query
+        :param query_id: Redshift query id
+        :return: dict with query_id, queue_time_ms, exec_time_ms, rows_unloaded, bytes_unloaded and bytes_scanned
+        """
+        stats = {'query_id': query_id}
+        try:
+            cursor = conn.cursor()
+            for query, columns in QUERY_STATS_QUERIES:
+                cursor.execute(query.format(query_id=query_id))
+                row = cursor.fetchone()
+                if row:
+                    stats.update((column, int(value)) for column, value in zip(columns, row))
+            conn.commit()
+        except pg.Error as e:
+            logger.warning(f"Failed to read execution statistics of query {query_id}: {e}")
+            if not conn.closed:
+                conn.rollback()
+        return stats
+
+    @staticmethod
+    def close_pools():
+        """
+        Closes the idle connections of every pool.
+        """
+        with RedshiftHandler._pools_lock:
+            for pool in RedshiftHandler._pools.values():
+                pool.closeall()
+
+    @staticmethod
+    def _get_pool(database_uri: str) -> "RedshiftConnectionPool":
+        with RedshiftHandler._pools_lock:
+            if database_uri not in RedshiftHandler._pools:
+                RedshiftHandler._pools[database_uri] = RedshiftConnectionPool(database_uri)
+            return RedshiftHandler._pools[database_uri]
+
+    @staticmethod
+    def _temp_tables(queries: typing.List[str]) -> typing.List[str]:
+        return [match.group(1) for query in queries for match in TEMP_TABLE_PATTERN.finditer(query)]
+
+    @staticmethod
+    def stage_key_set_queries(table_name: str,
+                              key_column: str,
+                              keys: typing.Iterable[str] = (),
+                              s3_url: str = None,
+                              iam_role: str = None) -> typing.List[str]:
+        """
+        Builds the queries staging a set of keys into a single column temporary table, so that
+        predicates on large key sets can be written as joins against the table instead of IN lists.
+        Temporary tables only exist for the duration of a session, so the returned queries must run in
+        the same transaction as the queries joining against the table.
+        :param table_name: Name of the temporary table
+        :param key_column: Name of the key column of the temporary table
+        :param keys: Keys to stage with batched multi-row INSERTs. Duplicate keys are staged once.
+        :param s3_url: S3 url of an object with one key per line (see key_set_content) to stage with COPY instead
+        :param iam_role: IAM role used by Redshift to read s3_url
+        :return: List of queries creating and populating the temporary table
+        """
+        queries = [f"CREATE TEMP TABLE {table_name} ({key_column} VARCHAR(256) NOT NULL) DISTSTYLE ALL;"]
+
+        if s3_url:
+            queries.append(f"COPY {table_name} FROM '{s3_url}' IAM_ROLE '{iam_role}' FORMAT AS CSV;")
+            return queries
+
+        keys = list(collections.OrderedDict.fromkeys(keys))
+        for i in range(0, len(keys), RedshiftHandler.KEY_SET_INSERT_BATCH_SIZE):
+            values = ", ".join("('" + str(key).replace("'", "''") + "')"
+                               for key in keys[i:i + RedshiftHandler.KEY_SET_INSERT_BATCH_SIZE])
+            queries.append(f"INSERT INTO {table_name} VALUES {values};")
+
+        return queries
+
+    @staticmethod
+    def key_set_content(keys: typing.Iterable[str]) -> str:
+        """
+        Formats a set of keys for staging with COPY (see stage_key_set_queries).
+        :param keys: Keys to stage. Duplicate keys are written once.
+        :return: str One key per line
+        """
+        return "\n".join(collections.OrderedDict.fromkeys(str(key) for key in keys))
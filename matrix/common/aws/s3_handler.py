@@ -5,6 +5,8 @@ class S3Handler:
     """
     Interface for interacting with an S3 Bucket.
     """
+    # Maximum number of keys S3 deletes per request
+    MAX_DELETE_BATCH_SIZE = 1000
 
     def __init__(self, bucket):
         self.s3 = boto3.resource('s3')
@@ -48,14 +50,17 @@ class S3Handler:
 
     def delete_objects(self, keys: list) -> list:
         """
-        Deletes a list keys from this S3 bucket.
+        Deletes a list keys from this S3 bucket, in batches of up to MAX_DELETE_BATCH_SIZE keys.
         :param keys: list of S3 keys to delete
         :return: List of successfully deleted objects
         """
-        objects = [{'Key': key} for key in keys]
+        deleted = []
+        for i in range(0, len(keys), S3Handler.MAX_DELETE_BATCH_SIZE):
+            objects = [{'Key': key} for key in keys[i:i + S3Handler.MAX_DELETE_BATCH_SIZE]]
 
-        response = self.s3_bucket.delete_objects(
-            Delete={'Objects': objects}
-        )
+            response = self.s3_bucket.delete_objects(
+                Delete={'Objects': objects}
+            )
+            deleted.extend(response.get('Deleted', []))
 
-        return response['Deleted'] if 'Deleted' in response else []
+        return deleted
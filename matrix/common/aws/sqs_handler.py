@@ -1,4 +1,5 @@
 import json
+import typing
 
 import boto3
 
@@ -9,6 +10,8 @@ class SQSHandler:
     """
     Interface for interacting with SQS.
     """
+    # Maximum number of entries of an SQS batch request
+    MAX_BATCH_SIZE = 10
 
     def __init__(self):
         self.sqs = boto3.resource('sqs')
@@ -22,10 +25,12 @@ class SQSHandler:
                                   detail=f"Adding message for {payload} "
                                          f"was unsuccessful to SQS {queue_url} with status {status})")
 
-    def receive_messages_from_queue(self, queue_url: str, wait_time=15, num_messages=1):
+    def receive_messages_from_queue(self, queue_url: str, wait_time=15, num_messages=1, visibility_timeout=None):
+        kwargs = {'VisibilityTimeout': visibility_timeout} if visibility_timeout is not None else {}
         response = self.sqs.meta.client.receive_message(QueueUrl=queue_url,
                                                         MaxNumberOfMessages=num_messages,
-                                                        WaitTimeSeconds=wait_time)
+                                                        WaitTimeSeconds=wait_time,
+                                                        **kwargs)
         status = response['ResponseMetadata']['HTTPStatusCode']
         if status != 200:
             raise MatrixException(status=500, title="Internal error",
@@ -41,3 +46,43 @@ class SQSHandler:
             raise MatrixException(status=500, title="Internal error",
                                   detail=f"Deleting message with receipt handle {receipt_handle} from {queue_url} "
                                          f"was unsuccessful with status {status})")
+
+    def delete_messages_from_queue(self, queue_url: str, receipt_handles: typing.List[str]) -> typing.List[dict]:
+        """
+        Deletes messages from a queue with batched requests.
+        :param queue_url: URL of the queue
+        :param receipt_handles: Receipt handles of the messages to delete
+        :return: List of the entries that failed to be deleted (see SQS DeleteMessageBatch)
+        """
+        return self._batch_request(self.sqs.meta.client.delete_message_batch,
+                                   queue_url,
+                                   [{'ReceiptHandle': receipt_handle} for receipt_handle in receipt_handles])
+
+    def change_messages_visibility(self,
+                                   queue_url: str,
+                                   receipt_handles: typing.List[str],
+                                   visibility_timeout: int) -> typing.List[dict]:
+        """
+        Sets the visibility timeout of received messages, counted from now, with batched requests.
+        :param queue_url: URL of the queue
+        :param receipt_handles: Receipt handles of the messages
+        :param visibility_timeout: Number of seconds before the messages become visible again
+        :return: List of the entries that failed to be changed (see SQS ChangeMessageVisibilityBatch)
+        """
+        return self._batch_request(self.sqs.meta.client.change_message_visibility_batch,
+                                   queue_url,
+                                   [{'ReceiptHandle': receipt_handle, 'VisibilityTimeout': visibility_timeout}
+                                    for receipt_handle in receipt_handles])
+
+    @staticmethod
+    def _batch_request(request, queue_url: str, entries: typing.List[dict]) -> typing.List[dict]:
+        failed = []
+        for i in range(0, len(entries), SQSHandler.MAX_BATCH_SIZE):
+            batch = [dict(entry, Id=str(j)) for j, entry in enumerate(entries[i:i + SQSHandler.MAX_BATCH_SIZE])]
+            response = request(QueueUrl=queue_url, Entries=batch)
+            status = response['ResponseMetadata']['HTTPStatusCode']
+            if status != 200:
+                raise MatrixException(status=500, title="Internal error",
+                                      detail=f"Batch request to {queue_url} was unsuccessful with status {status})")
+            failed.extend(response.get('Failed', []))
+        return failed
@@ -1,3 +1,4 @@
+import calendar
 import datetime
 import typing
 
@@ -15,3 +16,7 @@ def to_string(date: datetime.datetime) -> str:
 
 def to_datetime(date_string: str) -> datetime.datetime:
     return datetime.datetime.strptime(date_string, FORMAT_STRING)
+
+
+def to_timestamp(date: datetime.datetime) -> int:
+    return calendar.timegm(date.utctimetuple())
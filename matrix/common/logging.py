@@ -1,6 +1,25 @@
 import logging
 import os
 import sys
+import threading
+
+
+class _CorrelationIdFilter(logging.Filter):
+    """
+    Adds the correlation id set by the current thread, or else the most recently set one, to log records.
+    """
+    def __init__(self, correlation_id: str):
+        super().__init__()
+        self.correlation_id = correlation_id
+        self._thread_correlation_ids = threading.local()
+
+    def set_correlation_id(self, correlation_id: str):
+        self.correlation_id = correlation_id
+        self._thread_correlation_ids.value = correlation_id
+
+    def filter(self, record):
+        record.correlation_id = getattr(self._thread_correlation_ids, 'value', self.correlation_id)
+        return True
 
 
 class Logging:
@@ -22,7 +41,18 @@ class Logging:
 
     @staticmethod
     def set_correlation_id(logger: logging.Logger, id_name: str = "REQUEST_ID", value: str = None):
-        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s'
-                                      + f' {id_name}:{value} %(message)s', datefmt="%Y-%m-%dT%H:%M:%S%z")
-        logger.handlers[0].setFormatter(formatter)
+        """
+        Tags the messages of a logger with a correlation id. The id is tracked per thread, so that
+        threads handling different requests with the same logger tag their messages correctly.
+        """
+        handler = logger.handlers[0]
+        correlation_id = f"{id_name}:{value}"
+        correlation_id_filter = next((f for f in handler.filters if isinstance(f, _CorrelationIdFilter)), None)
+        if correlation_id_filter is None:
+            formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s %(correlation_id)s %(message)s',
+                                          datefmt="%Y-%m-%dT%H:%M:%S%z")
+            handler.setFormatter(formatter)
+            correlation_id_filter = _CorrelationIdFilter(correlation_id)
+            handler.addFilter(correlation_id_filter)
+        correlation_id_filter.set_correlation_id(correlation_id)
         return logger
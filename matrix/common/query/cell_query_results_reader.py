@@ -1,21 +1,38 @@
+import typing
+
 import pandas
 
 from matrix.common.query.query_results_reader import QueryResultsReader
 
 
 class CellQueryResultsReader(QueryResultsReader):
-    def load_results(self):
+    def load_results(self, columns: typing.List[str] = None):
+        """Load the cell metadata table from all result slices.
+
+        Categorical columns are recoded against a dictionary unified across all slices
+        so that concatenation preserves the compact category dtype instead of falling
+        back to object.
+
+        Args:
+            columns: Optional list of metadata fields to load. Defaults to all fields.
+
+        Returns:
+            dataframe of cell metadata. Index is "cellkey" and other columns are metadata
+            fields.
+        """
 
         if self.is_empty:
             return pandas.DataFrame()
 
-        return pandas.concat([self.load_slice(s) for s in range(len(self.manifest['part_urls']))], copy=False)
+        dfs = [self.load_slice(s, columns=columns) for s in range(len(self.manifest['part_urls']))]
+        return pandas.concat(self._unify_categories(dfs), copy=False)
 
-    def load_slice(self, slice_idx):
+    def load_slice(self, slice_idx, columns: typing.List[str] = None):
         """Load the cell metadata table from a particular result slice.
 
         Args:
             slice_idx: Index of the slice to get cell metadata for
+            columns: Optional list of metadata fields to load. Defaults to all fields.
 
         Returns:
             dataframe of cell metadata. Index is "cellkey" and other columns are metadata
@@ -28,10 +45,38 @@ class CellQueryResultsReader(QueryResultsReader):
         cell_table_dtype["emptydrops_is_cell"] = "object"
         cell_table_dtype["cellkey"] = "object"
 
+        usecols = None
+        if columns is not None:
+            usecols = ["cellkey"] + [c for c in columns if c != "cellkey"]
+            cell_table_dtype = {c: cell_table_dtype[c] for c in usecols if c in cell_table_dtype}
+
         part_url = self.manifest["part_urls"][slice_idx]
         df = pandas.read_csv(
-            part_url, sep='|', header=None, names=cell_table_columns,
+            part_url, sep='|', header=None, names=cell_table_columns, usecols=usecols,
             dtype=cell_table_dtype, true_values=["t"], false_values=["f"],
             index_col="cellkey")
 
         return df
+
+    @staticmethod
+    def _unify_categories(dfs: typing.List[pandas.DataFrame]) -> typing.List[pandas.DataFrame]:
+        """
+        Recodes the categorical columns of each slice against the union of the categories
+        found in every slice, so that pandas.concat can keep them categorical.
+        :param dfs: List of cell metadata dataframes, one per slice
+        :return: The same dataframes with shared category dictionaries
+        """
+        if len(dfs) < 2:
+            return dfs
+
+        for column in dfs[0].columns:
+            if not all(column in df.columns and pandas.api.types.is_categorical_dtype(df[column]) for df in dfs):
+                continue
+
+            categories = dfs[0][column].cat.categories
+            for df in dfs[1:]:
+                categories = categories.union(df[column].cat.categories)
+            for df in dfs:
+                df[column] = df[column].cat.set_categories(categories)
+
+        return dfs
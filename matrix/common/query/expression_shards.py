@@ -0,0 +1,42 @@
+import math
+import typing
+
+from matrix.common.query.manifest_service import ManifestService
+
+# The expression query of requests matching more than EXPRESSION_SHARD_CELLS cells is split
+# into up to MAX_EXPRESSION_SHARDS shards over disjoint sets of cells, which are queued as
+# separate messages so that several QueryRunner tasks can unload them in parallel.
+EXPRESSION_SHARD_CELLS = 100000
+MAX_EXPRESSION_SHARDS = 16
+
+# Restricts an expression query to one of num_shards disjoint shards of the cells, by hash of the cellkey
+EXPRESSION_SHARD_WHERE_CLAUSE = """
+  AND STRTOL(SUBSTRING(MD5(expression.cellkey), 1, 7), 16) % {num_shards} = {shard}"""
+
+
+def get_num_expression_shards(num_cells: int) -> int:
+    """The number of shards to split the expression query of a request matching num_cells cells into."""
+
+    return min(MAX_EXPRESSION_SHARDS, max(1, math.ceil(num_cells / EXPRESSION_SHARD_CELLS)))
+
+
+def create_expression_shard_queries(expression_query_template: str,
+                                    num_shards: int,
+                                    **kwargs) -> typing.Union[str, typing.List[str]]:
+    """Format an expression query template, split into num_shards queries.
+
+    Each shard selects the expression of the cells whose cellkey hashes to it
+    and is unloaded to its own prefix (see ManifestService.EXPRESSION_SHARD_PREFIX),
+    so every cell is in exactly one shard. If num_shards is 1, a single unsharded
+    query is returned.
+    """
+
+    if num_shards == 1:
+        return expression_query_template.format(shard_where_clause="",
+                                                expression_prefix="expression_",
+                                                **kwargs)
+
+    return [expression_query_template.format(
+        shard_where_clause=EXPRESSION_SHARD_WHERE_CLAUSE.format(num_shards=num_shards, shard=shard),
+        expression_prefix=ManifestService.EXPRESSION_SHARD_PREFIX.format(shard=shard),
+        **kwargs) for shard in range(num_shards)]
@@ -0,0 +1,180 @@
+import collections
+import json
+import os
+import threading
+import time
+import typing
+
+import botocore
+
+from matrix.common import constants
+from matrix.common import query_constructor
+from matrix.common.aws.redshift_handler import RedshiftHandler, TableName
+from matrix.common.aws.s3_handler import S3Handler
+from matrix.common.logging import Logging
+
+logger = Logging.get_logger(__name__)
+
+
+class FieldDetailService:
+    """
+    Provides cached access to the statistics of the metadata fields served by the /v1/fields/{name}
+    and /v1/filters/{name} endpoints.
+
+    The statistics of a field are computed in Redshift once per data version (see generate_field_details,
+    run when the data version is bumped) and stored as a compact JSON document per field in the query
+    results bucket. Parsed documents are cached per process and keyed by data version and field, so
+    that detail lookups do not touch Redshift. Documents that are missing, e.g. for data versions
+    created before the statistics were precomputed, removed by the bucket's expiration rule or deleted
+    after a bundle notification changed Redshift (see delete_stored_field_details), are computed on
+    first access.
+
+    Bundle notifications modify Redshift without bumping the data version, so cached documents expire
+    after CACHE_TTL_SECONDS and statistics may lag behind the data by up to that long.
+    """
+    MAX_CACHED_FIELD_DETAILS = 128
+    CACHE_TTL_SECONDS = 300
+
+    # Documents larger than this are served from S3 on every access instead of being cached
+    MAX_CACHED_DOCUMENT_BYTES = 1024 * 1024
+
+    FIELD_DETAILS_PREFIX = "field_details"
+
+    _cache = collections.OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.s3_handler = S3Handler(os.environ['MATRIX_QUERY_RESULTS_BUCKET'])
+
+    @classmethod
+    def field_detail_key(cls, data_version: int, field_name: str) -> str:
+        """
+        The S3 key of the statistics document of a field.
+        :param data_version: Data version the statistics are computed on
+        :param field_name: Metadata field name (see constants.FIELD_DETAIL)
+        :return: str S3 key in the query results bucket
+        """
+        return f"{cls.FIELD_DETAILS_PREFIX}/{data_version}/{field_name}.json"
+
+    def get_field_detail(self, field_name: str, data_version: int) -> dict:
+        """
+        Retrieves the statistics of a field, computing and storing them on the first access only.
+        Callers must treat the returned dict as read-only.
+        :param field_name: Metadata field name (see constants.FIELD_DETAIL)
+        :param data_version: Data version currently served by the deployment
+        :return: dict Field statistics (see compute_field_detail)
+        """
+        cache_key = (data_version, field_name)
+        with FieldDetailService._lock:
+            if cache_key in FieldDetailService._cache:
+                expiration, field_detail = FieldDetailService._cache[cache_key]
+                if time.monotonic() < expiration:
+                    FieldDetailService._cache.move_to_end(cache_key)
+                    return field_detail
+                FieldDetailService._cache.pop(cache_key)
+
+        try:
+            document = self.s3_handler.load_content_from_obj_key(self.field_detail_key(data_version, field_name))
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != "NoSuchKey":
+                raise
+            logger.info(f"Statistics of {field_name} on data version {data_version} not found, computing them")
+            document = self._store_field_detail(data_version, field_name, self.compute_field_detail(field_name))
+
+        field_detail = json.loads(document)
+        if len(document) <= FieldDetailService.MAX_CACHED_DOCUMENT_BYTES:
+            with FieldDetailService._lock:
+                FieldDetailService._cache[cache_key] = (time.monotonic() + FieldDetailService.CACHE_TTL_SECONDS,
+                                                        field_detail)
+                while len(FieldDetailService._cache) > FieldDetailService.MAX_CACHED_FIELD_DETAILS:
+                    FieldDetailService._cache.popitem(last=False)
+
+        return field_detail
+
+    def generate_field_details(self,
+                               data_version: int,
+                               field_names: typing.Iterable[str] = None) -> typing.Dict[str, dict]:
+        """
+        Computes the statistics of fields in Redshift and stores them for a data version.
+        Must be run while Redshift holds the data of the data version.
+        :param data_version: Data version the statistics are computed on
+        :param field_names: Metadata field names to compute the statistics of, defaults to all fields
+        :return: dict of field name to field statistics (see compute_field_detail)
+        """
+        field_details = {}
+        for field_name in (constants.FIELD_DETAIL if field_names is None else field_names):
+            field_details[field_name] = self.compute_field_detail(field_name)
+            self._store_field_detail(data_version, field_name, field_details[field_name])
+            logger.info(f"Stored statistics of {field_name} on data version {data_version}")
+
+        FieldDetailService.invalidate(data_version)
+        return field_details
+
+    def delete_stored_field_details(self) -> int:
+        """
+        Deletes the stored statistics of all data versions, so that they are recomputed on their next access.
+        Must be run whenever cells are added to or removed from Redshift without bumping the data version.
+        :return: int Number of deleted documents
+        """
+        deleted_count = 0
+        while True:
+            keys = [obj['Key'] for obj in self.s3_handler.ls(f"{FieldDetailService.FIELD_DETAILS_PREFIX}/")]
+            deleted = self.s3_handler.delete_objects(keys) if keys else []
+            deleted_count += len(deleted)
+            # S3 lists up to 1000 keys per request, stop once a listing deletes nothing more
+            if not deleted:
+                break
+
+        FieldDetailService.invalidate()
+        logger.info(f"Deleted {deleted_count} stored field statistics documents")
+        return deleted_count
+
+    @staticmethod
+    def compute_field_detail(field_name: str) -> dict:
+        """
+        Computes the statistics of a field over all cells in Redshift.
+        :param field_name: Metadata field name (see constants.FIELD_DETAIL)
+        :return: dict with keys:
+            "field_type": "categorical" or "numeric"
+            "cell_counts": number of cells per value of a categorical field, keyed by the value as a string
+                ("" for cells without a value)
+            "minimum", "maximum": range of the values of a numeric field
+        """
+        type_ = constants.METADATA_FIELD_TO_TYPE[field_name]
+        column_name = constants.METADATA_FIELD_TO_TABLE_COLUMN[field_name]
+        table_name = constants.TABLE_COLUMN_TO_TABLE[column_name]
+        fq_name = table_name + "." + column_name
+
+        table_primary_key = RedshiftHandler.PRIMARY_KEY[TableName(table_name)]
+        query = query_constructor.create_field_detail_query(fq_name, table_name, table_primary_key, type_)
+        results = RedshiftHandler().transaction([query], return_results=True, read_only=True)
+
+        if type_ == "categorical":
+            return {
+                "field_type": type_,
+                "cell_counts": {"" if value is None else str(value): count for value, count in results}
+            }
+        elif type_ == "numeric":
+            return {
+                "field_type": type_,
+                "minimum": results[0][0],
+                "maximum": results[0][1]
+            }
+
+    @staticmethod
+    def invalidate(data_version: int = None):
+        """
+        Drops the statistics of a data version from the cache, or all cached statistics if no data version is provided.
+        :param data_version: Data version the statistics are computed on
+        """
+        with FieldDetailService._lock:
+            if data_version is None:
+                FieldDetailService._cache.clear()
+            else:
+                for cache_key in [key for key in FieldDetailService._cache if key[0] == data_version]:
+                    FieldDetailService._cache.pop(cache_key)
+
+    def _store_field_detail(self, data_version: int, field_name: str, field_detail: dict) -> str:
+        document = json.dumps(field_detail, separators=(",", ":"))
+        self.s3_handler.store_content_in_s3(self.field_detail_key(data_version, field_name), document)
+        return document
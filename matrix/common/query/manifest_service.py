@@ -0,0 +1,156 @@
+import collections
+import json
+import os
+import threading
+import typing
+
+import s3fs
+
+
+class MatrixQueryResultsNotFound(Exception):
+    """Error indicating access to query results not found in S3"""
+    pass
+
+
+class ManifestService:
+    """
+    Provides cached access to the manifests produced by Redshift UNLOAD queries.
+
+    Parsed manifests are cached per process and keyed by S3 url, so every reader,
+    the request hash and the conversion scheduler of a request share a single
+    fetch.
+    """
+    MAX_CACHED_MANIFESTS = 64
+
+    # Redshift UNLOAD prefixes per QueryType value (see matrix.docker.query_runner.QueryType)
+    MANIFEST_PREFIXES = {
+        "cell": "cell_metadata_",
+        "expression": "expression_",
+        "feature": "gene_metadata_",
+    }
+
+    # Redshift UNLOAD prefix of each shard of a sharded expression query
+    EXPRESSION_SHARD_PREFIX = "expression_{shard}_"
+
+    _cache = collections.OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self._s3fs = None
+
+    @classmethod
+    def request_manifest_url(cls, request_id: str, query_type: str) -> str:
+        """
+        The S3 url of the manifest written by a request's query.
+        :param request_id: UUID identifying a matrix service request
+        :param query_type: QueryType value of the query (cell|expression|feature)
+        :return: str S3 url of the manifest
+        """
+        return f"s3://{os.environ['MATRIX_QUERY_RESULTS_BUCKET']}/{request_id}/" \
+               f"{cls.MANIFEST_PREFIXES[query_type]}manifest"
+
+    @classmethod
+    def expression_shard_manifest_url(cls, request_id: str, shard: int) -> str:
+        """
+        The S3 url of the manifest written by a shard of a request's sharded expression query.
+        :param request_id: UUID identifying a matrix service request
+        :param shard: Index of the expression query shard
+        :return: str S3 url of the manifest
+        """
+        return f"s3://{os.environ['MATRIX_QUERY_RESULTS_BUCKET']}/{request_id}/" \
+               f"{cls.EXPRESSION_SHARD_PREFIX.format(shard=shard)}manifest"
+
+    def get_request_manifest(self, request_id: str, query_type: str) -> dict:
+        """
+        Retrieves the parsed manifest of a request's query.
+        :param request_id: UUID identifying a matrix service request
+        :param query_type: QueryType value of the query (cell|expression|feature)
+        :return: dict Parsed manifest (see get_manifest)
+        """
+        return self.get_manifest(self.request_manifest_url(request_id, query_type))
+
+    def get_manifest(self, manifest_url: str) -> dict:
+        """
+        Retrieves a parsed manifest, fetching it from S3 on the first access only.
+        Callers must treat the returned dict as read-only.
+        :param manifest_url: S3 location of the manifest file
+        :return: dict Parsed manifest (see _parse_manifest)
+        """
+        with ManifestService._lock:
+            if manifest_url in ManifestService._cache:
+                ManifestService._cache.move_to_end(manifest_url)
+                return ManifestService._cache[manifest_url]
+
+        manifest = self._parse_manifest(manifest_url)
+
+        with ManifestService._lock:
+            ManifestService._cache[manifest_url] = manifest
+            while len(ManifestService._cache) > ManifestService.MAX_CACHED_MANIFESTS:
+                ManifestService._cache.popitem(last=False)
+
+        return manifest
+
+    def merge_manifests(self, manifest_urls: typing.List[str], target_url: str):
+        """
+        Writes a manifest listing the entries of several manifests of query results with the same
+        columns, so that the results of a sharded query can be read as the results of a single query.
+        :param manifest_urls: S3 locations of the manifests to merge
+        :param target_url: S3 location of the merged manifest
+        """
+        manifests = [self._load_manifest(manifest_url) for manifest_url in manifest_urls]
+        merged_manifest = {
+            "entries": [entry for manifest in manifests for entry in manifest["entries"]],
+            "schema": manifests[0]["schema"],
+            "meta": {
+                "content_length": sum(manifest["meta"].get("content_length", 0) for manifest in manifests),
+                "record_count": sum(manifest["meta"]["record_count"] for manifest in manifests),
+            },
+        }
+
+        with self._get_s3fs().open(target_url, "w") as manifest_file:
+            json.dump(merged_manifest, manifest_file)
+        ManifestService.invalidate(target_url)
+
+    @staticmethod
+    def invalidate(manifest_url: str = None):
+        """
+        Drops a manifest from the cache, or every cached manifest if no url is provided.
+        :param manifest_url: S3 location of the manifest file
+        """
+        with ManifestService._lock:
+            if manifest_url is None:
+                ManifestService._cache.clear()
+            else:
+                ManifestService._cache.pop(manifest_url, None)
+
+    def _parse_manifest(self, manifest_url: str) -> dict:
+        """Parse a manifest file produced by a Redshift UNLOAD query.
+
+        Args:
+            manifest_url: S3 location of the manifest file.
+
+        Returns:
+            dict with keys:
+                "columns": the column headers for the tables
+                "part_urls": full S3 urls for the files containing results from each
+                    Redshift slice
+                "record_count": total number of records returned by the query
+        """
+        manifest = self._load_manifest(manifest_url)
+
+        return {
+            "columns": [e["name"] for e in manifest["schema"]["elements"]],
+            "part_urls": [e["url"] for e in manifest["entries"] if e["meta"]["record_count"]],
+            "record_count": manifest["meta"]["record_count"],
+        }
+
+    def _load_manifest(self, manifest_url: str) -> dict:
+        try:
+            return json.load(self._get_s3fs().open(manifest_url))
+        except FileNotFoundError:
+            raise MatrixQueryResultsNotFound(f"Unable to locate query results at {manifest_url}.")
+
+    def _get_s3fs(self) -> s3fs.S3FileSystem:
+        if self._s3fs is None:
+            self._s3fs = s3fs.S3FileSystem()
+        return self._s3fs
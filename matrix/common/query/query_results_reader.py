@@ -1,13 +1,5 @@
-import json
-
-import s3fs
-
 from matrix.common import constants
-
-
-class MatrixQueryResultsNotFound(Exception):
-    """Error indicating access to query results not found in S3"""
-    pass
+from matrix.common.query.manifest_service import ManifestService, MatrixQueryResultsNotFound  # noqa: F401
 
 
 class QueryResultsReader:
@@ -17,10 +9,10 @@ class QueryResultsReader:
 
     load_results: Loads all results into memory
     load_slice: Loads results at the given slice index
+
+    Manifests are retrieved through the shared ManifestService cache and must not be modified.
     """
     def __init__(self, s3_manifest_key):
-        self._s3fs = s3fs.S3FileSystem()
-
         self.s3_manifest_key = s3_manifest_key
         self.manifest = self._parse_manifest(s3_manifest_key)
 
@@ -48,22 +40,13 @@ class QueryResultsReader:
             manifest_key: S3 location of the manifest file.
 
         Returns:
-            dict with three keys:
+            dict as returned by ManifestService.get_manifest, including:
                 "columns": the column headers for the tables
                 "part_urls": full S3 urls for the files containing results from each
                     Redshift slice
                 "record_count": total number of records returned by the query
         """
-        try:
-            manifest = json.load(self._s3fs.open(manifest_key))
-        except FileNotFoundError:
-            raise MatrixQueryResultsNotFound(f"Unable to locate query results at {manifest_key}.")
-
-        return {
-            "columns": [e["name"] for e in manifest["schema"]["elements"]],
-            "part_urls": [e["url"] for e in manifest["entries"] if e["meta"]["record_count"]],
-            "record_count": manifest["meta"]["record_count"]
-        }
+        return ManifestService().get_manifest(manifest_key)
 
     @staticmethod
     def _map_columns(cols: list):
@@ -1,8 +1,11 @@
 """Methods and templates for redshift queries."""
 
+import hashlib
+import json
 import typing
 
 from matrix.common import constants
+from matrix.common.query.expression_shards import create_expression_shard_queries
 from matrix.docker.query_runner import QueryType
 
 COMPARISON_OPERATORS = [
@@ -16,40 +19,100 @@ EXPRESSION_QUERY_TEMPLATE = """
 UNLOAD ($$SELECT cell.cellkey, expression.featurekey, expression.exrpvalue
 FROM expression
   LEFT OUTER JOIN feature on (expression.featurekey = feature.featurekey)
-  INNER JOIN cell on (expression.cellkey = cell.cellkey)
-  INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)
-  INNER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)
-  INNER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)
-  INNER JOIN donor on (specimen.donorkey = donor.donorkey)
-  INNER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)
-  INNER JOIN project on (cell.projectkey = project.projectkey)
+  INNER JOIN cell on (expression.cellkey = cell.cellkey){cell_joins}
 WHERE {feature_where_clause}
   AND expression.exprtype = 'Count'
-  AND {cell_where_clause}$$)
-TO 's3://{{results_bucket}}/{{request_id}}/expression_'
+  AND {cell_where_clause}{shard_where_clause}$$)
+TO 's3://{{results_bucket}}/{{request_id}}/{expression_prefix}'
 IAM_ROLE '{{iam_role}}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """
 
 CELL_QUERY_TEMPLATE = """
 UNLOAD($$SELECT cell.cellkey, {fields}
-FROM cell
-  LEFT OUTER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)
-  LEFT OUTER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)
-  LEFT OUTER JOIN donor on (specimen.donorkey = donor.donorkey)
-  LEFT OUTER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)
-  LEFT OUTER JOIN project on (cell.projectkey = project.projectkey)
-  INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)
+FROM cell{cell_joins}
 WHERE {cell_where_clause}$$)
 TO 's3://{{results_bucket}}/{{request_id}}/cell_metadata_'
 IAM_ROLE '{{iam_role}}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """
 
+# Templates for two-phase execution. The cellkeys matching the filter are materialized
+# once into a per-request staging table, which the cell and expression queries join against.
+CELL_KEYS_QUERY_TEMPLATE = """
+DROP TABLE IF EXISTS {{cell_keys_table}};
+CREATE TABLE {{cell_keys_table}} DISTKEY(cellkey) SORTKEY(cellkey) AS
+SELECT cell.cellkey, cell.genes_detected
+FROM cell{cell_joins}
+WHERE {cell_where_clause};
+SELECT COUNT(*), COALESCE(SUM(genes_detected), 0) FROM {{cell_keys_table}};
+"""
+
+STAGED_EXPRESSION_QUERY_TEMPLATE = """
+UNLOAD ($$SELECT expression.cellkey, expression.featurekey, expression.exrpvalue
+FROM expression
+  INNER JOIN {{cell_keys_table}} cell_keys on (expression.cellkey = cell_keys.cellkey)
+  LEFT OUTER JOIN feature on (expression.featurekey = feature.featurekey)
+WHERE {feature_where_clause}
+  AND expression.exprtype = 'Count'{shard_where_clause}$$)
+TO 's3://{{results_bucket}}/{{request_id}}/{expression_prefix}'
+IAM_ROLE '{{iam_role}}'
+GZIP
+ALLOWOVERWRITE
+MANIFEST VERBOSE
+;
+"""
+
+STAGED_CELL_QUERY_TEMPLATE = """
+UNLOAD($$SELECT cell.cellkey, {fields}
+FROM {{cell_keys_table}} cell_keys
+  INNER JOIN cell on (cell_keys.cellkey = cell.cellkey){cell_joins}$$)
+TO 's3://{{results_bucket}}/{{request_id}}/cell_metadata_'
+IAM_ROLE '{{iam_role}}'
+GZIP
+ALLOWOVERWRITE
+MANIFEST VERBOSE
+;
+"""
+
+CELL_COUNT_QUERY_TEMPLATE = """
+SELECT COUNT(*), COALESCE(SUM(cell.genes_detected), 0)
+FROM cell{cell_joins}
+WHERE {cell_where_clause}
+;
+"""
+
+# Joins from the cell table to the metadata tables, in the order they are emitted
+# in the expression and cell queries. Each entry is (table, table it joins onto, join condition).
+EXPRESSION_QUERY_CELL_JOINS = [
+    ("analysis", "cell", "INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)"),
+    ("cell_suspension", "cell",
+     "INNER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)"),
+    ("specimen", "cell_suspension", "INNER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)"),
+    ("donor", "specimen", "INNER JOIN donor on (specimen.donorkey = donor.donorkey)"),
+    ("library_preparation", "cell",
+     "INNER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)"),
+    ("project", "cell", "INNER JOIN project on (cell.projectkey = project.projectkey)"),
+]
+
+CELL_QUERY_CELL_JOINS = [
+    ("cell_suspension", "cell",
+     "LEFT OUTER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)"),
+    ("specimen", "cell_suspension",
+     "LEFT OUTER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)"),
+    ("donor", "specimen", "LEFT OUTER JOIN donor on (specimen.donorkey = donor.donorkey)"),
+    ("library_preparation", "cell",
+     "LEFT OUTER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)"),
+    ("project", "cell", "LEFT OUTER JOIN project on (cell.projectkey = project.projectkey)"),
+    ("analysis", "cell", "INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)"),
+]
+
 FEATURE_QUERY_TEMPLATE = """
 UNLOAD ($$SELECT *
 FROM feature
@@ -58,6 +121,7 @@ WHERE {feature_where_clause}
 to 's3://{{results_bucket}}/{{request_id}}/gene_metadata_'
 IAM_ROLE '{{iam_role}}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE;
 """
 
@@ -134,22 +198,128 @@ def translate_filters(filter_: typing.Dict[str, typing.Any]) -> typing.Dict[str,
     names inside the matrix service. This function takes a filter with a field
     like "project.project_core.project_short_name" and translates it to
     "project.short_name" so the query will execute correctly.
+
+    The filter tree is copied iteratively, so arbitrarily deep filters do not
+    hit the recursion limit.
     """
 
     new_filter = dict(filter_)
-    if "field" in filter_:
-        fq_name = _get_internal_name(filter_["field"])
-        new_filter["field"] = fq_name
-    else:
-        try:
-            new_values = [translate_filters(f) for f in filter_["value"]]
-            new_filter["value"] = new_values
-        except KeyError:
-            pass
+    stack = [new_filter]
+    while stack:
+        node = stack.pop()
+        if "field" in node:
+            node["field"] = _get_internal_name(node["field"])
+        elif "value" in node:
+            new_values = [dict(f) for f in node["value"]]
+            node["value"] = new_values
+            stack.extend(new_values)
 
     return new_filter
 
 
+def canonicalize_filter(filter_: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Rewrite a matrix filter into a canonical form, so that logically identical
+    filters compare (and hash) equal.
+
+    Field names are translated to their internal names, nested and/or operators
+    of the same kind are flattened, duplicate operands are dropped and the operands
+    of and/or as well as the values of "in" are sorted. An and/or left with a single
+    operand is replaced by that operand.
+    """
+
+    return _canonicalize_filter(filter_)[0]
+
+
+def _canonicalize_filter(filter_: typing.Dict[str, typing.Any]) -> typing.Tuple[typing.Dict[str, typing.Any], str]:
+    """Canonicalize a matrix filter (see canonicalize_filter) and digest the canonical filter.
+
+    The filter tree is walked iteratively, so arbitrarily deep filters do not hit
+    the recursion limit. Comparisons are keyed by their JSON serialization and
+    logical operators by a digest of the keys of their canonical operands, so that
+    no subtree is serialized more than once. Operands are sorted by key, which
+    orders comparisons as their serialization does and before logical operands.
+    """
+
+    def _dedupe_and_sort(values):
+        return [v for _, v in sorted({json.dumps(v, sort_keys=True): v for v in values}.items())]
+
+    # Each canonical node is kept with its sort key and, for and/or/not, its canonical operands
+    results = []
+    stack = [(filter_, False)]
+    while stack:
+        node, visited = stack.pop()
+        op = node.get("op") if isinstance(node, dict) else None
+        value = node.get("value") if isinstance(node, dict) else None
+
+        if not (op in LOGICAL_OPERATORS and isinstance(value, (list, tuple))):
+            if op in COMPARISON_OPERATORS:
+                canonical_filter = translate_filters(node)
+                if op == "in" and isinstance(value, (list, tuple)):
+                    canonical_filter["value"] = _dedupe_and_sort(value)
+            elif isinstance(node, dict):
+                # Leave malformed filters untouched, they are rejected when the queries are constructed
+                canonical_filter = dict(node)
+            else:
+                canonical_filter = node
+            results.append((canonical_filter, (0, json.dumps(canonical_filter, sort_keys=True)), None))
+            continue
+
+        if not visited:
+            stack.append((node, True))
+            stack.extend((v, False) for v in reversed(value))
+            continue
+
+        num_operands = len(value)
+        operands = results[len(results) - num_operands:]
+        del results[len(results) - num_operands:]
+
+        if op != "not":
+            flattened_operands = []
+            for operand in operands:
+                if operand[2] is not None and operand[0]["op"] == op:
+                    flattened_operands.extend(operand[2])
+                else:
+                    flattened_operands.append(operand)
+
+            operands = sorted({operand[1]: operand for operand in flattened_operands}.values(),
+                              key=lambda operand: operand[1])
+            if len(operands) == 1:
+                results.append(operands[0])
+                continue
+
+        digest = hashlib.md5(json.dumps([op, [operand[1] for operand in operands]]).encode()).hexdigest()
+        results.append(({"op": op, "value": [operand[0] for operand in operands]}, (1, digest), operands))
+
+    canonical_filter, key, _ = results[0]
+    return canonical_filter, hashlib.md5(json.dumps(key).encode()).hexdigest()
+
+
+def create_query_hash(filter_: typing.Dict[str, typing.Any],
+                      fields: typing.List[str],
+                      feature: str,
+                      format_: str,
+                      genus_species: constants.GenusSpecies,
+                      data_version: int) -> str:
+    """Create a hash identifying a matrix request by its canonical query
+    parameters.
+
+    Unlike the request hash, which is built from the cellkeys returned by the
+    cell query, the query hash is available before any query runs. Logically
+    identical requests on the same data version share the same query hash.
+    """
+
+    query_parameters = {
+        "filter": _canonicalize_filter(filter_)[1],
+        "fields": translate_fields(fields),
+        "feature": feature,
+        "format": format_,
+        "genus_species": genus_species.value,
+        "data_version": int(data_version),
+    }
+
+    return hashlib.md5(json.dumps(query_parameters, sort_keys=True).encode()).hexdigest()
+
+
 def translate_fields(fields: typing.List[str]) -> typing.List[str]:
     """Translate field list from external metadata field names to internal
     redshift names.
@@ -164,20 +334,37 @@ def translate_fields(fields: typing.List[str]) -> typing.List[str]:
 
 def create_matrix_request_queries(filter_: typing.Dict[str, typing.Any],
                                   fields: typing.List[str],
-                                  feature: str) -> typing.Dict[QueryType, str]:
+                                  feature: str,
+                                  num_expression_shards: int = 1
+                                  ) -> typing.Dict[QueryType, typing.Union[str, typing.List[str]]]:
     """Based on values from the matrix request, create an appropriate
     set of redshift queries to serve the request.
+
+    If num_expression_shards is greater than 1, the expression query is split
+    into that many queries over disjoint sets of cells (see
+    create_expression_shard_queries) and a list of queries is returned for it.
     """
 
-    cell_where_clause = filter_to_where(translate_filters(filter_))
+    translated_filter = translate_filters(filter_)
+    translated_fields = translate_fields(fields)
+    cell_where_clause = filter_to_where(translated_filter)
     feature_where_clause = feature_to_where(feature)
 
-    expression_query = EXPRESSION_QUERY_TEMPLATE.format(
+    filter_tables = referenced_tables(filter_fields(translated_filter))
+    field_tables = referenced_tables(translated_fields)
+
+    expression_query = create_expression_shard_queries(
+        EXPRESSION_QUERY_TEMPLATE,
+        num_expression_shards,
+        cell_joins=create_cell_joins(EXPRESSION_QUERY_CELL_JOINS, filter_tables),
         feature_where_clause=feature_where_clause,
         cell_where_clause=cell_where_clause)
 
     cell_query = CELL_QUERY_TEMPLATE.format(
-        fields=', '.join(translate_fields(fields)),
+        fields=', '.join(translated_fields),
+        cell_joins=create_cell_joins(CELL_QUERY_CELL_JOINS,
+                                     None if filter_tables is None or field_tables is None
+                                     else filter_tables | field_tables),
         cell_where_clause=cell_where_clause)
 
     feature_query = FEATURE_QUERY_TEMPLATE.format(feature_where_clause=feature_where_clause)
@@ -189,6 +376,147 @@ def create_matrix_request_queries(filter_: typing.Dict[str, typing.Any],
     }
 
 
+def create_two_phase_matrix_request_queries(filter_: typing.Dict[str, typing.Any],
+                                            fields: typing.List[str],
+                                            feature: str) -> typing.Dict[QueryType, str]:
+    """Based on values from the matrix request, create a set of redshift
+    queries that evaluate the filter only once.
+
+    The cell keys query materializes the cellkeys matching the filter into the
+    staging table {cell_keys_table} and returns their count and detected genes.
+    The cell and expression queries join against the staging table instead of
+    repeating the filter and its joins, so they must run after the cell keys
+    query. As the size of the request is only known then, the expression query
+    is returned as a template of its shards, which is split with
+    create_expression_shard_queries once the cell keys query has run.
+    """
+
+    translated_filter = translate_filters(filter_)
+    translated_fields = translate_fields(fields)
+    cell_where_clause = filter_to_where(translated_filter)
+    feature_where_clause = feature_to_where(feature)
+
+    cell_keys_query = CELL_KEYS_QUERY_TEMPLATE.format(
+        cell_joins=create_cell_joins(EXPRESSION_QUERY_CELL_JOINS,
+                                     referenced_tables(filter_fields(translated_filter))),
+        cell_where_clause=cell_where_clause)
+
+    expression_query = STAGED_EXPRESSION_QUERY_TEMPLATE.format(feature_where_clause=feature_where_clause,
+                                                               shard_where_clause="{{shard_where_clause}}",
+                                                               expression_prefix="{{expression_prefix}}")
+
+    cell_query = STAGED_CELL_QUERY_TEMPLATE.format(
+        fields=', '.join(translated_fields),
+        cell_joins=create_cell_joins(CELL_QUERY_CELL_JOINS, referenced_tables(translated_fields)))
+
+    feature_query = FEATURE_QUERY_TEMPLATE.format(feature_where_clause=feature_where_clause)
+
+    return {
+        QueryType.CELL_KEYS: cell_keys_query,
+        QueryType.EXPRESSION: expression_query,
+        QueryType.CELL: cell_query,
+        QueryType.FEATURE: feature_query
+    }
+
+
+def create_cell_count_query(filter_: typing.Dict[str, typing.Any]) -> str:
+    """Create a redshift query counting the cells matching a matrix filter and their detected genes,
+    which estimate the number of nonzero expression rows of the request."""
+
+    translated_filter = translate_filters(filter_)
+    return CELL_COUNT_QUERY_TEMPLATE.format(
+        cell_joins=create_cell_joins(EXPRESSION_QUERY_CELL_JOINS, referenced_tables(filter_fields(translated_filter))),
+        cell_where_clause=filter_to_where(translated_filter))
+
+
+def serialized_filter_size(matrix_filter: typing.Dict[str, typing.Any]) -> int:
+    """Determine the length of json.dumps(matrix_filter) without serializing the
+    whole filter, which would hit the recursion limit for arbitrarily deep filters.
+    """
+
+    size = 0
+    stack = [matrix_filter]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            # Braces and ", " between items, each item being the key and ": " before its value
+            size += 2 + 2 * max(len(node) - 1, 0) + sum(len(json.dumps(key)) + 2 for key in node)
+            stack.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            size += 2 + 2 * max(len(node) - 1, 0)
+            stack.extend(node)
+        else:
+            size += len(json.dumps(node))
+
+    return size
+
+
+def filter_fields(matrix_filter: typing.Dict[str, typing.Any]) -> typing.List[str]:
+    """List the fields referenced anywhere in a matrix filter."""
+
+    fields = []
+    stack = [matrix_filter]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+
+        if "field" in node:
+            fields.append(node["field"])
+            continue
+
+        value = node.get("value")
+        if node.get("op") in LOGICAL_OPERATORS and isinstance(value, (list, tuple)):
+            stack.extend(reversed(value))
+
+    return fields
+
+
+def referenced_tables(fields: typing.Iterable[str]) -> typing.Optional[typing.Set[str]]:
+    """Determine the tables referenced by a list of internal field names like
+    "project.short_name" or "donor.*".
+
+    Returns None if any field is not qualified with a known table name, in which
+    case the table it refers to cannot be determined.
+    """
+
+    known_tables = {"cell"} | {table for table, _, _ in EXPRESSION_QUERY_CELL_JOINS}
+
+    tables = set()
+    for field in fields:
+        table = field.split(".")[0] if "." in field else None
+        if table not in known_tables:
+            return None
+        tables.add(table)
+
+    return tables
+
+
+def create_cell_joins(cell_joins: typing.List[typing.Tuple[str, str, str]],
+                      tables: typing.Optional[typing.Set[str]]) -> str:
+    """Build the joins from the cell table needed to reach the given tables.
+
+    Only the tables referenced by a query (and the tables on their join path
+    from cell) are joined. Every join is on a NOT NULL foreign key to the
+    primary key of the joined table, so for data loaded with referential
+    integrity a join that is not referenced neither filters nor duplicates
+    rows and dropping it leaves the results unchanged. If tables is None, all
+    tables are joined.
+    """
+
+    if tables is None:
+        tables = {table for table, _, _ in cell_joins}
+
+    required_tables = set(tables)
+    parents = {table: parent for table, parent, _ in cell_joins}
+    for table in tables:
+        while table in parents:
+            table = parents[table]
+            required_tables.add(table)
+
+    return "".join(f"\n  {join}" for table, _, join in cell_joins if table in required_tables)
+
+
 def feature_to_where(matrix_feature: str) -> str:
     """Build the WHERE clause for the features."""
 
@@ -203,54 +531,83 @@ def feature_to_where(matrix_feature: str) -> str:
 def filter_to_where(matrix_filter: typing.Dict[str, typing.Any]) -> str:
     """Build a WHERE clause for the matrix request SQL query out of the matrix
     filter object.
+
+    The filter tree is compiled in a single iterative pass that appends SQL
+    fragments to a buffer joined once at the end, so the cost is linear in the
+    size of the filter and deep filters do not hit the recursion limit.
     """
 
-    try:
-        op = matrix_filter["op"]
-    except Exception as exc:
-        raise MalformedMatrixFilter("Could not retrieve filter op") from exc
+    sql = []
 
-    try:
-        value = matrix_filter["value"]
-    except Exception as exc:
-        raise MalformedMatrixFilter("Could not retrieve filter value") from exc
+    # Work items are either filter nodes to compile or SQL fragments to emit, in order
+    stack = [(False, matrix_filter)]
+    while stack:
+        is_fragment, item = stack.pop()
+        if is_fragment:
+            sql.append(item)
+            continue
 
-    if op in COMPARISON_OPERATORS:
+        try:
+            op = item["op"]
+        except Exception as exc:
+            raise MalformedMatrixFilter("Could not retrieve filter op") from exc
 
         try:
-            field = matrix_filter["field"]
+            value = item["value"]
         except Exception as exc:
-            raise MalformedMatrixFilter("Could not retrieve filter field") from exc
+            raise MalformedMatrixFilter("Could not retrieve filter value") from exc
+
+        if op in COMPARISON_OPERATORS:
+            sql.append(_comparison_to_where(item, op, value))
+
+        elif op in LOGICAL_OPERATORS:
 
-        if op == 'in':
             if not isinstance(value, (list, tuple)):
-                raise MalformedMatrixFilter("The 'in' operator requires an array value")
-            value = ', '.join([f"'{el}'" if isinstance(el, str) else str(el) for el in value])
-            value = '(' + value + ')'
+                raise MalformedMatrixFilter("Logical operators accept a value array")
+
+            if op == "not":
+                if len(value) != 1:
+                    raise MalformedMatrixFilter("not operator accepts an array of length 1")
+                sql.append("NOT (")
+                stack.append((True, ")"))
+                stack.append((False, value[0]))
+            else:
+                if len(value) < 2:
+                    raise MalformedMatrixFilter(
+                        "(and, or) operators accept an array of length at least 2")
+
+                # ((operand) OP (operand) OP ... (operand)), pushed in reverse
+                separator = (True, f") {op.upper()} (")
+                sql.append("((")
+                stack.append((True, "))"))
+                for i, v in enumerate(reversed(value)):
+                    if i:
+                        stack.append(separator)
+                    stack.append((False, v))
         else:
-            if isinstance(value, str):
-                value = f"'{value}'"
+            raise MalformedMatrixFilter(f"Invalid op: {op}")
 
-        return f"{field} {op.upper()} {value}"
+    return "".join(sql)
 
-    elif op in LOGICAL_OPERATORS:
 
-        if not isinstance(value, (list, tuple)):
-            raise MalformedMatrixFilter("Logical operators accept a value array")
+def _comparison_to_where(matrix_filter: typing.Dict[str, typing.Any], op: str, value: typing.Any) -> str:
+    """Build the WHERE clause of a single comparison in a matrix filter."""
 
-        if op == "not":
-            if len(value) != 1:
-                raise MalformedMatrixFilter("not operator accepts an array of length 1")
-            return f"NOT ({filter_to_where(value[0])})"
-        else:
-            if len(value) < 2:
-                raise MalformedMatrixFilter(
-                    "(and, or) operators accept an array of length at least 2")
+    try:
+        field = matrix_filter["field"]
+    except Exception as exc:
+        raise MalformedMatrixFilter("Could not retrieve filter field") from exc
 
-            return '(' + f" {op.upper()} ".join([
-                f"({filter_to_where(v)})" for v in value]) + ')'
+    if op == 'in':
+        if not isinstance(value, (list, tuple)):
+            raise MalformedMatrixFilter("The 'in' operator requires an array value")
+        value = ', '.join([f"'{el}'" if isinstance(el, str) else str(el) for el in value])
+        value = '(' + value + ')'
     else:
-        raise MalformedMatrixFilter(f"Invalid op: {op}")
+        if isinstance(value, str):
+            value = f"'{value}'"
+
+    return f"{field} {op.upper()} {value}"
 
 
 def format_str_list(values: typing.Iterable[str]) -> str:
@@ -266,21 +623,30 @@ def has_genus_species_term(matrix_filter: typing.Dict[str, typing.Any]) -> bool:
     """Determine if a matrix filter has a genus_species specified. This is needed
     so the default behavior of human-only results can be overridden when the user
     specifies species.
+
+    The filter tree is walked iteratively, so arbitrarily deep filters do not hit
+    the recursion limit.
     """
 
-    op = matrix_filter["op"]
-    value = matrix_filter["value"]
+    stack = [matrix_filter]
+    while stack:
+        node = stack.pop()
+        op = node["op"]
+        value = node["value"]
 
-    if op in COMPARISON_OPERATORS:
-        field = matrix_filter["field"]
-        return field in constants.GENUS_SPECIES_FILTERS
+        if op in COMPARISON_OPERATORS:
+            if node["field"] in constants.GENUS_SPECIES_FILTERS:
+                return True
 
-    elif op in LOGICAL_OPERATORS:
+        elif op in LOGICAL_OPERATORS:
 
-        if op == 'not':
-            return value[0] in constants.GENUS_SPECIES_FILTERS
-        else:
-            return any(has_genus_species_term(v) for v in value)
+            if op == 'not':
+                if value[0] in constants.GENUS_SPECIES_FILTERS:
+                    return True
+            else:
+                stack.extend(reversed(value))
+
+    return False
 
 
 def speciesify_filter(matrix_filter: typing.Dict[str, typing.Any],
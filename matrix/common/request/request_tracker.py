@@ -1,22 +1,43 @@
+import concurrent.futures
 import hashlib
 import os
-from datetime import timedelta
+import typing
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 
+import pandas
+
 from matrix.common import date
 from matrix.common.constants import DEFAULT_FIELDS, DEFAULT_FEATURE, GenusSpecies
 from matrix.common.aws.batch_handler import BatchHandler
 from matrix.common.aws.cloudwatch_handler import CloudwatchHandler, MetricName
-from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, RequestTableField
+from matrix.common.aws.dynamo_handler import (DynamoHandler, DynamoTable, QueryCacheTableField, RequestTableField,
+                                              ResultCacheTableField)
 from matrix.common.aws.s3_handler import S3Handler
 from matrix.common.exceptions import MatrixException
 from matrix.common.logging import Logging
 from matrix.common.query.cell_query_results_reader import CellQueryResultsReader
-from matrix.common.query.query_results_reader import MatrixQueryResultsNotFound
+from matrix.common.query.manifest_service import ManifestService, MatrixQueryResultsNotFound
 from matrix.common.constants import MatrixFormat
 
 logger = Logging.get_logger(__name__)
 
+# CloudWatch metrics of the Redshift execution statistics of query jobs (see RedshiftHandler.query_stats)
+QUERY_STATS_METRICS = {
+    'queue_time_ms': MetricName.QUERY_QUEUE_TIME,
+    'exec_time_ms': MetricName.QUERY_EXECUTION_TIME,
+    'rows_unloaded': MetricName.QUERY_ROWS_UNLOADED,
+    'bytes_unloaded': MetricName.QUERY_BYTES_UNLOADED,
+    'bytes_scanned': MetricName.QUERY_BYTES_SCANNED,
+}
+
+# Cached matrices are aliased by identical requests while they are available for at least this many days
+RESULT_ALIAS_MIN_LIFETIME_DAYS = 7
+
+# Cell keys are hashed in parallel slices with 64-bit hashes under each of these keys (see generate_request_hash)
+REQUEST_HASH_WORKERS = 8
+CELL_KEY_HASH_KEYS = ["matrixcellkeys01", "matrixcellkeys02"]
+
 
 class Subtask(Enum):
     """
@@ -33,6 +54,8 @@ class Subtask(Enum):
 class RequestTracker:
     """
     Provides an interface for tracking a request's parameters and state.
+
+    The request's item is read once into a snapshot that the properties read from (see item).
     """
 
     def __init__(self, request_id: str):
@@ -40,22 +63,39 @@ class RequestTracker:
 
         self.request_id = request_id
         self._request_hash = "N/A"
-        self._data_version = None
-        self._num_bundles = None
-        self._format = None
-        self._metadata_fields = None
-        self._feature = None
-        self._genus_species = None
+        self._item = None
 
         self.dynamo_handler = DynamoHandler()
         self.cloudwatch_handler = CloudwatchHandler()
         self.batch_handler = BatchHandler()
 
+    @property
+    def item(self) -> dict:
+        """
+        Snapshot of the request's item in the request table, loaded on first access and reloaded
+        after writes made through this tracker. Changes made by other processes are only seen
+        after a refresh.
+        :return: dict Request table item
+        """
+        if self._item is None:
+            self._item = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=self.request_id)
+        return self._item
+
+    def refresh(self) -> dict:
+        """
+        Reloads the snapshot of the request's item.
+        :return: dict Request table item
+        """
+        self._item = None
+        return self.item
+
+    def _invalidate(self):
+        self._item = None
+
     @property
     def is_initialized(self) -> bool:
         try:
-            self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                               key=self.request_id)
+            self.item
         except MatrixException:
             return False
 
@@ -69,10 +109,7 @@ class RequestTracker:
         :return: str Request hash
         """
         if self._request_hash == "N/A":
-            self._request_hash = self.dynamo_handler.get_table_item(
-                DynamoTable.REQUEST_TABLE,
-                key=self.request_id
-            )[RequestTableField.REQUEST_HASH.value]
+            self._request_hash = self.item.get(RequestTableField.REQUEST_HASH.value, "N/A")
 
             # Do not generate request hash in API requests to avoid timeouts.
             # Presence of MATRIX_VERSION indicates API deployment.
@@ -83,11 +120,31 @@ class RequestTracker:
                                                                    self.request_id,
                                                                    RequestTableField.REQUEST_HASH,
                                                                    self._request_hash)
+                    self._invalidate()
                 except MatrixQueryResultsNotFound as e:
                     logger.warning(f"Failed to generate a request hash. {e}")
 
         return self._request_hash
 
+    @property
+    def query_hash(self) -> str:
+        """
+        Hash of the request's canonical query parameters, computed before any query is run.
+        :return: str Query hash, "N/A" if the request was created without one
+        """
+        return self.item.get(RequestTableField.QUERY_HASH.value, "N/A")
+
+    @property
+    def leader_request_id(self) -> str:
+        """
+        The in-flight request this request was attached to on creation, whose status it reports.
+        :return: str Request ID of the leader, None if this request runs its own queries
+        """
+        leader_request_id = self.item.get(RequestTableField.LEADER_REQUEST_ID.value)
+        if not leader_request_id or leader_request_id == "N/A":
+            return None
+        return leader_request_id
+
     @property
     def s3_results_prefix(self) -> str:
         """
@@ -99,26 +156,41 @@ class RequestTracker:
     @property
     def s3_results_key(self) -> str:
         """
-        The S3 key where matrix results for this request are stored in the results bucket.
+        The S3 key where matrix results for this request are stored in the results bucket,
+        which is the key of an identical request's matrix if this request's result is an alias.
         :return: str S3 key
         """
+        if self.result_alias != "N/A":
+            return self.result_alias
+
         is_compressed = self.format == MatrixFormat.CSV.value or self.format == MatrixFormat.MTX.value
 
         return f"{self.data_version}/{self.request_hash}/{self.request_id}.{self.format}" + \
                (".zip" if is_compressed else "")
 
+    @property
+    def result_alias(self) -> str:
+        """
+        The S3 key of the identical request's matrix serving as this request's result (see alias_result).
+        :return: str S3 key, "N/A" if the request has its own matrix
+        """
+        return self.item.get(RequestTableField.RESULT_ALIAS.value, "N/A")
+
+    @property
+    def result_cache_key(self) -> str:
+        """
+        The key of the result cache entry of matrices with this request's parameters.
+        :return: str Result cache key
+        """
+        return DynamoHandler.result_cache_key(self.data_version, self.request_hash, self.format)
+
     @property
     def data_version(self) -> int:
         """
         The Redshift data version this request is generated on.
         :return: int Data version
         """
-        if self._data_version is None:
-            self._data_version = \
-                self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.DATA_VERSION.value]
-
-        return self._data_version
+        return self.item[RequestTableField.DATA_VERSION.value]
 
     @property
     def num_bundles(self) -> int:
@@ -126,11 +198,7 @@ class RequestTracker:
         The number of bundles in the request.
         :return: int Number of bundles
         """
-        if not self._num_bundles:
-            self._num_bundles = \
-                self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.NUM_BUNDLES.value]
-        return self._num_bundles
+        return self.item[RequestTableField.NUM_BUNDLES.value]
 
     @property
     def num_bundles_interval(self) -> str:
@@ -149,11 +217,7 @@ class RequestTracker:
         The request's genus/species combination.
         :return: GenusSpecies The genus/species for this request
         """
-        if not self._genus_species:
-            self._genus_species = \
-                self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.GENUS_SPECIES.value]
-        return GenusSpecies(self._genus_species)
+        return GenusSpecies(self.item[RequestTableField.GENUS_SPECIES.value])
 
     @property
     def format(self) -> str:
@@ -161,11 +225,7 @@ class RequestTracker:
         The request's user specified output file format of the resultant expression matrix.
         :return: str The file format (one of MatrixFormat)
         """
-        if not self._format:
-            self._format = \
-                self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.FORMAT.value]
-        return self._format
+        return self.item[RequestTableField.FORMAT.value]
 
     @property
     def metadata_fields(self) -> list:
@@ -173,11 +233,7 @@ class RequestTracker:
         The request's user-specified list of metadata fields to include in the resultant expression matrix.
         :return:  list List of metadata fields
         """
-        if not self._metadata_fields:
-            self._metadata_fields = \
-                self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.METADATA_FIELDS.value]
-        return self._metadata_fields
+        return self.item[RequestTableField.METADATA_FIELDS.value]
 
     @property
     def feature(self) -> str:
@@ -185,11 +241,15 @@ class RequestTracker:
         The request's user-specified feature type (gene|transcript) of the resultant expression matrix.
         :return: str Feature (gene|transcript)
         """
-        if not self._feature:
-            self._feature = \
-                self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.FEATURE.value]
-        return self._feature
+        return self.item[RequestTableField.FEATURE.value]
+
+    @property
+    def num_expression_shards(self) -> int:
+        """
+        The number of shards the request's expression query is split into.
+        :return: int Number of expression query shards
+        """
+        return int(self.item.get(RequestTableField.NUM_EXPRESSION_SHARDS.value, 1))
 
     @property
     def batch_job_id(self) -> str:
@@ -197,8 +257,7 @@ class RequestTracker:
         The batch job id for matrix conversion corresponding with a request.
         :return: str The batch job id
         """
-        table_item = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=self.request_id)
-        batch_job_id = table_item.get(RequestTableField.BATCH_JOB_ID.value)
+        batch_job_id = self.item.get(RequestTableField.BATCH_JOB_ID.value)
         if not batch_job_id or batch_job_id == "N/A":
             return None
         else:
@@ -221,8 +280,7 @@ class RequestTracker:
         The creation date of matrix service request.
         :return: str creation date
         """
-        return self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                  key=self.request_id)[RequestTableField.CREATION_DATE.value]
+        return self.item[RequestTableField.CREATION_DATE.value]
 
     @property
     def is_expired(self):
@@ -232,7 +290,9 @@ class RequestTracker:
         """
         s3_results_bucket_handler = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
         is_past_expiration = date.to_datetime(self.creation_date) < date.get_datetime_now() - timedelta(days=30)
-        is_expired = not s3_results_bucket_handler.exists(self.s3_results_key) and is_past_expiration
+        # Aliased matrices may expire before the request does
+        is_expired = (not s3_results_bucket_handler.exists(self.s3_results_key)
+                      and (is_past_expiration or self.result_alias != "N/A"))
 
         if is_expired:
             self.log_error("This request has expired after 30 days and is no longer available for download. "
@@ -240,56 +300,103 @@ class RequestTracker:
 
         return is_expired
 
+    @property
+    def results_expiration_date(self) -> typing.Optional[datetime]:
+        """
+        The date at which the matrix of this request expires from the results bucket, 30 days after it was written.
+        :return: datetime Expiration date (UTC), None if the matrix does not exist
+        """
+        s3_results_bucket_handler = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+        s3_results_key = self.s3_results_key
+        for obj in s3_results_bucket_handler.ls(s3_results_key):
+            if obj['Key'] == s3_results_key:
+                last_modified = obj['LastModified'].astimezone(timezone.utc).replace(tzinfo=None)
+                return last_modified + timedelta(days=30)
+        return None
+
     @property
     def timeout(self) -> bool:
-        timeout = date.to_datetime(self.creation_date) < date.get_datetime_now() - timedelta(hours=36)
+        timeout = self._is_timed_out(self.creation_date)
         if timeout:
             self.log_error("This request has timed out after 12 hours."
                            "Please try again by resubmitting the POST request.")
         return timeout
 
+    @staticmethod
+    def _is_timed_out(creation_date: str) -> bool:
+        return date.to_datetime(creation_date) < date.get_datetime_now() - timedelta(hours=36)
+
     @property
     def error(self) -> str:
         """
         The user-friendly message describing the latest error the request raised.
         :return: str The error message if one exists, else empty string
         """
-        error = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE,
-                                                   key=self.request_id)[RequestTableField.ERROR_MESSAGE.value]
+        error = self.item[RequestTableField.ERROR_MESSAGE.value]
         return error if error else ""
 
     def initialize_request(self,
                            fmt: str,
                            metadata_fields: list = DEFAULT_FIELDS,
                            feature: str = DEFAULT_FEATURE,
-                           genus_species: GenusSpecies = GenusSpecies.HUMAN) -> None:
+                           genus_species: GenusSpecies = GenusSpecies.HUMAN,
+                           query_hash: str = "N/A",
+                           data_version: int = None) -> None:
         """Initialize the request id in the request state table. Put request metric to cloudwatch.
         :param fmt: Request output format for matrix conversion
         :param metadata_fields: Metadata fields to include in expression matrix
         :param feature: Feature type to generate expression counts for (one of MatrixFeature)
+        :param genus_species: Genus/species to generate the matrix for
+        :param query_hash: Hash of the request's canonical query parameters (see query_constructor.create_query_hash)
+        :param data_version: Data version to generate the matrix on, defaults to the current data version
         """
         self.dynamo_handler.create_request_table_entry(self.request_id,
                                                        fmt,
                                                        metadata_fields,
                                                        feature,
-                                                       genus_species)
+                                                       genus_species,
+                                                       query_hash=query_hash,
+                                                       data_version=data_version)
+        self._invalidate()
         self.cloudwatch_handler.put_metric_data(
             metric_name=MetricName.REQUEST,
             metric_value=1
         )
 
+    @staticmethod
+    def initialize_requests(requests: typing.List[dict], data_version: int = None) -> typing.List['RequestTracker']:
+        """Initialize several requests in the request state table in batch writes. Put request metrics to cloudwatch.
+        :param requests: Request ids and parameters of initialize_request (request_id, fmt, metadata_fields, feature,
+                         genus_species, query_hash) for each request
+        :param data_version: Data version to generate the matrices on, defaults to the current data version
+        :return: list Request trackers of the initialized requests
+        """
+        if not requests:
+            return []
+
+        request_trackers = [RequestTracker(request['request_id']) for request in requests]
+        request_trackers[0].dynamo_handler.create_request_table_entries(requests, data_version)
+        for request_tracker in request_trackers:
+            request_tracker.cloudwatch_handler.put_metric_data(
+                metric_name=MetricName.REQUEST,
+                metric_value=1
+            )
+        return request_trackers
+
     def generate_request_hash(self) -> str:
         """
         Generates a request hash uniquely identifying a request by its input parameters.
+        The cell keys are hashed as a set, so the hash does not depend on how the cell query
+        results are split into slices or ordered within them.
         Requires cell query results to exist, else raises MatrixQueryResultsNotFound.
         :return: str Request hash
         """
-        cell_manifest_key = f"s3://{os.environ['MATRIX_QUERY_RESULTS_BUCKET']}/{self.request_id}/cell_metadata_manifest"
+        cell_manifest_key = ManifestService.request_manifest_url(self.request_id, "cell")
         reader = CellQueryResultsReader(cell_manifest_key)
 
         logger.info(f"Generating request hash from {cell_manifest_key}")
 
-        h = hashlib.md5()
+        h = hashlib.blake2b(digest_size=16)
         h.update(self.feature.encode())
         h.update(self.format.encode())
 
@@ -297,19 +404,127 @@ class RequestTracker:
             h.update(field.encode())
 
         n_slices = len(reader.manifest['part_urls'])
-        for i in range(n_slices):
-            logger.info(f"[Slice {i}] start.")
-            cell_df = reader.load_slice(i)
-            for key in cell_df.index:
-                h.update(key.encode())
-            logger.info(f"[Slice {i}] Hashed all {len(cell_df.index)} keys.")
-            del cell_df
+        num_keys = 0
+        key_digests = [0] * len(CELL_KEY_HASH_KEYS)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=REQUEST_HASH_WORKERS) as executor:
+            for slice_num_keys, slice_key_digests in executor.map(lambda i: self._hash_cell_keys(reader, i),
+                                                                  range(n_slices)):
+                num_keys += slice_num_keys
+                key_digests = [(digest + slice_digest) % 2 ** 64
+                               for digest, slice_digest in zip(key_digests, slice_key_digests)]
+        logger.info(f"Hashed all {num_keys} keys of {n_slices} slices.")
+
+        h.update(str(num_keys).encode())
+        for digest in key_digests:
+            h.update(digest.to_bytes(8, "big"))
 
         request_hash = h.hexdigest()
         logger.info(f"Successfully generated request hash {request_hash}.")
 
         return request_hash
 
+    @staticmethod
+    def _hash_cell_keys(reader: CellQueryResultsReader, slice_idx: int) -> typing.Tuple[int, typing.List[int]]:
+        """
+        Hashes the cell keys of a slice of cell query results into digests that can be summed
+        across slices in any order.
+        :param reader: CellQueryResultsReader of the request's cell query results
+        :param slice_idx: Slice to hash
+        :return: Number of cell keys in the slice and their digest per hash key in CELL_KEY_HASH_KEYS
+        """
+        cell_keys = reader.load_slice(slice_idx, columns=["cellkey"]).index
+        key_digests = [pandas.util.hash_pandas_object(cell_keys, index=False, hash_key=hash_key).values.sum()
+                       for hash_key in CELL_KEY_HASH_KEYS]
+        return len(cell_keys), [int(digest) for digest in key_digests]
+
+    @staticmethod
+    def lookup_cached_request(query_hash: str) -> str:
+        """
+        Retrieves the ID of a completed request with the given query hash whose matrix is still available
+        for at least RESULT_ALIAS_MIN_LIFETIME_DAYS and was created after the data was last modified by a
+        bundle notification. Returns "" if no such request exists
+        :param query_hash: Hash of the request's canonical query parameters
+        :return: str Request ID of the cached request
+        """
+        dynamo_handler = DynamoHandler()
+        try:
+            item = dynamo_handler.get_table_item(DynamoTable.QUERY_CACHE_TABLE, key=query_hash)
+        except MatrixException:
+            return ""
+
+        # Query hashes of requests that never completed only have an in-flight request
+        if QueryCacheTableField.REQUEST_ID.value not in item:
+            return ""
+
+        cached_request_tracker = RequestTracker(item[QueryCacheTableField.REQUEST_ID.value])
+
+        # Notifications modify the data without bumping the data version (and thus the query hash),
+        # so requests created before the last modification may have queried outdated data
+        data_modification_date = dynamo_handler.get_data_modification_date()
+        is_available = (data_modification_date is None
+                        or date.to_datetime(cached_request_tracker.creation_date)
+                        > date.to_datetime(data_modification_date))
+        is_available = is_available and not (cached_request_tracker.error or cached_request_tracker.is_expired)
+        if is_available:
+            # The query cache entry lives as long as the data version, so the matrix may expire any time after
+            # the request completed. Cached requests are served while their matrix is available for at least
+            # RESULT_ALIAS_MIN_LIFETIME_DAYS, as aliased matrices are.
+            expiration_date = cached_request_tracker.results_expiration_date
+            min_expiration_date = date.get_datetime_now() + timedelta(days=RESULT_ALIAS_MIN_LIFETIME_DAYS)
+            is_available = expiration_date is not None and expiration_date >= min_expiration_date
+
+        if not is_available:
+            logger.info(f"Cached request {cached_request_tracker.request_id} for query hash {query_hash} "
+                        f"is no longer available.")
+            return ""
+
+        return cached_request_tracker.request_id
+
+    def coalesce(self, query_hash: str) -> str:
+        """
+        Makes this request the in-flight request of its query hash or, if an identical request
+        is already in flight, attaches this request to it as a follower reporting its status
+        (see leader_request_id). In-flight requests that failed or timed out are replaced.
+        Must be called after the request is initialized.
+        :param query_hash: Hash of the request's canonical query parameters
+        :return: str Request ID of the request running the queries, this request's ID if it leads
+        """
+        stale_request_id = None
+        while True:
+            leader_request_id = self.dynamo_handler.claim_in_flight_query(query_hash,
+                                                                          self.request_id,
+                                                                          stale_request_id)
+            if leader_request_id == self.request_id:
+                return leader_request_id
+
+            stale_request_id = None
+            if leader_request_id:
+                # Read through this tracker's handler, since coalesce may run in a thread pool
+                # and boto3 resources must not be created concurrently from the default session
+                leader_item = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=leader_request_id)
+                if not (leader_item[RequestTableField.ERROR_MESSAGE.value]
+                        or self._is_timed_out(leader_item[RequestTableField.CREATION_DATE.value])):
+                    break
+                logger.info(f"Replacing failed in-flight request {leader_request_id} for query hash {query_hash}")
+                stale_request_id = leader_request_id
+
+        logger.info(f"Attaching to in-flight request {leader_request_id} for query hash {query_hash}")
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       self.request_id,
+                                                       RequestTableField.LEADER_REQUEST_ID,
+                                                       leader_request_id)
+        self._invalidate()
+        return leader_request_id
+
+    def cache_query_result(self):
+        """
+        Points the query cache entry of this request's query hash at this request.
+        Requests created without a query hash are not cached.
+        """
+        query_hash = self.query_hash
+        if query_hash != "N/A":
+            self.dynamo_handler.create_query_cache_table_entry(query_hash, self.request_id, self.data_version)
+
     def expect_subtask_execution(self, subtask: Subtask):
         """
         Expect the execution of 1 Subtask by tracking it in DynamoDB.
@@ -325,6 +540,24 @@ class RequestTracker:
                                                   self.request_id,
                                                   subtask_to_dynamo_field_name[subtask],
                                                   1)
+        self._invalidate()
+
+    def set_num_expression_shards(self, num_shards: int):
+        """
+        Records that the request's expression query is split into num_shards queries,
+        each of which must complete before the request is ready for conversion.
+        Must be called before any of the request's queries complete.
+        :param num_shards: Number of expression query shards
+        """
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       self.request_id,
+                                                       RequestTableField.NUM_EXPRESSION_SHARDS,
+                                                       num_shards)
+        self.dynamo_handler.increment_table_field(DynamoTable.REQUEST_TABLE,
+                                                  self.request_id,
+                                                  RequestTableField.EXPECTED_QUERY_EXECUTIONS,
+                                                  num_shards - 1)
+        self._invalidate()
 
     def complete_subtask_execution(self, subtask: Subtask):
         """
@@ -342,30 +575,142 @@ class RequestTracker:
                                                   self.request_id,
                                                   subtask_to_dynamo_field_name[subtask],
                                                   1)
+        self._invalidate()
+
+    def complete_subtask_and_check_ready(self, subtask: Subtask, num_executions: int = 1) -> bool:
+        """
+        Counts completed executions of a Subtask in DynamoDB and checks, in the same request,
+        whether they completed all expected executions of the Subtask.
+        Exactly one of the concurrent callers completing the last executions is told so.
+        :param subtask: The executed Subtask.
+        :param num_executions: Number of completed executions
+        :return: bool True if this call completed the last expected execution, else False
+        """
+        subtask_to_dynamo_field_names = {
+            Subtask.DRIVER: (RequestTableField.EXPECTED_DRIVER_EXECUTIONS,
+                             RequestTableField.COMPLETED_DRIVER_EXECUTIONS),
+            Subtask.QUERY: (RequestTableField.EXPECTED_QUERY_EXECUTIONS,
+                            RequestTableField.COMPLETED_QUERY_EXECUTIONS),
+            Subtask.CONVERTER: (RequestTableField.EXPECTED_CONVERTER_EXECUTIONS,
+                                RequestTableField.COMPLETED_CONVERTER_EXECUTIONS),
+        }
+        expected_field, completed_field = subtask_to_dynamo_field_names[subtask]
+
+        self._item = self.dynamo_handler.increment_table_field_and_get_item(DynamoTable.REQUEST_TABLE,
+                                                                            self.request_id,
+                                                                            completed_field,
+                                                                            num_executions)
+        return self._item[expected_field.value] == self._item[completed_field.value]
+
+    def record_query_stats(self, query_type: str, query_name: str, stats: dict):
+        """
+        Stores the Redshift execution statistics of one of the request's queries in the request table
+        and puts them to CloudWatch metrics by query type.
+        :param query_type: QueryType value of the query
+        :param query_name: Name of the query, unique within the request (e.g. expression_1 for a shard)
+        :param stats: Execution statistics (see RedshiftHandler.query_stats)
+        """
+        self.dynamo_handler.set_table_map_field_entry(DynamoTable.REQUEST_TABLE,
+                                                      self.request_id,
+                                                      RequestTableField.QUERY_STATS,
+                                                      query_name,
+                                                      {'query_type': query_type, **stats})
+        self._invalidate()
+        for stat, metric_name in QUERY_STATS_METRICS.items():
+            if stat in stats:
+                self.cloudwatch_handler.put_metric_data(
+                    metric_name=metric_name,
+                    metric_value=stats[stat],
+                    metric_dimensions=[
+                        {
+                            'Name': "Query Type",
+                            'Value': query_type
+                        },
+                    ]
+                )
 
     def lookup_cached_result(self) -> str:
         """
-        Retrieves the S3 key of an existing matrix result that corresponds to this request's request hash.
+        Retrieves the S3 key of an existing matrix result that corresponds to this request's request hash
+        from the result cache, counting the lookup as a cache hit or miss.
         Returns "" if no such result exists
         :return: S3 key of cached result
         """
-        results_bucket = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
-        objects = results_bucket.ls(f"{self.s3_results_prefix}/")
+        item = self.dynamo_handler.record_result_cache_hit(self.result_cache_key)
+        self.cloudwatch_handler.put_metric_data(
+            metric_name=MetricName.CACHE_HIT if item else MetricName.CACHE_MISS,
+            metric_value=1
+        )
 
-        if len(objects) > 0:
-            return objects[0]['Key']
+        if item:
+            return item[ResultCacheTableField.S3_KEY.value]
         return ""
 
-    def is_request_ready_for_conversion(self) -> bool:
+    def alias_result(self, s3_key: str) -> bool:
         """
-        Checks whether the request has completed all queries
-        and is ready for conversion
-        :return: bool True if complete, else False
+        Makes the cached matrix of an identical request this request's result without copying it,
+        counting the reference in the result cache. Matrices are only aliased while they are
+        available for at least RESULT_ALIAS_MIN_LIFETIME_DAYS.
+        :param s3_key: S3 key of the cached matrix (see lookup_cached_result)
+        :return: bool True if the matrix was aliased, else False
         """
-        request_state = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=self.request_id)
-        queries_complete = (request_state[RequestTableField.EXPECTED_QUERY_EXECUTIONS.value]
-                            == request_state[RequestTableField.COMPLETED_QUERY_EXECUTIONS.value])
-        return queries_complete
+        min_expiration_time = date.to_timestamp(date.get_datetime_now()
+                                                + timedelta(days=RESULT_ALIAS_MIN_LIFETIME_DAYS))
+        if not self.dynamo_handler.add_result_cache_reference(self.result_cache_key, s3_key, min_expiration_time):
+            return False
+
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       self.request_id,
+                                                       RequestTableField.RESULT_ALIAS,
+                                                       s3_key)
+        self._invalidate()
+        return True
+
+    def release_result(self) -> bool:
+        """
+        Releases this request's reference to its matrix in the result cache. Once no request
+        references the matrix, its result cache entry is expired.
+        :return: bool True if no other request references the matrix, else False
+        """
+        result_cache_key = self.result_cache_key
+        s3_results_key = self.s3_results_key
+        ref_count = self.dynamo_handler.release_result_cache_reference(result_cache_key, s3_results_key)
+        if ref_count is not None and ref_count > 0:
+            return False
+
+        self.dynamo_handler.expire_result_cache_table_entry(result_cache_key, s3_results_key)
+        return True
+
+    def invalidate_result(self, message: str) -> bool:
+        """
+        Invalidates this request, which then reports an ERROR state with the given explanation via the
+        GET endpoint, and releases its reference to its matrix (see release_result).
+        :param message: str The error message to log
+        :return: bool True if no other request references the matrix, else False
+        """
+        self.log_error(message)
+        return self.release_result()
+
+    def cache_result(self):
+        """
+        Points the result cache entry of this request's parameters at this request's matrix.
+        The entry expires with the matrix in the results bucket.
+        Requests without a request hash are not cached.
+        """
+        request_hash = self.request_hash
+        if request_hash == "N/A":
+            return
+
+        results_bucket = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+        s3_results_key = self.s3_results_key
+        self.dynamo_handler.put_result_cache_table_entry(
+            self.data_version,
+            request_hash,
+            self.format,
+            s3_results_key,
+            results_bucket.size(s3_results_key) or 0,
+            date.to_timestamp(date.get_datetime_now() + timedelta(days=30))
+        )
 
     def is_request_complete(self) -> bool:
         """
@@ -377,9 +722,13 @@ class RequestTracker:
 
     def complete_request(self, duration: float):
         """
-        Log the completion of a matrix request in CloudWatch Metrics
+        Log the completion of a matrix request in CloudWatch Metrics and make the result
+        available to identical requests through the result and query caches.
         :param duration: The time in seconds the request took to complete
         """
+        self.cache_result()
+        self.cache_query_result()
+
         self.cloudwatch_handler.put_metric_data(
             metric_name=MetricName.CONVERSION_COMPLETION,
             metric_value=1
@@ -419,10 +768,16 @@ class RequestTracker:
         :param message: str The error message to log
         """
         logger.debug(message)
+        query_hash = self.query_hash
         self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
                                                        self.request_id,
                                                        RequestTableField.ERROR_MESSAGE,
                                                        message)
+        self._invalidate()
+
+        # Identical requests posted from now on no longer attach to this request
+        if query_hash != "N/A":
+            self.dynamo_handler.release_in_flight_query(query_hash, self.request_id)
         self.cloudwatch_handler.put_metric_data(
             metric_name=MetricName.REQUEST_ERROR,
             metric_value=1
@@ -436,3 +791,4 @@ class RequestTracker:
                                                        self.request_id,
                                                        RequestTableField.BATCH_JOB_ID,
                                                        batch_job_id)
+        self._invalidate()
@@ -47,16 +47,20 @@ class MatrixConverter:
         try:
             LOGGER.debug(f"Beginning matrix conversion run for {self.args.request_id}")
             self.query_results = {
-                QueryType.CELL: CellQueryResultsReader(self.args.cell_metadata_manifest_key),
-                QueryType.EXPRESSION: ExpressionQueryResultsReader(self.args.expression_manifest_key),
-                QueryType.FEATURE: FeatureQueryResultsReader(self.args.gene_metadata_manifest_key)
+                QueryType.CELL: CellQueryResultsReader(self.args.cell_metadata_manifest_key)
             }
 
+            # Two-phase requests skip the expression query when there are no cells,
+            # so the remaining query results are only read for non-empty requests
             if self.query_results[QueryType.CELL].is_empty:
                 LOGGER.debug(f"Short-circuiting conversion because there are no cells.")
                 pathlib.Path(self.local_output_filename).touch()
                 local_converted_path = self.local_output_filename
             else:
+                self.query_results[QueryType.EXPRESSION] = ExpressionQueryResultsReader(
+                    self.args.expression_manifest_key)
+                self.query_results[QueryType.FEATURE] = FeatureQueryResultsReader(self.args.gene_metadata_manifest_key)
+
                 LOGGER.debug(f"Beginning conversion to {self.format}")
                 local_converted_path = getattr(self, f"_to_{self.format}")()
                 LOGGER.debug(f"Conversion to {self.format} completed")
@@ -76,13 +80,14 @@ class MatrixConverter:
             self.request_tracker.log_error(str(e))
             raise e
 
-    def _n_slices(self):
+    def _n_slices(self, query_type: QueryType = QueryType.CELL):
         """Return the number of slices associated with this Redshift result.
 
         Redshift UNLOAD creates on object per "slice" of the cluster. We might want to
-        iterate over that, so this get the count of them.
+        iterate over that, so this get the count of them. The expression results of a
+        sharded expression query have one object per slice of each shard.
         """
-        return len(self.query_results[QueryType.CELL].manifest["part_urls"])
+        return len(self.query_results[query_type].manifest["part_urls"])
 
     def _make_directory(self):
         if not self.local_output_filename.endswith(".zip"):
@@ -168,7 +173,7 @@ class MatrixConverter:
         def _grouper(iterable, n):
             args = [iter(iterable)] * n
             return itertools.zip_longest(*args, fillvalue=None)
-        for slice_idx in range(self._n_slices()):
+        for slice_idx in range(self._n_slices(QueryType.EXPRESSION)):
             for chunk in self.query_results[QueryType.EXPRESSION].load_slice(slice_idx):
                 grouped = chunk.groupby("cellkey")
                 for cell_group in _grouper(grouped, num_of_cells):
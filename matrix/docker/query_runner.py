@@ -1,7 +1,12 @@
 """Script to pull from sqs and run redshift queries. Will be dockerized."""
+import collections
 import json
 import os
+import signal
+import threading
+import time
 import traceback
+import typing
 from enum import Enum
 
 from matrix.common.aws.batch_handler import BatchHandler
@@ -10,6 +15,8 @@ from matrix.common.aws.s3_handler import S3Handler
 from matrix.common.aws.sqs_handler import SQSHandler
 from matrix.common.config import MatrixInfraConfig
 from matrix.common.logging import Logging
+from matrix.common.query import expression_shards
+from matrix.common.query.manifest_service import ManifestService
 from matrix.common.request.request_tracker import RequestTracker, Subtask
 
 logger = Logging.get_logger(__name__)
@@ -19,82 +26,568 @@ class QueryType(Enum):
     CELL = "cell"
     EXPRESSION = "expression"
     FEATURE = "feature"
+    CELL_KEYS = "cell_keys"
+
+
+# Maximum estimated cost, in rows scanned, of the queries of each priority class
+SMALL_QUERY_MAX_COST = 50000000
+MEDIUM_QUERY_MAX_COST = 250000000
+
+
+class QueryPriority(Enum):
+    """
+    Priority classes of query jobs, each with its own queue. The priority of a job is derived from
+    its estimated cost, the number of rows it scans (see Driver).
+    """
+    SMALL = "small"
+    MEDIUM = "medium"
+    LARGE = "large"
+
+    @staticmethod
+    def from_cost(cost: int) -> "QueryPriority":
+        if cost <= SMALL_QUERY_MAX_COST:
+            return QueryPriority.SMALL
+        if cost <= MEDIUM_QUERY_MAX_COST:
+            return QueryPriority.MEDIUM
+        return QueryPriority.LARGE
+
+
+def query_job_q_urls(infra_config: MatrixInfraConfig) -> typing.Dict[QueryPriority, str]:
+    """
+    The query job queue of each priority class. Medium priority jobs use the original query job queue.
+    :param infra_config: Matrix infra config
+    :return: dict of QueryPriority to queue URL
+    """
+    return {
+        QueryPriority.SMALL: infra_config.query_job_small_q_url,
+        QueryPriority.MEDIUM: infra_config.query_job_q_url,
+        QueryPriority.LARGE: infra_config.query_job_large_q_url,
+    }
+
+
+class QueryMessageReceiver:
+    """
+    Receives the query messages of the QueryRunner workers of a process.
+
+    Workers waiting for a message share a single poll, which receives up to one message per waiting
+    worker, so that no message is held behind the query of another worker. Received messages are kept
+    hidden by a heartbeat extending their visibility timeout until they are deleted. The visibility
+    timeout can therefore be short, so that SQS quickly redelivers the messages of a lost worker.
+    Deletes are batched and sent by the heartbeat.
+
+    Each poll tries the queues of the priority classes in order of their aged weight, the weight of
+    the class multiplied by 1 + the seconds since a message of the class was last received divided
+    by AGING_SECONDS, so that a busy small queue delays large jobs by minutes at most. Large jobs
+    never occupy every worker. If every queue is empty, the small queue is long polled.
+    """
+    VISIBILITY_TIMEOUT_SECONDS = 300
+    HEARTBEAT_INTERVAL_SECONDS = 30
+    PRIORITY_WEIGHTS = {
+        QueryPriority.SMALL: 6,
+        QueryPriority.MEDIUM: 3,
+        QueryPriority.LARGE: 1,
+    }
+    AGING_SECONDS = 60
+
+    def __init__(self,
+                 queue_urls: typing.Dict[QueryPriority, str],
+                 num_workers: int = 1,
+                 sqs_handler: SQSHandler = None):
+        self.queue_urls = queue_urls
+        self.max_large_in_flight = max(1, num_workers - 1)
+        self.sqs_handler = sqs_handler or SQSHandler()
+        self._buffer = collections.deque()
+        self._in_flight = {}
+        self._pending_deletes = collections.defaultdict(list)
+        self._last_received = {priority: time.monotonic() for priority in queue_urls}
+        self._num_waiting = 0
+        self._lock = threading.Lock()
+        self._receive_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        """
+        Starts the heartbeat.
+        """
+        self._heartbeat = threading.Thread(target=self._run_heartbeat, name="query-message-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def stop(self):
+        """
+        Stops the heartbeat, sends pending deletes and makes received messages that were not processed
+        visible again.
+        """
+        self._stop_event.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        self.flush()
+
+        with self._lock:
+            unprocessed = self._group_by_priority(message['ReceiptHandle'] for message in self._buffer)
+            for receipt_handle in (message['ReceiptHandle'] for message in self._buffer):
+                self._in_flight.pop(receipt_handle)
+            self._buffer.clear()
+        for priority, receipt_handles in unprocessed.items():
+            self.sqs_handler.change_messages_visibility(self.queue_urls[priority], receipt_handles, 0)
+
+    def receive(self) -> typing.Optional[dict]:
+        """
+        Receives a message, waiting up to the SQS long poll time.
+        :return: SQS message, or None if no message was received
+        """
+        with self._lock:
+            if self._buffer:
+                return self._buffer.popleft()
+            self._num_waiting += 1
+
+        try:
+            with self._receive_lock:
+                with self._lock:
+                    if self._buffer:
+                        return self._buffer.popleft()
+                    num_messages = min(SQSHandler.MAX_BATCH_SIZE, self._num_waiting)
+
+                for priority in self._poll_order():
+                    messages = self._receive_from(priority, num_messages, wait_time=0)
+                    if messages:
+                        break
+                else:
+                    priority = QueryPriority.SMALL
+                    messages = self._receive_from(priority, num_messages, wait_time=15)
+
+                with self._lock:
+                    self._in_flight.update((message['ReceiptHandle'], priority) for message in messages)
+                    self._buffer.extend(messages)
+                    return self._buffer.popleft() if self._buffer else None
+        finally:
+            with self._lock:
+                self._num_waiting -= 1
+
+    def delete(self, receipt_handle: str):
+        """
+        Stops the heartbeat of a message and schedules its deletion.
+        :param receipt_handle: Receipt handle of the message
+        """
+        with self._lock:
+            if receipt_handle not in self._in_flight:
+                return
+            priority = self._in_flight.pop(receipt_handle)
+            self._pending_deletes[priority].append(receipt_handle)
+            flush = len(self._pending_deletes[priority]) >= SQSHandler.MAX_BATCH_SIZE
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Deletes the messages scheduled for deletion.
+        """
+        with self._lock:
+            pending_deletes, self._pending_deletes = self._pending_deletes, collections.defaultdict(list)
+        for priority, receipt_handles in pending_deletes.items():
+            failed = self.sqs_handler.delete_messages_from_queue(self.queue_urls[priority], receipt_handles)
+            if failed:
+                logger.error(f"Failed to delete messages from {self.queue_urls[priority]}: {failed}")
+
+    def extend_visibility(self):
+        """
+        Extends the visibility timeout of the received messages that have not been deleted.
+        """
+        with self._lock:
+            in_flight = self._group_by_priority(self._in_flight)
+        for priority, receipt_handles in in_flight.items():
+            failed = self.sqs_handler.change_messages_visibility(self.queue_urls[priority],
+                                                                 receipt_handles,
+                                                                 QueryMessageReceiver.VISIBILITY_TIMEOUT_SECONDS)
+            if failed:
+                logger.error(f"Failed to extend visibility of messages from {self.queue_urls[priority]}: {failed}")
+
+    def _poll_order(self) -> typing.List[QueryPriority]:
+        now = time.monotonic()
+        with self._lock:
+            num_large_in_flight = sum(1 for priority in self._in_flight.values() if priority == QueryPriority.LARGE)
+        priorities = [priority for priority in self.queue_urls
+                      if priority != QueryPriority.LARGE or num_large_in_flight < self.max_large_in_flight]
+
+        def _aged_weight(priority):
+            age = now - self._last_received[priority]
+            return QueryMessageReceiver.PRIORITY_WEIGHTS[priority] * (1 + age / QueryMessageReceiver.AGING_SECONDS)
+        return sorted(priorities, key=_aged_weight, reverse=True)
+
+    def _receive_from(self, priority: QueryPriority, num_messages: int, wait_time: int) -> typing.List[dict]:
+        messages = self.sqs_handler.receive_messages_from_queue(
+            self.queue_urls[priority],
+            wait_time=wait_time,
+            num_messages=num_messages,
+            visibility_timeout=QueryMessageReceiver.VISIBILITY_TIMEOUT_SECONDS) or []
+        if messages:
+            self._last_received[priority] = time.monotonic()
+        return messages
+
+    def _group_by_priority(self, receipt_handles: typing.Iterable[str]) -> typing.Dict[QueryPriority, typing.List[str]]:
+        grouped = collections.defaultdict(list)
+        for receipt_handle in receipt_handles:
+            grouped[self._in_flight[receipt_handle]].append(receipt_handle)
+        return grouped
+
+    def _run_heartbeat(self):
+        while not self._stop_event.wait(QueryMessageReceiver.HEARTBEAT_INTERVAL_SECONDS):
+            try:
+                self.extend_visibility()
+                self.flush()
+            except Exception as e:
+                logger.error(f"Query message heartbeat failed with error {e}")
 
 
 class QueryRunner:
+    """
+    Runs the queries of matrix requests queued in SQS.
 
-    def __init__(self):
+    A process runs several QueryRunner workers in parallel (see run_workers), so that short queries
+    are not held up behind long expression UNLOADs. Each worker keeps its own handlers, reuses
+    pooled Redshift connections, and stops receiving messages once its stop event is set. The
+    workers of a process share a QueryMessageReceiver.
+    """
+    DEFAULT_WORKERS = 1
+    DEFAULT_WLM_SLOTS = 5
+
+    def __init__(self, stop_event: threading.Event = None, message_receiver: QueryMessageReceiver = None):
         self.sqs_handler = SQSHandler()
         self.s3_handler = S3Handler(os.environ["MATRIX_QUERY_BUCKET"])
         self.batch_handler = BatchHandler()
         self.redshift_handler = RedshiftHandler()
         self.matrix_infra_config = MatrixInfraConfig()
+        self.stop_event = stop_event or threading.Event()
+        self.message_receiver = message_receiver
 
     @property
     def query_job_q_url(self):
         return self.matrix_infra_config.query_job_q_url
 
+    @property
+    def query_job_q_urls(self):
+        return query_job_q_urls(self.matrix_infra_config)
+
     @property
     def query_job_deadletter_q_url(self):
         return self.matrix_infra_config.query_job_deadletter_q_url
 
+    @staticmethod
+    def num_workers() -> int:
+        """
+        The number of workers to run, set by MATRIX_QUERY_RUNNER_WORKERS and capped by the number of
+        Redshift WLM query slots available to this process, MATRIX_REDSHIFT_WLM_SLOTS, as queries
+        beyond the available slots would only queue in Redshift.
+        :return: int Number of workers
+        """
+        workers = int(os.getenv("MATRIX_QUERY_RUNNER_WORKERS", QueryRunner.DEFAULT_WORKERS))
+        wlm_slots = int(os.getenv("MATRIX_REDSHIFT_WLM_SLOTS", QueryRunner.DEFAULT_WLM_SLOTS))
+        return max(1, min(workers, wlm_slots))
+
     def run(self, max_loops=None):
-        loops = 0
-        while max_loops is None or loops < max_loops:
-            loops += 1
-            messages = self.sqs_handler.receive_messages_from_queue(self.query_job_q_url)
-            if messages:
-                message = messages[0]
-                logger.info(f"Received {message} from {self.query_job_q_url}")
-                payload = json.loads(message['Body'])
-                request_id = payload['request_id']
-                request_tracker = RequestTracker(request_id)
-                Logging.set_correlation_id(logger, value=request_id)
-                obj_key = payload['s3_obj_key']
-                query_type = payload['type']
-                receipt_handle = message['ReceiptHandle']
+        message_receiver = self.message_receiver
+        if message_receiver is None:
+            message_receiver = QueryMessageReceiver(self.query_job_q_urls, sqs_handler=self.sqs_handler)
+            message_receiver.start()
+
+        try:
+            loops = 0
+            while (max_loops is None or loops < max_loops) and not self.stop_event.is_set():
+                loops += 1
+                message = message_receiver.receive()
+                if message:
+                    self._process_message(message, message_receiver)
+                else:
+                    logger.info("No messages to read from query job queues")
+        finally:
+            if self.message_receiver is None:
+                message_receiver.stop()
+
+    def _process_message(self, message: dict, message_receiver: QueryMessageReceiver):
+        payload = json.loads(message['Body'])
+        logger.info(f"Received {message} with priority {payload.get('priority', QueryPriority.MEDIUM.value)}")
+        request_id = payload['request_id']
+        request_tracker = RequestTracker(request_id)
+        Logging.set_correlation_id(logger, value=request_id)
+        obj_key = payload['s3_obj_key']
+        query_type = payload['type']
+        receipt_handle = message['ReceiptHandle']
+        try:
+            query = self._load_query(payload)
+
+            # Queries of two-phase requests use the cell keys staging table, which only the
+            # read-write user is guaranteed to have access to
+            cell_keys_table = payload.get('cell_keys_table')
+            logger.info(f"Running query from {obj_key}")
+            results, stats = self.redshift_handler.transaction([query],
+                                                               return_results=query_type == QueryType.CELL_KEYS.value,
+                                                               read_only=(cell_keys_table is None
+                                                                          or query_type == QueryType.FEATURE.value),
+                                                               collect_stats=True)
+            logger.info(f"Finished running query from {obj_key}")
+            self._record_query_stats(request_tracker, query_type, obj_key, stats)
+
+            if query_type == QueryType.CELL_KEYS.value:
+                num_cells, num_nonzeros = results[0]
+                self._run_staged_queries(request_tracker, payload, num_cells=num_cells, num_nonzeros=num_nonzeros)
+            elif not (query_type == QueryType.CELL.value and self._complete_from_cached_result(request_tracker)):
+                self._complete_queries(request_tracker, cell_keys_table=cell_keys_table)
+                self._queue_deferred_queries(request_tracker, payload)
+
+            # The heartbeat keeps the message hidden until the follow-up queries are queued or the request
+            # completes, so that SQS redelivers it if this worker is lost before then. Queries unload with
+            # ALLOWOVERWRITE, so redelivered messages can run their query again.
+            logger.info(f"Deleting {message}")
+            message_receiver.delete(receipt_handle)
+        except Exception as e:
+            logger.info(f"QueryRunner failed on {message} with error {e}")
+            request_tracker.log_error(str(e))
+            logger.error(traceback.format_exc())
+            logger.info(f"Adding {message} to {self.query_job_deadletter_q_url}")
+            self.sqs_handler.add_message_to_queue(self.query_job_deadletter_q_url, payload)
+            logger.info(f"Deleting {message}")
+            message_receiver.delete(receipt_handle)
+
+            # A failed request never completes all of its queries, which would otherwise drop the staging table
+            if payload.get('cell_keys_table'):
                 try:
-                    logger.info(f"Fetching query from {obj_key}")
-                    query = self.s3_handler.load_content_from_obj_key(obj_key)
-
-                    logger.info(f"Running query from {obj_key}")
-                    self.redshift_handler.transaction([query], read_only=True)
-                    logger.info(f"Finished running query from {obj_key}")
-
-                    logger.info(f"Deleting {message} from {self.query_job_q_url}")
-                    self.sqs_handler.delete_message_from_queue(self.query_job_q_url, receipt_handle)
-
-                    if query_type == QueryType.CELL.value:
-                        cached_result_s3_key = request_tracker.lookup_cached_result()
-                        if cached_result_s3_key:
-                            s3 = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
-                            s3.copy_obj(cached_result_s3_key, request_tracker.s3_results_key)
-                            continue
-
-                    logger.info("Incrementing completed queries in state table")
-                    request_tracker.complete_subtask_execution(Subtask.QUERY)
-
-                    if request_tracker.is_request_ready_for_conversion():
-                        logger.info("Scheduling batch conversion job")
-                        batch_job_id = self.batch_handler.schedule_matrix_conversion(request_id,
-                                                                                     request_tracker.format,
-                                                                                     request_tracker.s3_results_key)
-                        request_tracker.write_batch_job_id_to_db(batch_job_id)
-                except Exception as e:
-                    logger.info(f"QueryRunner failed on {message} with error {e}")
-                    request_tracker.log_error(str(e))
-                    logger.error(traceback.format_exc())
-                    logger.info(f"Adding {message} to {self.query_job_deadletter_q_url}")
-                    self.sqs_handler.add_message_to_queue(self.query_job_deadletter_q_url, payload)
-                    logger.info(f"Deleting {message} from {self.query_job_q_url}")
-                    self.sqs_handler.delete_message_from_queue(self.query_job_q_url, receipt_handle)
-            else:
-                logger.info(f"No messages to read from {self.query_job_q_url}")
+                    self._drop_cell_keys_table(payload['cell_keys_table'])
+                except Exception as drop_error:
+                    logger.warning(f"Failed to drop cell keys staging table {payload['cell_keys_table']}: "
+                                   f"{drop_error}")
+
+    def _load_query(self, payload: dict) -> str:
+        """
+        The query text of a message, sent inline by the driver if it fits in the message, else fetched from S3.
+        :param payload: Message payload
+        :return: str Query
+        """
+        if 'query' in payload:
+            return payload['query']
+
+        logger.info(f"Fetching query from {payload['s3_obj_key']}")
+        return self.s3_handler.load_content_from_obj_key(payload['s3_obj_key'])
+
+    def _run_staged_queries(self, request_tracker: RequestTracker, payload: dict, num_cells: int, num_nonzeros: int):
+        """
+        Runs the cell query of a two-phase request once its cell keys are staged, then splits the deferred
+        expression query into shards and queues them with the deferred feature query. The expression query
+        is sharded and prioritized by the size of the request, which the cell keys query determined while
+        evaluating the filter. The follow-up queries are skipped if no cells match the request or if the
+        request hash computed from the cell query results matches an existing matrix.
+        :param request_tracker: RequestTracker of the request
+        :param payload: Message payload of the request's cell keys query
+        :param num_cells: Number of cells staged by the cell keys query
+        :param num_nonzeros: Number of genes detected in the staged cells, which estimates the number of
+        nonzero expression values of the request
+        """
+        cell_keys_table = payload['cell_keys_table']
+        deferred_queries = payload['deferred_queries']
+        logger.info(f"Staged {num_cells} cells with {num_nonzeros} detected genes in {cell_keys_table}")
+
+        cell_query_obj_key = deferred_queries[QueryType.CELL.value]
+        logger.info(f"Running query from {cell_query_obj_key}")
+        _, stats = self.redshift_handler.transaction([self.s3_handler.load_content_from_obj_key(cell_query_obj_key)],
+                                                     collect_stats=True)
+        logger.info(f"Finished running query from {cell_query_obj_key}")
+        self._record_query_stats(request_tracker, QueryType.CELL.value, cell_query_obj_key, stats)
+
+        if num_cells == 0:
+            # The matrix conversion of requests without cells does not read the expression and feature results
+            logger.info("Skipping expression and feature queries of request with no cells")
+            num_skipped_queries = 1 + (1 if QueryType.FEATURE.value in deferred_queries else 0)
+            self._complete_queries(request_tracker,
+                                   num_queries=1 + num_skipped_queries,
+                                   cell_keys_table=cell_keys_table)
+        elif self._complete_from_cached_result(request_tracker):
+            self._drop_cell_keys_table(cell_keys_table)
+        else:
+            expression_obj_keys = self._store_expression_shard_queries(request_tracker,
+                                                                       deferred_queries[QueryType.EXPRESSION.value],
+                                                                       num_cells)
+            expression_priority = QueryPriority.from_cost(num_nonzeros)
+            logger.info(f"Queueing {len(expression_obj_keys)} expression queries as {expression_priority.value}")
+
+            self._complete_queries(request_tracker, cell_keys_table=cell_keys_table)
+            self._queue_deferred_queries(request_tracker, {
+                **payload,
+                'deferred_queries': {**deferred_queries, QueryType.EXPRESSION.value: expression_obj_keys},
+                'expression_priority': expression_priority.value,
+            })
+
+    def _store_expression_shard_queries(self,
+                                        request_tracker: RequestTracker,
+                                        template_obj_key: str,
+                                        num_cells: int) -> typing.List[str]:
+        """
+        Splits the expression query template of a two-phase request into shards over its cells and stores
+        the shard queries in S3, as the driver does for the expression query of other requests.
+        :param request_tracker: RequestTracker of the request
+        :param template_obj_key: S3 key of the expression query template
+        :param num_cells: Number of cells matching the request
+        :return: list of S3 keys of the expression query shards
+        """
+        num_shards = expression_shards.get_num_expression_shards(num_cells)
+        logger.info(f"Request matches {num_cells} cells, using {num_shards} expression query shards")
+        template = self.s3_handler.load_content_from_obj_key(template_obj_key)
+        expression_obj_key = f"{request_tracker.request_id}/{QueryType.EXPRESSION.value}"
+        if num_shards == 1:
+            return [self.s3_handler.store_content_in_s3(
+                expression_obj_key, expression_shards.create_expression_shard_queries(template, num_shards))]
+
+        # The shards must be counted before the cell query completes, which could otherwise complete the
+        # request. They are already counted if this message is redelivered after a failure.
+        if request_tracker.num_expression_shards != num_shards:
+            request_tracker.set_num_expression_shards(num_shards)
+        return [self.s3_handler.store_content_in_s3(f"{expression_obj_key}_{shard}", query)
+                for shard, query in enumerate(expression_shards.create_expression_shard_queries(template,
+                                                                                                num_shards))]
+
+    def _queue_deferred_queries(self, request_tracker: RequestTracker, payload: dict):
+        """
+        Queues the expression query shards and the feature query the driver deferred in the message of
+        a request's cell query (or cell keys query), once the cell query missed the result cache.
+        :param request_tracker: RequestTracker of the request
+        :param payload: Message payload of the request's cell query or cell keys query
+        """
+        deferred_queries = payload.get('deferred_queries', {})
+        # Estimated from the genes detected in the request's cells by the driver's cell count query,
+        # or by the cell keys query of two-phase requests
+        expression_priority = QueryPriority(payload.get('expression_priority', QueryPriority.MEDIUM.value))
+        jobs = [(QueryType.EXPRESSION, obj_key, expression_priority)
+                for obj_key in deferred_queries.get(QueryType.EXPRESSION.value, [])]
+        if QueryType.FEATURE.value in deferred_queries:
+            jobs.append((QueryType.FEATURE, deferred_queries[QueryType.FEATURE.value], QueryPriority.SMALL))
+
+        for query_type, obj_key, priority in jobs:
+            job_payload = {
+                'request_id': request_tracker.request_id,
+                's3_obj_key': obj_key,
+                'type': query_type.value,
+                'priority': priority.value,
+            }
+            if 'cell_keys_table' in payload:
+                job_payload['cell_keys_table'] = payload['cell_keys_table']
+            q_url = self.query_job_q_urls[priority]
+            logger.info(f"Adding {job_payload} to {q_url}")
+            self.sqs_handler.add_message_to_queue(q_url, job_payload)
+
+    @staticmethod
+    def _record_query_stats(request_tracker: RequestTracker, query_type: str, obj_key: str, stats: dict):
+        """
+        Records the Redshift execution statistics of a query. Failures are logged, as the query itself succeeded.
+        :param request_tracker: RequestTracker of the request
+        :param query_type: QueryType value of the query
+        :param obj_key: S3 key of the query, whose name identifies the query within the request
+        :param stats: Execution statistics (see RedshiftHandler.query_stats)
+        """
+        logger.info(f"Query from {obj_key} ran with {stats}")
+        try:
+            request_tracker.record_query_stats(query_type, obj_key.split("/")[-1], stats)
+        except Exception as e:
+            logger.warning(f"Failed to record execution statistics of query from {obj_key}: {e}")
+
+    def _complete_from_cached_result(self, request_tracker: RequestTracker) -> bool:
+        """
+        Completes a request from an existing matrix with the same request hash, if one exists.
+        The matrix is aliased, or copied if it expires too soon to be aliased.
+        :param request_tracker: RequestTracker of the request
+        :return: True if the request was completed from a cached result, else False
+        """
+        cached_result_s3_key = request_tracker.lookup_cached_result()
+        if not cached_result_s3_key:
+            return False
+
+        if not request_tracker.alias_result(cached_result_s3_key):
+            s3 = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+            s3.copy_obj(cached_result_s3_key, request_tracker.s3_results_key)
+            request_tracker.cache_result()
+        request_tracker.cache_query_result()
+        return True
+
+    def _complete_queries(self, request_tracker: RequestTracker, num_queries: int = 1, cell_keys_table: str = None):
+        """
+        Counts completed queries and schedules the matrix conversion once all queries of the request completed.
+        :param request_tracker: RequestTracker of the request
+        :param num_queries: Number of queries completed
+        :param cell_keys_table: Cell keys staging table of a two-phase request, dropped once all queries completed
+        """
+        logger.info("Incrementing completed queries in state table")
+        if request_tracker.complete_subtask_and_check_ready(Subtask.QUERY, num_queries):
+            if cell_keys_table:
+                self._drop_cell_keys_table(cell_keys_table)
+            if request_tracker.num_expression_shards > 1:
+                self._merge_expression_shard_manifests(request_tracker)
+            logger.info("Scheduling batch conversion job")
+            batch_job_id = self.batch_handler.schedule_matrix_conversion(request_tracker.request_id,
+                                                                         request_tracker.format,
+                                                                         request_tracker.s3_results_key)
+            request_tracker.write_batch_job_id_to_db(batch_job_id)
+
+    @staticmethod
+    def _merge_expression_shard_manifests(request_tracker: RequestTracker):
+        """
+        Merges the manifests of a sharded expression query into the expression manifest read by the
+        matrix conversion. Shards are not run for requests without cells.
+        :param request_tracker: RequestTracker of the request
+        """
+        request_id = request_tracker.request_id
+        manifest_service = ManifestService()
+        if manifest_service.get_request_manifest(request_id, QueryType.CELL.value)['record_count'] == 0:
+            return
+
+        logger.info(f"Merging manifests of {request_tracker.num_expression_shards} expression query shards")
+        manifest_service.merge_manifests(
+            [ManifestService.expression_shard_manifest_url(request_id, shard)
+             for shard in range(request_tracker.num_expression_shards)],
+            ManifestService.request_manifest_url(request_id, QueryType.EXPRESSION.value))
+
+    def _drop_cell_keys_table(self, cell_keys_table: str):
+        logger.info(f"Dropping cell keys staging table {cell_keys_table}")
+        self.redshift_handler.transaction([f"DROP TABLE IF EXISTS {cell_keys_table};"])
+
+
+def run_workers(num_workers: int, stop_event: threading.Event, max_loops=None):
+    """
+    Runs QueryRunner workers in parallel threads until stop_event is set. Workers finish the query
+    they are running before stopping, and received messages that no worker started are made visible
+    to other query runners again.
+    :param num_workers: Number of workers
+    :param stop_event: Event signaling the workers to stop
+    :param max_loops: Maximum number of receive loops of each worker
+    """
+    # Workers are created before any is started, so that the boto3 default session
+    # is initialized by a single thread
+    query_runners = [QueryRunner(stop_event) for _ in range(num_workers)]
+    message_receiver = QueryMessageReceiver(query_runners[0].query_job_q_urls, num_workers=num_workers)
+    for query_runner in query_runners:
+        query_runner.message_receiver = message_receiver
+    threads = [threading.Thread(target=query_runner.run,
+                                kwargs={'max_loops': max_loops},
+                                name=f"query-runner-{i}")
+               for i, query_runner in enumerate(query_runners)]
+
+    logger.info(f"Starting {num_workers} query runner workers")
+    message_receiver.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    message_receiver.stop()
+    RedshiftHandler.close_pools()
+    logger.info("Query runner workers stopped")
 
 
 def main():
-    query_runner = QueryRunner()
-    query_runner.run()
+    stop_event = threading.Event()
+
+    def _stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping query runner workers")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    run_workers(QueryRunner.num_workers(), stop_event)
 
 
 if __name__ == "__main__":
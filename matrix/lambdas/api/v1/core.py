@@ -1,4 +1,4 @@
-import json
+import concurrent.futures
 import os
 import requests
 import uuid
@@ -9,9 +9,10 @@ from matrix.common import query_constructor
 from matrix.common.exceptions import MatrixException
 from matrix.common.constants import GenusSpecies, MatrixFormat, MatrixRequestStatus
 from matrix.common.config import MatrixInfraConfig
+from matrix.common.aws.dynamo_handler import DynamoHandler
 from matrix.common.aws.lambda_handler import LambdaHandler, LambdaName
-from matrix.common.aws.redshift_handler import RedshiftHandler, TableName
 from matrix.common.aws.s3_handler import S3Handler
+from matrix.common.query.field_detail_service import FieldDetailService
 from matrix.common.request.request_tracker import RequestTracker
 
 lambda_handler = LambdaHandler()
@@ -37,7 +38,7 @@ def post_matrix(body: dict):
                             "Visit https://matrix.dev.data.humancellatlas.org for more information."},
                 requests.codes.bad_request)
 
-    if len(json.dumps(body["filter"])) > 128000:
+    if query_constructor.serialized_filter_size(body["filter"]) > 128000:
         return ({'message': "The filter specification is too large. "
                             "Visit https://matrix.dev.data.humancellatlas.org for more information."},
                 requests.codes.request_entity_too_large)
@@ -55,33 +56,73 @@ def post_matrix(body: dict):
     if format_ == MatrixFormat.MTX.value and "cell.barcode" not in fields and "barcode" not in fields:
         fields.append("cell.barcode")
 
-    human_request_id = ""
-    non_human_request_ids = {}
+    data_version = DynamoHandler().get_current_data_version()
+
+    request_ids = {}
+    new_requests = []
     for genus_species in genera_species:
-        request_id = str(uuid.uuid4())
-        RequestTracker(request_id).initialize_request(format_, fields, feature, genus_species)
-
-        driver_payload = {
-            'request_id': request_id,
-            'filter': body["filter"],
-            'fields': fields,
-            'feature': feature,
-            'genus_species': genus_species.value
-        }
-        lambda_handler.invoke(LambdaName.DRIVER_V1, driver_payload)
+        # Identical requests on the current data version are answered by the request that already served them
+        query_hash = query_constructor.create_query_hash(body["filter"], fields, feature, format_,
+                                                         genus_species, data_version)
+        request_ids[genus_species] = RequestTracker.lookup_cached_request(query_hash)
+
+        if not request_ids[genus_species]:
+            request_ids[genus_species] = str(uuid.uuid4())
+            new_requests.append({
+                'request_id': request_ids[genus_species],
+                'fmt': format_,
+                'metadata_fields': fields,
+                'feature': feature,
+                'genus_species': genus_species,
+                'query_hash': query_hash
+            })
+
+    request_trackers = RequestTracker.initialize_requests(new_requests, data_version)
+    driver_payloads = [{
+        'request_id': request['request_id'],
+        'filter': body["filter"],
+        'fields': fields,
+        'feature': feature,
+        'genus_species': request['genus_species'].value
+    } for request in new_requests]
+    query_hashes = [request['query_hash'] for request in new_requests]
+
+    # The request trackers' boto3 resources were created above in this thread and each is used by a
+    # single worker, while the shared Lambda client is thread-safe, so the requests can be started in parallel
+    if request_trackers:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(request_trackers)) as executor:
+            list(executor.map(_start_request, request_trackers, query_hashes, driver_payloads))
 
+    human_request_id = ""
+    non_human_request_ids = {}
+    for genus_species, request_id in request_ids.items():
         if genus_species == GenusSpecies.HUMAN:
             human_request_id = request_id
         else:
             non_human_request_ids[genus_species.value] = request_id
 
+    # Requests answered by identical requests that already completed do not start a job
+    if new_requests:
+        status = MatrixRequestStatus.IN_PROGRESS.value
+        message = "Job started."
+    else:
+        status = MatrixRequestStatus.COMPLETE.value
+        message = ("Identical requests have already completed. "
+                   "Retrieve their matrices via GET /v1/matrix/{request_id}.")
+
     return ({'request_id': human_request_id,
              'non_human_request_ids': non_human_request_ids,
-             'status': MatrixRequestStatus.IN_PROGRESS.value,
-             'message': "Job started."},
+             'status': status,
+             'message': message},
             requests.codes.accepted)
 
 
+def _start_request(request_tracker: RequestTracker, query_hash: str, driver_payload: dict):
+    # Identical requests posted while one is in flight follow it instead of running their own queries
+    if request_tracker.coalesce(query_hash) == request_tracker.request_id:
+        lambda_handler.invoke(LambdaName.DRIVER_V1, driver_payload)
+
+
 def get_matrix(request_id: str):
 
     # There are a few cases to handle here. First, if the request_id is not in
@@ -108,6 +149,14 @@ def get_matrix(request_id: str):
     except MatrixException:
         return in_progress_response
 
+    # Requests attached to an identical in-flight request report the status of that request
+    leader_request_id = request_tracker.leader_request_id
+    if leader_request_id:
+        response, status_code = get_matrix(leader_request_id)
+        response['request_id'] = request_id
+        response['message'] = response['message'].replace(leader_request_id, request_id)
+        return response, status_code
+
     # Failed case
     if request_tracker.error:
         return ({'request_id': request_id,
@@ -132,11 +181,10 @@ def get_matrix(request_id: str):
         matrix_results_bucket = os.environ['MATRIX_RESULTS_BUCKET']
         matrix_results_handler = S3Handler(matrix_results_bucket)
 
+        # Resolves the matrix of an identical request for requests completed from the result cache
         matrix_key = ""
-        if format == MatrixFormat.LOOM.value:
-            matrix_key = f"{request_tracker.s3_results_prefix}/{request_id}.{format}"
-        elif format == MatrixFormat.CSV.value or format == MatrixFormat.MTX.value:
-            matrix_key = f"{request_tracker.s3_results_prefix}/{request_id}.{format}.zip"
+        if format in (MatrixFormat.LOOM.value, MatrixFormat.CSV.value, MatrixFormat.MTX.value):
+            matrix_key = request_tracker.s3_results_key
 
         matrix_location = f"https://s3.amazonaws.com/{matrix_results_bucket}/{matrix_key}"
 
@@ -199,49 +247,14 @@ def get_fields():
             requests.codes.ok)
 
 
-def _redshift_detail_lookup(name, description):
-    type_ = constants.METADATA_FIELD_TO_TYPE[name]
-    column_name = constants.METADATA_FIELD_TO_TABLE_COLUMN[name]
-    table_name = constants.TABLE_COLUMN_TO_TABLE[column_name]
-    fq_name = table_name + "." + column_name
-
-    table_primary_key = RedshiftHandler.PRIMARY_KEY[TableName(table_name)]
-
-    rs_handler = RedshiftHandler()
-
-    if type_ == "categorical":
-        query = query_constructor.create_field_detail_query(
-            fq_name, table_name, table_primary_key, type_)
-        results = dict(rs_handler.transaction([query], return_results=True, read_only=True))
-        if None in results:
-            results[""] = results[None]
-            results.pop(None)
-        if True in results:
-            results["True"] = results[True]
-            results.pop(True)
-        if False in results:
-            results["False"] = results[False]
-            results.pop(False)
-        return ({
-            "field_name": name,
-            "field_description": description,
-            "field_type": type_,
-            "cell_counts": results},
-            requests.codes.ok)
-
-    elif type_ == "numeric":
-        query = query_constructor.create_field_detail_query(
-            fq_name, table_name, table_primary_key, type_)
-        results = rs_handler.transaction([query], return_results=True, read_only=True)
-        min_ = results[0][0]
-        max_ = results[0][1]
-        return ({
-            "field_name": name,
-            "field_description": description,
-            "field_type": type_,
-            "minimum": min_,
-            "maximum": max_},
-            requests.codes.ok)
+def _field_detail_lookup(name, description):
+    data_version = DynamoHandler().get_current_data_version()
+    field_detail = FieldDetailService().get_field_detail(name, data_version)
+    return ({
+        "field_name": name,
+        "field_description": description,
+        **field_detail},
+        requests.codes.ok)
 
 
 def get_filter_detail(filter_name: str):
@@ -253,7 +266,7 @@ def get_filter_detail(filter_name: str):
 
     description = constants.FILTER_DETAIL[filter_name]
 
-    return _redshift_detail_lookup(filter_name, description)
+    return _field_detail_lookup(filter_name, description)
 
 
 def get_field_detail(field_name: str):
@@ -269,7 +282,7 @@ def get_field_detail(field_name: str):
 
     description = constants.FIELD_DETAIL[field_name]
 
-    return _redshift_detail_lookup(field_name, description)
+    return _field_detail_lookup(field_name, description)
 
 
 def get_formats():
@@ -0,0 +1,97 @@
+import datetime
+import os
+
+from matrix.common import date
+from matrix.common.aws.cloudwatch_handler import CloudwatchHandler, MetricName
+from matrix.common.aws.dynamo_handler import DynamoHandler, RequestTableField, ResultCacheTableField
+from matrix.common.aws.s3_handler import S3Handler
+from matrix.common.logging import Logging
+from matrix.common.request.request_tracker import RequestTracker
+
+logger = Logging.get_logger(__name__)
+
+
+class EvictionHandler:
+    """
+    Keeps the matrices of the result cache within the results bucket budget, MATRIX_RESULTS_BUCKET_BUDGET_BYTES.
+
+    Once the cached matrices exceed the budget, they are evicted in order of their GDSF priority with a
+    uniform cost, the number of requests for the matrix per byte, so that large matrices that are rarely
+    reused are evicted before small popular ones. Instead of inflating the priority of later accesses,
+    the number of requests is halved every ACCESS_HALF_LIFE_DAYS since the matrix was last requested, so
+    that formerly popular matrices age out. The requests of evicted matrices are invalidated and report
+    an explanation via the GET endpoint, as with scripts/invalidate_cache_entries.py.
+    """
+    ACCESS_HALF_LIFE_DAYS = 7
+    EVICTION_MESSAGE = ("This request has been evicted from the cache and is no longer available for download. "
+                        "Please generate a new matrix at POST /v1/matrix.")
+
+    def __init__(self, budget_bytes: int = None):
+        self.budget_bytes = (int(os.environ['MATRIX_RESULTS_BUCKET_BUDGET_BYTES'])
+                             if budget_bytes is None else budget_bytes)
+        self.dynamo_handler = DynamoHandler()
+        self.s3_results_bucket_handler = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+        self.cloudwatch_handler = CloudwatchHandler()
+
+    def run(self):
+        entries = self.dynamo_handler.get_live_result_cache_table_entries()
+        cached_bytes = sum(int(entry[ResultCacheTableField.SIZE.value]) for entry in entries)
+        logger.info(f"{len(entries)} cached matrices use {cached_bytes} of {self.budget_bytes} bytes")
+        if cached_bytes <= self.budget_bytes:
+            return
+
+        now = date.get_datetime_now()
+        evicted_keys = []
+        evicted_bytes = 0
+        for entry in sorted(entries, key=lambda entry: self.priority(entry, now)):
+            if cached_bytes - evicted_bytes <= self.budget_bytes:
+                break
+            self.evict(entry)
+            evicted_keys.append(entry[ResultCacheTableField.S3_KEY.value])
+            evicted_bytes += int(entry[ResultCacheTableField.SIZE.value])
+
+        deleted_objects = self.s3_results_bucket_handler.delete_objects(evicted_keys)
+        logger.info(f"Evicted {len(evicted_keys)} matrices of {evicted_bytes} bytes, "
+                    f"deleted {len(deleted_objects)} of them from the results bucket")
+
+        self.cloudwatch_handler.put_metric_data(metric_name=MetricName.CACHE_EVICTION,
+                                                metric_value=len(evicted_keys))
+        self.cloudwatch_handler.put_metric_data(metric_name=MetricName.CACHE_EVICTED_BYTES,
+                                                metric_value=evicted_bytes)
+
+    @staticmethod
+    def priority(entry: dict, now: datetime.datetime) -> float:
+        """
+        The priority of a cached matrix to be kept in the results bucket.
+        :param entry: Result Cache table entry of the matrix
+        :param now: Time of the eviction
+        :return: float Decayed number of requests for the matrix per byte
+        """
+        last_access_date = date.to_datetime(entry[ResultCacheTableField.LAST_ACCESS_DATE.value])
+        idle_days = max(0.0, (now - last_access_date).total_seconds() / 86400)
+        num_requests = (1 + int(entry[ResultCacheTableField.HIT_COUNT.value])) \
+            * 0.5 ** (idle_days / EvictionHandler.ACCESS_HALF_LIFE_DAYS)
+        return num_requests / max(1, int(entry[ResultCacheTableField.SIZE.value]))
+
+    def evict(self, entry: dict):
+        """
+        Expires the Result Cache table entry of a matrix and invalidates the requests served by the matrix.
+        The entry is expired first, so that no request aliases the matrix while it is evicted.
+        :param entry: Result Cache table entry of the matrix
+        """
+        cache_key = entry[ResultCacheTableField.CACHE_KEY.value]
+        s3_key = entry[ResultCacheTableField.S3_KEY.value]
+        logger.info(f"Evicting {s3_key} of {entry[ResultCacheTableField.SIZE.value]} bytes from the result cache")
+        self.dynamo_handler.expire_result_cache_table_entry(cache_key, s3_key)
+
+        items = self.dynamo_handler.query_by_request_hash(
+            entry[ResultCacheTableField.REQUEST_HASH.value],
+            int(entry[ResultCacheTableField.DATA_VERSION.value]),
+            attrs={
+                RequestTableField.FORMAT.value: entry[ResultCacheTableField.FORMAT.value],
+                RequestTableField.ERROR_MESSAGE.value: 0,
+            })
+        for item in items:
+            request_tracker = RequestTracker(item[RequestTableField.REQUEST_ID.value])
+            if request_tracker.s3_results_key == s3_key:
+                request_tracker.invalidate_result(EvictionHandler.EVICTION_MESSAGE)
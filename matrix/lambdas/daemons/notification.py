@@ -2,8 +2,10 @@ import os
 import shutil
 
 from matrix.common import etl
+from matrix.common.aws.dynamo_handler import DynamoHandler
 from matrix.common.aws.redshift_handler import RedshiftHandler
 from matrix.common.etl.transformers import MetadataToPsvTransformer
+from matrix.common.query.field_detail_service import FieldDetailService
 from matrix.common.logging import Logging
 
 logger = Logging.get_logger(__name__)
@@ -11,19 +13,24 @@ logger = Logging.get_logger(__name__)
 
 class NotificationHandler:
 
-    DELETE_ANALYSIS_QUERY_TEMPLATE = """DELETE FROM analysis WHERE bundle_fqid='{bundle_uuid}.{bundle_version}'"""
+    # Deletes join against the bundle_fqids temporary table (see RedshiftHandler.stage_key_set_queries)
+    DELETE_ANALYSIS_QUERY_TEMPLATE = """
+                                     DELETE FROM analysis
+                                      USING bundle_fqids
+                                      WHERE analysis.bundle_fqid = bundle_fqids.bundle_fqid
+                                     """
     DELETE_CELL_QUERY_TEMPLATE = """
                                  DELETE FROM cell
-                                  WHERE cell.analysiskey IN
-                                  (SELECT analysis.analysiskey FROM analysis
-                                  WHERE analysis.bundle_fqid='{bundle_uuid}.{bundle_version}')
+                                  USING analysis, bundle_fqids
+                                  WHERE cell.analysiskey = analysis.analysiskey
+                                  AND analysis.bundle_fqid = bundle_fqids.bundle_fqid
                                  """
     DELETE_EXPRESSION_QUERY_TEMPLATE = """
                                        DELETE FROM expression
-                                        WHERE expression.cellkey IN
-                                        (SELECT cell.cellkey FROM cell
-                                        JOIN analysis ON cell.analysiskey = analysis.analysiskey
-                                        WHERE analysis.bundle_fqid='{bundle_uuid}.{bundle_version}')
+                                        USING cell, analysis, bundle_fqids
+                                        WHERE expression.cellkey = cell.cellkey
+                                        AND cell.analysiskey = analysis.analysiskey
+                                        AND analysis.bundle_fqid = bundle_fqids.bundle_fqid
                                        """
 
     def __init__(self, bundle_uuid, bundle_version, event_type):
@@ -43,6 +50,14 @@ class NotificationHandler:
             logger.error(f"Failed to process notification. Received invalid event type {self.event_type}.")
             return
 
+        # Cells were added or removed without bumping the data version, so the requests in the query cache
+        # and the field statistics are stale. Failures to record the modification are retried with the notification.
+        DynamoHandler().set_data_modification_date()
+        try:
+            FieldDetailService().delete_stored_field_details()
+        except Exception as e:
+            logger.warning(f"Failed to delete stored field statistics: {e}")
+
         logger.info(f"Done processing DSS notification for {self.bundle_uuid}.{self.bundle_version}.")
 
     def update_bundle(self):
@@ -64,17 +79,12 @@ class NotificationHandler:
                            deployment_stage=os.environ['DEPLOYMENT_STAGE'])
 
     def remove_bundle(self):
-        self.redshift.transaction([
-            self.DELETE_EXPRESSION_QUERY_TEMPLATE.format(
-                bundle_uuid=self.bundle_uuid,
-                bundle_version=self.bundle_version
-            ),
-            self.DELETE_CELL_QUERY_TEMPLATE.format(
-                bundle_uuid=self.bundle_uuid,
-                bundle_version=self.bundle_version
-            ),
-            self.DELETE_ANALYSIS_QUERY_TEMPLATE.format(
-                bundle_uuid=self.bundle_uuid,
-                bundle_version=self.bundle_version
-            )
-        ])
+        self.redshift.transaction(
+            RedshiftHandler.stage_key_set_queries("bundle_fqids",
+                                                  "bundle_fqid",
+                                                  [f"{self.bundle_uuid}.{self.bundle_version}"])
+            + [
+                self.DELETE_EXPRESSION_QUERY_TEMPLATE,
+                self.DELETE_CELL_QUERY_TEMPLATE,
+                self.DELETE_ANALYSIS_QUERY_TEMPLATE
+            ])
@@ -12,17 +12,20 @@ from matrix.common.aws.sqs_handler import SQSHandler
 from matrix.common.config import MatrixInfraConfig, MatrixRedshiftConfig
 from matrix.common.logging import Logging
 from matrix.common.request.request_tracker import RequestTracker, Subtask
-from matrix.common.query_constructor import format_str_list, QueryType
+from matrix.common.query_constructor import QueryType
 
 logger = Logging.get_logger(__name__)
 
+# The bundle uuids of a request are staged into the bundle_uuids temporary table (see
+# RedshiftHandler.stage_key_set_queries) by the queries preceding each template.
 analysis_bundle_count_query_template = """
     SELECT count(*)
     FROM analysis
-    WHERE bundle_uuid IN {0};
+    INNER JOIN bundle_uuids on (analysis.bundle_uuid = bundle_uuids.bundle_uuid);
 """
 
 expression_query_template = """
+    {3}
     UNLOAD ($$SELECT cell.cellkey, expression.featurekey, expression.exrpvalue
     FROM expression
     LEFT OUTER JOIN feature on (expression.featurekey = feature.featurekey)
@@ -31,9 +34,9 @@ expression_query_template = """
     INNER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)
     INNER JOIN specimen on (specimen.specimenkey = cell_suspension.specimenkey)
     INNER JOIN donor on (specimen.donorkey = donor.donorkey)
+    INNER JOIN bundle_uuids on (analysis.bundle_uuid = bundle_uuids.bundle_uuid)
     WHERE feature.isgene
     AND expression.exprtype = 'Count'
-    AND analysis.bundle_uuid IN {3}
     AND cell_suspension.genus_species_label = '{4}'$$)
     TO 's3://{0}/{1}/expression_'
     IAM_ROLE '{2}'
@@ -43,6 +46,7 @@ expression_query_template = """
 """
 
 cell_query_template = """
+    {3}
     UNLOAD($$SELECT cell.cellkey, cell.genes_detected, cell.file_uuid,
     cell.file_version, cell.total_umis, cell.emptydrops_is_cell, cell.barcode, cell_suspension.*,
     specimen.organ_ontology, specimen.organ_label, specimen.organ_parts_ontology, specimen.organ_parts_label,
@@ -55,8 +59,8 @@ cell_query_template = """
     LEFT OUTER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)
     LEFT OUTER JOIN project on (cell.projectkey = project.projectkey)
     INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)
-    WHERE analysis.bundle_uuid IN {3}
-    AND cell_suspension.genus_species_label = '{4}'$$)
+    INNER JOIN bundle_uuids on (analysis.bundle_uuid = bundle_uuids.bundle_uuid)
+    WHERE cell_suspension.genus_species_label = '{4}'$$)
     TO 's3://{0}/{1}/cell_metadata_'
     IAM_ROLE '{2}'
     GZIP
@@ -94,6 +98,7 @@ class Driver:
         self.query_results_bucket = os.environ['MATRIX_QUERY_RESULTS_BUCKET']
         self.s3_handler = S3Handler(os.environ['MATRIX_QUERY_BUCKET'])
         self.redshift_handler = RedshiftHandler()
+        self._staged_obj_keys = set()
 
     @property
     def query_job_q_url(self):
@@ -171,17 +176,18 @@ class Driver:
                                                       genus_species)
         feature_query_obj_key = self.s3_handler.store_content_in_s3(f"{self.request_id}/feature", feature_query)
 
+        bundle_uuids_staging_queries = self._stage_bundle_uuids_queries(resolved_bundle_uuids)
         exp_query = expression_query_template.format(self.query_results_bucket,
                                                      self.request_id,
                                                      self.redshift_role_arn,
-                                                     format_str_list(resolved_bundle_uuids),
+                                                     "\n    ".join(bundle_uuids_staging_queries),
                                                      genus_species)
         exp_query_obj_key = self.s3_handler.store_content_in_s3(f"{self.request_id}/expression", exp_query)
 
         cell_query = cell_query_template.format(self.query_results_bucket,
                                                 self.request_id,
                                                 self.redshift_role_arn,
-                                                format_str_list(resolved_bundle_uuids),
+                                                "\n    ".join(bundle_uuids_staging_queries),
                                                 genus_species)
         cell_query_obj_key = self.s3_handler.store_content_in_s3(f"{self.request_id}/cell", cell_query)
 
@@ -201,12 +207,33 @@ class Driver:
         logger.debug(f"Adding {payload} to sqs {queue_url}")
         self.sqs_handler.add_message_to_queue(queue_url, payload)
 
-    def _fetch_bundle_count_from_analysis_table(self, resolved_bundle_fqids: list):
-        analysis_table_bundle_count_query = analysis_bundle_count_query_template.format(
-            format_str_list(resolved_bundle_fqids))
-        analysis_table_bundle_count_query = analysis_table_bundle_count_query.strip().replace('\n', '')
-        results = self.redshift_handler.transaction([analysis_table_bundle_count_query],
+    def _fetch_bundle_count_from_analysis_table(self, resolved_bundle_uuids: list):
+        analysis_table_bundle_count_query = analysis_bundle_count_query_template.strip().replace('\n', '')
+        results = self.redshift_handler.transaction(self._stage_bundle_uuids_queries(resolved_bundle_uuids)
+                                                    + [analysis_table_bundle_count_query],
                                                     read_only=True,
                                                     return_results=True)
         analysis_table_bundle_count = results[0][0]
         return analysis_table_bundle_count
+
+    def _stage_bundle_uuids_queries(self, resolved_bundle_uuids: list):
+        """
+        Builds the queries staging the bundle uuids of the request into the bundle_uuids temporary table.
+        Large key sets are written to S3 once and loaded with COPY to keep the queries small.
+        :param resolved_bundle_uuids: Bundle uuids of the request
+        :return: List of staging queries
+        """
+        if len(resolved_bundle_uuids) <= RedshiftHandler.KEY_SET_INSERT_BATCH_SIZE:
+            return RedshiftHandler.stage_key_set_queries("bundle_uuids", "bundle_uuid", resolved_bundle_uuids)
+
+        bundle_uuids_obj_key = f"{self.request_id}/bundle_uuids"
+        if bundle_uuids_obj_key not in self._staged_obj_keys:
+            self.s3_handler.store_content_in_s3(bundle_uuids_obj_key,
+                                                RedshiftHandler.key_set_content(resolved_bundle_uuids))
+            self._staged_obj_keys.add(bundle_uuids_obj_key)
+
+        return RedshiftHandler.stage_key_set_queries("bundle_uuids",
+                                                     "bundle_uuid",
+                                                     s3_url=f"s3://{os.environ['MATRIX_QUERY_BUCKET']}/"
+                                                            f"{bundle_uuids_obj_key}",
+                                                     iam_role=self.redshift_role_arn)
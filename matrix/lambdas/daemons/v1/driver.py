@@ -4,11 +4,13 @@ import os
 from matrix.common import query_constructor
 from matrix.common.config import MatrixInfraConfig, MatrixRedshiftConfig
 from matrix.common.logging import Logging
+from matrix.common.query import expression_shards
 from matrix.common.request.request_tracker import RequestTracker, Subtask
 from matrix.common.aws.dynamo_handler import DynamoHandler
+from matrix.common.aws.redshift_handler import RedshiftHandler
 from matrix.common.aws.sqs_handler import SQSHandler
 from matrix.common.aws.s3_handler import S3Handler
-from matrix.docker.query_runner import QueryType
+from matrix.docker.query_runner import QueryPriority, QueryType, query_job_q_urls
 
 logger = Logging.get_logger(__name__)
 
@@ -16,18 +18,35 @@ logger = Logging.get_logger(__name__)
 class Driver:
     """
     Formats and stores redshift queries in s3 and sqs for execution.
+
+    Only the cell query of a request is queued (preceded by the cell keys query in two-phase
+    requests). The expression and feature queries are deferred in its message and queued by the
+    QueryRunner once the cell query has completed, unless the request hash computed from its
+    results matches a cached matrix.
+
+    The expression query of large requests is split into shards over disjoint sets of cells (see
+    matrix.common.query.expression_shards). Requests are sized by a cell count query, except
+    two-phase requests, which the QueryRunner sizes from the results of their cell keys query so
+    that the filter is only evaluated once.
     """
-    def __init__(self, request_id: str):
+    # Queries up to this size are also sent in their SQS message, which is limited to 256 KB,
+    # saving the QueryRunner from fetching them from S3
+    MAX_INLINE_QUERY_BYTES = 200 * 1024
+
+    def __init__(self, request_id: str, two_phase: bool = None):
         Logging.set_correlation_id(logger, value=request_id)
 
         self.request_id = request_id
+        self.two_phase = (os.getenv('MATRIX_QUERY_PLAN') == "two_phase") if two_phase is None else two_phase
         self.request_tracker = RequestTracker(request_id)
         self.dynamo_handler = DynamoHandler()
         self.sqs_handler = SQSHandler()
+        self.redshift_handler = RedshiftHandler()
         self.infra_config = MatrixInfraConfig()
         self.redshift_config = MatrixRedshiftConfig()
         self.query_results_bucket = os.environ['MATRIX_QUERY_RESULTS_BUCKET']
         self.s3_handler = S3Handler(os.environ['MATRIX_QUERY_BUCKET'])
+        self._formatted_queries = {}
 
     @property
     def query_job_q_url(self):
@@ -37,6 +56,10 @@ class Driver:
     def redshift_role_arn(self):
         return self.redshift_config.redshift_role_arn
 
+    @property
+    def cell_keys_table(self):
+        return f"cell_keys_{self.request_id.replace('-', '_')}"
+
     def run(self, filter_: typing.Dict[str, typing.Any], fields: typing.List[str], feature: str, genus_species: str):
         """
         Initialize a matrix service request and spawn redshift queries.
@@ -50,57 +73,126 @@ class Driver:
                      f"fields={fields}, feature={feature}")
 
         try:
-            matrix_request_queries = query_constructor.create_matrix_request_queries(
-                query_constructor.speciesify_filter(filter_, genus_species),
-                fields,
-                feature)
+            speciesified_filter = query_constructor.speciesify_filter(filter_, genus_species)
+            if self.two_phase:
+                matrix_request_queries = query_constructor.create_two_phase_matrix_request_queries(
+                    speciesified_filter, fields, feature)
+            else:
+                num_cells, num_nonzeros = self._estimate_request_size(speciesified_filter)
+                num_expression_shards = self._get_num_expression_shards(num_cells)
+                matrix_request_queries = query_constructor.create_matrix_request_queries(
+                    speciesified_filter, fields, feature, num_expression_shards=num_expression_shards)
         except (query_constructor.MalformedMatrixFilter, query_constructor.MalformedMatrixFeature) as exc:
             self.request_tracker.log_error(f"Query construction failed with error: {str(exc)}")
             raise
 
-        s3_obj_keys = self._format_and_store_queries_in_s3(matrix_request_queries, genus_species)
-        for key in s3_obj_keys:
-            self._add_request_query_to_sqs(key, s3_obj_keys[key])
+        if self.two_phase:
+            # The cell query depends on the cell keys staging table and is run by the QueryRunner
+            # once the cell keys query has completed. The QueryRunner then splits the expression
+            # query template into shards and prioritizes them by the cells the cell keys query
+            # staged. As the size of the request is unknown until then, the cell keys query is
+            # queued at the default priority. The staging table is dropped by whichever query of
+            # the request completes last.
+            expression_template = matrix_request_queries.pop(QueryType.EXPRESSION)
+            s3_obj_keys = self._format_and_store_queries_in_s3(matrix_request_queries, genus_species)
+            expression_template_obj_key = self._format_and_store_query_in_s3(
+                f"{QueryType.EXPRESSION.value}_template", expression_template, genus_species)
+            self._add_request_query_to_sqs(QueryType.CELL_KEYS,
+                                           s3_obj_keys[QueryType.CELL_KEYS],
+                                           cell_keys_table=self.cell_keys_table,
+                                           deferred_queries={
+                                               QueryType.CELL.value: s3_obj_keys[QueryType.CELL],
+                                               QueryType.EXPRESSION.value: expression_template_obj_key,
+                                               QueryType.FEATURE.value: s3_obj_keys[QueryType.FEATURE],
+                                           })
+        else:
+            if num_expression_shards > 1:
+                self.request_tracker.set_num_expression_shards(num_expression_shards)
+
+            # Queries are queued by the estimated number of rows they scan, so that small requests
+            # are not held up behind large ones. Feature queries only scan the feature table.
+            cell_priority = QueryPriority.from_cost(num_cells)
+            expression_priority = QueryPriority.from_cost(num_nonzeros)
+            logger.debug(f"Request matches {num_cells} cells and {num_nonzeros} nonzero expression values, "
+                         f"queueing cell queries as {cell_priority.value} "
+                         f"and expression queries as {expression_priority.value}")
+
+            s3_obj_keys = self._format_and_store_queries_in_s3(matrix_request_queries, genus_species)
+            expression_obj_keys = s3_obj_keys[QueryType.EXPRESSION]
+            if not isinstance(expression_obj_keys, list):
+                expression_obj_keys = [expression_obj_keys]
+            self._add_request_query_to_sqs(QueryType.CELL,
+                                           s3_obj_keys[QueryType.CELL],
+                                           priority=cell_priority,
+                                           deferred_queries={
+                                               QueryType.EXPRESSION.value: expression_obj_keys,
+                                               QueryType.FEATURE.value: s3_obj_keys[QueryType.FEATURE],
+                                           },
+                                           expression_priority=expression_priority.value)
 
         self.request_tracker.complete_subtask_execution(Subtask.DRIVER)
 
-    def _format_and_store_queries_in_s3(self, queries: dict, genus_species: str):
-        feature_query = queries[QueryType.FEATURE].format(results_bucket=self.query_results_bucket,
-                                                          request_id=self.request_id,
-                                                          genus_species=genus_species,
-                                                          iam_role=self.redshift_role_arn)
-        feature_query_obj_key = self.s3_handler.store_content_in_s3(
-            f"{self.request_id}/{QueryType.FEATURE.value}",
-            feature_query)
-
-        exp_query = queries[QueryType.EXPRESSION].format(results_bucket=self.query_results_bucket,
-                                                         request_id=self.request_id,
-                                                         genus_species=genus_species,
-                                                         iam_role=self.redshift_role_arn)
-        exp_query_obj_key = self.s3_handler.store_content_in_s3(
-            f"{self.request_id}/{QueryType.EXPRESSION.value}",
-            exp_query)
-
-        cell_query = queries[QueryType.CELL].format(results_bucket=self.query_results_bucket,
-                                                    request_id=self.request_id,
-                                                    genus_species=genus_species,
-                                                    iam_role=self.redshift_role_arn)
-        cell_query_obj_key = self.s3_handler.store_content_in_s3(
-            f"{self.request_id}/{QueryType.CELL.value}",
-            cell_query)
-
-        return {
-            QueryType.CELL: cell_query_obj_key,
-            QueryType.EXPRESSION: exp_query_obj_key,
-            QueryType.FEATURE: feature_query_obj_key
-        }
+    def _estimate_request_size(self, filter_: typing.Dict[str, typing.Any]) -> typing.Tuple[int, int]:
+        """
+        Estimates the size of a request from the cells matching the filter.
+        :param filter_: Speciesified filter dict of the request
+        :return: (int Number of cells, int Estimated number of nonzero expression values)
+        """
+        results = self.redshift_handler.transaction([query_constructor.create_cell_count_query(filter_)],
+                                                    return_results=True,
+                                                    read_only=True)
+        num_cells, num_nonzeros = results[0]
+        return num_cells, num_nonzeros
+
+    @staticmethod
+    def _get_num_expression_shards(num_cells: int) -> int:
+        """
+        The number of shards to split the request's expression query into.
+        :param num_cells: Number of cells matching the request
+        :return: int Number of expression query shards
+        """
+        num_shards = expression_shards.get_num_expression_shards(num_cells)
+        logger.debug(f"Request matches {num_cells} cells, using {num_shards} expression query shards")
+        return num_shards
 
-    def _add_request_query_to_sqs(self, query_type: QueryType, s3_obj_key: str):
-        queue_url = self.query_job_q_url
+    def _format_and_store_queries_in_s3(self, queries: dict, genus_species: str):
+        s3_obj_keys = {}
+        for query_type, query in queries.items():
+            if isinstance(query, list):
+                s3_obj_keys[query_type] = [self._format_and_store_query_in_s3(f"{query_type.value}_{shard}",
+                                                                              shard_query,
+                                                                              genus_species)
+                                           for shard, shard_query in enumerate(query)]
+            else:
+                s3_obj_keys[query_type] = self._format_and_store_query_in_s3(query_type.value, query, genus_species)
+
+        return s3_obj_keys
+
+    def _format_and_store_query_in_s3(self, name: str, query: str, genus_species: str):
+        formatted_query = query.format(results_bucket=self.query_results_bucket,
+                                       request_id=self.request_id,
+                                       genus_species=genus_species,
+                                       iam_role=self.redshift_role_arn,
+                                       cell_keys_table=self.cell_keys_table)
+        s3_obj_key = self.s3_handler.store_content_in_s3(f"{self.request_id}/{name}", formatted_query)
+        self._formatted_queries[s3_obj_key] = formatted_query
+        return s3_obj_key
+
+    def _add_request_query_to_sqs(self,
+                                  query_type: QueryType,
+                                  s3_obj_key: str,
+                                  priority: QueryPriority = QueryPriority.MEDIUM,
+                                  **kwargs):
+        queue_url = query_job_q_urls(self.infra_config)[priority]
         payload = {
             'request_id': self.request_id,
             's3_obj_key': s3_obj_key,
-            'type': query_type.value
+            'type': query_type.value,
+            'priority': priority.value,
+            **kwargs
         }
+        query = self._formatted_queries.get(s3_obj_key)
+        if query is not None and len(query.encode()) <= Driver.MAX_INLINE_QUERY_BYTES:
+            payload['query'] = query
         logger.debug(f"Adding {payload} to sqs {queue_url}")
         self.sqs_handler.add_message_to_queue(queue_url, payload)
@@ -15,7 +15,7 @@ def invalidate_cache_entries(request_ids: list,
     """
     Invalidates a list of request IDs and/or request hashes.
     Invalidation refers to the invalidation of the request in DynamoDB
-    and the deletion of the associated matrix in S3.
+    and the deletion of the associated matrix in S3, once no other request references it.
 
     Invalidated requests will return an `ERROR` state and explanation
     to the user via the GET endpoint.
@@ -32,12 +32,9 @@ def invalidate_cache_entries(request_ids: list,
     data_version = dynamo_handler.get_table_item(table=DynamoTable.DEPLOYMENT_TABLE,
                                                  key=deployment_stage)[DeploymentTableField.CURRENT_DATA_VERSION.value]
     for request_hash in request_hashes:
-        items = dynamo_handler.filter_table_items(table=DynamoTable.REQUEST_TABLE,
-                                                  attrs={
-                                                      RequestTableField.REQUEST_HASH.value: request_hash,
-                                                      RequestTableField.DATA_VERSION.value: data_version,
-                                                      RequestTableField.ERROR_MESSAGE.value: 0
-                                                  })
+        items = dynamo_handler.query_by_request_hash(request_hash,
+                                                     data_version,
+                                                     attrs={RequestTableField.ERROR_MESSAGE.value: 0})
         for item in items:
             request_ids.append(item[RequestTableField.REQUEST_ID.value])
 
@@ -45,9 +42,10 @@ def invalidate_cache_entries(request_ids: list,
     for request_id in request_ids:
         print(f"Writing deletion error to {request_id} in DynamoDB.")
         request_tracker = RequestTracker(request_id=request_id)
-        request_tracker.log_error("This request has been deleted and is no longer available for download. "
-                                  "Please generate a new matrix at POST /v1/matrix.")
-        s3_keys_to_delete.append(request_tracker.s3_results_key)
+        # Matrices are shared by the requests aliasing them and deleted with the last reference
+        if request_tracker.invalidate_result("This request has been deleted and is no longer available for download. "
+                                             "Please generate a new matrix at POST /v1/matrix."):
+            s3_keys_to_delete.append(request_tracker.s3_results_key)
 
     print(f"Deleting matrices at the following S3 keys: {s3_keys_to_delete}")
     if s3_keys_to_delete:
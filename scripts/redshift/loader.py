@@ -6,7 +6,6 @@ import os
 from matrix.common import etl
 from matrix.common.aws.redshift_handler import RedshiftHandler
 from matrix.common.constants import MetadataSchemaName, SUPPORTED_METADATA_SCHEMA_VERSIONS
-from matrix.common.query_constructor import format_str_list
 
 # Match all SS2 and 10X analysis bundles
 DSS_SEARCH_QUERY_TEMPLATE = {
@@ -243,8 +242,10 @@ def _verify_load(es_query):
     print(f"Loading {len(expected_bundles)} bundles to {os.environ['DEPLOYMENT_STAGE']} complete.\n"
           f"Verifying row counts in Redshift...")
     redshift = RedshiftHandler()
-    count_bundles_query = f"SELECT COUNT(*) FROM analysis WHERE bundle_fqid IN {format_str_list(expected_bundles)}"
-    results = redshift.transaction(queries=[count_bundles_query],
+    stage_bundles_queries = RedshiftHandler.stage_key_set_queries("expected_bundles", "bundle_fqid", expected_bundles)
+    count_bundles_query = "SELECT COUNT(*) FROM analysis " \
+                          "INNER JOIN expected_bundles ON (analysis.bundle_fqid = expected_bundles.bundle_fqid)"
+    results = redshift.transaction(queries=stage_bundles_queries + [count_bundles_query],
                                    return_results=True)
     print(f"Found {results[0][0]} analysis rows for {len(expected_bundles)} expected bundles.")
     assert (results[0][0] == len(expected_bundles))
@@ -6,7 +6,7 @@ pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 sys.path.insert(0, pkg_root)  # noqa
 
 from matrix.common.exceptions import MatrixException
-from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, DeploymentTableField
+from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable
 from matrix.common.logging import Logging
 
 logger = Logging.get_logger(__file__)
@@ -18,15 +18,11 @@ def set_data_version(version):
     If the desired version does not exist in the Data Version table, the request will fail.
     """
     dynamo_handler = DynamoHandler()
-    deployment_stage = os.environ['DEPLOYMENT_STAGE']
 
     try:
         dynamo_handler.get_table_item(table=DynamoTable.DATA_VERSION_TABLE,
                                       key=version)
-        dynamo_handler.set_table_field_with_value(table=DynamoTable.DEPLOYMENT_TABLE,
-                                                  key=deployment_stage,
-                                                  field_enum=DeploymentTableField.CURRENT_DATA_VERSION,
-                                                  field_value=version)
+        dynamo_handler.set_current_data_version(version)
     except MatrixException:
         logger.error(f"Version {version} does not exist in {DynamoTable.DEPLOYMENT_TABLE.value}. "
                      f"Please use an existing version or generate one via `make bump-data-version.`")
@@ -8,9 +8,58 @@ resource "aws_dynamodb_table" "request_table" {
     name = "RequestId"
     type = "S"
   }
+
+  attribute {
+    name = "RequestHash"
+    type = "S"
+  }
+
+  attribute {
+    name = "DataVersion"
+    type = "N"
+  }
+
+  global_secondary_index {
+    name            = "RequestHashIndex"
+    hash_key        = "RequestHash"
+    range_key       = "DataVersion"
+    read_capacity   = 25
+    write_capacity  = 25
+    projection_type = "ALL"
+  }
   # Add tags to this resource
 }
 
+resource "aws_dynamodb_table" "query_cache_table" {
+  name           = "dcp-matrix-service-query-cache-table-${var.deployment_stage}"
+  read_capacity  = 25
+  write_capacity = 25
+  hash_key       = "QueryHash"
+
+  attribute {
+    name = "QueryHash"
+    type = "S"
+  }
+}
+
+resource "aws_dynamodb_table" "result_cache_table" {
+  name           = "dcp-matrix-service-result-cache-table-${var.deployment_stage}"
+  read_capacity  = 25
+  write_capacity = 25
+  hash_key       = "CacheKey"
+
+  attribute {
+    name = "CacheKey"
+    type = "S"
+  }
+
+  # Entries expire with their matrix in the results bucket
+  ttl {
+    attribute_name = "ExpirationTime"
+    enabled        = true
+  }
+}
+
 resource "aws_dynamodb_table" "data_version_table" {
   name           = "dcp-matrix-service-data-version-table-${var.deployment_stage}"
   read_capacity  = 25
@@ -35,6 +35,14 @@ resource "aws_ecs_task_definition" "query_runner" {
         "name": "DYNAMO_REQUEST_TABLE_NAME",
         "value": "dcp-matrix-service-request-table-${var.deployment_stage}"
       },
+      {
+        "name": "DYNAMO_QUERY_CACHE_TABLE_NAME",
+        "value": "dcp-matrix-service-query-cache-table-${var.deployment_stage}"
+      },
+      {
+        "name": "DYNAMO_RESULT_CACHE_TABLE_NAME",
+        "value": "dcp-matrix-service-result-cache-table-${var.deployment_stage}"
+      },
       {
         "name": "BATCH_CONVERTER_JOB_QUEUE_ARN",
         "value": "arn:aws:batch:${var.aws_region}:${var.account_id}:job-queue/dcp-matrix-converter-queue-${var.deployment_stage}"
@@ -42,8 +50,17 @@ resource "aws_ecs_task_definition" "query_runner" {
       {
         "name": "BATCH_CONVERTER_JOB_DEFINITION_ARN",
         "value": "arn:aws:batch:${var.aws_region}:${var.account_id}:job-definition/dcp-matrix-converter-job-definition-${var.deployment_stage}"
+      },
+      {
+        "name": "MATRIX_QUERY_RUNNER_WORKERS",
+        "value": "${var.query_runner_workers}"
+      },
+      {
+        "name": "MATRIX_REDSHIFT_WLM_SLOTS",
+        "value": "${floor(var.redshift_wlm_slots / var.query_runner_concurrency)}"
       }
     ],
+    "stopTimeout": 120,
     "ulimits": [
       {
         "softLimit": 4100,
@@ -157,10 +174,13 @@ resource "aws_iam_role_policy" "query_runner" {
           "Action": [
             "sqs:SendMessage",
             "sqs:ReceiveMessage",
-            "sqs:DeleteMessage"
+            "sqs:DeleteMessage",
+            "sqs:ChangeMessageVisibility"
           ],
           "Resource": [
             "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-queue-${var.deployment_stage}",
+            "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-small-queue-${var.deployment_stage}",
+            "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-large-queue-${var.deployment_stage}",
             "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-deadletter-queue-${var.deployment_stage}"
           ]
         },
@@ -197,7 +217,9 @@ resource "aws_iam_role_policy" "query_runner" {
           "Resource": [
             "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-data-version-table-${var.deployment_stage}",
             "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-deployment-table-${var.deployment_stage}",
-            "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-request-table-${var.deployment_stage}"
+            "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-request-table-${var.deployment_stage}",
+            "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-query-cache-table-${var.deployment_stage}",
+            "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-result-cache-table-${var.deployment_stage}"
           ]
         },
         {
@@ -74,7 +74,9 @@ resource "aws_iam_role_policy" "matrix_service_redshift" {
         "arn:aws:s3:::dcp-matrix-service-preload-${var.deployment_stage}",
         "arn:aws:s3:::dcp-matrix-service-preload-${var.deployment_stage}/*",
         "arn:aws:s3:::dcp-matrix-service-query-results-${var.deployment_stage}",
-        "arn:aws:s3:::dcp-matrix-service-query-results-${var.deployment_stage}/*"
+        "arn:aws:s3:::dcp-matrix-service-query-results-${var.deployment_stage}/*",
+        "arn:aws:s3:::dcp-matrix-service-queries-${var.deployment_stage}",
+        "arn:aws:s3:::dcp-matrix-service-queries-${var.deployment_stage}/*"
       ]
     }
   ]
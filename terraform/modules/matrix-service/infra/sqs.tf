@@ -1,7 +1,25 @@
 resource "aws_sqs_queue" "query_queue" {
   name                      = "dcp-matrix-query-queue-${var.deployment_stage}"
-//  Queue visibility timeout must be larger than (triggered lambda) function timeout
-  visibility_timeout_seconds = 1800
+//  Query runners extend the visibility of the messages they process with a heartbeat,
+//  so that messages of a lost query runner are redelivered after this timeout
+  visibility_timeout_seconds = 300
+  message_retention_seconds = 86400
+  redrive_policy            = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.query_deadletter_queue.arn}\",\"maxReceiveCount\":4}"
+
+}
+
+//  Query jobs are queued by priority class, the medium priority queue being query_queue
+resource "aws_sqs_queue" "query_small_queue" {
+  name                      = "dcp-matrix-query-small-queue-${var.deployment_stage}"
+  visibility_timeout_seconds = 300
+  message_retention_seconds = 86400
+  redrive_policy            = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.query_deadletter_queue.arn}\",\"maxReceiveCount\":4}"
+
+}
+
+resource "aws_sqs_queue" "query_large_queue" {
+  name                      = "dcp-matrix-query-large-queue-${var.deployment_stage}"
+  visibility_timeout_seconds = 300
   message_retention_seconds = 86400
   redrive_policy            = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.query_deadletter_queue.arn}\",\"maxReceiveCount\":4}"
 
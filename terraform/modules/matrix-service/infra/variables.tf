@@ -35,6 +35,16 @@ variable "query_runner_concurrency" {
   default = "1"
 }
 
+variable "query_runner_workers" {
+  type = string
+  default = "4"
+}
+
+variable "redshift_wlm_slots" {
+  type = string
+  default = "5"
+}
+
 variable "readonly_redshift_username" {
   type = string
 }
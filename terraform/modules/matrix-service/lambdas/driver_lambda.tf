@@ -95,7 +95,9 @@ resource "aws_iam_role_policy" "matrix_service_driver_lambda" {
         "sqs:SendMessage"
       ],
       "Resource": [
-        "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-queue-${var.deployment_stage}"
+        "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-queue-${var.deployment_stage}",
+        "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-small-queue-${var.deployment_stage}",
+        "arn:aws:sqs:${var.aws_region}:${var.account_id}:dcp-matrix-query-large-queue-${var.deployment_stage}"
       ]
     }
   ]
@@ -115,9 +117,12 @@ resource "aws_lambda_function" "matrix_service_driver_v0_lambda" {
   environment {
     variables = {
         DEPLOYMENT_STAGE =  var.deployment_stage
+        MATRIX_METRICS_FORMAT = "emf"
         DYNAMO_DATA_VERSION_TABLE_NAME="dcp-matrix-service-data-version-table-${var.deployment_stage}"
         DYNAMO_DEPLOYMENT_TABLE_NAME="dcp-matrix-service-deployment-table-${var.deployment_stage}"
         DYNAMO_REQUEST_TABLE_NAME="dcp-matrix-service-request-table-${var.deployment_stage}"
+        DYNAMO_QUERY_CACHE_TABLE_NAME="dcp-matrix-service-query-cache-table-${var.deployment_stage}"
+        DYNAMO_RESULT_CACHE_TABLE_NAME="dcp-matrix-service-result-cache-table-${var.deployment_stage}"
         MATRIX_QUERY_BUCKET = "dcp-matrix-service-queries-${var.deployment_stage}"
         MATRIX_QUERY_RESULTS_BUCKET = "dcp-matrix-service-query-results-${var.deployment_stage}"
         BATCH_CONVERTER_JOB_QUEUE_ARN = "arn:aws:batch:${var.aws_region}:${var.account_id}:job-queue/dcp-matrix-converter-queue-${var.deployment_stage}"
@@ -138,11 +143,15 @@ resource "aws_lambda_function" "matrix_service_driver_v1_lambda" {
   environment {
     variables = {
         DEPLOYMENT_STAGE =  var.deployment_stage
+        MATRIX_METRICS_FORMAT = "emf"
         DYNAMO_DATA_VERSION_TABLE_NAME="dcp-matrix-service-data-version-table-${var.deployment_stage}"
         DYNAMO_DEPLOYMENT_TABLE_NAME="dcp-matrix-service-deployment-table-${var.deployment_stage}"
         DYNAMO_REQUEST_TABLE_NAME="dcp-matrix-service-request-table-${var.deployment_stage}"
+        DYNAMO_QUERY_CACHE_TABLE_NAME="dcp-matrix-service-query-cache-table-${var.deployment_stage}"
+        DYNAMO_RESULT_CACHE_TABLE_NAME="dcp-matrix-service-result-cache-table-${var.deployment_stage}"
         MATRIX_QUERY_BUCKET = "dcp-matrix-service-queries-${var.deployment_stage}"
         MATRIX_QUERY_RESULTS_BUCKET = "dcp-matrix-service-query-results-${var.deployment_stage}"
+        MATRIX_QUERY_PLAN = "two_phase"
         BATCH_CONVERTER_JOB_QUEUE_ARN = "arn:aws:batch:${var.aws_region}:${var.account_id}:job-queue/dcp-matrix-converter-queue-${var.deployment_stage}"
         BATCH_CONVERTER_JOB_DEFINITION_ARN = "arn:aws:batch:${var.aws_region}:${var.account_id}:job-definition/dcp-matrix-converter-job-definition-${var.deployment_stage}"
     }
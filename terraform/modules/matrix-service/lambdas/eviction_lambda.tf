@@ -0,0 +1,131 @@
+resource "aws_iam_role" "matrix_service_eviction_lambda" {
+  name = "matrix-service-eviction-daemon-${var.deployment_stage}"
+
+  assume_role_policy = <<POLICY
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Action": "sts:AssumeRole",
+      "Principal": {
+        "Service": "lambda.amazonaws.com"
+      },
+      "Effect": "Allow",
+      "Sid": ""
+    }
+  ]
+}
+POLICY
+}
+
+resource "aws_iam_role_policy" "matrix_service_eviction_lambda" {
+  name = "matrix-service-eviction-daemon-${var.deployment_stage}"
+  role =  aws_iam_role.matrix_service_eviction_lambda.name
+  policy = <<EOF
+{
+  "Version": "2012-10-17",
+  "Statement": [
+    {
+      "Sid": "LogsPolicy",
+      "Effect": "Allow",
+      "Resource": [
+        "arn:aws:logs:${var.aws_region}:${var.account_id}:log-group:/aws/lambda/dcp-matrix-service-eviction-${var.deployment_stage}",
+        "arn:aws:logs:${var.aws_region}:${var.account_id}:log-group:/aws/lambda/dcp-matrix-service-eviction-${var.deployment_stage}:*:*"
+      ],
+      "Action": [
+        "logs:CreateLogGroup",
+        "logs:CreateLogStream",
+        "logs:PutLogEvents"
+      ]
+    },
+    {
+      "Sid": "DynamoPolicy",
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:UpdateItem",
+        "dynamodb:GetItem",
+        "dynamodb:Query",
+        "dynamodb:Scan"
+      ],
+      "Resource": [
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-deployment-table-${var.deployment_stage}",
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-request-table-${var.deployment_stage}",
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-request-table-${var.deployment_stage}/index/*",
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-query-cache-table-${var.deployment_stage}",
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-result-cache-table-${var.deployment_stage}"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:GetItem"
+      ],
+      "Resource": [
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-data-version-table-${var.deployment_stage}"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "cloudwatch:PutMetricData"
+      ],
+      "Resource": "*"
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "s3:GetObject",
+        "s3:DeleteObject",
+        "s3:ListBucket"
+      ],
+      "Resource": [
+        "${var.results_bucket_arn}",
+        "${var.results_bucket_arn}/*"
+      ]
+    }
+  ]
+}
+EOF
+}
+
+resource "aws_lambda_function" "matrix_service_eviction_lambda" {
+  function_name    = "dcp-matrix-service-eviction-${var.deployment_stage}"
+  s3_bucket        =  var.deployment_bucket_id
+  s3_key           = "eviction_daemon.zip"
+  role             =  aws_iam_role.matrix_service_eviction_lambda.arn
+  handler          = "app.eviction_handler"
+  runtime          = "python3.6"
+  timeout          = 900
+
+  environment {
+    variables = {
+        DEPLOYMENT_STAGE =  var.deployment_stage
+        MATRIX_METRICS_FORMAT = "emf"
+        DYNAMO_DATA_VERSION_TABLE_NAME="dcp-matrix-service-data-version-table-${var.deployment_stage}"
+        DYNAMO_DEPLOYMENT_TABLE_NAME="dcp-matrix-service-deployment-table-${var.deployment_stage}"
+        DYNAMO_REQUEST_TABLE_NAME="dcp-matrix-service-request-table-${var.deployment_stage}"
+        DYNAMO_QUERY_CACHE_TABLE_NAME="dcp-matrix-service-query-cache-table-${var.deployment_stage}"
+        DYNAMO_RESULT_CACHE_TABLE_NAME="dcp-matrix-service-result-cache-table-${var.deployment_stage}"
+        MATRIX_RESULTS_BUCKET = "dcp-matrix-service-results-${var.deployment_stage}"
+        MATRIX_RESULTS_BUCKET_BUDGET_BYTES = var.results_bucket_budget_gb * 1073741824
+    }
+  }
+}
+
+resource "aws_cloudwatch_event_rule" "matrix_service_eviction" {
+  name                = "dcp-matrix-service-eviction-${var.deployment_stage}"
+  schedule_expression = "rate(1 hour)"
+}
+
+resource "aws_cloudwatch_event_target" "matrix_service_eviction" {
+  rule = aws_cloudwatch_event_rule.matrix_service_eviction.name
+  arn  = aws_lambda_function.matrix_service_eviction_lambda.arn
+}
+
+resource "aws_lambda_permission" "matrix_service_eviction" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.matrix_service_eviction_lambda.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.matrix_service_eviction.arn
+}
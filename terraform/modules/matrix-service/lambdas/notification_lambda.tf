@@ -63,6 +63,34 @@ resource "aws_iam_role_policy" "matrix_service_notification_lambda" {
         "arn:aws:s3:::dcp-matrix-service-preload-${var.deployment_stage}/*"
       ]
     },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "s3:ListBucket"
+      ],
+      "Resource": [
+        "arn:aws:s3:::dcp-matrix-service-query-results-${var.deployment_stage}"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "s3:DeleteObject"
+      ],
+      "Resource": [
+        "arn:aws:s3:::dcp-matrix-service-query-results-${var.deployment_stage}/field_details/*"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:GetItem",
+        "dynamodb:UpdateItem"
+      ],
+      "Resource": [
+        "arn:aws:dynamodb:${var.aws_region}:${var.account_id}:table/dcp-matrix-service-deployment-table-${var.deployment_stage}"
+      ]
+    },
     {
       "Effect": "Allow",
       "Action": [
@@ -104,7 +132,13 @@ resource "aws_lambda_function" "matrix_service_notification_lambda" {
   environment {
     variables = {
       DEPLOYMENT_STAGE =  var.deployment_stage
+      DYNAMO_DATA_VERSION_TABLE_NAME = "dcp-matrix-service-data-version-table-${var.deployment_stage}"
+      DYNAMO_DEPLOYMENT_TABLE_NAME = "dcp-matrix-service-deployment-table-${var.deployment_stage}"
+      DYNAMO_REQUEST_TABLE_NAME = "dcp-matrix-service-request-table-${var.deployment_stage}"
+      DYNAMO_QUERY_CACHE_TABLE_NAME = "dcp-matrix-service-query-cache-table-${var.deployment_stage}"
+      DYNAMO_RESULT_CACHE_TABLE_NAME = "dcp-matrix-service-result-cache-table-${var.deployment_stage}"
       MATRIX_PRELOAD_BUCKET = "dcp-matrix-service-preload-${var.deployment_stage}"
+      MATRIX_QUERY_RESULTS_BUCKET = "dcp-matrix-service-query-results-${var.deployment_stage}"
       MATRIX_REDSHIFT_IAM_ROLE_ARN = "arn:aws:iam::${var.account_id}:role/matrix-service-redshift-${var.deployment_stage}"
       XDG_CONFIG_HOME = "/tmp"
     }
@@ -17,3 +17,8 @@ variable "deployment_bucket_id" {
 variable "results_bucket_arn" {
   type = string
 }
+
+variable "results_bucket_budget_gb" {
+  type = number
+  default = 1024
+}
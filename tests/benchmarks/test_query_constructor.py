@@ -0,0 +1,85 @@
+"""Micro-benchmarks for compiling matrix filters into SQL.
+
+Run with `make benchmarks`. Each benchmark times filter compilation over synthetic
+filters of growing size and fails if the time per filter node grows faster than
+linearly with the size of the filter.
+"""
+import timeit
+import unittest
+
+from matrix.common import query_constructor
+
+SIZES = [1000, 2000, 4000, 8000, 16000, 32000]
+
+# Allowed growth of the time per node from the smallest to the largest filter, which
+# absorbs timer noise. Quadratic compilation would grow it by SIZES[-1] / SIZES[0].
+MAX_PER_NODE_GROWTH = 3.0
+
+
+def wide_in_filter(size):
+    return {"op": "in",
+            "field": "project.project_core.project_short_name",
+            "value": [f"project_{i}" for i in range(size)]}
+
+
+def wide_and_filter(size):
+    return {"op": "and", "value": [{"op": "=", "field": "cell.genes_detected", "value": i} for i in range(size)]}
+
+
+def balanced_filter(size):
+    filters = [{"op": "=", "field": "donor_organism.sex", "value": str(i)} for i in range(size)]
+    ops = ["and", "or"]
+    depth = 0
+    while len(filters) > 1:
+        filters = [{"op": ops[depth % 2], "value": filters[i:i + 2]} if i + 1 < len(filters) else filters[i]
+                   for i in range(0, len(filters), 2)]
+        depth += 1
+    return filters[0]
+
+
+def deep_filter(size):
+    filter_ = {"op": "=", "field": "cell.genes_detected", "value": 0}
+    for i in range(1, size):
+        if i % 2:
+            filter_ = {"op": "not", "value": [filter_]}
+        else:
+            filter_ = {"op": "or", "value": [filter_, {"op": "=", "field": "cell.genes_detected", "value": i}]}
+    return filter_
+
+
+class TestFilterCompilationScaling(unittest.TestCase):
+
+    def _assert_linear(self, name, make_filter, compile_filter):
+        per_node = []
+        for size in SIZES:
+            filter_ = make_filter(size)
+            seconds = min(timeit.repeat(lambda: compile_filter(filter_), number=1, repeat=5))
+            per_node.append(seconds / size)
+            print(f"{name:>24} {size:>7} nodes {seconds * 1000:>9.2f} ms {seconds / size * 1e6:>7.3f} us/node")
+
+        self.assertLess(per_node[-1] / per_node[0], MAX_PER_NODE_GROWTH)
+
+    def _compile(self, filter_):
+        return query_constructor.filter_to_where(query_constructor.translate_filters(filter_))
+
+    def test_wide_in(self):
+        self._assert_linear("wide in", wide_in_filter, self._compile)
+
+    def test_wide_and(self):
+        self._assert_linear("wide and", wide_and_filter, self._compile)
+
+    def test_balanced(self):
+        self._assert_linear("balanced and/or", balanced_filter, self._compile)
+
+    def test_deep(self):
+        self._assert_linear("deep not/or", deep_filter, self._compile)
+
+    def test_matrix_request_queries(self):
+        self._assert_linear("matrix request queries", balanced_filter,
+                            lambda filter_: query_constructor.create_matrix_request_queries(filter_,
+                                                                                            ["cell.barcode"],
+                                                                                            "gene"))
+
+
+if __name__ == "__main__":
+    unittest.main()
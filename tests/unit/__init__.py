@@ -14,6 +14,8 @@ os.environ['LAMBDA_NOTIFICATION_FUNCTION_NAME'] = "test_notification_name"
 os.environ['DYNAMO_DATA_VERSION_TABLE_NAME'] = "test_data_version_table_name"
 os.environ['DYNAMO_DEPLOYMENT_TABLE_NAME'] = "test_deployment_table_name"
 os.environ['DYNAMO_REQUEST_TABLE_NAME'] = "test_request_table_name"
+os.environ['DYNAMO_QUERY_CACHE_TABLE_NAME'] = "test_query_cache_table_name"
+os.environ['DYNAMO_RESULT_CACHE_TABLE_NAME'] = "test_result_cache_table_name"
 os.environ['MATRIX_RESULTS_BUCKET'] = "test_results_bucket"
 os.environ['MATRIX_QUERY_BUCKET'] = "test_query_bucket"
 os.environ['MATRIX_QUERY_RESULTS_BUCKET'] = "test_query_results_bucket"
@@ -23,7 +25,7 @@ os.environ['BATCH_CONVERTER_JOB_QUEUE_ARN'] = "test-job-queue"
 os.environ['BATCH_CONVERTER_JOB_DEFINITION_ARN'] = "test-job-definition"
 
 # must be imported after test environment variables are set
-from matrix.common.aws.dynamo_handler import DataVersionTableField, DeploymentTableField  # noqa
+from matrix.common.aws.dynamo_handler import DataVersionTableField, DeploymentTableField, DynamoHandler  # noqa
 from matrix.common.config import MatrixInfraConfig, MatrixRedshiftConfig  # noqa
 
 
@@ -31,6 +33,8 @@ class MatrixTestCaseUsingMockAWS(unittest.TestCase):
 
     TEST_CONFIG = {
         'query_job_q_url': 'test_query_job_q_name',
+        'query_job_small_q_url': 'test_query_job_small_q_name',
+        'query_job_large_q_url': 'test_query_job_large_q_name',
         'query_job_deadletter_q_url': 'test_deadletter_query_job_q_name',
         'notification_q_url': 'test_notification_q_url'
     }
@@ -51,11 +55,15 @@ class MatrixTestCaseUsingMockAWS(unittest.TestCase):
         self.sts_mock = mock_sts()
         self.sts_mock.start()
 
+        DynamoHandler.invalidate_current_data_version()
+
         self.matrix_infra_config = MatrixInfraConfig()
         self.redshift_config = MatrixRedshiftConfig()
 
         self.sqs = boto3.resource('sqs')
         self.sqs.create_queue(QueueName=f"test_query_job_q_name")
+        self.sqs.create_queue(QueueName=f"test_query_job_small_q_name")
+        self.sqs.create_queue(QueueName=f"test_query_job_large_q_name")
         self.sqs.create_queue(QueueName=f"test_deadletter_query_job_q_name")
         self.sqs.create_queue(QueueName=f"test_notification_q_url")
 
@@ -121,6 +129,80 @@ class MatrixTestCaseUsingMockAWS(unittest.TestCase):
                 {
                     'AttributeName': "RequestId",
                     'AttributeType': "S",
+                },
+                {
+                    'AttributeName': "RequestHash",
+                    'AttributeType': "S",
+                },
+                {
+                    'AttributeName': "DataVersion",
+                    'AttributeType': "N",
+                }
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': "RequestHashIndex",
+                    'KeySchema': [
+                        {
+                            'AttributeName': "RequestHash",
+                            'KeyType': "HASH",
+                        },
+                        {
+                            'AttributeName': "DataVersion",
+                            'KeyType': "RANGE",
+                        }
+                    ],
+                    'Projection': {
+                        'ProjectionType': "ALL",
+                    },
+                    'ProvisionedThroughput': {
+                        'ReadCapacityUnits': 25,
+                        'WriteCapacityUnits': 25,
+                    },
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 25,
+                'WriteCapacityUnits': 25,
+            },
+        )
+
+    @staticmethod
+    def create_test_query_cache_table():
+        boto3.resource("dynamodb", region_name=os.environ['AWS_DEFAULT_REGION']).create_table(
+            TableName=os.environ['DYNAMO_QUERY_CACHE_TABLE_NAME'],
+            KeySchema=[
+                {
+                    'AttributeName': "QueryHash",
+                    'KeyType': "HASH",
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': "QueryHash",
+                    'AttributeType': "S",
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 25,
+                'WriteCapacityUnits': 25,
+            },
+        )
+
+    @staticmethod
+    def create_test_result_cache_table():
+        boto3.resource("dynamodb", region_name=os.environ['AWS_DEFAULT_REGION']).create_table(
+            TableName=os.environ['DYNAMO_RESULT_CACHE_TABLE_NAME'],
+            KeySchema=[
+                {
+                    'AttributeName': "CacheKey",
+                    'KeyType': "HASH",
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': "CacheKey",
+                    'AttributeType': "S",
                 }
             ],
             ProvisionedThroughput={
@@ -162,3 +244,8 @@ class MatrixTestCaseUsingMockAWS(unittest.TestCase):
     def create_s3_queries_bucket():
         boto3.resource("s3", region_name=os.environ['AWS_DEFAULT_REGION']) \
              .create_bucket(Bucket=os.environ['MATRIX_QUERY_BUCKET'])
+
+    @staticmethod
+    def create_s3_query_results_bucket():
+        boto3.resource("s3", region_name=os.environ['AWS_DEFAULT_REGION']) \
+             .create_bucket(Bucket=os.environ['MATRIX_QUERY_RESULTS_BUCKET'])
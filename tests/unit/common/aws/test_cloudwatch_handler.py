@@ -1,9 +1,12 @@
+import io
+import json
 import unittest
 import os
+from unittest import mock
 
-from botocore.stub import Stubber
+from botocore.stub import ANY, Stubber
 
-from matrix.common.aws.cloudwatch_handler import CloudwatchHandler, MetricName
+from matrix.common.aws.cloudwatch_handler import CloudwatchHandler, MetricName, MetricsFormat
 
 
 class TestCloudwatchHandler(unittest.TestCase):
@@ -12,21 +15,80 @@ class TestCloudwatchHandler(unittest.TestCase):
     """
     def setUp(self):
         self.deploment_stage = os.environ["DEPLOYMENT_STAGE"]
-        self.handler = CloudwatchHandler()
+        self.handler = CloudwatchHandler(MetricsFormat.API.value)
         self.mock_cloudwatch_client = Stubber(self.handler._client)
+        self._clear_buffer()
+
+    def tearDown(self):
+        self._clear_buffer()
+
+    @staticmethod
+    def _clear_buffer():
+        with CloudwatchHandler._lock:
+            CloudwatchHandler._buffer = []
+            if CloudwatchHandler._timer is not None:
+                CloudwatchHandler._timer.cancel()
+                CloudwatchHandler._timer = None
 
     def test_put_metric_data(self):
-        metric_data = {'MetricName': MetricName.REQUEST.value, 'Value': 1}
-        expected_params = {'MetricData': [metric_data],
+        metric_data = {'MetricName': MetricName.REQUEST.value, 'Value': 1, 'Timestamp': ANY}
+        expected_params = {'MetricData': [metric_data, metric_data],
                            'Namespace': f"dcp-matrix-service-{self.deploment_stage}"}
         self.mock_cloudwatch_client.add_response('put_metric_data', {}, expected_params)
         self.mock_cloudwatch_client.activate()
         self.handler.put_metric_data(MetricName.REQUEST, 1)
+        self.handler.put_metric_data(MetricName.REQUEST, 1)
+        self.handler.flush()
+        self.mock_cloudwatch_client.assert_no_pending_responses()
 
     def test_put_metric_data_with_dimensions(self):
-        metric_data = {'MetricName': MetricName.REQUEST.value, 'Value': 1, 'Dimensions': [{'Name': "a", 'Value': "b"}]}
+        metric_data = {'MetricName': MetricName.REQUEST.value, 'Value': 1, 'Timestamp': ANY,
+                       'Dimensions': [{'Name': "a", 'Value': "b"}]}
         expected_params = {'MetricData': [metric_data],
                            'Namespace': f"dcp-matrix-service-{self.deploment_stage}"}
         self.mock_cloudwatch_client.add_response('put_metric_data', {}, expected_params)
         self.mock_cloudwatch_client.activate()
         self.handler.put_metric_data(MetricName.REQUEST, 1, [{'Name': "a", 'Value': "b"}])
+        self.handler.flush()
+        self.mock_cloudwatch_client.assert_no_pending_responses()
+
+    @mock.patch.object(CloudwatchHandler, "MAX_BATCH_SIZE", 2)
+    def test_put_metric_data_flushes_full_buffer(self):
+        metric_data = {'MetricName': MetricName.REQUEST.value, 'Value': 1, 'Timestamp': ANY}
+        expected_params = {'MetricData': [metric_data, metric_data],
+                           'Namespace': f"dcp-matrix-service-{self.deploment_stage}"}
+        self.mock_cloudwatch_client.add_response('put_metric_data', {}, expected_params)
+        self.mock_cloudwatch_client.activate()
+        self.handler.put_metric_data(MetricName.REQUEST, 1)
+        self.handler.put_metric_data(MetricName.REQUEST, 1)
+        self.mock_cloudwatch_client.assert_no_pending_responses()
+        self.assertIsNone(CloudwatchHandler._timer)
+
+    @mock.patch.object(CloudwatchHandler, "FLUSH_INTERVAL_SECONDS", 0.05)
+    def test_put_metric_data_flushes_on_timer(self):
+        metric_data = {'MetricName': MetricName.REQUEST.value, 'Value': 1, 'Timestamp': ANY}
+        expected_params = {'MetricData': [metric_data],
+                           'Namespace': f"dcp-matrix-service-{self.deploment_stage}"}
+        self.mock_cloudwatch_client.add_response('put_metric_data', {}, expected_params)
+        self.mock_cloudwatch_client.activate()
+        self.handler.put_metric_data(MetricName.REQUEST, 1)
+        timer = CloudwatchHandler._timer
+        timer.join(timeout=1)
+        self.mock_cloudwatch_client.assert_no_pending_responses()
+
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_put_metric_data_emf(self, mock_stdout):
+        handler = CloudwatchHandler(MetricsFormat.EMF.value)
+        self.mock_cloudwatch_client.activate()
+        handler.put_metric_data(MetricName.REQUEST, 1, [{'Name': "a", 'Value': "b"}])
+
+        self.assertEqual(CloudwatchHandler._buffer, [])
+        event = json.loads(mock_stdout.getvalue())
+        self.assertEqual(event[MetricName.REQUEST.value], 1)
+        self.assertEqual(event['a'], "b")
+        self.assertEqual(event['_aws']['CloudWatchMetrics'], [{
+            'Namespace': f"dcp-matrix-service-{self.deploment_stage}",
+            'Dimensions': [["a"]],
+            'Metrics': [{'Name': MetricName.REQUEST.value}],
+        }])
+        self.assertIsInstance(event['_aws']['Timestamp'], int)
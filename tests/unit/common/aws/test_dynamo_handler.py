@@ -5,7 +5,8 @@ import mock
 import boto3
 
 from matrix.common.constants import DEFAULT_FIELDS, GenusSpecies, SUPPORTED_METADATA_SCHEMA_VERSIONS
-from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, RequestTableField, DataVersionTableField
+from matrix.common.aws.dynamo_handler import (DynamoHandler, DynamoTable, RequestTableField, DataVersionTableField,
+                                              DeploymentTableField, QueryCacheTableField, ResultCacheTableField)
 from matrix.common.exceptions import MatrixException
 from tests.unit import MatrixTestCaseUsingMockAWS
 
@@ -27,6 +28,8 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
         self.create_test_data_version_table()
         self.create_test_deployment_table()
         self.create_test_request_table()
+        self.create_test_query_cache_table()
+        self.create_test_result_cache_table()
 
         self.init_test_data_version_table()
         self.init_test_deployment_table()
@@ -56,9 +59,8 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
         entry = response['Responses'][self.request_table_name][0]
         return response, entry
 
-    @mock.patch("matrix.common.v1_api_handler.V1ApiHandler.describe_filter")
     @mock.patch("matrix.common.date.get_datetime_now")
-    def test_create_data_version_table_entry(self, mock_get_datetime_now, mock_describe_filter):
+    def test_create_data_version_table_entry(self, mock_get_datetime_now):
         stub_date = '2019-03-18T180907.136216Z'
         mock_get_datetime_now.return_value = stub_date
 
@@ -66,11 +68,8 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
             'test_project_uuid_1': 10,
             'test_project_uuid_2': 100
         }
-        mock_describe_filter.return_value = {
-            'cell_counts': stub_cell_counts
-        }
 
-        self.handler.create_data_version_table_entry(self.data_version)
+        self.handler.create_data_version_table_entry(self.data_version, stub_cell_counts)
         response, entry = self._get_data_version_table_response_and_entry()
 
         metadata_schema_versions = {}
@@ -94,17 +93,100 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
 
         self.assertEqual(len(response['Responses'][self.request_table_name]), 1)
 
-        self.assertTrue(all(field.value in entry for field in RequestTableField))
+        self.assertTrue(all(field.value in entry for field in RequestTableField
+                            if field is not RequestTableField.REQUEST_HASH))
         self.assertEqual(entry[RequestTableField.FORMAT.value], self.format)
         self.assertEqual(entry[RequestTableField.METADATA_FIELDS.value], DEFAULT_FIELDS)
         self.assertEqual(entry[RequestTableField.FEATURE.value], "gene")
         self.assertEqual(entry[RequestTableField.GENUS_SPECIES.value], GenusSpecies.HUMAN.value)
         self.assertEqual(entry[RequestTableField.DATA_VERSION.value], 0)
-        self.assertEqual(entry[RequestTableField.REQUEST_HASH.value], "N/A")
+        self.assertNotIn(RequestTableField.REQUEST_HASH.value, entry)
+        self.assertEqual(entry[RequestTableField.QUERY_HASH.value], "N/A")
         self.assertEqual(entry[RequestTableField.EXPECTED_DRIVER_EXECUTIONS.value], 1)
         self.assertEqual(entry[RequestTableField.EXPECTED_CONVERTER_EXECUTIONS.value], 1)
         self.assertEqual(entry[RequestTableField.CREATION_DATE.value], stub_date)
 
+    def test_create_request_table_entries(self):
+        request_ids = [str(uuid.uuid4()) for _ in range(30)]
+        self.handler.create_request_table_entries([{'request_id': request_id,
+                                                    'fmt': self.format,
+                                                    'genus_species': GenusSpecies.MOUSE,
+                                                    'query_hash': "test_query_hash"}
+                                                   for request_id in request_ids],
+                                                  data_version=self.data_version)
+
+        for request_id in request_ids:
+            entry = self.handler.get_table_item(DynamoTable.REQUEST_TABLE, key=request_id)
+            self.assertTrue(all(field.value in entry for field in RequestTableField
+                                if field is not RequestTableField.REQUEST_HASH))
+            self.assertEqual(entry[RequestTableField.FORMAT.value], self.format)
+            self.assertEqual(entry[RequestTableField.METADATA_FIELDS.value], DEFAULT_FIELDS)
+            self.assertEqual(entry[RequestTableField.GENUS_SPECIES.value], GenusSpecies.MOUSE.value)
+            self.assertEqual(entry[RequestTableField.QUERY_HASH.value], "test_query_hash")
+            self.assertEqual(entry[RequestTableField.DATA_VERSION.value], self.data_version)
+
+    def test_claim_in_flight_query(self):
+        other_request_id = str(uuid.uuid4())
+
+        self.assertEqual(self.handler.claim_in_flight_query("test_query_hash", self.request_id), self.request_id)
+        self.assertEqual(self.handler.claim_in_flight_query("test_query_hash", other_request_id), self.request_id)
+
+        with self.subTest("Claims are only taken over from the given request"):
+            self.assertEqual(self.handler.claim_in_flight_query("test_query_hash", other_request_id, "test_stale_id"),
+                             self.request_id)
+            self.assertEqual(self.handler.claim_in_flight_query("test_query_hash", other_request_id, self.request_id),
+                             other_request_id)
+
+        with self.subTest("Claims are only released by the in-flight request"):
+            self.handler.release_in_flight_query("test_query_hash", self.request_id)
+            self.assertEqual(self.handler.claim_in_flight_query("test_query_hash", self.request_id), other_request_id)
+
+            self.handler.release_in_flight_query("test_query_hash", other_request_id)
+            self.assertEqual(self.handler.claim_in_flight_query("test_query_hash", self.request_id), self.request_id)
+
+    @mock.patch("matrix.common.date.get_datetime_now")
+    def test_create_query_cache_table_entry(self, mock_get_datetime_now):
+        stub_date = '2019-03-18T180907.136216Z'
+        mock_get_datetime_now.return_value = stub_date
+        self.handler.create_query_cache_table_entry("test_query_hash", self.request_id, self.data_version)
+
+        entry = self.handler.get_table_item(DynamoTable.QUERY_CACHE_TABLE, key="test_query_hash")
+        self.assertEqual(entry[QueryCacheTableField.REQUEST_ID.value], self.request_id)
+        self.assertEqual(entry[QueryCacheTableField.DATA_VERSION.value], self.data_version)
+        self.assertEqual(entry[QueryCacheTableField.CREATION_DATE.value], stub_date)
+
+    def test_get_current_data_version(self):
+        self.assertEqual(self.handler.get_current_data_version(), 0)
+
+        with self.subTest("The current data version is cached"):
+            self.handler.set_table_field_with_value(DynamoTable.DEPLOYMENT_TABLE,
+                                                    os.environ['DEPLOYMENT_STAGE'],
+                                                    DeploymentTableField.CURRENT_DATA_VERSION,
+                                                    1)
+            self.assertEqual(DynamoHandler().get_current_data_version(), 0)
+
+        with self.subTest("The cached current data version expires"):
+            with mock.patch.object(DynamoHandler, "CURRENT_DATA_VERSION_TTL_SECONDS", 0):
+                DynamoHandler.invalidate_current_data_version()
+                self.assertEqual(self.handler.get_current_data_version(), 1)
+                self.handler.set_table_field_with_value(DynamoTable.DEPLOYMENT_TABLE,
+                                                        os.environ['DEPLOYMENT_STAGE'],
+                                                        DeploymentTableField.CURRENT_DATA_VERSION,
+                                                        2)
+                self.assertEqual(self.handler.get_current_data_version(), 2)
+
+        with self.subTest("Setting the current data version invalidates the cache"):
+            self.handler.set_current_data_version(3)
+            self.assertEqual(self.handler.get_current_data_version(), 3)
+
+    @mock.patch("matrix.common.date.get_datetime_now")
+    def test_data_modification_date(self, mock_get_datetime_now):
+        self.assertIsNone(self.handler.get_data_modification_date())
+
+        mock_get_datetime_now.return_value = "2019-03-18T180907.136216Z"
+        self.handler.set_data_modification_date()
+        self.assertEqual(self.handler.get_data_modification_date(), "2019-03-18T180907.136216Z")
+
     def test_increment_table_field_request_table_path(self):
         self.handler.create_request_table_entry(self.request_id, self.format)
 
@@ -136,13 +218,35 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
 
         key_dict = {"RequestId": self.request_id}
         field_enum = RequestTableField.COMPLETED_DRIVER_EXECUTIONS
-        self.handler._increment_field(self.handler._get_dynamo_table_resource_from_enum(DynamoTable.REQUEST_TABLE),
-                                      key_dict,
-                                      field_enum,
-                                      15)
+        item = self.handler._increment_field(
+            self.handler._get_dynamo_table_resource_from_enum(DynamoTable.REQUEST_TABLE),
+            key_dict,
+            field_enum,
+            15)
         response, entry = self._get_request_table_response_and_entry()
         self.assertEqual(entry[RequestTableField.COMPLETED_DRIVER_EXECUTIONS.value], 15)
         self.assertEqual(entry[RequestTableField.COMPLETED_CONVERTER_EXECUTIONS.value], 0)
+        self.assertEqual(item, entry)
+
+    def test_increment_table_field_and_get_item(self):
+        self.handler.create_request_table_entry(self.request_id, self.format)
+
+        field_enum = RequestTableField.COMPLETED_QUERY_EXECUTIONS
+        item = self.handler.increment_table_field_and_get_item(DynamoTable.REQUEST_TABLE,
+                                                               self.request_id,
+                                                               field_enum,
+                                                               2)
+        self.assertEqual(item[field_enum.value], 2)
+        self.assertEqual(item[RequestTableField.EXPECTED_QUERY_EXECUTIONS.value], 3)
+
+        self.assertEqual(self.handler.increment_table_field(DynamoTable.REQUEST_TABLE, self.request_id, field_enum, 1),
+                         (2, 3))
+
+        self.assertRaises(MatrixException, self.handler.increment_table_field_and_get_item,
+                          DynamoTable.REQUEST_TABLE,
+                          "missing_request_id",
+                          field_enum,
+                          1)
 
     def test_set_field(self):
         self.handler.create_request_table_entry(self.request_id, self.format)
@@ -172,6 +276,48 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
         entry = self.handler.get_table_item(DynamoTable.REQUEST_TABLE, key=self.request_id)
         self.assertEqual(entry[RequestTableField.COMPLETED_DRIVER_EXECUTIONS.value], 15)
 
+    def test_result_cache_table_entry(self):
+        cache_key = self.handler.result_cache_key(0, "test_hash", "loom")
+        self.assertEqual(cache_key, "0/test_hash/loom")
+        self.assertIsNone(self.handler.record_result_cache_hit(cache_key))
+
+        self.handler.put_result_cache_table_entry(0, "test_hash", "loom", "test_key_1", 10, 2 ** 32)
+        item = self.handler.record_result_cache_hit(cache_key)
+        self.assertEqual(item[ResultCacheTableField.S3_KEY.value], "test_key_1")
+        self.assertEqual(item[ResultCacheTableField.SIZE.value], 10)
+        self.assertEqual(item[ResultCacheTableField.HIT_COUNT.value], 1)
+
+        with self.subTest("Replacing the matrix keeps the hit count"):
+            self.handler.put_result_cache_table_entry(0, "test_hash", "loom", "test_key_2", 20, 2 ** 32)
+            item = self.handler.record_result_cache_hit(cache_key)
+            self.assertEqual(item[ResultCacheTableField.S3_KEY.value], "test_key_2")
+            self.assertEqual(item[ResultCacheTableField.HIT_COUNT.value], 2)
+
+        with self.subTest("Expired entries are not hit"):
+            self.handler.put_result_cache_table_entry(0, "test_hash", "loom", "test_key_2", 20, 0)
+            self.assertIsNone(self.handler.record_result_cache_hit(cache_key))
+
+        with self.subTest("Entries are only expired if they point at the matrix"):
+            self.handler.put_result_cache_table_entry(0, "test_hash", "loom", "test_key_2", 20, 2 ** 32)
+            self.handler.expire_result_cache_table_entry(cache_key, "test_key_1")
+            self.assertIsNotNone(self.handler.record_result_cache_hit(cache_key))
+            self.handler.expire_result_cache_table_entry(cache_key, "test_key_2")
+            self.assertIsNone(self.handler.record_result_cache_hit(cache_key))
+
+    def test_result_cache_references(self):
+        cache_key = self.handler.result_cache_key(0, "test_hash", "loom")
+        self.handler.put_result_cache_table_entry(0, "test_hash", "loom", "test_key", 10, 100)
+
+        self.assertTrue(self.handler.add_result_cache_reference(cache_key, "test_key", 100))
+        self.assertFalse(self.handler.add_result_cache_reference(cache_key, "test_key", 101))
+        self.assertFalse(self.handler.add_result_cache_reference(cache_key, "other_key", 100))
+        item = self.handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE, key=cache_key)
+        self.assertEqual(item[ResultCacheTableField.REF_COUNT.value], 2)
+
+        self.assertIsNone(self.handler.release_result_cache_reference(cache_key, "other_key"))
+        self.assertEqual(self.handler.release_result_cache_reference(cache_key, "test_key"), 1)
+        self.assertEqual(self.handler.release_result_cache_reference(cache_key, "test_key"), 0)
+
     def test_get_table_item(self):
         self.assertRaises(MatrixException, self.handler.get_table_item,
                           DynamoTable.REQUEST_TABLE,
@@ -184,7 +330,7 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
     def test_filter_table_items(self):
         items = self.handler.filter_table_items(
             table=DynamoTable.REQUEST_TABLE,
-            attrs={RequestTableField.REQUEST_HASH.value: "N/A"}
+            attrs={RequestTableField.QUERY_HASH.value: "N/A"}
         )
         self.assertEqual(len(items), 0)
 
@@ -193,14 +339,48 @@ class TestDynamoHandler(MatrixTestCaseUsingMockAWS):
 
         items = self.handler.filter_table_items(
             table=DynamoTable.REQUEST_TABLE,
-            attrs={RequestTableField.REQUEST_HASH.value: "N/A"}
+            attrs={RequestTableField.QUERY_HASH.value: "N/A"}
         )
         self.assertEqual(len(items), 2)
 
         items = self.handler.filter_table_items(
             table=DynamoTable.REQUEST_TABLE,
-            attrs={RequestTableField.REQUEST_HASH.value: "N/A",
+            attrs={RequestTableField.QUERY_HASH.value: "N/A",
                    RequestTableField.FORMAT.value: self.format}
         )
         self.assertEqual(len(items), 1)
         self.assertEqual(items[0][RequestTableField.REQUEST_ID.value], self.request_id)
+
+    def test_query_by_request_hash(self):
+        items = self.handler.query_by_request_hash("test_hash")
+        self.assertEqual(len(items), 0)
+
+        request_ids = [self.request_id, str(uuid.uuid4()), str(uuid.uuid4())]
+        for request_id in request_ids:
+            self.handler.create_request_table_entry(request_id, self.format)
+            self.handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                    request_id,
+                                                    RequestTableField.REQUEST_HASH,
+                                                    "test_hash")
+        self.handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                request_ids[1],
+                                                RequestTableField.DATA_VERSION,
+                                                1)
+        self.handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                request_ids[2],
+                                                RequestTableField.ERROR_MESSAGE,
+                                                "test error")
+
+        items = self.handler.query_by_request_hash("test_hash")
+        self.assertCountEqual([item[RequestTableField.REQUEST_ID.value] for item in items], request_ids)
+
+        items = self.handler.query_by_request_hash("test_hash", 0)
+        self.assertCountEqual([item[RequestTableField.REQUEST_ID.value] for item in items],
+                              [request_ids[0], request_ids[2]])
+
+        items = self.handler.query_by_request_hash("test_hash", 0, attrs={RequestTableField.ERROR_MESSAGE.value: 0})
+        self.assertEqual([item[RequestTableField.REQUEST_ID.value] for item in items], [self.request_id])
+
+        # Requests are only indexed once their request hash is known
+        self.handler.create_request_table_entry(str(uuid.uuid4()), self.format)
+        self.assertEqual(self.handler.query_by_request_hash("N/A"), [])
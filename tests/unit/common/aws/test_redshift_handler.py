@@ -0,0 +1,188 @@
+import time
+import unittest
+from unittest import mock
+
+import psycopg2
+import psycopg2.extensions
+
+from matrix.common.aws.redshift_handler import RedshiftConnectionPool, RedshiftHandler
+
+
+class TestRedshiftHandler(unittest.TestCase):
+
+    def setUp(self):
+        RedshiftHandler._pools = {}
+
+    def tearDown(self):
+        RedshiftHandler._pools = {}
+
+    @staticmethod
+    def _handler():
+        with mock.patch("matrix.common.aws.redshift_handler.MatrixRedshiftConfig"):
+            handler = RedshiftHandler()
+        handler.redshift_config.database_uri = "rw_uri"
+        handler.redshift_config.readonly_database_uri = "ro_uri"
+        return handler
+
+    @staticmethod
+    def _connection(uri):
+        conn = mock.MagicMock(closed=False, uri=uri)
+        conn.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        return conn
+
+    @mock.patch("psycopg2.connect")
+    def test_transaction(self, mock_connect):
+        mock_connect.side_effect = self._connection
+        handler = self._handler()
+
+        handler.transaction(["query_1"])
+        self._handler().transaction(["query_2"])
+        handler.transaction(["query_3"], read_only=True)
+
+        self.assertEqual(mock_connect.call_args_list, [mock.call("rw_uri"), mock.call("ro_uri")])
+        rw_conn = RedshiftHandler._pools["rw_uri"].getconn()
+        rw_conn.close.assert_not_called()
+        self.assertEqual(rw_conn.commit.call_count, 2)
+        self.assertEqual(rw_conn.cursor.return_value.execute.call_args_list,
+                         [mock.call("query_1"), mock.call("query_2")])
+
+    @mock.patch("psycopg2.connect")
+    def test_transaction_results(self, mock_connect):
+        mock_connect.return_value.cursor.return_value.fetchall.return_value = [(1,)]
+
+        self.assertEqual(self._handler().transaction(["query"], return_results=True), [(1,)])
+
+    @mock.patch("psycopg2.connect")
+    def test_transaction_stats(self, mock_connect):
+        mock_connect.side_effect = self._connection
+        handler = self._handler()
+        handler.transaction(["query"])
+        cursor = RedshiftHandler._pools["rw_uri"]._idle[0][0].cursor.return_value
+        cursor.fetchall.return_value = [(1,)]
+        cursor.fetchone.side_effect = [(123,), (5, 2000), (100, 4096), (8192,)]
+
+        results, stats = handler.transaction(["query"], return_results=True, collect_stats=True)
+
+        self.assertEqual(results, [(1,)])
+        self.assertEqual(stats, {'query_id': 123,
+                                 'queue_time_ms': 5,
+                                 'exec_time_ms': 2000,
+                                 'rows_unloaded': 100,
+                                 'bytes_unloaded': 4096,
+                                 'bytes_scanned': 8192})
+        executed = [c[0][0] for c in cursor.execute.call_args_list]
+        self.assertEqual(executed[2], "SELECT PG_LAST_QUERY_ID();")
+        self.assertTrue(all("query = 123" in query for query in executed[3:]))
+
+        with self.subTest("Statistics that cannot be read are omitted"):
+            cursor.fetchone.side_effect = [(123,), psycopg2.Error("permission denied")]
+
+            results, stats = handler.transaction(["query"], collect_stats=True)
+
+            self.assertEqual(stats, {'query_id': 123})
+            self.assertEqual(len(RedshiftHandler._pools["rw_uri"]._idle), 1)
+
+    @mock.patch("psycopg2.connect")
+    def test_transaction_drops_temp_tables(self, mock_connect):
+        mock_connect.side_effect = self._connection
+
+        self._handler().transaction(RedshiftHandler.stage_key_set_queries("keys", "key", ["a"])
+                                    + ["CREATE TEMPORARY TABLE IF NOT EXISTS other_temp (a INT);",
+                                       "SELECT * FROM keys;"])
+
+        execute = RedshiftHandler._pools["rw_uri"].getconn().cursor.return_value.execute
+        self.assertEqual(execute.call_args_list[-2:], [mock.call("DROP TABLE IF EXISTS keys;"),
+                                                       mock.call("DROP TABLE IF EXISTS other_temp;")])
+
+    @mock.patch("psycopg2.connect")
+    def test_transaction_failure_discards_connection(self, mock_connect):
+        mock_connect.side_effect = self._connection
+        handler = self._handler()
+        handler.transaction(["query"])
+        conn = RedshiftHandler._pools["rw_uri"]._idle[0][0]
+        conn.cursor.return_value.execute.side_effect = psycopg2.Error("error")
+
+        with self.assertRaises(psycopg2.Error):
+            handler.transaction(["query"])
+
+        conn.close.assert_called_once_with()
+        handler.transaction(["query"])
+        self.assertEqual(mock_connect.call_count, 2)
+
+    @mock.patch("psycopg2.connect")
+    def test_connection_validation(self, mock_connect):
+        mock_connect.side_effect = self._connection
+        pool = RedshiftConnectionPool("rw_uri")
+
+        with self.subTest("Recently used connections are reused without a round trip"):
+            conn = pool.getconn()
+            pool.putconn(conn)
+
+            self.assertIs(pool.getconn(), conn)
+            conn.cursor.assert_not_called()
+            pool.putconn(conn)
+
+        with self.subTest("Idle connections are checked with a round trip"):
+            with mock.patch("time.monotonic", return_value=time.monotonic() + 3600):
+                self.assertIs(pool.getconn(), conn)
+            conn.cursor.return_value.execute.assert_called_once_with("SELECT 1;")
+            pool.putconn(conn)
+
+        with self.subTest("Broken connections are replaced"):
+            conn.cursor.return_value.execute.side_effect = psycopg2.OperationalError("server closed the connection")
+            with mock.patch("time.monotonic", return_value=time.monotonic() + 3600):
+                new_conn = pool.getconn()
+
+            self.assertIsNot(new_conn, conn)
+            conn.close.assert_called_once_with()
+            pool.putconn(new_conn)
+
+        with self.subTest("Closed connections are replaced"):
+            new_conn.closed = True
+            self.assertIsNot(pool.getconn(), new_conn)
+            self.assertEqual(mock_connect.call_count, 3)
+
+    @mock.patch("psycopg2.connect")
+    def test_pool_idle_limit(self, mock_connect):
+        mock_connect.side_effect = self._connection
+        pool = RedshiftConnectionPool("rw_uri")
+
+        conns = [pool.getconn() for _ in range(RedshiftConnectionPool.MAX_IDLE_CONNECTIONS + 1)]
+        for conn in conns:
+            pool.putconn(conn)
+
+        conns[-1].close.assert_called_once_with()
+        self.assertEqual(len(pool._idle), RedshiftConnectionPool.MAX_IDLE_CONNECTIONS)
+
+        pool.closeall()
+        for conn in conns[:-1]:
+            conn.close.assert_called_once_with()
+
+    def test_stage_key_set_queries(self):
+        with self.subTest("Multi-row insert"):
+            queries = RedshiftHandler.stage_key_set_queries("keys", "key", ["a", "b", "a", "c'd"])
+
+            self.assertEqual(queries, [
+                "CREATE TEMP TABLE keys (key VARCHAR(256) NOT NULL) DISTSTYLE ALL;",
+                "INSERT INTO keys VALUES ('a'), ('b'), ('c''d');"
+            ])
+
+        with self.subTest("Batched multi-row insert"):
+            keys = [str(i) for i in range(2 * RedshiftHandler.KEY_SET_INSERT_BATCH_SIZE + 1)]
+
+            queries = RedshiftHandler.stage_key_set_queries("keys", "key", keys)
+
+            self.assertEqual(len(queries), 4)
+            self.assertEqual(sum(query.count("('") for query in queries[1:]), len(keys))
+            self.assertEqual(queries[-1], f"INSERT INTO keys VALUES ('{keys[-1]}');")
+
+        with self.subTest("COPY"):
+            queries = RedshiftHandler.stage_key_set_queries("keys", "key", s3_url="s3://bucket/keys", iam_role="role")
+
+            self.assertEqual(queries, [
+                "CREATE TEMP TABLE keys (key VARCHAR(256) NOT NULL) DISTSTYLE ALL;",
+                "COPY keys FROM 's3://bucket/keys' IAM_ROLE 'role' FORMAT AS CSV;"
+            ])
+
+    def test_key_set_content(self):
+        self.assertEqual(RedshiftHandler.key_set_content(["a", "b", "a"]), "a\nb")
@@ -1,5 +1,6 @@
 import os
 import uuid
+from unittest import mock
 
 from matrix.common.aws.s3_handler import S3Handler
 from tests.unit import MatrixTestCaseUsingMockAWS
@@ -108,7 +109,8 @@ class TestS3Handler(MatrixTestCaseUsingMockAWS):
             self.assertEqual(keys_in_s3, expected_keys)
             self.assertEqual(deleted_objects[0]['Key'], obj_key_1)
 
-        with self.subTest("Delete multiple objects"):
+        with self.subTest("Delete multiple objects in batches"), \
+                mock.patch.object(S3Handler, "MAX_DELETE_BATCH_SIZE", 1):
             deleted_objects = self.s3_handler.delete_objects(keys=[obj_key_2, obj_key_3])
 
             expected_keys = []
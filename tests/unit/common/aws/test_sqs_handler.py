@@ -43,3 +43,29 @@ class TestSQSHandler(MatrixTestCaseUsingMockAWS):
 
         message = self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1)
         self.assertEqual(message, None)
+
+    def test_delete_messages_from_queue(self):
+        for i in range(12):
+            self.sqs_handler.add_message_to_queue("test_query_job_q_name", {'test_key': i})
+        receipt_handles = []
+        while len(receipt_handles) < 12:
+            messages = self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1, num_messages=10)
+            receipt_handles.extend(message['ReceiptHandle'] for message in messages)
+
+        failed = self.sqs_handler.delete_messages_from_queue("test_query_job_q_name", receipt_handles)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1), None)
+
+    def test_change_messages_visibility(self):
+        self.sqs_handler.add_message_to_queue("test_query_job_q_name", {'test_key': "test_value"})
+        messages = self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1, visibility_timeout=300)
+        self.assertEqual(self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1), None)
+
+        failed = self.sqs_handler.change_messages_visibility("test_query_job_q_name",
+                                                             [messages[0]['ReceiptHandle']],
+                                                             0)
+
+        self.assertEqual(failed, [])
+        messages = self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1)
+        self.assertEqual(json.loads(messages[0]['Body']), {'test_key': "test_value"})
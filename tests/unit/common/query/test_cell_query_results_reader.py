@@ -20,9 +20,30 @@ class TestCellQueryResultsReader(unittest.TestCase):
         reader = CellQueryResultsReader("test_manifest_key")
         reader.load_results()
 
-        expected_calls = [mock.call(0), mock.call(1), mock.call(2)]
+        expected_calls = [mock.call(0, columns=None), mock.call(1, columns=None), mock.call(2, columns=None)]
         mock_load_slice.assert_has_calls(expected_calls)
 
+    @mock.patch("matrix.common.query.cell_query_results_reader.CellQueryResultsReader.load_slice")
+    @mock.patch("matrix.common.query.query_results_reader.QueryResultsReader._parse_manifest")
+    def test_load_results_unifies_categories(self, mock_parse_manifest, mock_load_slice):
+        mock_parse_manifest.return_value = {
+            "columns": ["cellkey", "project"],
+            "part_urls": ["A", "B"],
+            "record_count": 4
+        }
+        test_dfs = [
+            pandas.DataFrame({"project": pandas.Categorical(["p1", "p2"])}, index=["c1", "c2"]),
+            pandas.DataFrame({"project": pandas.Categorical(["p3", "p1"])}, index=["c3", "c4"])
+        ]
+        mock_load_slice.side_effect = lambda i, columns: test_dfs[i]
+        reader = CellQueryResultsReader("test_manifest_key")
+        results = reader.load_results()
+
+        self.assertTrue(pandas.api.types.is_categorical_dtype(results["project"]))
+        self.assertListEqual(list(results["project"].cat.categories), ["p1", "p2", "p3"])
+        self.assertListEqual(list(results["project"]), ["p1", "p2", "p3", "p1"])
+        self.assertListEqual(list(results.index), ["c1", "c2", "c3", "c4"])
+
     @mock.patch("pandas.read_csv")
     @mock.patch("s3fs.S3FileSystem.open")
     def test_load_slice(self, mock_open, mock_pd_read_csv):
@@ -37,8 +58,24 @@ class TestCellQueryResultsReader(unittest.TestCase):
         pandas_kwargs = mock_pd_read_csv.call_args[-1]
 
         self.assertIn("project.project_core.project_short_name", pandas_kwargs["names"])
+        self.assertIsNone(pandas_kwargs["usecols"])
         self.assertTrue(pandas_args[0].startswith("s3://"))
 
+    @mock.patch("pandas.read_csv")
+    @mock.patch("s3fs.S3FileSystem.open")
+    def test_load_slice_with_columns(self, mock_open, mock_pd_read_csv):
+        manifest_file_path = "tests/functional/res/cell_metadata_manifest"
+        with open(manifest_file_path) as f:
+            mock_open.return_value = f
+            reader = CellQueryResultsReader("test_manifest_key")
+
+            reader.load_slice(3, columns=["genes_detected"])
+
+        pandas_kwargs = mock_pd_read_csv.call_args[-1]
+
+        self.assertEqual(pandas_kwargs["usecols"], ["cellkey", "genes_detected"])
+        self.assertEqual(pandas_kwargs["dtype"], {"cellkey": "object", "genes_detected": "uint32"})
+
     @mock.patch("matrix.common.query.query_results_reader.QueryResultsReader._parse_manifest")
     def test_load_empty_results(self, mock_parse_manifest):
 
@@ -0,0 +1,26 @@
+import unittest
+
+from matrix.common.query import expression_shards
+
+
+class TestExpressionShards(unittest.TestCase):
+
+    def test_get_num_expression_shards(self):
+        for num_cells, expected_shards in [(0, 1),
+                                           (expression_shards.EXPRESSION_SHARD_CELLS, 1),
+                                           (expression_shards.EXPRESSION_SHARD_CELLS + 1, 2),
+                                           (100 * expression_shards.EXPRESSION_SHARD_CELLS,
+                                            expression_shards.MAX_EXPRESSION_SHARDS)]:
+            self.assertEqual(expression_shards.get_num_expression_shards(num_cells), expected_shards)
+
+    def test_create_expression_shard_queries(self):
+        template = "SELECT * FROM expression WHERE {clause}{shard_where_clause} TO '{expression_prefix}'"
+
+        self.assertEqual(expression_shards.create_expression_shard_queries(template, 1, clause="TRUE"),
+                         "SELECT * FROM expression WHERE TRUE TO 'expression_'")
+
+        shard_queries = expression_shards.create_expression_shard_queries(template, 3, clause="TRUE")
+        self.assertEqual(len(shard_queries), 3)
+        for shard, query in enumerate(shard_queries):
+            shard_where_clause = expression_shards.EXPRESSION_SHARD_WHERE_CLAUSE.format(num_shards=3, shard=shard)
+            self.assertEqual(query, f"SELECT * FROM expression WHERE TRUE{shard_where_clause} TO 'expression_{shard}_'")
@@ -0,0 +1,117 @@
+import json
+import os
+
+import mock
+
+from matrix.common import constants
+from matrix.common.aws.s3_handler import S3Handler
+from matrix.common.query.field_detail_service import FieldDetailService
+from tests.unit import MatrixTestCaseUsingMockAWS
+
+
+class TestFieldDetailService(MatrixTestCaseUsingMockAWS):
+
+    def setUp(self):
+        super(TestFieldDetailService, self).setUp()
+
+        self.create_s3_query_results_bucket()
+        FieldDetailService.invalidate()
+
+        self.field_detail_service = FieldDetailService()
+        self.s3_handler = S3Handler(os.environ['MATRIX_QUERY_RESULTS_BUCKET'])
+
+    def tearDown(self):
+        super(TestFieldDetailService, self).tearDown()
+        FieldDetailService.invalidate()
+
+    def test_field_detail_key(self):
+        self.assertEqual(FieldDetailService.field_detail_key(3, "genes_detected"),
+                         "field_details/3/genes_detected.json")
+
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    def test_compute_field_detail(self, mock_transaction):
+        with self.subTest("Categorical"):
+            mock_transaction.return_value = [("abc", 123), ("def", 456), (None, 789)]
+            field_detail = FieldDetailService.compute_field_detail("donor_organism.human_specific.ethnicity.ontology")
+            self.assertEqual(field_detail,
+                             {"field_type": "categorical", "cell_counts": {"abc": 123, "def": 456, "": 789}})
+
+        with self.subTest("Boolean"):
+            mock_transaction.return_value = [(True, 123), (False, 456), (None, 789)]
+            self.assertEqual(FieldDetailService.compute_field_detail("emptydrops_is_cell"),
+                             {"field_type": "categorical", "cell_counts": {"True": 123, "False": 456, "": 789}})
+
+        with self.subTest("Numeric"):
+            mock_transaction.return_value = [(10, 100)]
+            self.assertEqual(FieldDetailService.compute_field_detail("genes_detected"),
+                             {"field_type": "numeric", "minimum": 10, "maximum": 100})
+
+        mock_transaction.assert_called_with([mock.ANY], return_results=True, read_only=True)
+
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.compute_field_detail")
+    def test_generate_field_details(self, mock_compute_field_detail):
+        mock_compute_field_detail.side_effect = lambda field_name: {"field_type": "numeric",
+                                                                    "minimum": 0,
+                                                                    "maximum": len(field_name)}
+
+        field_details = self.field_detail_service.generate_field_details(3)
+
+        self.assertEqual(list(field_details.keys()), list(constants.FIELD_DETAIL.keys()))
+        for field_name in constants.FIELD_DETAIL:
+            document = self.s3_handler.load_content_from_obj_key(FieldDetailService.field_detail_key(3, field_name))
+            self.assertEqual(json.loads(document), field_details[field_name])
+
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.compute_field_detail")
+    def test_get_field_detail(self, mock_compute_field_detail):
+        field_detail = {"field_type": "categorical", "cell_counts": {"abc": 123}}
+        self.s3_handler.store_content_in_s3(FieldDetailService.field_detail_key(3, "test_field"),
+                                            json.dumps(field_detail))
+
+        with self.subTest("Stored statistics are served from S3 on the first access only"):
+            with mock.patch.object(S3Handler, "load_content_from_obj_key",
+                                   wraps=self.field_detail_service.s3_handler.load_content_from_obj_key) as mock_load:
+                self.assertEqual(self.field_detail_service.get_field_detail("test_field", 3), field_detail)
+                self.assertEqual(self.field_detail_service.get_field_detail("test_field", 3), field_detail)
+                mock_load.assert_called_once()
+            mock_compute_field_detail.assert_not_called()
+
+        with self.subTest("Missing statistics are computed and stored"):
+            mock_compute_field_detail.return_value = {"field_type": "numeric", "minimum": 1, "maximum": 2}
+
+            self.assertEqual(self.field_detail_service.get_field_detail("test_field", 4),
+                             mock_compute_field_detail.return_value)
+            mock_compute_field_detail.assert_called_once_with("test_field")
+            document = self.s3_handler.load_content_from_obj_key(FieldDetailService.field_detail_key(4, "test_field"))
+            self.assertEqual(json.loads(document), mock_compute_field_detail.return_value)
+
+        with self.subTest("Large statistics are not cached"):
+            with mock.patch.object(FieldDetailService, "MAX_CACHED_DOCUMENT_BYTES", 1):
+                self.field_detail_service.get_field_detail("test_field", 5)
+            self.assertNotIn((5, "test_field"), FieldDetailService._cache)
+            self.assertIn((4, "test_field"), FieldDetailService._cache)
+
+        with self.subTest("Invalidation drops the statistics of a data version"):
+            FieldDetailService.invalidate(4)
+            self.assertNotIn((4, "test_field"), FieldDetailService._cache)
+            self.assertIn((3, "test_field"), FieldDetailService._cache)
+
+        with self.subTest("Cached statistics expire after the cache TTL"):
+            with mock.patch.object(FieldDetailService, "CACHE_TTL_SECONDS", 0):
+                FieldDetailService.invalidate()
+                self.field_detail_service.get_field_detail("test_field", 3)
+            with mock.patch.object(S3Handler, "load_content_from_obj_key",
+                                   wraps=self.field_detail_service.s3_handler.load_content_from_obj_key) as mock_load:
+                self.assertEqual(self.field_detail_service.get_field_detail("test_field", 3), field_detail)
+                mock_load.assert_called_once()
+
+    def test_delete_stored_field_details(self):
+        for data_version in [3, 4]:
+            self.s3_handler.store_content_in_s3(FieldDetailService.field_detail_key(data_version, "test_field"), "{}")
+        self.s3_handler.store_content_in_s3("other_key", "{}")
+        self.field_detail_service.get_field_detail("test_field", 3)
+
+        self.assertEqual(self.field_detail_service.delete_stored_field_details(), 2)
+
+        self.assertFalse(self.s3_handler.exists(f"{FieldDetailService.FIELD_DETAILS_PREFIX}/"))
+        self.assertTrue(self.s3_handler.exists("other_key"))
+        self.assertNotIn((3, "test_field"), FieldDetailService._cache)
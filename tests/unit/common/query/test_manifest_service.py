@@ -0,0 +1,124 @@
+import io
+import json
+import os
+import unittest
+
+import mock
+
+from matrix.common.query.manifest_service import ManifestService, MatrixQueryResultsNotFound
+
+
+class TestManifestService(unittest.TestCase):
+
+    def setUp(self):
+        ManifestService.invalidate()
+        self.manifest_service = ManifestService()
+
+    def tearDown(self):
+        ManifestService.invalidate()
+
+    def test_request_manifest_url(self):
+        bucket = os.environ['MATRIX_QUERY_RESULTS_BUCKET']
+        self.assertEqual(ManifestService.request_manifest_url("test_id", "cell"),
+                         f"s3://{bucket}/test_id/cell_metadata_manifest")
+        self.assertEqual(ManifestService.request_manifest_url("test_id", "expression"),
+                         f"s3://{bucket}/test_id/expression_manifest")
+        self.assertEqual(ManifestService.request_manifest_url("test_id", "feature"),
+                         f"s3://{bucket}/test_id/gene_metadata_manifest")
+
+    def test_expression_shard_manifest_url(self):
+        bucket = os.environ['MATRIX_QUERY_RESULTS_BUCKET']
+        self.assertEqual(ManifestService.expression_shard_manifest_url("test_id", 3),
+                         f"s3://{bucket}/test_id/expression_3_manifest")
+
+    @mock.patch("s3fs.S3FileSystem.open")
+    def test_merge_manifests(self, mock_open):
+        shard_manifests = {
+            f"shard_{shard}_manifest": {
+                "entries": [{"url": f"s3://bucket/expression_{shard}_000{i}",
+                             "meta": {"record_count": shard + i, "content_length": 10}}
+                            for i in range(2)],
+                "schema": {"elements": [{"name": "cellkey"}, {"name": "featurekey"}, {"name": "exprvalue"}]},
+                "meta": {"record_count": 2 * shard + 1, "content_length": 20},
+            } for shard in range(2)
+        }
+        merged_manifest_file = io.StringIO()
+        merged_manifest_file.close = lambda: None
+
+        stale_manifest = dict(shard_manifests["shard_0_manifest"], meta={"record_count": 1})
+
+        def _open(url, mode="rb"):
+            if mode == "w":
+                return merged_manifest_file
+            return io.StringIO(json.dumps(shard_manifests.get(url, stale_manifest)))
+        mock_open.side_effect = _open
+
+        self.manifest_service.get_manifest("merged_manifest")
+        self.manifest_service.merge_manifests(list(shard_manifests), "merged_manifest")
+
+        merged_manifest = json.loads(merged_manifest_file.getvalue())
+        self.assertEqual([e["url"] for e in merged_manifest["entries"]],
+                         ["s3://bucket/expression_0_0000", "s3://bucket/expression_0_0001",
+                          "s3://bucket/expression_1_0000", "s3://bucket/expression_1_0001"])
+        self.assertEqual(merged_manifest["meta"], {"record_count": 4, "content_length": 40})
+        self.assertEqual(merged_manifest["schema"], shard_manifests["shard_0_manifest"]["schema"])
+
+        # the merged manifest replaces the cached manifest, and its empty parts are skipped
+        mock_open.side_effect = lambda url, mode="rb": io.StringIO(merged_manifest_file.getvalue())
+        manifest = self.manifest_service.get_manifest("merged_manifest")
+        self.assertEqual(manifest["part_urls"], ["s3://bucket/expression_0_0001",
+                                                 "s3://bucket/expression_1_0000",
+                                                 "s3://bucket/expression_1_0001"])
+        self.assertEqual(manifest["record_count"], 4)
+
+    @mock.patch("s3fs.S3FileSystem.open")
+    def test_get_manifest(self, mock_open):
+        manifest_file_path = "tests/functional/res/cell_metadata_manifest"
+
+        with open(manifest_file_path) as f:
+            mock_open.return_value = f
+            manifest = self.manifest_service.get_manifest("test_manifest_key")
+
+        self.assertEqual(len(manifest['columns']), 23)
+        self.assertEqual(manifest['record_count'], 2544)
+        self.assertEqual(len(manifest['part_urls']), 8)
+
+    @mock.patch("matrix.common.query.manifest_service.ManifestService._parse_manifest")
+    def test_get_manifest_cached(self, mock_parse_manifest):
+        mock_parse_manifest.return_value = {"record_count": 1}
+
+        self.manifest_service.get_manifest("test_manifest_key")
+        manifest = ManifestService().get_manifest("test_manifest_key")
+
+        self.assertEqual(manifest, {"record_count": 1})
+        mock_parse_manifest.assert_called_once_with("test_manifest_key")
+
+        ManifestService.invalidate("test_manifest_key")
+        self.manifest_service.get_manifest("test_manifest_key")
+        self.assertEqual(mock_parse_manifest.call_count, 2)
+
+    @mock.patch("matrix.common.query.manifest_service.ManifestService._parse_manifest")
+    def test_get_manifest_evicts_least_recently_used(self, mock_parse_manifest):
+        mock_parse_manifest.return_value = {}
+
+        with mock.patch.object(ManifestService, "MAX_CACHED_MANIFESTS", 2):
+            self.manifest_service.get_manifest("key_1")
+            self.manifest_service.get_manifest("key_2")
+            self.manifest_service.get_manifest("key_1")
+            self.manifest_service.get_manifest("key_3")
+            self.assertEqual(mock_parse_manifest.call_count, 3)
+
+            self.manifest_service.get_manifest("key_1")
+            self.assertEqual(mock_parse_manifest.call_count, 3)
+            self.manifest_service.get_manifest("key_2")
+            self.assertEqual(mock_parse_manifest.call_count, 4)
+
+    @mock.patch("s3fs.S3FileSystem.open")
+    def test_get_manifest_not_found(self, mock_open):
+        mock_open.side_effect = FileNotFoundError
+
+        with self.assertRaises(MatrixQueryResultsNotFound):
+            self.manifest_service.get_manifest("test_manifest_key")
+        with self.assertRaises(MatrixQueryResultsNotFound):
+            self.manifest_service.get_manifest("test_manifest_key")
+        self.assertEqual(mock_open.call_count, 2)
@@ -1,6 +1,7 @@
 import mock
 import unittest
 
+from matrix.common.query.manifest_service import ManifestService
 from matrix.common.query.query_results_reader import QueryResultsReader
 
 
@@ -18,6 +19,7 @@ class TestQueryResultsReader(unittest.TestCase):
 
     @mock.patch("s3fs.S3FileSystem.open")
     def test_parse_manifest(self, mock_open):
+        ManifestService.invalidate()
         manifest_file_path = "tests/functional/res/cell_metadata_manifest"
 
         with open(manifest_file_path) as f:
@@ -1,14 +1,15 @@
-import hashlib
 import os
 import pandas
 import uuid
 from unittest import mock
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 from matrix.common import date
-from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, RequestTableField
+from matrix.common.aws.dynamo_handler import (DynamoHandler, DynamoTable, QueryCacheTableField, RequestTableField,
+                                              ResultCacheTableField)
 from matrix.common.aws.s3_handler import S3Handler
 from matrix.common.constants import DEFAULT_FIELDS, DEFAULT_FEATURE, GenusSpecies
+from matrix.common.exceptions import MatrixException
 from matrix.common.request.request_tracker import RequestTracker, Subtask
 from matrix.common.aws.cloudwatch_handler import MetricName
 from tests.unit import MatrixTestCaseUsingMockAWS
@@ -29,6 +30,8 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
         self.create_test_data_version_table()
         self.create_test_deployment_table()
         self.create_test_request_table()
+        self.create_test_query_cache_table()
+        self.create_test_result_cache_table()
         self.create_s3_results_bucket()
 
         self.init_test_data_version_table()
@@ -46,6 +49,32 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
         new_request_tracker = RequestTracker("test_uuid")
         self.assertFalse(new_request_tracker.is_initialized)
 
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_table_item")
+    def test_item(self, mock_get_table_item):
+        mock_get_table_item.return_value = {
+            RequestTableField.FORMAT.value: "loom",
+            RequestTableField.FEATURE.value: "gene",
+            RequestTableField.NUM_BUNDLES.value: 10,
+        }
+
+        with self.subTest("Test properties read a single snapshot"):
+            self.assertEqual(self.request_tracker.format, "loom")
+            self.assertEqual(self.request_tracker.feature, "gene")
+            self.assertEqual(self.request_tracker.num_bundles, 10)
+            mock_get_table_item.assert_called_once()
+
+        with self.subTest("Test refresh reloads the snapshot"):
+            mock_get_table_item.return_value = {RequestTableField.FORMAT.value: "csv"}
+            self.assertEqual(self.request_tracker.refresh(), {RequestTableField.FORMAT.value: "csv"})
+            self.assertEqual(self.request_tracker.format, "csv")
+            self.assertEqual(mock_get_table_item.call_count, 2)
+
+    def test_item_invalidated_on_write(self):
+        self.assertEqual(self.request_tracker.batch_job_id, None)
+
+        self.request_tracker.write_batch_job_id_to_db("123-123")
+        self.assertEqual(self.request_tracker.batch_job_id, "123-123")
+
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.generate_request_hash")
     def test_request_hash(self, mock_generate_request_hash):
         with self.subTest("Test skip generation in API deployments:"):
@@ -53,13 +82,13 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
             self.assertEqual(self.request_tracker.request_hash, "N/A")
             mock_generate_request_hash.assert_not_called()
 
-            stored_request_hash = self.dynamo_handler.get_table_item(
+            stored_item = self.dynamo_handler.get_table_item(
                 DynamoTable.REQUEST_TABLE,
                 key=self.request_id
-            )[RequestTableField.REQUEST_HASH.value]
+            )
 
             self.assertEqual(self.request_tracker._request_hash, "N/A")
-            self.assertEqual(stored_request_hash, "N/A")
+            self.assertNotIn(RequestTableField.REQUEST_HASH.value, stored_item)
 
             del os.environ['MATRIX_VERSION']
 
@@ -112,6 +141,13 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
         self.assertEqual(self.request_tracker.s3_results_key,
                          f"test_data_version/test_request_hash/{self.request_id}.mtx.zip")
 
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       self.request_id,
+                                                       RequestTableField.RESULT_ALIAS,
+                                                       "test_alias_key")
+        self.request_tracker.refresh()
+        self.assertEqual(self.request_tracker.s3_results_key, "test_alias_key")
+
     @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_table_item")
     def test_data_version(self, mock_get_table_item):
         mock_get_table_item.return_value = {RequestTableField.DATA_VERSION.value: 0}
@@ -136,6 +172,16 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
     def test_feature(self):
         self.assertEqual(self.request_tracker.feature, "test_feature")
 
+    def test_num_expression_shards(self):
+        self.assertEqual(self.request_tracker.num_expression_shards, 1)
+
+    def test_set_num_expression_shards(self):
+        self.request_tracker.set_num_expression_shards(4)
+
+        self.assertEqual(RequestTracker(self.request_id).num_expression_shards, 4)
+        self.assertFalse(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY, 5))
+        self.assertTrue(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY))
+
     def test_batch_job_id(self):
         self.assertEqual(self.request_tracker.batch_job_id, None)
 
@@ -144,6 +190,8 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
                                                        self.request_id,
                                                        field_enum,
                                                        "123-123")
+        self.assertEqual(self.request_tracker.batch_job_id, None)
+        self.request_tracker.refresh()
         self.assertEqual(self.request_tracker.batch_job_id, "123-123")
 
     @mock.patch("matrix.common.aws.batch_handler.BatchHandler.get_batch_job_status")
@@ -192,28 +240,57 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
                                                                 "test_format",
                                                                 DEFAULT_FIELDS,
                                                                 DEFAULT_FEATURE,
-                                                                GenusSpecies.HUMAN)
+                                                                GenusSpecies.HUMAN,
+                                                                query_hash="N/A",
+                                                                data_version=None)
         mock_create_cw_metric.assert_called_once()
 
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_initialize_requests(self, mock_cw_put):
+        requests = [{'request_id': request_id, 'fmt': "test_format", 'genus_species': genus_species}
+                    for request_id, genus_species in [("test_human_id", GenusSpecies.HUMAN),
+                                                      ("test_mouse_id", GenusSpecies.MOUSE)]]
+        request_trackers = RequestTracker.initialize_requests(requests, data_version=1)
+
+        self.assertEqual([request_tracker.request_id for request_tracker in request_trackers],
+                         ["test_human_id", "test_mouse_id"])
+        self.assertEqual(request_trackers[1].genus_species, GenusSpecies.MOUSE)
+        self.assertEqual(request_trackers[1].data_version, 1)
+        self.assertEqual(mock_cw_put.call_count, 2)
+        mock_cw_put.assert_called_with(metric_name=MetricName.REQUEST, metric_value=1)
+
+        self.assertEqual(RequestTracker.initialize_requests([]), [])
+
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.metadata_fields", new_callable=mock.PropertyMock)
     @mock.patch("matrix.common.query.cell_query_results_reader.CellQueryResultsReader.load_slice")
     @mock.patch("matrix.common.query.query_results_reader.QueryResultsReader._parse_manifest")
     def test_generate_request_hash(self, mock_parse_manifest, mock_load_slice, mock_metadata_fields):
-        mock_parse_manifest.return_value = {'part_urls': ["url_1", "url_2"]}
-        test_cell_dfs = [pandas.DataFrame(index=["test_cell_key_1"]),
-                         pandas.DataFrame(index=["test_cell_key_2"])]
-        mock_load_slice.side_effect = lambda i: test_cell_dfs[0] if i == 0 else test_cell_dfs[1]
         mock_metadata_fields.return_value = ["test_field_1", "test_field_2"]
 
-        h = hashlib.md5()
-        h.update(self.request_tracker.feature.encode())
-        h.update(self.request_tracker.format.encode())
-        h.update("test_field_1".encode())
-        h.update("test_field_2".encode())
-        h.update("test_cell_key_1".encode())
-        h.update("test_cell_key_2".encode())
+        def _request_hash(slices):
+            mock_parse_manifest.return_value = {'part_urls': [f"url_{i}" for i in range(len(slices))]}
+            mock_load_slice.side_effect = lambda i, columns=None: pandas.DataFrame(index=slices[i])
+            return self.request_tracker.generate_request_hash()
+
+        request_hash = _request_hash([["test_cell_key_1", "test_cell_key_2"], ["test_cell_key_3"]])
+        self.assertEqual(len(request_hash), 32)
+        mock_load_slice.assert_called_with(mock.ANY, columns=["cellkey"])
 
-        self.assertEqual(self.request_tracker.generate_request_hash(), h.hexdigest())
+        with self.subTest("Test hash is independent of slicing and order of cell keys"):
+            self.assertEqual(_request_hash([["test_cell_key_3"], ["test_cell_key_2", "test_cell_key_1"]]),
+                             request_hash)
+            self.assertEqual(_request_hash([["test_cell_key_3", "test_cell_key_1", "test_cell_key_2"], []]),
+                             request_hash)
+
+        with self.subTest("Test hash depends on cell keys"):
+            self.assertNotEqual(_request_hash([["test_cell_key_1", "test_cell_key_2"]]), request_hash)
+            self.assertNotEqual(_request_hash([["test_cell_key_1", "test_cell_key_2"], ["test_cell_key_4"]]),
+                                request_hash)
+
+        with self.subTest("Test hash depends on request parameters"):
+            mock_metadata_fields.return_value = ["test_field_1"]
+            self.assertNotEqual(_request_hash([["test_cell_key_1", "test_cell_key_2"], ["test_cell_key_3"]]),
+                                request_hash)
 
     @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.increment_table_field")
     def test_expect_subtask_execution(self, mock_increment_table_field):
@@ -233,20 +310,203 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
                                                            RequestTableField.COMPLETED_DRIVER_EXECUTIONS,
                                                            1)
 
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.s3_results_prefix",
-                new_callable=mock.PropertyMock)
-    def test_lookup_cached_result(self, mock_s3_results_prefix):
-        mock_s3_results_prefix.return_value = "test_prefix"
-        s3_handler = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.request_hash", new_callable=mock.PropertyMock)
+    def test_lookup_cached_result(self, mock_request_hash, mock_cw_put):
+        mock_request_hash.return_value = "test_hash"
+
+        with self.subTest("Cache miss"):
+            self.assertEqual(self.request_tracker.lookup_cached_result(), "")
+            mock_cw_put.assert_called_once_with(metric_name=MetricName.CACHE_MISS, metric_value=1)
 
-        with self.subTest("Do not match in S3 'directories'"):
-            s3_handler.store_content_in_s3("test_prefix", "test_content")
+        with self.subTest("Cache miss on expired entry"):
+            mock_cw_put.reset_mock()
+            expired = date.to_timestamp(date.get_datetime_now() - timedelta(days=1))
+            self.dynamo_handler.put_result_cache_table_entry(0, "test_hash", "test_format", "test_key", 1, expired)
             self.assertEqual(self.request_tracker.lookup_cached_result(), "")
+            mock_cw_put.assert_called_once_with(metric_name=MetricName.CACHE_MISS, metric_value=1)
+
+        with self.subTest("Cache hit"):
+            mock_cw_put.reset_mock()
+            mock_request_hash.return_value = "test_hash_2"
+            expiration = date.to_timestamp(date.get_datetime_now() + timedelta(days=1))
+            self.dynamo_handler.put_result_cache_table_entry(0, "test_hash_2", "test_format", "test_key", 1,
+                                                             expiration)
+            self.assertEqual(self.request_tracker.lookup_cached_result(), "test_key")
+            self.assertEqual(self.request_tracker.lookup_cached_result(), "test_key")
+            mock_cw_put.assert_called_with(metric_name=MetricName.CACHE_HIT, metric_value=1)
+
+            cache_key = DynamoHandler.result_cache_key(0, "test_hash_2", "test_format")
+            item = self.dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE, key=cache_key)
+            self.assertEqual(item[ResultCacheTableField.HIT_COUNT.value], 2)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.request_hash", new_callable=mock.PropertyMock)
+    def test_cache_result(self, mock_request_hash):
+        with self.subTest("Requests without a request hash are not cached"):
+            mock_request_hash.return_value = "N/A"
+            self.request_tracker.cache_result()
+            self.assertRaises(MatrixException, self.dynamo_handler.get_table_item,
+                              DynamoTable.RESULT_CACHE_TABLE,
+                              key=DynamoHandler.result_cache_key(0, "N/A", "test_format"))
+
+        with self.subTest("Requests with a request hash are cached"):
+            mock_request_hash.return_value = "test_hash"
+            s3_handler = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+            s3_handler.store_content_in_s3(self.request_tracker.s3_results_key, "test_content")
+            self.request_tracker.cache_result()
+
+            item = self.dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE,
+                                                      key=self.request_tracker.result_cache_key)
+            self.assertEqual(item[ResultCacheTableField.S3_KEY.value], self.request_tracker.s3_results_key)
+            self.assertEqual(item[ResultCacheTableField.SIZE.value], len("test_content"))
+            self.assertEqual(item[ResultCacheTableField.HIT_COUNT.value], 0)
+            self.assertGreater(item[ResultCacheTableField.EXPIRATION_TIME.value],
+                               date.to_timestamp(date.get_datetime_now() + timedelta(days=29)))
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.request_hash", new_callable=mock.PropertyMock)
+    def test_alias_result(self, mock_request_hash):
+        mock_request_hash.return_value = "test_hash"
+        cache_key = self.request_tracker.result_cache_key
+
+        with self.subTest("Matrices expiring soon are not aliased"):
+            expiration = date.to_timestamp(date.get_datetime_now() + timedelta(days=1))
+            self.dynamo_handler.put_result_cache_table_entry(0, "test_hash", "test_format", "test_key", 1, expiration)
+            self.assertFalse(self.request_tracker.alias_result("test_key"))
+            self.assertEqual(self.request_tracker.result_alias, "N/A")
+
+        with self.subTest("Available matrices are aliased"):
+            expiration = date.to_timestamp(date.get_datetime_now() + timedelta(days=30))
+            self.dynamo_handler.put_result_cache_table_entry(0, "test_hash", "test_format", "test_key", 1, expiration)
+            self.assertTrue(self.request_tracker.alias_result("test_key"))
+            self.assertEqual(self.request_tracker.result_alias, "test_key")
+            self.assertEqual(self.request_tracker.s3_results_key, "test_key")
+
+            item = self.dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE, key=cache_key)
+            self.assertEqual(item[ResultCacheTableField.REF_COUNT.value], 2)
+
+        with self.subTest("Matrices are released with their last reference"):
+            self.assertFalse(self.request_tracker.release_result())
+            item = self.dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE, key=cache_key)
+            self.assertEqual(item[ResultCacheTableField.EXPIRATION_TIME.value], expiration)
+
+            self.assertTrue(self.request_tracker.release_result())
+            item = self.dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE, key=cache_key)
+            self.assertEqual(item[ResultCacheTableField.EXPIRATION_TIME.value], 0)
+
+    def test_query_hash(self):
+        self.assertEqual(self.request_tracker.query_hash, "N/A")
+
+        request_id = str(uuid.uuid4())
+        self.dynamo_handler.create_request_table_entry(request_id, "test_format", query_hash="test_query_hash")
+        self.assertEqual(RequestTracker(request_id).query_hash, "test_query_hash")
+
+    def test_cache_query_result(self):
+        with self.subTest("Requests without a query hash are not cached"):
+            self.request_tracker.cache_query_result()
+            self.assertEqual(RequestTracker.lookup_cached_request("N/A"), "")
+
+        with self.subTest("Requests with a query hash are cached"):
+            request_id = str(uuid.uuid4())
+            self.dynamo_handler.create_request_table_entry(request_id, "test_format", query_hash="test_query_hash")
+            RequestTracker(request_id).cache_query_result()
+
+            item = self.dynamo_handler.get_table_item(DynamoTable.QUERY_CACHE_TABLE, key="test_query_hash")
+            self.assertEqual(item[QueryCacheTableField.REQUEST_ID.value], request_id)
+            self.assertEqual(item[QueryCacheTableField.DATA_VERSION.value], 0)
+
+    def test_results_expiration_date(self):
+        self.assertIsNone(self.request_tracker.results_expiration_date)
+
+        s3_results_key = self.request_tracker.s3_results_key
+        S3Handler(os.environ['MATRIX_RESULTS_BUCKET']).store_content_in_s3(s3_results_key, "test matrix")
+        last_modified = datetime.utcnow()
+        self.assertAlmostEqual(self.request_tracker.results_expiration_date,
+                               last_modified + timedelta(days=30),
+                               delta=timedelta(minutes=1))
+
+    def test_lookup_cached_request(self):
+        with self.subTest("Unknown query hash"):
+            self.assertEqual(RequestTracker.lookup_cached_request("test_query_hash"), "")
+
+        self.dynamo_handler.create_query_cache_table_entry("test_query_hash", self.request_id, 0)
+        s3_results_key = self.request_tracker.s3_results_key
+        results_bucket = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+        results_bucket.store_content_in_s3(s3_results_key, "test matrix")
+
+        with self.subTest("Cached request is complete"):
+            self.assertEqual(RequestTracker.lookup_cached_request("test_query_hash"), self.request_id)
+
+        with self.subTest("Cached request results expire too soon"):
+            with mock.patch("matrix.common.date.get_datetime_now") as mock_get_datetime_now:
+                mock_get_datetime_now.return_value = datetime.utcnow() + timedelta(days=25)
+                self.assertEqual(RequestTracker.lookup_cached_request("test_query_hash"), "")
+
+        with self.subTest("Cached request results are no longer available"):
+            results_bucket.delete_objects([s3_results_key])
+            self.assertEqual(RequestTracker.lookup_cached_request("test_query_hash"), "")
+            self.assertIn("expired", RequestTracker(self.request_id).error)
+
+        with self.subTest("Cached request has been invalidated"):
+            results_bucket.store_content_in_s3(s3_results_key, "test matrix")
+            self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                           self.request_id,
+                                                           RequestTableField.ERROR_MESSAGE,
+                                                           "test error")
+            self.assertEqual(RequestTracker.lookup_cached_request("test_query_hash"), "")
 
-        with self.subTest("Successfully retrieve a result key"):
-            s3_handler.store_content_in_s3("test_prefix/test_result_1", "test_content")
-            s3_handler.store_content_in_s3("test_prefix/test_result_2", "test_content")
-            self.assertEqual(self.request_tracker.lookup_cached_result(), "test_prefix/test_result_1")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.timeout", new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_coalesce(self, mock_cw_put, mock_timeout):
+        mock_timeout.return_value = False
+        request_ids = [str(uuid.uuid4()) for _ in range(3)]
+        for request_id in request_ids:
+            self.dynamo_handler.create_request_table_entry(request_id, "test_format", query_hash="test_query_hash")
+        leader, follower, other_follower = (RequestTracker(request_id) for request_id in request_ids)
+
+        with self.subTest("First request leads"):
+            self.assertEqual(leader.coalesce("test_query_hash"), leader.request_id)
+            self.assertIsNone(leader.leader_request_id)
+            self.assertEqual(RequestTracker.lookup_cached_request("test_query_hash"), "")
+
+        with self.subTest("Identical requests follow the in-flight request"):
+            # The leader's status is read through the follower's handler instead of a new request tracker
+            with mock.patch("matrix.common.request.request_tracker.RequestTracker", side_effect=AssertionError):
+                self.assertEqual(follower.coalesce("test_query_hash"), leader.request_id)
+            self.assertEqual(follower.leader_request_id, leader.request_id)
+
+        with self.subTest("Failed in-flight requests are replaced"):
+            leader.log_error("test error")
+            self.assertEqual(other_follower.coalesce("test_query_hash"), other_follower.request_id)
+            self.assertIsNone(other_follower.leader_request_id)
+
+        with self.subTest("Timed out in-flight requests are replaced"):
+            request_id = str(uuid.uuid4())
+            self.dynamo_handler.create_request_table_entry(request_id, "test_format", query_hash="test_query_hash")
+            with mock.patch("matrix.common.date.get_datetime_now",
+                            return_value=datetime.utcnow() + timedelta(hours=37)):
+                self.assertEqual(RequestTracker(request_id).coalesce("test_query_hash"), request_id)
+
+        with self.subTest("Completion releases the query hash"):
+            other_follower.cache_query_result()
+            item = self.dynamo_handler.get_table_item(DynamoTable.QUERY_CACHE_TABLE, key="test_query_hash")
+            self.assertNotIn(QueryCacheTableField.IN_FLIGHT_REQUEST_ID.value, item)
+
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_record_query_stats(self, mock_cw_put):
+        stats = {'query_id': 123, 'exec_time_ms': 2000, 'rows_unloaded': 100}
+        self.request_tracker.record_query_stats("expression", "expression_1", stats)
+        self.request_tracker.record_query_stats("cell", "cell", {'query_id': 124})
+
+        item = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=self.request_id)
+        self.assertEqual(item[RequestTableField.QUERY_STATS.value], {
+            'expression_1': {'query_type': "expression", **stats},
+            'cell': {'query_type': "cell", 'query_id': 124},
+        })
+        dimensions = [{'Name': "Query Type", 'Value': "expression"}]
+        self.assertEqual(mock_cw_put.call_args_list, [
+            mock.call(metric_name=MetricName.QUERY_EXECUTION_TIME, metric_value=2000, metric_dimensions=dimensions),
+            mock.call(metric_name=MetricName.QUERY_ROWS_UNLOADED, metric_value=100, metric_dimensions=dimensions),
+        ])
 
     def test_is_request_complete(self):
         self.assertFalse(self.request_tracker.is_request_complete())
@@ -258,13 +518,16 @@ class TestRequestTracker(MatrixTestCaseUsingMockAWS):
 
         self.assertTrue(self.request_tracker.is_request_complete())
 
-    def test_is_request_ready_for_conversion(self):
-        self.assertFalse(self.request_tracker.is_request_ready_for_conversion())
-        self.dynamo_handler.increment_table_field(DynamoTable.REQUEST_TABLE,
-                                                  self.request_id,
-                                                  RequestTableField.COMPLETED_QUERY_EXECUTIONS,
-                                                  3)
-        self.assertTrue(self.request_tracker.is_request_ready_for_conversion())
+    def test_complete_subtask_and_check_ready(self):
+        self.assertFalse(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY))
+        self.assertFalse(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY))
+        self.assertTrue(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY))
+        self.assertEqual(self.request_tracker.item[RequestTableField.COMPLETED_QUERY_EXECUTIONS.value], 3)
+
+        with self.subTest("Only the call completing the last execution is ready"):
+            self.request_tracker.set_num_expression_shards(3)
+            self.assertTrue(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY, 2))
+            self.assertFalse(self.request_tracker.complete_subtask_and_check_ready(Subtask.QUERY))
 
     @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
     def test_complete_request(self, mock_cw_put):
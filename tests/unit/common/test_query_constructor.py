@@ -1,3 +1,8 @@
+import hashlib
+import itertools
+import json
+import sqlite3
+import sys
 import unittest
 
 from matrix.common import constants
@@ -205,6 +210,36 @@ class TestFilterWhereConstruction(unittest.TestCase):
                         "OR (NOT (foo IN ('bar', 'baz'))) OR (qux > 5) OR (quuz = 'thud'))")
         self.assertEqual(query_constructor.filter_to_where(filter_), expected_sql)
 
+    def test_deep_nesting(self):
+        depth = 5 * sys.getrecursionlimit()
+        filter_ = {"op": "=", "field": "foo", "value": 0}
+        for i in range(1, depth):
+            filter_ = {"op": "and", "value": [filter_, {"op": "=", "field": "foo", "value": i}]}
+            filter_ = {"op": "not", "value": [filter_]}
+
+        sql = query_constructor.filter_to_where(filter_)
+
+        self.assertTrue(sql.startswith("NOT (((NOT (((NOT ((("))
+        self.assertTrue(sql.endswith(f"(foo = {depth - 2})))) AND (foo = {depth - 1})))"))
+        self.assertEqual(sql.count("NOT"), depth - 1)
+
+    def test_nested_errors(self):
+        filter_ = \
+            {
+                "op": "and",
+                "value": [
+                    {"op": "=", "field": "foo", "value": 1},
+                    {"op": "or", "value": [{"op": "=", "field": "foo", "value": 1}, {"op": "=", "value": 2}]},
+                    {"op": "and", "value": [{"op": "=", "field": "foo", "value": 1}]}
+                ]
+            }
+        self.assertRaisesRegex(query_constructor.MalformedMatrixFilter, "Could not retrieve filter field",
+                               query_constructor.filter_to_where, filter_)
+
+        filter_ = {"op": "and", "value": [{"op": "=", "field": "foo", "value": 1}, "bar"]}
+        self.assertRaisesRegex(query_constructor.MalformedMatrixFilter, "Could not retrieve filter op",
+                               query_constructor.filter_to_where, filter_)
+
 
 class TestFeatureWhereConstruction(unittest.TestCase):
 
@@ -258,6 +293,7 @@ WHERE (NOT feature.isgene)
 TO 's3://{results_bucket}/{request_id}/expression_'
 IAM_ROLE '{iam_role}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """
@@ -271,6 +307,7 @@ WHERE (NOT feature.isgene)
 to 's3://{results_bucket}/{request_id}/gene_metadata_'
 IAM_ROLE '{iam_role}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE;
 """
         self.assertEqual(queries[QueryType.FEATURE], expected_feature_query)
@@ -340,6 +377,7 @@ WHERE ((((num_field_1 IN (1, 2, 3, 4)) AND (num_field_2 > 50) AND (quuz = 'thud'
 TO 's3://{results_bucket}/{request_id}/cell_metadata_'
 IAM_ROLE '{iam_role}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """)
@@ -363,6 +401,7 @@ WHERE feature.isgene
 TO 's3://{results_bucket}/{request_id}/expression_'
 IAM_ROLE '{iam_role}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """)
@@ -399,11 +438,26 @@ WHERE NOT (foo IN ('bar', 'baz'))$$)
 TO 's3://{results_bucket}/{request_id}/cell_metadata_'
 IAM_ROLE '{iam_role}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """)
         self.assertEqual(queries[QueryType.CELL], expected_cell_query)
 
+    def test_deep_filter_conversion(self):
+        depth = 5 * sys.getrecursionlimit()
+        filter_ = {"op": "=", "field": "project.project_core.project_short_name", "value": "foo"}
+        for _ in range(depth):
+            filter_ = {"op": "not", "value": [filter_]}
+
+        translated_filter = query_constructor.translate_filters(filter_)
+
+        for _ in range(depth):
+            self.assertIsNot(translated_filter, filter_)
+            translated_filter, filter_ = translated_filter["value"][0], filter_["value"][0]
+        self.assertEqual(translated_filter["field"], "project.short_name")
+        self.assertEqual(filter_["field"], "project.project_core.project_short_name")
+
     def test_filter_conversion(self):
         filter_ = \
             {
@@ -440,6 +494,7 @@ WHERE ((project.short_name = 'project1') AND (cell.genes_detected > 1000))$$)
 TO 's3://{{results_bucket}}/{{request_id}}/cell_metadata_'
 IAM_ROLE '{{iam_role}}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """)
@@ -450,11 +505,6 @@ UNLOAD ($$SELECT cell.cellkey, expression.featurekey, expression.exrpvalue
 FROM expression
   LEFT OUTER JOIN feature on (expression.featurekey = feature.featurekey)
   INNER JOIN cell on (expression.cellkey = cell.cellkey)
-  INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)
-  INNER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)
-  INNER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)
-  INNER JOIN donor on (specimen.donorkey = donor.donorkey)
-  INNER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)
   INNER JOIN project on (cell.projectkey = project.projectkey)
 WHERE (NOT feature.isgene)
   AND expression.exprtype = 'Count'
@@ -462,12 +512,391 @@ WHERE (NOT feature.isgene)
 TO 's3://{results_bucket}/{request_id}/expression_'
 IAM_ROLE '{iam_role}'
 GZIP
+ALLOWOVERWRITE
 MANIFEST VERBOSE
 ;
 """)
         self.assertEqual(queries[QueryType.EXPRESSION], expected_exp_query)
 
 
+class TestJoinPruning(unittest.TestCase):
+    """Runs pruned matrix request queries and the fully joined queries generated before
+    join pruning against a small in-memory database and compares their results."""
+
+    FULL_EXPRESSION_QUERY = """SELECT cell.cellkey, expression.featurekey, expression.exrpvalue
+FROM expression
+  LEFT OUTER JOIN feature on (expression.featurekey = feature.featurekey)
+  INNER JOIN cell on (expression.cellkey = cell.cellkey)
+  INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)
+  INNER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)
+  INNER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)
+  INNER JOIN donor on (specimen.donorkey = donor.donorkey)
+  INNER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)
+  INNER JOIN project on (cell.projectkey = project.projectkey)
+WHERE {feature_where_clause}
+  AND expression.exprtype = 'Count'
+  AND {cell_where_clause}"""
+
+    FULL_CELL_QUERY = """SELECT cell.cellkey, {fields}
+FROM cell
+  LEFT OUTER JOIN cell_suspension on (cell.cellsuspensionkey = cell_suspension.cellsuspensionkey)
+  LEFT OUTER JOIN specimen on (cell_suspension.specimenkey = specimen.specimenkey)
+  LEFT OUTER JOIN donor on (specimen.donorkey = donor.donorkey)
+  LEFT OUTER JOIN library_preparation on (cell.librarykey = library_preparation.librarykey)
+  LEFT OUTER JOIN project on (cell.projectkey = project.projectkey)
+  INNER JOIN analysis on (cell.analysiskey = analysis.analysiskey)
+WHERE {cell_where_clause}"""
+
+    # Formats queries as the driver does, for the staged queries of two-phase requests
+    DRIVER_PARAMETERS = {
+        'results_bucket': "test_bucket",
+        'request_id': "test_request_id",
+        'iam_role': "test_role",
+        'cell_keys_table': "cell_keys_test",
+    }
+
+    FILTERS = [
+        {"op": "=", "field": "project.project_core.project_short_name", "value": "project_1"},
+        {"op": "=", "field": "donor_organism.sex", "value": "female"},
+        {"op": ">", "field": "genes_detected", "value": 5},
+        {"op": "and", "value": [
+            {"op": "=", "field": "library_preparation_protocol.strand", "value": "first"},
+            {"op": "in", "field": "specimen_from_organism.organ.ontology_label", "value": ["organ_0", "organ_2"]}]},
+        {"op": "or", "value": [
+            {"op": "=", "field": "project.project_core.project_short_name", "value": "project_2"},
+            {"op": "=", "field": "analysis_protocol.protocol_core.protocol_id", "value": "protocol_0"}]},
+        {"op": "not", "value": [
+            {"op": "=", "field": "cell_suspension.genus_species.ontology_label", "value": "Mus musculus"}]},
+    ]
+
+    FIELDS = [
+        ["genes_detected"],
+        ["barcode", "project.project_core.project_short_name"],
+        ["donor_organism.sex", "library_preparation_protocol.strand"],
+        ["cell_suspension.*", "analysis.*"],
+    ]
+
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript("""
+            CREATE TABLE project (projectkey TEXT PRIMARY KEY, short_name TEXT);
+            CREATE TABLE analysis (analysiskey TEXT PRIMARY KEY, protocol TEXT);
+            CREATE TABLE library_preparation (librarykey TEXT PRIMARY KEY, strand TEXT);
+            CREATE TABLE donor (donorkey TEXT PRIMARY KEY, sex TEXT);
+            CREATE TABLE specimen (specimenkey TEXT PRIMARY KEY, donorkey TEXT, organ_label TEXT);
+            CREATE TABLE cell_suspension (cellsuspensionkey TEXT PRIMARY KEY, specimenkey TEXT,
+                                          genus_species_label TEXT);
+            CREATE TABLE cell (cellkey TEXT PRIMARY KEY, cellsuspensionkey TEXT, projectkey TEXT, librarykey TEXT,
+                               analysiskey TEXT, barcode TEXT, genes_detected INTEGER);
+            CREATE TABLE feature (featurekey TEXT PRIMARY KEY, isgene BOOLEAN);
+            CREATE TABLE expression (cellkey TEXT, featurekey TEXT, exprtype TEXT, exrpvalue REAL);
+        """)
+
+        def insert(table, rows):
+            self.db.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+
+        insert("project", [(f"p{i}", f"project_{i}") for i in range(3)])
+        insert("analysis", [(f"a{i}", f"protocol_{i}") for i in range(2)])
+        insert("library_preparation", [(f"l{i}", ["first", "second"][i]) for i in range(2)])
+        insert("donor", [(f"d{i}", ["female", "male"][i]) for i in range(2)])
+        insert("specimen", [(f"s{i}", f"d{i % 2}", f"organ_{i}") for i in range(3)])
+        insert("cell_suspension", [(f"cs{i}", f"s{i}", ["Homo sapiens", "Mus musculus"][i % 2]) for i in range(3)])
+        insert("cell", [(f"c{i}", f"cs{i % 3}", f"p{i % 3}", f"l{i % 2}", f"a{(i // 2) % 2}", f"b{i}", i)
+                        for i in range(12)])
+        insert("feature", [(f"f{i}", i % 2) for i in range(4)])
+        insert("expression", [(f"c{c}", f"f{f}", exprtype, c * f)
+                              for c in range(12) for f in range(4) for exprtype in ["Count", "TPM"]])
+
+    def tearDown(self):
+        self.db.close()
+
+    def _run(self, query):
+        return sorted(self.db.execute(query).fetchall(), key=repr)
+
+    def test_pruned_queries_return_identical_results(self):
+        for filter_, fields, feature in itertools.product(self.FILTERS, self.FIELDS, ["gene", "transcript"]):
+            with self.subTest(filter=filter_, fields=fields, feature=feature):
+                queries = query_constructor.create_matrix_request_queries(filter_, fields, feature)
+                cell_where_clause = query_constructor.filter_to_where(query_constructor.translate_filters(filter_))
+
+                full_expression_query = self.FULL_EXPRESSION_QUERY.format(
+                    feature_where_clause=query_constructor.feature_to_where(feature),
+                    cell_where_clause=cell_where_clause)
+                full_cell_query = self.FULL_CELL_QUERY.format(
+                    fields=", ".join(query_constructor.translate_fields(fields)),
+                    cell_where_clause=cell_where_clause)
+
+                pruned_expression_results = self._run(queries[QueryType.EXPRESSION].split("$$")[1])
+                pruned_cell_results = self._run(queries[QueryType.CELL].split("$$")[1])
+
+                self.assertTrue(pruned_cell_results)
+                self.assertEqual(pruned_expression_results, self._run(full_expression_query))
+                self.assertEqual(pruned_cell_results, self._run(full_cell_query))
+
+    def test_two_phase_queries_return_identical_results(self):
+        for filter_, fields, feature in itertools.product(self.FILTERS, self.FIELDS, ["gene", "transcript"]):
+            with self.subTest(filter=filter_, fields=fields, feature=feature):
+                queries = query_constructor.create_matrix_request_queries(filter_, fields, feature)
+                two_phase_queries = query_constructor.create_two_phase_matrix_request_queries(filter_, fields, feature)
+
+                cell_keys_query = two_phase_queries[QueryType.CELL_KEYS].format(cell_keys_table="cell_keys_test")
+                self.db.executescript(cell_keys_query.replace("DISTKEY(cellkey) SORTKEY(cellkey) ", ""))
+                num_cells, num_genes_detected = self.db.execute(cell_keys_query.strip().split(";")[-2]).fetchone()
+
+                cell_results = self._run(queries[QueryType.CELL].split("$$")[1])
+                expression_results = self._run(queries[QueryType.EXPRESSION].split("$$")[1])
+
+                self.assertEqual(num_cells, len(cell_results))
+                self.assertEqual(num_genes_detected,
+                                 self.db.execute(query_constructor.create_cell_count_query(filter_)).fetchone()[1])
+                self.assertEqual(self._run(two_phase_queries[QueryType.CELL].split("$$")[1]
+                                           .format(cell_keys_table="cell_keys_test")),
+                                 cell_results)
+                self.assertEqual(self._run(query_constructor.create_expression_shard_queries(
+                    two_phase_queries[QueryType.EXPRESSION].format(**self.DRIVER_PARAMETERS), 1).split("$$")[1]),
+                    expression_results)
+
+    def test_sharded_expression_queries_partition_results(self):
+        self.db.create_function("MD5", 1, lambda value: hashlib.md5(value.encode()).hexdigest())
+        self.db.create_function("SUBSTRING", 3, lambda value, start, length: value[start - 1:start - 1 + length])
+        self.db.create_function("STRTOL", 2, lambda value, base: int(value, base))
+
+        for filter_, feature in itertools.product(self.FILTERS, ["gene", "transcript"]):
+            with self.subTest(filter=filter_, feature=feature):
+                expression_results = self._run(query_constructor.create_matrix_request_queries(
+                    filter_, self.FIELDS[0], feature)[QueryType.EXPRESSION].split("$$")[1])
+
+                queries = query_constructor.create_matrix_request_queries(filter_, self.FIELDS[0], feature,
+                                                                          num_expression_shards=3)
+                two_phase_queries = query_constructor.create_two_phase_matrix_request_queries(filter_,
+                                                                                              self.FIELDS[0],
+                                                                                              feature)
+                self.db.executescript(two_phase_queries[QueryType.CELL_KEYS]
+                                      .format(cell_keys_table="cell_keys_test")
+                                      .replace("DISTKEY(cellkey) SORTKEY(cellkey) ", ""))
+                two_phase_expression_queries = query_constructor.create_expression_shard_queries(
+                    two_phase_queries[QueryType.EXPRESSION].format(**self.DRIVER_PARAMETERS), 3)
+
+                for expression_queries in (queries[QueryType.EXPRESSION], two_phase_expression_queries):
+                    self.assertEqual(len(expression_queries), 3)
+                    shard_results = [self._run(query.split("$$")[1].format(cell_keys_table="cell_keys_test"))
+                                     for query in expression_queries]
+                    self.assertEqual(sorted(sum(shard_results, []), key=repr), expression_results)
+                    shard_cellkeys = [{row[0] for row in results} for results in shard_results]
+                    self.assertFalse(set.intersection(*shard_cellkeys))
+
+    def test_create_cell_count_query(self):
+        for filter_ in self.FILTERS:
+            with self.subTest(filter=filter_):
+                cell_results = self._run(query_constructor.create_matrix_request_queries(
+                    filter_, self.FIELDS[0], "gene")[QueryType.CELL].split("$$")[1])
+
+                count_query = query_constructor.create_cell_count_query(filter_)
+                num_cells, num_genes_detected = self.db.execute(count_query).fetchone()
+                self.assertEqual(num_cells, len(cell_results))
+
+                cellkeys = [row[0] for row in cell_results]
+                expected_genes_detected = self.db.execute(
+                    f"SELECT COALESCE(SUM(genes_detected), 0) FROM cell "
+                    f"WHERE cellkey IN ({', '.join('?' * len(cellkeys))})", cellkeys).fetchone()[0]
+                self.assertEqual(num_genes_detected, expected_genes_detected)
+
+    def test_joins(self):
+        with self.subTest("Only referenced tables are joined"):
+            queries = query_constructor.create_matrix_request_queries(
+                {"op": "=", "field": "project.project_core.project_short_name", "value": "project_1"},
+                ["genes_detected"],
+                "gene")
+
+            self.assertIn("JOIN project", queries[QueryType.EXPRESSION])
+            self.assertIn("JOIN project", queries[QueryType.CELL])
+            for table in ["analysis", "cell_suspension", "specimen", "donor", "library_preparation"]:
+                self.assertNotIn(f"JOIN {table} ", queries[QueryType.EXPRESSION])
+                self.assertNotIn(f"JOIN {table} ", queries[QueryType.CELL])
+
+        with self.subTest("Tables on the join path are joined"):
+            queries = query_constructor.create_matrix_request_queries(
+                {"op": "=", "field": "donor_organism.sex", "value": "female"},
+                ["genes_detected"],
+                "gene")
+
+            for table in ["cell_suspension", "specimen", "donor"]:
+                self.assertIn(f"JOIN {table} ", queries[QueryType.EXPRESSION])
+
+        with self.subTest("Unqualified fields join all tables"):
+            queries = query_constructor.create_matrix_request_queries(
+                {"op": "=", "field": "foo", "value": "bar"},
+                ["genes_detected"],
+                "gene")
+
+            for table in ["analysis", "cell_suspension", "specimen", "donor", "library_preparation", "project"]:
+                self.assertIn(f"JOIN {table} ", queries[QueryType.EXPRESSION])
+                self.assertIn(f"JOIN {table} ", queries[QueryType.CELL])
+
+    def test_referenced_tables(self):
+        self.assertEqual(query_constructor.referenced_tables(["cell.barcode", "donor.*", "project.short_name"]),
+                         {"cell", "donor", "project"})
+        self.assertEqual(query_constructor.referenced_tables([]), set())
+        self.assertIsNone(query_constructor.referenced_tables(["cell.barcode", "foo"]))
+        self.assertIsNone(query_constructor.referenced_tables(["test.field1"]))
+
+
+class TestSerializedFilterSize(unittest.TestCase):
+
+    def test_serialized_filter_size(self):
+        filter_ = {"op": "and", "value": [{"op": "in", "field": "foo", "value": ["a", 1, 2.5, None, True]},
+                                          {"op": "not", "value": [{"op": "=", "field": "bar\u00e9", "value": "\"b\""}]},
+                                          {"op": "or", "value": []}]}
+        self.assertEqual(query_constructor.serialized_filter_size(filter_), len(json.dumps(filter_)))
+
+        depth = 5 * sys.getrecursionlimit()
+        deep_filter = {"op": "=", "field": "foo", "value": 0}
+        for _ in range(depth):
+            deep_filter = {"op": "not", "value": [deep_filter]}
+        self.assertEqual(query_constructor.serialized_filter_size(deep_filter),
+                         depth * len('{"op": "not", "value": []}') + len('{"op": "=", "field": "foo", "value": 0}'))
+
+
+class TestCanonicalizeFilter(unittest.TestCase):
+
+    def test_comparison(self):
+        filter_ = {"op": "=", "field": "project.project_core.project_short_name", "value": "foo"}
+
+        self.assertDictEqual(query_constructor.canonicalize_filter(filter_),
+                             {"op": "=", "field": "project.short_name", "value": "foo"})
+
+    def test_in(self):
+        filter_ = {"op": "in", "field": "foo", "value": ["c", "a", "b", "a"]}
+
+        self.assertDictEqual(query_constructor.canonicalize_filter(filter_),
+                             {"op": "in", "field": "foo", "value": ["a", "b", "c"]})
+
+    def test_logical(self):
+        filter_ = {
+            "op": "and",
+            "value": [
+                {"op": ">", "field": "foo", "value": 1},
+                {
+                    "op": "and",
+                    "value": [
+                        {"op": "=", "field": "bar", "value": "baz"},
+                        {"op": ">", "field": "foo", "value": 1}
+                    ]
+                },
+                {
+                    "op": "or",
+                    "value": [
+                        {"op": "=", "field": "qux", "value": "b"},
+                        {"op": "=", "field": "qux", "value": "a"}
+                    ]
+                }
+            ]
+        }
+        equivalent_filter = {
+            "op": "and",
+            "value": [
+                {
+                    "op": "or",
+                    "value": [
+                        {"op": "=", "field": "qux", "value": "a"},
+                        {"op": "=", "field": "qux", "value": "b"}
+                    ]
+                },
+                {"op": "=", "field": "bar", "value": "baz"},
+                {"op": ">", "field": "foo", "value": 1}
+            ]
+        }
+
+        canonical_filter = query_constructor.canonicalize_filter(filter_)
+        self.assertDictEqual(canonical_filter, query_constructor.canonicalize_filter(equivalent_filter))
+        self.assertEqual(canonical_filter["op"], "and")
+        self.assertEqual(len(canonical_filter["value"]), 3)
+
+    def test_single_operand(self):
+        filter_ = {
+            "op": "or",
+            "value": [
+                {"op": "=", "field": "foo", "value": "bar"},
+                {"op": "=", "field": "foo", "value": "bar"}
+            ]
+        }
+
+        self.assertDictEqual(query_constructor.canonicalize_filter(filter_),
+                             {"op": "=", "field": "foo", "value": "bar"})
+
+    def test_not(self):
+        filter_ = {"op": "not", "value": [{"op": "in", "field": "foo", "value": ["b", "a"]}]}
+
+        self.assertDictEqual(query_constructor.canonicalize_filter(filter_),
+                             {"op": "not", "value": [{"op": "in", "field": "foo", "value": ["a", "b"]}]})
+
+    def test_where_clause_equivalent(self):
+        filter_ = {
+            "op": "or",
+            "value": [
+                {"op": "in", "field": "foo", "value": [3, 1, 2]},
+                {"op": "or", "value": [{"op": "<", "field": "bar", "value": 5},
+                                       {"op": ">", "field": "baz", "value": 1}]}
+            ]
+        }
+
+        self.assertEqual(query_constructor.filter_to_where(query_constructor.canonicalize_filter(filter_)),
+                         "((bar < 5) OR (baz > 1) OR (foo IN (1, 2, 3)))")
+
+    def test_deep_nesting(self):
+        depth = 5 * sys.getrecursionlimit()
+        filter_ = {"op": "in", "field": "foo", "value": [1, 0]}
+        equivalent_filter = {"op": "in", "field": "foo", "value": [0, 1]}
+        for i in range(1, depth):
+            comparison = {"op": "=", "field": "foo", "value": i}
+            filter_ = {"op": "not", "value": [{"op": "or", "value": [filter_, comparison]}]}
+            equivalent_filter = {"op": "not", "value": [{"op": "or", "value": [comparison, equivalent_filter]}]}
+
+        canonical_filter = query_constructor.canonicalize_filter(filter_)
+
+        # Comparing the filters themselves would recurse, their query hashes do not
+        args = (["cell.barcode"], "gene", "loom", constants.GenusSpecies.HUMAN, 1)
+        self.assertEqual(query_constructor.create_query_hash(filter_, *args),
+                         query_constructor.create_query_hash(equivalent_filter, *args))
+        for i in range(depth - 1, 0, -1):
+            self.assertEqual(canonical_filter["op"], "not")
+            comparison, canonical_filter = canonical_filter["value"][0]["value"]
+            self.assertEqual(comparison, {"op": "=", "field": "foo", "value": i})
+        self.assertEqual(canonical_filter, {"op": "in", "field": "foo", "value": [0, 1]})
+
+
+class TestCreateQueryHash(unittest.TestCase):
+
+    def test_equivalent_requests(self):
+        filter_ = {"op": "in", "field": "foo", "value": ["a", "b"]}
+        equivalent_filter = {"op": "in", "field": "foo", "value": ["b", "a", "b"]}
+        args = (["cell.barcode"], "gene", "loom", constants.GenusSpecies.HUMAN, 1)
+
+        self.assertEqual(query_constructor.create_query_hash(filter_, *args),
+                         query_constructor.create_query_hash(equivalent_filter, *args))
+
+    def test_distinct_requests(self):
+        filter_ = {"op": "in", "field": "foo", "value": ["a", "b"]}
+        query_hash = query_constructor.create_query_hash(filter_, ["cell.barcode"], "gene", "loom",
+                                                         constants.GenusSpecies.HUMAN, 1)
+
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            filter_, ["cell.barcode"], "gene", "loom", constants.GenusSpecies.HUMAN, 2))
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            filter_, ["cell.barcode"], "gene", "csv", constants.GenusSpecies.HUMAN, 1))
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            filter_, ["cell.barcode"], "transcript", "loom", constants.GenusSpecies.HUMAN, 1))
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            filter_, ["cell.barcode"], "gene", "loom", constants.GenusSpecies.MOUSE, 1))
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            filter_, ["genes_detected"], "gene", "loom", constants.GenusSpecies.HUMAN, 1))
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            {"op": "not", "value": [filter_]}, ["cell.barcode"], "gene", "loom", constants.GenusSpecies.HUMAN, 1))
+        self.assertNotEqual(query_hash, query_constructor.create_query_hash(
+            {"op": "in", "field": "foo", "value": ["a"]}, ["cell.barcode"], "gene", "loom",
+            constants.GenusSpecies.HUMAN, 1))
+
+
 class TestDetailQuery(unittest.TestCase):
 
     def test_cell_numeric(self):
@@ -654,6 +1083,16 @@ class TestHasGenusSpecies(unittest.TestCase):
             }
         self.assertFalse(query_constructor.has_genus_species_term(filter_))
 
+    def test_deep_nesting(self):
+        depth = 5 * sys.getrecursionlimit()
+        filter_ = {"op": "=", "field": "cell_suspension.genus_species.ontology", "value": "NCBITaxon:9606"}
+        for i in range(depth):
+            filter_ = {"op": "or", "value": [{"op": "=", "field": "foo", "value": i}, filter_]}
+
+        self.assertTrue(query_constructor.has_genus_species_term(filter_))
+        self.assertFalse(query_constructor.has_genus_species_term(
+            {"op": "and", "value": [filter_["value"][0], {"op": "=", "field": "foo", "value": "bar"}]}))
+
 
 class TestSpeciesifyFilter(unittest.TestCase):
 
@@ -6,6 +6,7 @@ import os
 import random
 import scipy.io
 import shutil
+import tempfile
 import unittest
 import zipfile
 
@@ -76,6 +77,30 @@ class TestMatrixConverter(unittest.TestCase):
         mock_complete_request.assert_called_once()
         mock_upload_converted_matrix.assert_called_once_with("local_matrix_path", "test_target")
 
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.creation_date", new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_request")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
+    @mock.patch("matrix.docker.matrix_converter.MatrixConverter._upload_converted_matrix")
+    @mock.patch("matrix.docker.matrix_converter.MatrixConverter._to_loom")
+    @mock.patch("matrix.common.query.query_results_reader.QueryResultsReader._parse_manifest")
+    def test_run_with_no_cells(self,
+                               mock_parse_manifest,
+                               mock_to_loom,
+                               mock_upload_converted_matrix,
+                               mock_subtask_exec,
+                               mock_complete_request,
+                               mock_creation_date):
+        mock_parse_manifest.return_value = dict(self.test_manifest, part_urls=[], record_count=0)
+        mock_creation_date.return_value = date.to_string(datetime.datetime.utcnow())
+
+        self.matrix_converter.run()
+
+        mock_parse_manifest.assert_called_once_with("test_cell_manifest")
+        mock_to_loom.assert_not_called()
+        mock_subtask_exec.assert_called_once_with(Subtask.CONVERTER)
+        mock_upload_converted_matrix.assert_called_once_with("test_target", "test_target")
+        self.assertFalse(os.path.exists("test_target"))
+
     def test__loom_timestamp(self):
         timestamp = self.matrix_converter._loom_timestamp()
         expected_timestamp = loompy.utils.timestamp()
@@ -519,12 +544,14 @@ class TestMatrixConverter(unittest.TestCase):
 
         mock_parse_manifest.return_value = {"record_count": 0}
 
-        self.matrix_converter.local_output_filename = "unit_test_empty_loom.loom"
+        # os.remove is mocked, so the output is written to a temporary directory that is removed by the cleanup
+        working_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, working_dir)
+        local_output_filename = os.path.join(working_dir, "unit_test_empty_loom.loom")
+        self.matrix_converter.local_output_filename = local_output_filename
         self.matrix_converter.run()
 
-        self.assertEqual(os.path.getsize("unit_test_empty_loom.loom"), 0)
+        self.assertEqual(os.path.getsize(local_output_filename), 0)
 
         mock_complete_subtask_execution.assert_called_once_with(Subtask.CONVERTER)
         mock_complete_request.assert_called_once()
-
-        os.remove("unit_test_empty_loom.loom")
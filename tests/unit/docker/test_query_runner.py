@@ -1,11 +1,14 @@
+import os
+import threading
 from unittest import mock
 import uuid
 import json
 import requests
 
-from matrix.docker.query_runner import QueryRunner
+from matrix.docker.query_runner import QueryMessageReceiver, QueryPriority, QueryRunner, run_workers
 from matrix.common.aws.sqs_handler import SQSHandler
-from matrix.common.request.request_tracker import Subtask
+from matrix.common.query import expression_shards
+from matrix.common.request.request_tracker import RequestTracker, Subtask
 from matrix.common.exceptions import MatrixException
 from tests.unit import MatrixTestCaseUsingMockAWS
 
@@ -20,25 +23,181 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
         self.sqs_handler = SQSHandler()
         self.sqs.meta.client.purge_queue(QueueUrl="test_query_job_q_name")
         self.sqs.meta.client.purge_queue(QueueUrl="test_deadletter_query_job_q_name")
+        self.mock_record_query_stats = mock.patch(
+            "matrix.common.request.request_tracker.RequestTracker.record_query_stats").start()
+        self.addCleanup(mock.patch.stopall)
 
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
     @mock.patch("matrix.common.aws.sqs_handler.SQSHandler.receive_messages_from_queue")
     def test_run__with_no_messages_in_queue(self, mock_receive_messages, mock_load_obj):
         mock_receive_messages.return_value = None
         self.query_runner.run(max_loops=1)
-        mock_receive_messages.assert_called_once_with(self.query_runner.query_job_q_url)
+        self.assertEqual([c[0][0] for c in mock_receive_messages.call_args_list],
+                         ["test_query_job_small_q_name",
+                          "test_query_job_q_name",
+                          "test_query_job_large_q_name",
+                          "test_query_job_small_q_name"])
+        mock_receive_messages.assert_called_with(
+            "test_query_job_small_q_name",
+            wait_time=15,
+            num_messages=1,
+            visibility_timeout=QueryMessageReceiver.VISIBILITY_TIMEOUT_SECONDS)
         mock_load_obj.assert_not_called()
 
+    @mock.patch("matrix.docker.query_runner.QueryMessageReceiver.receive")
+    def test_run__stops_when_stop_event_is_set(self, mock_receive):
+        def _receive():
+            if mock_receive.call_count == 2:
+                self.query_runner.stop_event.set()
+        mock_receive.side_effect = _receive
+
+        self.query_runner.run(max_loops=10)
+
+        self.assertEqual(mock_receive.call_count, 2)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_inline_query(self,
+                                    mock_load_obj,
+                                    mock_transaction,
+                                    mock_complete_subtask):
+        payload = {
+            'request_id': str(uuid.uuid4()),
+            's3_obj_key': "test_s3_obj_key",
+            'type': "feature",
+            'query': "inline query"
+        }
+        self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_complete_subtask.return_value = False
+
+        self.query_runner.run(max_loops=1)
+
+        mock_load_obj.assert_not_called()
+        mock_transaction.assert_called_once_with(["inline query"],
+                                                 return_results=False,
+                                                 read_only=True,
+                                                 collect_stats=True)
+        self.mock_record_query_stats.assert_called_once_with("feature", "test_s3_obj_key", {'query_id': 1})
+        self.assertEqual(self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1), None)
+
+    def test_message_receiver(self):
+        for i in range(3):
+            self.sqs_handler.add_message_to_queue("test_query_job_q_name", {'test_key': i})
+        message_receiver = QueryMessageReceiver(self.query_runner.query_job_q_urls)
+
+        with self.subTest("Receives one message per waiting worker"):
+            with mock.patch.object(message_receiver, "_num_waiting", 1), \
+                    mock.patch("matrix.common.aws.sqs_handler.SQSHandler.receive_messages_from_queue",
+                               wraps=message_receiver.sqs_handler.receive_messages_from_queue) as mock_receive:
+                # another worker is already waiting
+                message = message_receiver.receive()
+                self.assertEqual(mock_receive.call_args[1]['num_messages'], 2)
+                self.assertEqual(len(message_receiver._buffer), 1)
+                num_receive_calls = mock_receive.call_count
+
+                buffered_message = message_receiver.receive()
+                self.assertEqual(mock_receive.call_count, num_receive_calls)
+
+            self.assertEqual(message_receiver._in_flight, {message['ReceiptHandle']: QueryPriority.MEDIUM,
+                                                           buffered_message['ReceiptHandle']: QueryPriority.MEDIUM})
+
+        with self.subTest("Extends visibility of received messages"):
+            with mock.patch("matrix.common.aws.sqs_handler.SQSHandler.change_messages_visibility") as mock_change:
+                mock_change.return_value = []
+                message_receiver.extend_visibility()
+
+            self.assertEqual(mock_change.call_args[0][0], "test_query_job_q_name")
+            self.assertCountEqual(mock_change.call_args[0][1], [message['ReceiptHandle'],
+                                                                buffered_message['ReceiptHandle']])
+            self.assertEqual(mock_change.call_args[0][2], QueryMessageReceiver.VISIBILITY_TIMEOUT_SECONDS)
+
+        with self.subTest("Batches deletes"):
+            with mock.patch("matrix.common.aws.sqs_handler.SQSHandler.delete_messages_from_queue") as mock_delete:
+                mock_delete.return_value = []
+                message_receiver.delete(message['ReceiptHandle'])
+                message_receiver.delete(buffered_message['ReceiptHandle'])
+                mock_delete.assert_not_called()
+
+                message_receiver.flush()
+                mock_delete.assert_called_once_with("test_query_job_q_name", [message['ReceiptHandle'],
+                                                                              buffered_message['ReceiptHandle']])
+            self.assertEqual(message_receiver._in_flight, {})
+
+        with self.subTest("Stopping releases unprocessed messages"):
+            with mock.patch.object(message_receiver, "_num_waiting", 1):
+                message = message_receiver.receive()
+            self.assertEqual(len(message_receiver._buffer), 0)
+            message_receiver._buffer.append(message)
+
+            message_receiver.stop()
+
+            messages = self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1)
+            self.assertEqual(messages[0]['Body'], message['Body'])
+
+    @mock.patch("matrix.docker.query_runner.time.monotonic")
+    def test_message_receiver__priority(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        message_receiver = QueryMessageReceiver(self.query_runner.query_job_q_urls, num_workers=2)
+
+        with self.subTest("Polls queues by weight"):
+            self.assertEqual(message_receiver._poll_order(),
+                             [QueryPriority.SMALL, QueryPriority.MEDIUM, QueryPriority.LARGE])
+
+        with self.subTest("Ages queues that were not served"):
+            mock_monotonic.return_value = 600
+            message_receiver._last_received[QueryPriority.SMALL] = 600
+            message_receiver._last_received[QueryPriority.MEDIUM] = 590
+            self.assertEqual(message_receiver._poll_order(),
+                             [QueryPriority.LARGE, QueryPriority.SMALL, QueryPriority.MEDIUM])
+
+        with self.subTest("Large jobs leave a worker to smaller jobs"):
+            self.sqs_handler.add_message_to_queue("test_query_job_large_q_name", {'test_key': 0})
+            with mock.patch.object(message_receiver, "_num_waiting", 1):
+                message = message_receiver.receive()
+            self.assertEqual(message_receiver._in_flight, {message['ReceiptHandle']: QueryPriority.LARGE})
+            self.assertEqual(message_receiver._poll_order(), [QueryPriority.SMALL, QueryPriority.MEDIUM])
+
+        with self.subTest("Deletes from the queue of the message"):
+            with mock.patch("matrix.common.aws.sqs_handler.SQSHandler.delete_messages_from_queue") as mock_delete:
+                mock_delete.return_value = []
+                message_receiver.delete(message['ReceiptHandle'])
+                message_receiver.flush()
+                mock_delete.assert_called_once_with("test_query_job_large_q_name", [message['ReceiptHandle']])
+
+    def test_num_workers(self):
+        for env, expected_workers in [({}, 1),
+                                      ({'MATRIX_QUERY_RUNNER_WORKERS': "4"}, 4),
+                                      ({'MATRIX_QUERY_RUNNER_WORKERS': "8", 'MATRIX_REDSHIFT_WLM_SLOTS': "5"}, 5),
+                                      ({'MATRIX_QUERY_RUNNER_WORKERS': "4", 'MATRIX_REDSHIFT_WLM_SLOTS': "0"}, 1)]:
+            with self.subTest(env=env), mock.patch.dict(os.environ, env):
+                self.assertEqual(QueryRunner.num_workers(), expected_workers)
+
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.close_pools")
+    @mock.patch("matrix.docker.query_runner.QueryRunner.run", autospec=True)
+    def test_run_workers(self, mock_run, mock_close_pools):
+        stop_event = threading.Event()
+        threads = set()
+        mock_run.side_effect = lambda query_runner, max_loops: threads.add(threading.current_thread().name)
+
+        run_workers(3, stop_event, max_loops=1)
+
+        self.assertEqual(threads, {"query-runner-0", "query-runner-1", "query-runner-2"})
+        self.assertEqual(mock_run.call_count, 3)
+        for call in mock_run.call_args_list:
+            self.assertIs(call[0][0].stop_event, stop_event)
+            self.assertEqual(call[1], {'max_loops': 1})
+        mock_close_pools.assert_called_once_with()
+
     @mock.patch("matrix.common.aws.batch_handler.BatchHandler.schedule_matrix_conversion")
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.is_request_ready_for_conversion")
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
     @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
     def test_run__with_one_message_in_queue_and_not_ready_for_conversion(self,
                                                                          mock_load_obj,
                                                                          mock_transaction,
                                                                          mock_complete_subtask,
-                                                                         mock_is_ready_for_conversion,
                                                                          mock_schedule_conversion):
         request_id = str(uuid.uuid4())
         payload = {
@@ -47,32 +206,34 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
             'type': "test_type"
         }
         self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
-        mock_is_ready_for_conversion.return_value = False
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_complete_subtask.return_value = False
 
         self.query_runner.run(max_loops=1)
 
         mock_load_obj.assert_called_once_with("test_s3_obj_key")
         mock_transaction.assert_called()
-        mock_complete_subtask.assert_called_once_with(Subtask.QUERY)
+        mock_complete_subtask.assert_called_once_with(Subtask.QUERY, 1)
         mock_schedule_conversion.assert_not_called()
 
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.num_expression_shards",
+                new_callable=mock.PropertyMock)
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.s3_results_key", new_callable=mock.PropertyMock)
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.format", new_callable=mock.PropertyMock)
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.write_batch_job_id_to_db")
     @mock.patch("matrix.common.aws.batch_handler.BatchHandler.schedule_matrix_conversion")
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.is_request_ready_for_conversion")
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
     @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
     def test_run__with_one_message_in_queue_and_ready_for_conversion(self,
                                                                      mock_load_obj,
                                                                      mock_transaction,
                                                                      mock_complete_subtask,
-                                                                     mock_is_ready_for_conversion,
                                                                      mock_schedule_conversion,
                                                                      mock_write_batch_job_id_to_db,
                                                                      mock_format,
-                                                                     mock_s3_results_key):
+                                                                     mock_s3_results_key,
+                                                                     mock_num_expression_shards):
         request_id = str(uuid.uuid4())
         payload = {
             'request_id': request_id,
@@ -80,10 +241,12 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
             'type': "test_type"
         }
         self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
-        mock_is_ready_for_conversion.return_value = True
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_complete_subtask.return_value = True
         mock_format.return_value = "test_format"
         mock_s3_results_key.return_value = "test_s3_results_key"
         mock_schedule_conversion.return_value = "123-123"
+        mock_num_expression_shards.return_value = 1
 
         self.query_runner.run(max_loops=1)
 
@@ -94,7 +257,7 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
 
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.log_error")
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.format")
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
     @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
     def test_run__with_one_message_in_queue_and_fails(self,
@@ -110,6 +273,7 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
             'type': "test_type"
         }
         self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+        mock_transaction.return_value = ([], {'query_id': 1})
         mock_complete_subtask.side_effect = MatrixException(status=requests.codes.not_found, title=f"Unable to find")
 
         self.query_runner.run(max_loops=1)
@@ -123,13 +287,16 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
         self.assertEqual(message_body['request_id'], request_id)
         self.assertEqual(message_body['s3_obj_key'], "test_s3_obj_key")
 
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.cache_result")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.alias_result")
     @mock.patch("matrix.common.aws.batch_handler.BatchHandler.schedule_matrix_conversion")
-    @mock.patch("matrix.common.request.request_tracker.RequestTracker.is_request_ready_for_conversion")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.copy_obj")
-    @mock.patch("matrix.common.aws.sqs_handler.SQSHandler.delete_message_from_queue")
+    @mock.patch("matrix.common.aws.sqs_handler.SQSHandler.delete_messages_from_queue")
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.s3_results_key", new_callable=mock.PropertyMock)
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.format", new_callable=mock.PropertyMock)
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.write_batch_job_id_to_db")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.cache_query_result")
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_result")
     @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
@@ -137,28 +304,411 @@ class TestQueryRunner(MatrixTestCaseUsingMockAWS):
                                                                    mock_load_obj,
                                                                    mock_transaction,
                                                                    mock_lookup_cached_result,
+                                                                   mock_cache_query_result,
                                                                    mock_write_batch_job_id_to_db,
                                                                    mock_format,
                                                                    mock_s3_results_key,
                                                                    mock_delete_message_from_queue,
                                                                    mock_copy_obj,
-                                                                   mock_is_request_ready_for_conversion,
-                                                                   mock_schedule_matrix_conversion):
+                                                                   mock_complete_subtask_and_check_ready,
+                                                                   mock_schedule_matrix_conversion,
+                                                                   mock_alias_result,
+                                                                   mock_cache_result):
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_format.return_value = "test_format"
+        mock_s3_results_key.return_value = "test_s3_results_key"
+        mock_lookup_cached_result.return_value = "test_cached_result_key"
+
+        for is_aliased in [True, False]:
+            with self.subTest(is_aliased=is_aliased):
+                mock_delete_message_from_queue.reset_mock()
+                mock_cache_query_result.reset_mock()
+                payload = {
+                    'request_id': str(uuid.uuid4()),
+                    's3_obj_key': "test_s3_obj_key",
+                    'type': "cell",
+                    'deferred_queries': {'expression': ["test_expression_obj_key"], 'feature': "test_feature_obj_key"}
+                }
+                self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+                mock_alias_result.return_value = is_aliased
+
+                self.query_runner.run(max_loops=1)
+
+                mock_delete_message_from_queue.assert_called_once_with("test_query_job_q_name", [mock.ANY])
+                mock_alias_result.assert_called_with("test_cached_result_key")
+                if is_aliased:
+                    mock_copy_obj.assert_not_called()
+                    mock_cache_result.assert_not_called()
+                else:
+                    mock_copy_obj.assert_called_once_with("test_cached_result_key", "test_s3_results_key")
+                    mock_cache_result.assert_called_once_with()
+                mock_cache_query_result.assert_called_once_with()
+                mock_complete_subtask_and_check_ready.assert_not_called()
+                mock_write_batch_job_id_to_db.assert_not_called()
+                mock_schedule_matrix_conversion.assert_not_called()
+                for queue in ["test_query_job_small_q_name", "test_query_job_q_name"]:
+                    self.assertEqual(self.sqs_handler.receive_messages_from_queue(queue, 1), None)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_result")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_cell_message_and_deferred_queries(self,
+                                                         mock_load_obj,
+                                                         mock_transaction,
+                                                         mock_complete_subtask,
+                                                         mock_lookup_cached_result):
         request_id = str(uuid.uuid4())
         payload = {
             'request_id': request_id,
-            's3_obj_key': "test_s3_obj_key",
-            'type': "cell"
+            's3_obj_key': "test_cell_obj_key",
+            'type': "cell",
+            'priority': "small",
+            'deferred_queries': {'expression': ["test_expression_obj_key"], 'feature': "test_feature_obj_key"},
+            'expression_priority': "large"
+        }
+        self.sqs_handler.add_message_to_queue("test_query_job_small_q_name", payload)
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_lookup_cached_result.return_value = ""
+        mock_complete_subtask.return_value = False
+
+        self.query_runner.run(max_loops=1)
+
+        self.assertEqual(mock_transaction.call_count, 1)
+        mock_lookup_cached_result.assert_called_once_with()
+        mock_complete_subtask.assert_called_once_with(Subtask.QUERY, 1)
+        expression_queue_messages = self.sqs_handler.receive_messages_from_queue("test_query_job_large_q_name", 1)
+        self.assertEqual(json.loads(expression_queue_messages[0]['Body']), {
+            'request_id': request_id,
+            's3_obj_key': "test_expression_obj_key",
+            'type': "expression",
+            'priority': "large"
+        })
+        feature_queue_messages = self.sqs_handler.receive_messages_from_queue("test_query_job_small_q_name", 1)
+        self.assertEqual(json.loads(feature_queue_messages[0]['Body']), {
+            'request_id': request_id,
+            's3_obj_key': "test_feature_obj_key",
+            'type': "feature",
+            'priority': "small"
+        })
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.num_expression_shards",
+                new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.set_num_expression_shards")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_result")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_cell_keys_message(self,
+                                         mock_load_obj,
+                                         mock_store_content_in_s3,
+                                         mock_transaction,
+                                         mock_complete_subtask,
+                                         mock_lookup_cached_result,
+                                         mock_set_num_expression_shards,
+                                         mock_num_expression_shards):
+        request_id = str(uuid.uuid4())
+        payload = {
+            'request_id': request_id,
+            's3_obj_key': "test_cell_keys_obj_key",
+            'type': "cell_keys",
+            'cell_keys_table': "test_cell_keys_table",
+            'deferred_queries': {'cell': "test_cell_obj_key",
+                                 'expression': "test_expression_template_obj_key",
+                                 'feature': "test_feature_obj_key"}
         }
         self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
-        mock_format.return_value = "test_format"
-        mock_s3_results_key.return_value = "test_s3_results_key"
-        mock_lookup_cached_result.return_value = "test_cached_result_key"
+        mock_load_obj.side_effect = lambda key: f"query from {key}" + (
+            "{shard_where_clause} to {expression_prefix}" if key == "test_expression_template_obj_key" else "")
+        mock_store_content_in_s3.side_effect = lambda key, content: key
+        mock_transaction.return_value = ([(expression_shards.EXPRESSION_SHARD_CELLS + 1, 300000000)],
+                                         {'query_id': 1})
+        mock_lookup_cached_result.return_value = ""
+        mock_complete_subtask.return_value = False
+        mock_num_expression_shards.return_value = 1
+        # The shards must be counted before the cell query completes
+        mock_complete_subtask.side_effect = lambda *args: mock_set_num_expression_shards.assert_called_once_with(2)
 
         self.query_runner.run(max_loops=1)
 
-        mock_delete_message_from_queue.assert_called_once_with("test_query_job_q_name", mock.ANY)
-        mock_copy_obj.assert_called_once_with("test_cached_result_key", "test_s3_results_key")
-        mock_is_request_ready_for_conversion.assert_not_called()
-        mock_write_batch_job_id_to_db.assert_not_called()
-        mock_schedule_matrix_conversion.assert_not_called()
+        mock_transaction.assert_has_calls([
+            mock.call(["query from test_cell_keys_obj_key"], return_results=True, read_only=False, collect_stats=True),
+            mock.call(["query from test_cell_obj_key"], collect_stats=True)
+        ])
+        mock_complete_subtask.assert_called_once_with(Subtask.QUERY, 1)
+        mock_load_obj.assert_any_call("test_expression_template_obj_key")
+        self.assertEqual(mock_store_content_in_s3.call_args_list, [
+            mock.call(f"{request_id}/expression_{shard}",
+                      f"query from test_expression_template_obj_key"
+                      f"{expression_shards.EXPRESSION_SHARD_WHERE_CLAUSE.format(num_shards=2, shard=shard)}"
+                      f" to expression_{shard}_") for shard in range(2)
+        ])
+        query_queue_messages = self.sqs_handler.receive_messages_from_queue("test_query_job_large_q_name",
+                                                                            1,
+                                                                            num_messages=10)
+        self.assertEqual(sorted((json.loads(message['Body']) for message in query_queue_messages),
+                                key=lambda payload: payload['s3_obj_key']), [
+            {
+                'request_id': request_id,
+                's3_obj_key': f"{request_id}/expression_{shard}",
+                'type': "expression",
+                'priority': "large",
+                'cell_keys_table': "test_cell_keys_table"
+            } for shard in range(2)
+        ])
+        feature_queue_messages = self.sqs_handler.receive_messages_from_queue("test_query_job_small_q_name", 1)
+        self.assertEqual(json.loads(feature_queue_messages[0]['Body']), {
+            'request_id': request_id,
+            's3_obj_key': "test_feature_obj_key",
+            'type': "feature",
+            'priority': "small",
+            'cell_keys_table': "test_cell_keys_table"
+        })
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.num_expression_shards",
+                new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.set_num_expression_shards")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_store_expression_shard_queries(self,
+                                            mock_load_obj,
+                                            mock_store_content_in_s3,
+                                            mock_set_num_expression_shards,
+                                            mock_num_expression_shards):
+        request_tracker = RequestTracker("test_request_id")
+        mock_load_obj.return_value = "expression query{shard_where_clause} to {expression_prefix}"
+        mock_store_content_in_s3.side_effect = lambda key, content: key
+
+        with self.subTest("Requests with few cells are not sharded"):
+            self.assertEqual(self.query_runner._store_expression_shard_queries(request_tracker, "template_key", 10),
+                             ["test_request_id/expression"])
+            mock_store_content_in_s3.assert_called_once_with("test_request_id/expression",
+                                                             "expression query to expression_")
+            mock_set_num_expression_shards.assert_not_called()
+
+        for num_expression_shards in [1, 3]:
+            with self.subTest("Shards are counted once", num_expression_shards=num_expression_shards):
+                mock_set_num_expression_shards.reset_mock()
+                mock_num_expression_shards.return_value = num_expression_shards
+
+                self.assertEqual(self.query_runner._store_expression_shard_queries(
+                    request_tracker, "template_key", 2 * expression_shards.EXPRESSION_SHARD_CELLS + 1),
+                    [f"test_request_id/expression_{shard}" for shard in range(3)])
+                self.assertEqual(mock_set_num_expression_shards.call_args_list,
+                                 [mock.call(3)] if num_expression_shards == 1 else [])
+
+    @mock.patch("matrix.docker.query_runner.QueryRunner._queue_deferred_queries")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_result")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__deletes_message_after_follow_up_queries(self,
+                                                          mock_load_obj,
+                                                          mock_store_content_in_s3,
+                                                          mock_transaction,
+                                                          mock_complete_subtask,
+                                                          mock_lookup_cached_result,
+                                                          mock_queue_deferred_queries):
+        message_receiver = QueryMessageReceiver(self.query_runner.query_job_q_urls)
+        self.query_runner.message_receiver = message_receiver
+        mock_load_obj.side_effect = lambda key: f"query from {key}"
+        mock_store_content_in_s3.side_effect = lambda key, content: key
+        mock_transaction.return_value = ([(10, 1000)], {'query_id': 1})
+        mock_lookup_cached_result.return_value = ""
+        mock_complete_subtask.return_value = False
+        # Messages lost before their follow-up queries are queued must be redelivered
+        in_flight_counts = []
+        mock_queue_deferred_queries.side_effect = \
+            lambda request_tracker, payload: in_flight_counts.append(len(message_receiver._in_flight))
+
+        for query_type, payload in [
+            ("cell_keys", {'type': "cell_keys",
+                           's3_obj_key': "test_cell_keys_obj_key",
+                           'cell_keys_table': "test_cell_keys_table",
+                           'deferred_queries': {'cell': "test_cell_obj_key",
+                                                'expression': "test_expression_template_obj_key",
+                                                'feature': "test_feature_obj_key"}}),
+            ("cell", {'type': "cell",
+                      's3_obj_key': "test_cell_obj_key",
+                      'deferred_queries': {'expression': ["test_expression_0_obj_key"],
+                                           'feature': "test_feature_obj_key"}}),
+        ]:
+            with self.subTest(query_type):
+                in_flight_counts.clear()
+                self.sqs_handler.add_message_to_queue("test_query_job_q_name",
+                                                      {'request_id': str(uuid.uuid4()), **payload})
+
+                self.query_runner.run(max_loops=1)
+
+                self.assertEqual(in_flight_counts, [1])
+                self.assertEqual(message_receiver._in_flight, {})
+                self.assertEqual(len(message_receiver._pending_deletes[QueryPriority.MEDIUM]), 1)
+                message_receiver.flush()
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_result")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_cell_keys_message_and_no_cells(self,
+                                                      mock_load_obj,
+                                                      mock_transaction,
+                                                      mock_complete_subtask,
+                                                      mock_lookup_cached_result):
+        request_id = str(uuid.uuid4())
+        payload = {
+            'request_id': request_id,
+            's3_obj_key': "test_cell_keys_obj_key",
+            'type': "cell_keys",
+            'cell_keys_table': "test_cell_keys_table",
+            'deferred_queries': {'cell': "test_cell_obj_key",
+                                 'expression': "test_expression_template_obj_key",
+                                 'feature': "test_feature_obj_key"}
+        }
+        self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+        mock_transaction.return_value = ([(0, 0)], {'query_id': 1})
+        mock_complete_subtask.return_value = False
+
+        self.query_runner.run(max_loops=1)
+
+        self.assertEqual(mock_transaction.call_count, 2)
+        mock_lookup_cached_result.assert_not_called()
+        mock_complete_subtask.assert_called_once_with(Subtask.QUERY, 3)
+        for queue in ["test_query_job_small_q_name", "test_query_job_q_name", "test_query_job_large_q_name"]:
+            self.assertEqual(self.sqs_handler.receive_messages_from_queue(queue, 1), None)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.log_error")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_cell_keys_message_and_staged_query_fails(self,
+                                                                mock_load_obj,
+                                                                mock_transaction,
+                                                                mock_complete_subtask,
+                                                                mock_log_error):
+        request_id = str(uuid.uuid4())
+        payload = {
+            'request_id': request_id,
+            's3_obj_key': "test_cell_keys_obj_key",
+            'type': "cell_keys",
+            'cell_keys_table': "test_cell_keys_table",
+            'deferred_queries': {'cell': "test_cell_obj_key",
+                                 'expression': "test_expression_template_obj_key",
+                                 'feature': "test_feature_obj_key"}
+        }
+        mock_load_obj.side_effect = lambda key: f"query from {key}"
+
+        def _transaction(queries, **kwargs):
+            if queries == ["query from test_cell_obj_key"]:
+                raise Exception("test staged query error")
+            return [(10, 1000)], {'query_id': 1}
+
+        with self.subTest("The staging table is dropped"):
+            self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+            mock_transaction.side_effect = _transaction
+
+            self.query_runner.run(max_loops=1)
+
+            mock_transaction.assert_called_with(["DROP TABLE IF EXISTS test_cell_keys_table;"])
+            mock_complete_subtask.assert_not_called()
+            mock_log_error.assert_called_once_with("test staged query error")
+            deadletter_queue_messages = self.sqs_handler.receive_messages_from_queue(
+                "test_deadletter_query_job_q_name", 1)
+            self.assertEqual(json.loads(deadletter_queue_messages[0]['Body']), payload)
+            self.sqs_handler.delete_message_from_queue("test_deadletter_query_job_q_name",
+                                                       deadletter_queue_messages[0]['ReceiptHandle'])
+
+        with self.subTest("Failures to drop the staging table are logged"):
+            self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+
+            def _transaction_and_drop_fails(queries, **kwargs):
+                if queries[0].startswith("DROP TABLE"):
+                    raise Exception("test drop error")
+                return _transaction(queries, **kwargs)
+            mock_transaction.side_effect = _transaction_and_drop_fails
+
+            self.query_runner.run(max_loops=1)
+
+            mock_transaction.assert_called_with(["DROP TABLE IF EXISTS test_cell_keys_table;"])
+            deadletter_queue_messages = self.sqs_handler.receive_messages_from_queue(
+                "test_deadletter_query_job_q_name", 1)
+            self.assertEqual(json.loads(deadletter_queue_messages[0]['Body']), payload)
+            self.assertEqual(self.sqs_handler.receive_messages_from_queue("test_query_job_q_name", 1), None)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_staged_expression_message(self,
+                                                 mock_load_obj,
+                                                 mock_transaction,
+                                                 mock_complete_subtask):
+        request_id = str(uuid.uuid4())
+        payload = {
+            'request_id': request_id,
+            's3_obj_key': "test_expression_obj_key",
+            'type': "expression",
+            'cell_keys_table': "test_cell_keys_table"
+        }
+        self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_load_obj.return_value = "expression query"
+        mock_complete_subtask.return_value = False
+
+        self.query_runner.run(max_loops=1)
+
+        self.assertEqual(mock_transaction.call_args_list, [
+            mock.call(["expression query"], return_results=False, read_only=False, collect_stats=True)
+        ])
+        mock_complete_subtask.assert_called_once_with(Subtask.QUERY, 1)
+
+    @mock.patch("matrix.common.query.manifest_service.ManifestService.merge_manifests")
+    @mock.patch("matrix.common.query.manifest_service.ManifestService.get_request_manifest")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.num_expression_shards",
+                new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.s3_results_key", new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.format", new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.write_batch_job_id_to_db")
+    @mock.patch("matrix.common.aws.batch_handler.BatchHandler.schedule_matrix_conversion")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_and_check_ready")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.load_content_from_obj_key")
+    def test_run__with_last_staged_feature_message_and_sharded_expression(self,
+                                                                          mock_load_obj,
+                                                                          mock_transaction,
+                                                                          mock_complete_subtask,
+                                                                          mock_schedule_conversion,
+                                                                          mock_write_batch_job_id_to_db,
+                                                                          mock_format,
+                                                                          mock_s3_results_key,
+                                                                          mock_num_expression_shards,
+                                                                          mock_get_request_manifest,
+                                                                          mock_merge_manifests):
+        request_id = str(uuid.uuid4())
+        payload = {
+            'request_id': request_id,
+            's3_obj_key': "test_feature_obj_key",
+            'type': "feature",
+            'cell_keys_table': "test_cell_keys_table"
+        }
+        self.sqs_handler.add_message_to_queue("test_query_job_q_name", payload)
+        mock_transaction.return_value = ([], {'query_id': 1})
+        mock_load_obj.return_value = "feature query"
+        mock_complete_subtask.return_value = True
+        mock_num_expression_shards.return_value = 2
+        mock_get_request_manifest.return_value = {'record_count': 10}
+        mock_schedule_conversion.return_value = "123-123"
+
+        self.query_runner.run(max_loops=1)
+
+        self.assertEqual(mock_transaction.call_args_list, [
+            mock.call(["feature query"], return_results=False, read_only=True, collect_stats=True),
+            mock.call(["DROP TABLE IF EXISTS test_cell_keys_table;"])
+        ])
+        mock_get_request_manifest.assert_called_once_with(request_id, "cell")
+        bucket = os.environ['MATRIX_QUERY_RESULTS_BUCKET']
+        mock_merge_manifests.assert_called_once_with(
+            [f"s3://{bucket}/{request_id}/expression_0_manifest", f"s3://{bucket}/{request_id}/expression_1_manifest"],
+            f"s3://{bucket}/{request_id}/expression_manifest")
+        mock_schedule_conversion.assert_called_once()
+        mock_write_batch_job_id_to_db.assert_called_once_with("123-123")
@@ -45,7 +45,9 @@ class TestCore(unittest.TestCase):
                 format,
                 DEFAULT_FIELDS,
                 "gene",
-                gs)
+                gs,
+                query_hash="N/A",
+                data_version=None)
 
         self.assertEqual(type(response[0]['request_id']), str)
         self.assertEqual(type(response[0]['non_human_request_ids']), dict)
@@ -84,7 +86,9 @@ class TestCore(unittest.TestCase):
                 format,
                 DEFAULT_FIELDS,
                 "gene",
-                gs)
+                gs,
+                query_hash="N/A",
+                data_version=None)
 
         self.assertEqual(type(response[0]['request_id']), str)
         self.assertEqual(type(response[0]['non_human_request_ids']), dict)
@@ -1,25 +1,37 @@
 import os
 import requests
+import sys
 import unittest
 import uuid
 from unittest import mock
 
 from matrix.common import constants
+from matrix.common import query_constructor
 from matrix.common.constants import GenusSpecies, MatrixFormat, MatrixRequestStatus
 from matrix.common.date import get_datetime_now
 from matrix.common.exceptions import MatrixException
-from matrix.common.aws.dynamo_handler import RequestTableField
+from matrix.common.aws.dynamo_handler import DynamoHandler, RequestTableField
 from matrix.common.aws.lambda_handler import LambdaName
 from matrix.common.aws.cloudwatch_handler import MetricName
+from matrix.common.aws.s3_handler import S3Handler
+from matrix.common.request.request_tracker import RequestTracker
 import matrix.lambdas.api.v1.core as core
+from tests.unit import MatrixTestCaseUsingMockAWS
 
 
 class TestCore(unittest.TestCase):
 
-    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entry")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.coalesce", autospec=True,
+                side_effect=lambda request_tracker, query_hash: request_tracker.request_id)
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
     @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
     @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
-    def test_post_matrix_with_just_filter_ok(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request):
+    def test_post_matrix_with_just_filter_ok(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                             mock_lookup_cached_request, mock_get_current_data_version, mock_coalesce):
+        mock_lookup_cached_request.return_value = ""
+        mock_get_current_data_version.return_value = 0
         filter_ = {"op": ">", "field": "foo", "value": 42}
         format_ = MatrixFormat.LOOM.value
 
@@ -36,17 +48,28 @@ class TestCore(unittest.TestCase):
         body.pop('format')
 
         mock_lambda_invoke.assert_called_once_with(LambdaName.DRIVER_V1, body)
-        mock_dynamo_create_request.assert_called_once_with(mock.ANY, format_, constants.DEFAULT_FIELDS,
-                                                           "gene", GenusSpecies.HUMAN)
+        mock_dynamo_create_request.assert_called_once_with([{'request_id': mock.ANY,
+                                                             'fmt': format_,
+                                                             'metadata_fields': constants.DEFAULT_FIELDS,
+                                                             'feature': "gene",
+                                                             'genus_species': GenusSpecies.HUMAN,
+                                                             'query_hash': mock.ANY}], 0)
         mock_cw_put.assert_called_once_with(metric_name=MetricName.REQUEST, metric_value=1)
         self.assertEqual(type(response[0]['request_id']), str)
         self.assertEqual(response[0]['status'], MatrixRequestStatus.IN_PROGRESS.value)
         self.assertEqual(response[1], requests.codes.accepted)
 
-    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entry")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.coalesce", autospec=True,
+                side_effect=lambda request_tracker, query_hash: request_tracker.request_id)
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
     @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
     @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
-    def test_post_matrix_with_species(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request):
+    def test_post_matrix_with_species(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                      mock_lookup_cached_request, mock_get_current_data_version, mock_coalesce):
+        mock_lookup_cached_request.return_value = ""
+        mock_get_current_data_version.return_value = 0
         filter_ = {"op": "=",
                    "field": "cell_suspension.genus_species.ontology_label",
                    "value": "monkey whatever"}
@@ -66,7 +89,8 @@ class TestCore(unittest.TestCase):
 
         genera_species = list(GenusSpecies)
         self.assertEqual(mock_lambda_invoke.call_count, len(genera_species))
-        self.assertEqual(mock_dynamo_create_request.call_count, len(genera_species))
+        mock_dynamo_create_request.assert_called_once_with(mock.ANY, 0)
+        self.assertEqual(len(mock_dynamo_create_request.call_args[0][0]), len(genera_species))
         self.assertEqual(mock_cw_put.call_count, len(genera_species))
 
         for gs in genera_species:
@@ -74,12 +98,13 @@ class TestCore(unittest.TestCase):
             gs_body["genus_species"] = gs.value
             mock_lambda_invoke.assert_any_call(LambdaName.DRIVER_V1, gs_body)
 
-            mock_dynamo_create_request.assert_any_call(
-                mock.ANY,
-                format_,
-                constants.DEFAULT_FIELDS,
-                constants.DEFAULT_FEATURE,
-                gs)
+            self.assertIn({'request_id': mock.ANY,
+                           'fmt': format_,
+                           'metadata_fields': constants.DEFAULT_FIELDS,
+                           'feature': constants.DEFAULT_FEATURE,
+                           'genus_species': gs,
+                           'query_hash': mock.ANY},
+                          mock_dynamo_create_request.call_args[0][0])
 
         self.assertEqual(type(response[0]['request_id']), str)
         self.assertEqual(type(response[0]['non_human_request_ids']), dict)
@@ -87,10 +112,18 @@ class TestCore(unittest.TestCase):
         self.assertEqual(response[0]['status'], MatrixRequestStatus.IN_PROGRESS.value)
         self.assertEqual(response[1], requests.codes.accepted)
 
-    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entry")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.coalesce", autospec=True,
+                side_effect=lambda request_tracker, query_hash: request_tracker.request_id)
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
     @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
     @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
-    def test_post_matrix_with_fields_and_feature_ok(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request):
+    def test_post_matrix_with_fields_and_feature_ok(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                                    mock_lookup_cached_request, mock_get_current_data_version,
+                                                    mock_coalesce):
+        mock_lookup_cached_request.return_value = ""
+        mock_get_current_data_version.return_value = 0
         filter_ = {"op": ">", "field": "foo", "value": 42}
         format_ = MatrixFormat.LOOM.value
 
@@ -107,20 +140,29 @@ class TestCore(unittest.TestCase):
         body.pop('format')
 
         mock_lambda_invoke.assert_called_once_with(LambdaName.DRIVER_V1, body)
-        mock_dynamo_create_request.assert_called_once_with(mock.ANY,
-                                                           format_,
-                                                           ["test.field1", "test.field2"],
-                                                           "transcript",
-                                                           GenusSpecies.HUMAN)
+        mock_dynamo_create_request.assert_called_once_with([{'request_id': mock.ANY,
+                                                             'fmt': format_,
+                                                             'metadata_fields': ["test.field1", "test.field2"],
+                                                             'feature': "transcript",
+                                                             'genus_species': GenusSpecies.HUMAN,
+                                                             'query_hash': mock.ANY}], 0)
         mock_cw_put.assert_called_once_with(metric_name=MetricName.REQUEST, metric_value=1)
         self.assertEqual(type(response[0]['request_id']), str)
         self.assertEqual(response[0]['status'], MatrixRequestStatus.IN_PROGRESS.value)
         self.assertEqual(response[1], requests.codes.accepted)
 
-    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entry")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.coalesce", autospec=True,
+                side_effect=lambda request_tracker, query_hash: request_tracker.request_id)
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
     @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
     @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
-    def test_post_matrix_with_fields_and_feature_mtx(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request):
+    def test_post_matrix_with_fields_and_feature_mtx(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                                     mock_lookup_cached_request, mock_get_current_data_version,
+                                                     mock_coalesce):
+        mock_lookup_cached_request.return_value = ""
+        mock_get_current_data_version.return_value = 0
         filter_ = {"op": ">", "field": "foo", "value": 42}
         format_ = MatrixFormat.MTX.value
 
@@ -137,16 +179,95 @@ class TestCore(unittest.TestCase):
         body.pop('format')
 
         mock_lambda_invoke.assert_called_once_with(LambdaName.DRIVER_V1, body)
-        mock_dynamo_create_request.assert_called_once_with(mock.ANY,
-                                                           format_,
-                                                           ["test.field1", "test.field2", "cell.barcode"],
-                                                           "transcript",
-                                                           GenusSpecies.HUMAN)
+        fields = ["test.field1", "test.field2", "cell.barcode"]
+        mock_dynamo_create_request.assert_called_once_with([{'request_id': mock.ANY,
+                                                             'fmt': format_,
+                                                             'metadata_fields': fields,
+                                                             'feature': "transcript",
+                                                             'genus_species': GenusSpecies.HUMAN,
+                                                             'query_hash': mock.ANY}], 0)
         mock_cw_put.assert_called_once_with(metric_name=MetricName.REQUEST, metric_value=1)
         self.assertEqual(type(response[0]['request_id']), str)
         self.assertEqual(response[0]['status'], MatrixRequestStatus.IN_PROGRESS.value)
         self.assertEqual(response[1], requests.codes.accepted)
 
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
+    @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_post_matrix_cached_request(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                        mock_lookup_cached_request, mock_get_current_data_version):
+        mock_lookup_cached_request.return_value = "test_cached_request_id"
+        mock_get_current_data_version.return_value = 0
+        filter_ = {"op": "and", "value": [{"op": ">", "field": "foo", "value": 42},
+                                          {"op": "in", "field": "bar", "value": ["b", "a"]}]}
+        equivalent_filter_ = {"op": "and", "value": [{"op": "in", "field": "bar", "value": ["a", "b", "a"]},
+                                                     {"op": ">", "field": "foo", "value": 42}]}
+
+        response = core.post_matrix({'filter': filter_, 'format': MatrixFormat.LOOM.value})
+        core.post_matrix({'filter': equivalent_filter_, 'format': MatrixFormat.LOOM.value})
+
+        self.assertEqual(mock_lookup_cached_request.call_count, 2)
+        self.assertEqual(mock_lookup_cached_request.call_args_list[0], mock_lookup_cached_request.call_args_list[1])
+        mock_lambda_invoke.assert_not_called()
+        mock_dynamo_create_request.assert_not_called()
+        mock_cw_put.assert_not_called()
+        self.assertEqual(response[0]['request_id'], "test_cached_request_id")
+        self.assertEqual(response[0]['status'], MatrixRequestStatus.COMPLETE.value)
+        self.assertNotIn("started", response[0]['message'])
+        self.assertEqual(response[1], requests.codes.accepted)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.coalesce")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
+    @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_post_matrix_in_flight_request(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                           mock_lookup_cached_request, mock_get_current_data_version, mock_coalesce):
+        mock_lookup_cached_request.return_value = ""
+        mock_get_current_data_version.return_value = 0
+        mock_coalesce.return_value = "test_in_flight_request_id"
+
+        response = core.post_matrix({'filter': {"op": ">", "field": "foo", "value": 42},
+                                     'format': MatrixFormat.LOOM.value})
+
+        mock_dynamo_create_request.assert_called_once()
+        entry = mock_dynamo_create_request.call_args[0][0][0]
+        mock_coalesce.assert_called_once_with(entry['query_hash'])
+        mock_lambda_invoke.assert_not_called()
+        self.assertEqual(response[0]['request_id'], entry['request_id'])
+        self.assertNotEqual(response[0]['request_id'], "test_in_flight_request_id")
+        self.assertEqual(response[1], requests.codes.accepted)
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.coalesce", autospec=True,
+                side_effect=lambda request_tracker, query_hash: request_tracker.request_id)
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.lookup_cached_request")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.create_request_table_entries")
+    @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_post_matrix_with_deep_filter(self, mock_cw_put, mock_lambda_invoke, mock_dynamo_create_request,
+                                          mock_lookup_cached_request, mock_get_current_data_version, mock_coalesce):
+        mock_lookup_cached_request.return_value = ""
+        mock_get_current_data_version.return_value = 0
+        species_filter = {"op": "=", "field": "cell_suspension.genus_species.ontology", "value": "NCBITaxon:10090"}
+        filter_ = species_filter
+        for _ in range(5 * sys.getrecursionlimit()):
+            filter_ = {"op": "or", "value": [filter_]}
+
+        response = core.post_matrix({'filter': filter_, 'format': MatrixFormat.LOOM.value})
+
+        self.assertEqual(response[1], requests.codes.accepted)
+        self.assertEqual(response[0]['status'], MatrixRequestStatus.IN_PROGRESS.value)
+        # The species term at the bottom of the filter requests every species
+        self.assertEqual(mock_lambda_invoke.call_count, len(GenusSpecies))
+        # and single operand ors are dropped from the canonical filter
+        mock_lookup_cached_request.assert_any_call(query_constructor.create_query_hash(
+            species_filter, constants.DEFAULT_FIELDS, constants.DEFAULT_FEATURE, MatrixFormat.LOOM.value,
+            GenusSpecies.HUMAN, 0))
+
     @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
     def test_post_matrix_with_ids_ok_and_unexpected_format(self, mock_lambda_invoke):
         bundle_fqids = ["id1", "id2"]
@@ -266,6 +387,28 @@ class TestCore(unittest.TestCase):
         self.assertEqual(response[0]['status'], MatrixRequestStatus.FAILED.value)
         self.assertEqual(response[0]['message'], "test error")
 
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.is_initialized")
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_table_item")
+    def test_get_matrix_follower(self, mock_get_table_item, mock_initialized):
+        request_id = str(uuid.uuid4())
+        leader_request_id = str(uuid.uuid4())
+        mock_initialized.return_value = True
+        mock_get_table_item.side_effect = lambda table, key: {
+            request_id: {RequestTableField.ERROR_MESSAGE.value: "",
+                         RequestTableField.FORMAT.value: "loom",
+                         RequestTableField.LEADER_REQUEST_ID.value: leader_request_id},
+            leader_request_id: {RequestTableField.ERROR_MESSAGE.value: f"{leader_request_id} failed",
+                                RequestTableField.FORMAT.value: "loom",
+                                RequestTableField.LEADER_REQUEST_ID.value: "N/A"},
+        }[key]
+
+        response = core.get_matrix(request_id)
+
+        self.assertEqual(response[1], requests.codes.ok)
+        self.assertEqual(response[0]['request_id'], request_id)
+        self.assertEqual(response[0]['status'], MatrixRequestStatus.FAILED.value)
+        self.assertEqual(response[0]['message'], f"{request_id} failed")
+
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.size")
     @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_table_item")
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.is_request_complete")
@@ -410,19 +553,24 @@ class TestCore(unittest.TestCase):
         self.assertEqual(response[1], requests.codes.ok)
         self.assertListEqual(response[0], list(constants.FEATURE_DETAIL.keys()))
 
-    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
-    def test_get_filter_detail(self, mock_transaction):
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.get_field_detail")
+    def test_get_filter_detail(self, mock_get_field_detail, mock_get_current_data_version):
+        mock_get_current_data_version.return_value = 3
 
         response = core.get_filter_detail("not.a.real.filter.")
         self.assertEqual(response[1], requests.codes.not_found)
+        mock_get_field_detail.assert_not_called()
 
         filter_ = 'donor_organism.human_specific.ethnicity.ontology'
         description = constants.FILTER_DETAIL[filter_]
 
-        mock_transaction.return_value = [("abc", 123), ("def", 456), (None, 789)]
+        mock_get_field_detail.return_value = {"field_type": "categorical",
+                                              "cell_counts": {"abc": 123, "def": 456, "": 789}}
 
         response = core.get_filter_detail(filter_)
 
+        mock_get_field_detail.assert_called_once_with(filter_, 3)
         self.assertEqual(response[1], requests.codes.ok)
         self.assertDictEqual(
             response[0],
@@ -434,7 +582,7 @@ class TestCore(unittest.TestCase):
 
         filter_ = 'genes_detected'
         description = constants.FILTER_DETAIL[filter_]
-        mock_transaction.return_value = [(10, 100)]
+        mock_get_field_detail.return_value = {"field_type": "numeric", "minimum": 10, "maximum": 100}
         response = core.get_filter_detail(filter_)
 
         self.assertEqual(response[1], requests.codes.ok)
@@ -447,36 +595,23 @@ class TestCore(unittest.TestCase):
                 "minimum": 10,
                 "maximum": 100})
 
-    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
-    def test_get_filter_detail_boolean(self, mock_transaction):
-        filter_ = 'emptydrops_is_cell'
-        description = constants.FILTER_DETAIL[filter_]
-
-        mock_transaction.return_value = [(True, 123), (False, 456), (None, 789)]
-
-        response = core.get_filter_detail(filter_)
-
-        self.assertEqual(response[1], requests.codes.ok)
-        self.assertDictEqual(
-            response[0],
-            {
-                "field_name": filter_,
-                "field_description": description,
-                "field_type": "categorical",
-                "cell_counts": {"True": 123, "False": 456, "": 789}})
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.get_current_data_version")
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.get_field_detail")
+    def test_get_field(self, mock_get_field_detail, mock_get_current_data_version):
+        mock_get_current_data_version.return_value = 3
 
-    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
-    def test_get_field(self, mock_transaction):
         response = core.get_field_detail("not.a.real.field.")
         self.assertEqual(response[1], requests.codes.not_found)
+        mock_get_field_detail.assert_not_called()
 
         field = 'donor_organism.human_specific.ethnicity.ontology'
         description = constants.FIELD_DETAIL[field]
 
-        mock_transaction.return_value = [("abc", 123), ("def", 456)]
+        mock_get_field_detail.return_value = {"field_type": "categorical", "cell_counts": {"abc": 123, "def": 456}}
 
         response = core.get_field_detail(field)
 
+        mock_get_field_detail.assert_called_once_with(field, 3)
         self.assertEqual(response[1], requests.codes.ok)
         self.assertDictEqual(
             response[0],
@@ -486,21 +621,6 @@ class TestCore(unittest.TestCase):
                 "field_type": "categorical",
                 "cell_counts": {"abc": 123, "def": 456}})
 
-        field = 'genes_detected'
-        description = constants.FIELD_DETAIL[field]
-        mock_transaction.return_value = [(10, 100)]
-        response = core.get_field_detail(field)
-
-        self.assertEqual(response[1], requests.codes.ok)
-        self.assertDictEqual(
-            response[0],
-            {
-                "field_name": field,
-                "field_description": description,
-                "field_type": "numeric",
-                "minimum": 10,
-                "maximum": 100})
-
     def test_get_feature_detail(self):
 
         response = core.get_feature_detail("gene")
@@ -524,3 +644,49 @@ class TestCore(unittest.TestCase):
 
         response = core.get_format_detail("not.a.format")
         self.assertEqual(response[1], requests.codes.not_found)
+
+
+class TestCoreUsingMockAWS(MatrixTestCaseUsingMockAWS):
+
+    def setUp(self):
+        super(TestCoreUsingMockAWS, self).setUp()
+
+        self.create_test_data_version_table()
+        self.create_test_deployment_table()
+        self.create_test_request_table()
+        self.create_test_query_cache_table()
+        self.create_test_result_cache_table()
+        self.create_s3_results_bucket()
+
+        self.init_test_data_version_table()
+        self.init_test_deployment_table()
+
+        self.dynamo_handler = DynamoHandler()
+
+    @mock.patch("matrix.common.aws.lambda_handler.LambdaHandler.invoke")
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_post_matrix_cached_request_after_notification(self, mock_cw_put, mock_lambda_invoke):
+        body = {'filter': {"op": ">", "field": "foo", "value": 42}, 'format': MatrixFormat.LOOM.value}
+        query_hash = query_constructor.create_query_hash(body['filter'], constants.DEFAULT_FIELDS,
+                                                         constants.DEFAULT_FEATURE, MatrixFormat.LOOM.value,
+                                                         GenusSpecies.HUMAN, 0)
+        cached_request_id = str(uuid.uuid4())
+        self.dynamo_handler.create_request_table_entry(cached_request_id, MatrixFormat.LOOM.value,
+                                                       query_hash=query_hash, data_version=0)
+        self.dynamo_handler.create_query_cache_table_entry(query_hash, cached_request_id, 0)
+        S3Handler(os.environ['MATRIX_RESULTS_BUCKET']).store_content_in_s3(
+            RequestTracker(cached_request_id).s3_results_key, "test matrix")
+
+        with self.subTest("Identical requests are served by the cached request"):
+            response = core.post_matrix(body)
+            self.assertEqual(response[0]['request_id'], cached_request_id)
+            mock_lambda_invoke.assert_not_called()
+
+        with self.subTest("Identical requests after a notification modified the data start a new request"):
+            # Processing a bundle notification records the modification (see NotificationHandler.run)
+            self.dynamo_handler.set_data_modification_date()
+
+            response = core.post_matrix(body)
+            self.assertNotEqual(response[0]['request_id'], cached_request_id)
+            self.assertEqual(response[0]['status'], MatrixRequestStatus.IN_PROGRESS.value)
+            mock_lambda_invoke.assert_called_once_with(LambdaName.DRIVER_V1, mock.ANY)
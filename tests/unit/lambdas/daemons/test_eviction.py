@@ -0,0 +1,135 @@
+import os
+import re
+import subprocess
+import sys
+from datetime import timedelta
+from unittest import mock
+
+from matrix.common import date
+from matrix.common.aws.cloudwatch_handler import MetricName
+from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, RequestTableField, ResultCacheTableField
+from matrix.common.aws.s3_handler import S3Handler
+from matrix.lambdas.daemons.eviction import EvictionHandler
+from tests.unit import MatrixTestCaseUsingMockAWS
+
+
+class TestEvictionHandler(MatrixTestCaseUsingMockAWS):
+
+    def setUp(self):
+        super(TestEvictionHandler, self).setUp()
+
+        self.create_test_deployment_table()
+        self.create_test_request_table()
+        self.create_test_query_cache_table()
+        self.create_test_result_cache_table()
+
+        self.init_test_deployment_table()
+        self.create_s3_results_bucket()
+
+        self.dynamo_handler = DynamoHandler()
+        self.s3_results_bucket_handler = S3Handler(os.environ['MATRIX_RESULTS_BUCKET'])
+        self.expiration_time = date.to_timestamp(date.get_datetime_now() + timedelta(days=30))
+
+    def _cache_matrix(self, request_id: str, request_hash: str, size: int, hits: int) -> str:
+        self.dynamo_handler.create_request_table_entry(request_id, "loom")
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       request_id,
+                                                       RequestTableField.REQUEST_HASH,
+                                                       request_hash)
+        s3_key = f"0/{request_hash}/{request_id}.loom"
+        self.s3_results_bucket_handler.store_content_in_s3(s3_key, "x" * size)
+        self.dynamo_handler.put_result_cache_table_entry(0, request_hash, "loom", s3_key, size, self.expiration_time)
+        for _ in range(hits):
+            self.dynamo_handler.record_result_cache_hit(DynamoHandler.result_cache_key(0, request_hash, "loom"))
+        return s3_key
+
+    @mock.patch("matrix.common.aws.cloudwatch_handler.CloudwatchHandler.put_metric_data")
+    def test_run(self, mock_put_metric_data):
+        popular_s3_key = self._cache_matrix("popular_id", "popular_hash", 10, 5)
+        cold_s3_key = self._cache_matrix("cold_id", "cold_hash", 100, 0)
+        reused_s3_key = self._cache_matrix("reused_id", "reused_hash", 50, 1)
+
+        # A request aliasing the cold matrix
+        self.dynamo_handler.create_request_table_entry("alias_id", "loom")
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       "alias_id",
+                                                       RequestTableField.REQUEST_HASH,
+                                                       "cold_hash")
+        self.dynamo_handler.add_result_cache_reference(DynamoHandler.result_cache_key(0, "cold_hash", "loom"),
+                                                       cold_s3_key,
+                                                       self.expiration_time)
+        self.dynamo_handler.set_table_field_with_value(DynamoTable.REQUEST_TABLE,
+                                                       "alias_id",
+                                                       RequestTableField.RESULT_ALIAS,
+                                                       cold_s3_key)
+
+        with self.subTest("Matrices within the budget are kept"):
+            EvictionHandler(budget_bytes=160).run()
+
+            self.assertEqual(len(self.dynamo_handler.get_live_result_cache_table_entries()), 3)
+            mock_put_metric_data.assert_not_called()
+
+        with self.subTest("Large cold matrices are evicted first"):
+            EvictionHandler(budget_bytes=70).run()
+
+            self.assertTrue(self.s3_results_bucket_handler.exists(popular_s3_key))
+            self.assertFalse(self.s3_results_bucket_handler.exists(cold_s3_key))
+            self.assertTrue(self.s3_results_bucket_handler.exists(reused_s3_key))
+            self.assertEqual(sorted(entry[ResultCacheTableField.REQUEST_HASH.value]
+                                    for entry in self.dynamo_handler.get_live_result_cache_table_entries()),
+                             ["popular_hash", "reused_hash"])
+
+            for request_id in ["cold_id", "alias_id"]:
+                item = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=request_id)
+                self.assertEqual(item[RequestTableField.ERROR_MESSAGE.value], EvictionHandler.EVICTION_MESSAGE)
+            for request_id in ["popular_id", "reused_id"]:
+                item = self.dynamo_handler.get_table_item(DynamoTable.REQUEST_TABLE, key=request_id)
+                self.assertEqual(item[RequestTableField.ERROR_MESSAGE.value], 0)
+
+            mock_put_metric_data.assert_any_call(metric_name=MetricName.CACHE_EVICTION, metric_value=1)
+            mock_put_metric_data.assert_any_call(metric_name=MetricName.CACHE_EVICTED_BYTES, metric_value=100)
+
+    def test_priority(self):
+        now = date.get_datetime_now()
+        entry = {
+            ResultCacheTableField.SIZE.value: 10,
+            ResultCacheTableField.HIT_COUNT.value: 3,
+            ResultCacheTableField.LAST_ACCESS_DATE.value: date.to_string(now),
+        }
+        self.assertEqual(EvictionHandler.priority(entry, now), 0.4)
+
+        idle_now = now + timedelta(days=EvictionHandler.ACCESS_HALF_LIFE_DAYS)
+        self.assertAlmostEqual(EvictionHandler.priority(entry, idle_now), 0.2)
+
+        entry[ResultCacheTableField.SIZE.value] = 20
+        self.assertEqual(EvictionHandler.priority(entry, now), 0.2)
+
+    def test_init_with_terraform_environment(self):
+        # Dynamo table names are read on import, so the handler is built in a process with only the
+        # environment the eviction lambda declares, plus the variables set by the Lambda runtime
+        repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+        terraform_path = os.path.join(repo_root, "terraform", "modules", "matrix-service", "lambdas",
+                                      "eviction_lambda.tf")
+        with open(terraform_path) as fh:
+            variables_block = re.search(r"variables = \{(.*?)\}\s*\}", fh.read(), re.DOTALL).group(1)
+
+        environment = {
+            'AWS_DEFAULT_REGION': os.environ['AWS_DEFAULT_REGION'],
+            'AWS_ACCESS_KEY_ID': "test_access_key_id",
+            'AWS_SECRET_ACCESS_KEY': "test_secret_access_key",
+            'PATH': os.environ['PATH'],
+        }
+        for name, value in re.findall(r"^\s*(\w+)\s*=\s*(.+?)\s*$", variables_block, re.MULTILINE):
+            value = value.replace("${var.deployment_stage}", "test_deployment_stage").strip('"')
+            environment[name] = "1073741824" if value.startswith("var.") else value
+
+        process = subprocess.run([sys.executable, "-c",
+                                  "from matrix.lambdas.daemons.eviction import EvictionHandler; "
+                                  "from matrix.common.request.request_tracker import RequestTracker; "
+                                  "EvictionHandler(); RequestTracker('test_request_id')"],
+                                 cwd=repo_root,
+                                 env=environment,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+
+        self.assertEqual(process.returncode, 0, process.stderr.decode())
@@ -11,6 +11,13 @@ class TestNotificationHandler(unittest.TestCase):
         self.bundle_uuid = "test_uuid"
         self.bundle_version = "test_version"
 
+        # Processed notifications invalidate cached results in AWS (see test_run_invalidates_cached_results)
+        for target in ["matrix.common.aws.dynamo_handler.DynamoHandler.set_data_modification_date",
+                       "matrix.common.query.field_detail_service.FieldDetailService.delete_stored_field_details"]:
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     @mock.patch("matrix.lambdas.daemons.notification.NotificationHandler.update_bundle")
     def test_create_event(self, mock_update_bundle):
         handler = NotificationHandler(self.bundle_uuid, self.bundle_version, "CREATE")
@@ -72,16 +79,39 @@ class TestNotificationHandler(unittest.TestCase):
         handler.remove_bundle()
 
         mock_transaction.assert_called_once_with([
-            NotificationHandler.DELETE_EXPRESSION_QUERY_TEMPLATE.format(
-                bundle_uuid=self.bundle_uuid,
-                bundle_version=self.bundle_version
-            ),
-            NotificationHandler.DELETE_CELL_QUERY_TEMPLATE.format(
-                bundle_uuid=self.bundle_uuid,
-                bundle_version=self.bundle_version
-            ),
-            NotificationHandler.DELETE_ANALYSIS_QUERY_TEMPLATE.format(
-                bundle_uuid=self.bundle_uuid,
-                bundle_version=self.bundle_version
-            )
+            "CREATE TEMP TABLE bundle_fqids (bundle_fqid VARCHAR(256) NOT NULL) DISTSTYLE ALL;",
+            f"INSERT INTO bundle_fqids VALUES ('{self.bundle_uuid}.{self.bundle_version}');",
+            NotificationHandler.DELETE_EXPRESSION_QUERY_TEMPLATE,
+            NotificationHandler.DELETE_CELL_QUERY_TEMPLATE,
+            NotificationHandler.DELETE_ANALYSIS_QUERY_TEMPLATE
         ])
+
+    @mock.patch("matrix.common.aws.dynamo_handler.DynamoHandler.set_data_modification_date")
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.delete_stored_field_details")
+    @mock.patch("matrix.lambdas.daemons.notification.NotificationHandler.remove_bundle")
+    @mock.patch("matrix.lambdas.daemons.notification.NotificationHandler.update_bundle")
+    def test_run_invalidates_cached_results(self,
+                                            mock_update_bundle,
+                                            mock_remove_bundle,
+                                            mock_delete_stored_field_details,
+                                            mock_set_data_modification_date):
+        for event_type in ["CREATE", "UPDATE", "DELETE", "TOMBSTONE"]:
+            with self.subTest(event_type):
+                mock_delete_stored_field_details.reset_mock()
+                mock_set_data_modification_date.reset_mock()
+                NotificationHandler(self.bundle_uuid, self.bundle_version, event_type).run()
+                mock_delete_stored_field_details.assert_called_once_with()
+                mock_set_data_modification_date.assert_called_once_with()
+
+        with self.subTest("Invalid event"):
+            mock_delete_stored_field_details.reset_mock()
+            mock_set_data_modification_date.reset_mock()
+            NotificationHandler(self.bundle_uuid, self.bundle_version, "INVALID").run()
+            mock_delete_stored_field_details.assert_not_called()
+            mock_set_data_modification_date.assert_not_called()
+
+        with self.subTest("Failures to delete the statistics do not fail the notification"):
+            mock_delete_stored_field_details.side_effect = Exception("test")
+            with mock.patch("matrix.lambdas.daemons.notification.logger.warning") as mock_warning:
+                NotificationHandler(self.bundle_uuid, self.bundle_version, "DELETE").run()
+                mock_warning.assert_called_once()
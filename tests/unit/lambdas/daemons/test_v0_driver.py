@@ -1,8 +1,10 @@
+import os
 import unittest
 import uuid
 from unittest import mock
 
 from matrix.common.aws.dynamo_handler import DynamoTable, RequestTableField
+from matrix.common.aws.redshift_handler import RedshiftHandler
 from matrix.common.constants import GenusSpecies
 from matrix.common.request.request_tracker import Subtask
 from matrix.common.config import MatrixInfraConfig
@@ -181,3 +183,42 @@ class TestDriver(unittest.TestCase):
              QueryType.FEATURE: "test_key",
              QueryType.EXPRESSION: "test_key"},
             result)
+
+    @mock.patch("matrix.lambdas.daemons.v0.driver.Driver.redshift_role_arn", new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    def test__format_and_store_queries_in_s3_stages_bundle_uuids(self, mock_store_in_s3, mock_redshift_role):
+        self._driver.query_results_bucket = "test_query_results_bucket"
+        mock_redshift_role.return_value = "test_redshift_role_arn"
+        mock_store_in_s3.return_value = "test_key"
+
+        self._driver._format_and_store_queries_in_s3(["id1", "id2"], GenusSpecies.HUMAN.value)
+
+        queries = {c[0][0]: c[0][1] for c in mock_store_in_s3.call_args_list}
+        for query_type in ["cell", "expression"]:
+            query = queries[f"{self.request_id}/{query_type}"]
+            self.assertIn("CREATE TEMP TABLE bundle_uuids", query)
+            self.assertIn("INSERT INTO bundle_uuids VALUES ('id1'), ('id2');", query)
+            self.assertIn("INNER JOIN bundle_uuids on (analysis.bundle_uuid = bundle_uuids.bundle_uuid)", query)
+            self.assertNotIn(" IN ", query)
+
+    @mock.patch("matrix.lambdas.daemons.v0.driver.Driver.redshift_role_arn", new_callable=mock.PropertyMock)
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    def test__stage_bundle_uuids_queries(self, mock_store_in_s3, mock_redshift_role):
+        mock_redshift_role.return_value = "test_redshift_role_arn"
+
+        with self.subTest("Small key sets are inserted"):
+            queries = self._driver._stage_bundle_uuids_queries(["id1", "id2"])
+
+            self.assertEqual(queries[1], "INSERT INTO bundle_uuids VALUES ('id1'), ('id2');")
+            mock_store_in_s3.assert_not_called()
+
+        with self.subTest("Large key sets are copied from S3 once"):
+            bundle_uuids = [f"id{i}" for i in range(RedshiftHandler.KEY_SET_INSERT_BATCH_SIZE + 1)]
+
+            queries = self._driver._stage_bundle_uuids_queries(bundle_uuids)
+            self._driver._stage_bundle_uuids_queries(bundle_uuids)
+
+            mock_store_in_s3.assert_called_once_with(f"{self.request_id}/bundle_uuids", "\n".join(bundle_uuids))
+            self.assertEqual(queries[1],
+                             f"COPY bundle_uuids FROM 's3://{os.environ['MATRIX_QUERY_BUCKET']}/{self.request_id}"
+                             f"/bundle_uuids' IAM_ROLE 'test_redshift_role_arn' FORMAT AS CSV;")
@@ -5,8 +5,9 @@ from unittest import mock
 from matrix.common.constants import GenusSpecies
 from matrix.common.request.request_tracker import Subtask
 from matrix.common.config import MatrixInfraConfig
+from matrix.common.query import expression_shards
 from matrix.lambdas.daemons.v1.driver import Driver
-from matrix.docker.query_runner import QueryType
+from matrix.docker.query_runner import QueryPriority, QueryType
 
 
 class TestDriver(unittest.TestCase):
@@ -14,6 +15,7 @@ class TestDriver(unittest.TestCase):
         self.request_id = str(uuid.uuid4())
         self._driver = Driver(self.request_id)
 
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
     @mock.patch("matrix.lambdas.daemons.v1.driver.Driver.redshift_role_arn")
     @mock.patch("matrix.lambdas.daemons.v1.driver.Driver._add_request_query_to_sqs")
     @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
@@ -22,18 +24,124 @@ class TestDriver(unittest.TestCase):
                                  mock_complete_subtask_execution,
                                  mock_store_content_in_s3,
                                  mock_add_to_sqs,
-                                 mock_redshift_role):
+                                 mock_redshift_role,
+                                 mock_transaction):
         filter_ = {"op": "in", "field": "foo", "value": [1, 2, 3]}
         fields = ["test.field1", "test.field2"]
         feature = "gene"
 
         mock_store_content_in_s3.return_value = "s3_key"
         mock_redshift_role.return_value = "redshift_role"
+        mock_transaction.return_value = [(1000, 2000000)]
+        self._driver.two_phase = False
 
         self._driver.run(filter_, fields, feature, GenusSpecies.HUMAN.value)
 
         mock_complete_subtask_execution.assert_called_once_with(Subtask.DRIVER)
         self.assertEqual(mock_store_content_in_s3.call_count, 3)
+        self.assertEqual(mock_add_to_sqs.call_args_list, [
+            mock.call(QueryType.CELL,
+                      "s3_key",
+                      priority=QueryPriority.SMALL,
+                      deferred_queries={'expression': ["s3_key"], 'feature': "s3_key"},
+                      expression_priority="small")
+        ])
+
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.lambdas.daemons.v1.driver.Driver.redshift_role_arn")
+    @mock.patch("matrix.lambdas.daemons.v1.driver.Driver._add_request_query_to_sqs")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
+    def test_run_two_phase(self,
+                           mock_complete_subtask_execution,
+                           mock_store_content_in_s3,
+                           mock_add_to_sqs,
+                           mock_redshift_role,
+                           mock_transaction):
+        filter_ = {"op": "in", "field": "foo", "value": [1, 2, 3]}
+        fields = ["test.field1", "test.field2"]
+        feature = "gene"
+
+        mock_store_content_in_s3.side_effect = lambda key, content: key
+        mock_redshift_role.return_value = "redshift_role"
+        self._driver.two_phase = True
+
+        self._driver.run(filter_, fields, feature, GenusSpecies.HUMAN.value)
+
+        # The filter is only evaluated by the cell keys query, which also sizes the request
+        mock_transaction.assert_not_called()
+        mock_complete_subtask_execution.assert_called_once_with(Subtask.DRIVER)
+        self.assertEqual(mock_store_content_in_s3.call_count, 4)
+        stored_queries = {c[0][0]: c[0][1] for c in mock_store_content_in_s3.call_args_list}
+        cell_keys_table = f"cell_keys_{self.request_id.replace('-', '_')}"
+        self.assertIn(f"CREATE TABLE {cell_keys_table}", stored_queries[f"{self.request_id}/cell_keys"])
+        expression_template = stored_queries[f"{self.request_id}/expression_template"]
+        self.assertIn(f"INNER JOIN {cell_keys_table} cell_keys", expression_template)
+        self.assertIn("{shard_where_clause}", expression_template)
+        self.assertIn(f"/{self.request_id}/{{expression_prefix}}'", expression_template)
+        self.assertEqual(mock_add_to_sqs.call_args_list, [
+            mock.call(QueryType.CELL_KEYS,
+                      f"{self.request_id}/cell_keys",
+                      cell_keys_table=cell_keys_table,
+                      deferred_queries={'cell': f"{self.request_id}/cell",
+                                        'expression': f"{self.request_id}/expression_template",
+                                        'feature': f"{self.request_id}/feature"})
+        ])
+
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.set_num_expression_shards")
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    @mock.patch("matrix.lambdas.daemons.v1.driver.Driver.redshift_role_arn")
+    @mock.patch("matrix.lambdas.daemons.v1.driver.Driver._add_request_query_to_sqs")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
+    def test_run_sharded(self,
+                         mock_complete_subtask_execution,
+                         mock_store_content_in_s3,
+                         mock_add_to_sqs,
+                         mock_redshift_role,
+                         mock_transaction,
+                         mock_set_num_expression_shards):
+        filter_ = {"op": "in", "field": "foo", "value": [1, 2, 3]}
+        fields = ["test.field1", "test.field2"]
+        feature = "gene"
+
+        mock_store_content_in_s3.side_effect = lambda key, content: key
+        mock_redshift_role.return_value = "redshift_role"
+        mock_transaction.return_value = [(2 * expression_shards.EXPRESSION_SHARD_CELLS + 1, 100000000)]
+        self._driver.two_phase = False
+
+        self._driver.run(filter_, fields, feature, GenusSpecies.HUMAN.value)
+
+        mock_set_num_expression_shards.assert_called_once_with(3)
+        self.assertEqual(mock_store_content_in_s3.call_count, 5)
+        shard_queries = {c[0][0]: c[0][1] for c in mock_store_content_in_s3.call_args_list
+                         if "/expression" in c[0][0]}
+        for shard in range(3):
+            shard_query = shard_queries[f"{self.request_id}/expression_{shard}"]
+            self.assertIn(f"% 3 = {shard}", shard_query)
+            self.assertIn(f"/{self.request_id}/expression_{shard}_'", shard_query)
+        self.assertEqual(mock_add_to_sqs.call_args_list, [
+            mock.call(QueryType.CELL,
+                      f"{self.request_id}/cell",
+                      priority=QueryPriority.SMALL,
+                      deferred_queries={'expression': [f"{self.request_id}/expression_{shard}" for shard in range(3)],
+                                        'feature': f"{self.request_id}/feature"},
+                      expression_priority="medium")
+        ])
+
+    @mock.patch("matrix.common.aws.redshift_handler.RedshiftHandler.transaction")
+    def test_estimate_request_size(self, mock_transaction):
+        filter_ = {"op": "=", "field": "foo", "value": 1}
+        mock_transaction.return_value = [(1000, 2000000)]
+
+        self.assertEqual(self._driver._estimate_request_size(filter_), (1000, 2000000))
+        self.assertIn("SELECT COUNT(*), COALESCE(SUM(cell.genes_detected), 0)", mock_transaction.call_args[0][0][0])
+        self.assertEqual(mock_transaction.call_args[1], {'return_results': True, 'read_only': True})
+
+    def test_query_priority(self):
+        from_cost = QueryPriority.from_cost
+        self.assertEqual([from_cost(0), from_cost(50000000), from_cost(50000001), from_cost(300000000)],
+                         [QueryPriority.SMALL, QueryPriority.SMALL, QueryPriority.MEDIUM, QueryPriority.LARGE])
 
     @mock.patch("matrix.common.aws.sqs_handler.SQSHandler.add_message_to_queue")
     @mock.patch("matrix.common.request.request_tracker.RequestTracker.complete_subtask_execution")
@@ -43,15 +151,59 @@ class TestDriver(unittest.TestCase):
                                           mock_complete_subtask_execution,
                                           mock_add_to_queue):
         config = MatrixInfraConfig()
-        config.set({'query_job_q_url': "query_job_q_url"})
-        self._driver.config = config
+        config.set({'query_job_q_url': "query_job_q_url",
+                    'query_job_small_q_url': "query_job_small_q_url",
+                    'query_job_large_q_url': "query_job_large_q_url"})
+        self._driver.infra_config = config
         test_query_loc = "test_path"
 
-        self._driver._add_request_query_to_sqs(QueryType.CELL, test_query_loc)
+        for priority, queue_url in [(QueryPriority.SMALL, "query_job_small_q_url"),
+                                    (QueryPriority.MEDIUM, "query_job_q_url"),
+                                    (QueryPriority.LARGE, "query_job_large_q_url")]:
+            with self.subTest(priority=priority):
+                self._driver._add_request_query_to_sqs(QueryType.CELL, test_query_loc, priority=priority)
+
+                payload = {
+                    'request_id': self.request_id,
+                    's3_obj_key': test_query_loc,
+                    'type': "cell",
+                    'priority': priority.value
+                }
+                mock_add_to_queue.assert_called_with(queue_url, payload)
+
+    @mock.patch("matrix.common.aws.sqs_handler.SQSHandler.add_message_to_queue")
+    @mock.patch("matrix.common.aws.s3_handler.S3Handler.store_content_in_s3")
+    @mock.patch("matrix.lambdas.daemons.v1.driver.Driver.redshift_role_arn")
+    def test___add_request_queries_to_sqs__with_inline_query(self,
+                                                             mock_redshift_role,
+                                                             mock_store_content_in_s3,
+                                                             mock_add_to_queue):
+        config = MatrixInfraConfig()
+        config.set({'query_job_q_url': "query_job_q_url",
+                    'query_job_small_q_url': "query_job_small_q_url",
+                    'query_job_large_q_url': "query_job_large_q_url"})
+        self._driver.infra_config = config
+        mock_store_content_in_s3.side_effect = lambda key, content: key
+        s3_obj_keys = self._driver._format_and_store_queries_in_s3({
+            QueryType.CELL: "small query",
+            QueryType.FEATURE: "x" * (Driver.MAX_INLINE_QUERY_BYTES + 1),
+        }, GenusSpecies.HUMAN.value)
+
+        self._driver._add_request_query_to_sqs(QueryType.CELL, s3_obj_keys[QueryType.CELL])
+        self._driver._add_request_query_to_sqs(QueryType.FEATURE, s3_obj_keys[QueryType.FEATURE])
 
-        payload = {
-            'request_id': self.request_id,
-            's3_obj_key': test_query_loc,
-            'type': "cell"
-        }
-        mock_add_to_queue.assert_called_once_with("query_job_q_url", payload)
+        self.assertEqual(mock_add_to_queue.call_args_list, [
+            mock.call("query_job_q_url", {
+                'request_id': self.request_id,
+                's3_obj_key': f"{self.request_id}/cell",
+                'type': "cell",
+                'priority': "medium",
+                'query': "small query"
+            }),
+            mock.call("query_job_q_url", {
+                'request_id': self.request_id,
+                's3_obj_key': f"{self.request_id}/feature",
+                'type': "feature",
+                'priority': "medium"
+            })
+        ])
@@ -21,22 +21,27 @@ class TestBumpDataVersion(MatrixTestCaseUsingMockAWS):
         self.dynamo_handler = DynamoHandler()
         self.deployment_stage = os.environ['DEPLOYMENT_STAGE']
 
-    @mock.patch("matrix.common.v1_api_handler.V1ApiHandler.describe_filter")
-    def test_bump_data_version(self, mock_describe_filter):
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.generate_field_details")
+    def test_bump_data_version(self, mock_generate_field_details):
         self.assertEqual(self._get_current_data_version(), 0)
         self.assertTrue(self._data_version_exists(0))
         self.assertFalse(self._data_version_exists(1))
 
-        mock_describe_filter.return_value = {'cell_counts': {'test_project': 1}}
+        mock_generate_field_details.return_value = {
+            'project.provenance.document_id': {'field_type': "categorical", 'cell_counts': {'test_project': 1}}
+        }
         bump_data_version()
 
+        mock_generate_field_details.assert_called_once_with(1)
         self.assertEqual(self._get_current_data_version(), 1)
         self.assertTrue(self._data_version_exists(0))
         self.assertTrue(self._data_version_exists(1))
 
-    @mock.patch("matrix.common.v1_api_handler.V1ApiHandler.describe_filter")
-    def test_bump_data_version_existing(self, mock_describe_filter):
-        mock_describe_filter.return_value = {'cell_counts': {'test_project': 1}}
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.generate_field_details")
+    def test_bump_data_version_existing(self, mock_generate_field_details):
+        mock_generate_field_details.return_value = {
+            'project.provenance.document_id': {'field_type': "categorical", 'cell_counts': {'test_project': 1}}
+        }
         bump_data_version()
         self.assertEqual(self._get_current_data_version(), 1)
         self.assertTrue(self._data_version_exists(1))
@@ -47,6 +52,7 @@ class TestBumpDataVersion(MatrixTestCaseUsingMockAWS):
             self.assertEqual(self._get_current_data_version(), 0)
             bump_data_version()
             mock_create_data_version_table_entry.assert_not_called()
+            mock_generate_field_details.assert_called_once_with(1)
             self.assertEqual(self._get_current_data_version(), 1)
 
     def _set_data_version(self, version):
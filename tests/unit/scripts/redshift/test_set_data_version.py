@@ -22,9 +22,11 @@ class TestSetDataVersion(MatrixTestCaseUsingMockAWS):
         self.dynamo_handler = DynamoHandler()
         self.deployment_stage = os.environ['DEPLOYMENT_STAGE']
 
-    @mock.patch("matrix.common.v1_api_handler.V1ApiHandler.describe_filter")
-    def test_set_data_version(self, mock_describe_filter):
-        mock_describe_filter.return_value = {'cell_counts': {'test_project': 1}}
+    @mock.patch("matrix.common.query.field_detail_service.FieldDetailService.generate_field_details")
+    def test_set_data_version(self, mock_generate_field_details):
+        mock_generate_field_details.return_value = {
+            'project.provenance.document_id': {'field_type': "categorical", 'cell_counts': {'test_project': 1}}
+        }
         bump_data_version()
 
         with self.subTest("Success"):
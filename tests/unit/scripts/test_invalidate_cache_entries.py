@@ -1,7 +1,7 @@
 import os
 import mock
 
-from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, RequestTableField
+from matrix.common.aws.dynamo_handler import DynamoHandler, DynamoTable, RequestTableField, ResultCacheTableField
 from matrix.common.aws.s3_handler import S3Handler
 from scripts.invalidate_cache_entries import invalidate_cache_entries
 from tests.unit import MatrixTestCaseUsingMockAWS
@@ -13,6 +13,7 @@ class TestInvalidateCacheEntries(MatrixTestCaseUsingMockAWS):
 
         self.create_test_deployment_table()
         self.create_test_request_table()
+        self.create_test_result_cache_table()
 
         self.init_test_deployment_table()
         self.create_s3_results_bucket()
@@ -77,6 +78,9 @@ class TestInvalidateCacheEntries(MatrixTestCaseUsingMockAWS):
         self.assertTrue(s3_results_bucket_handler.exists(s3_key_3))
         self.assertTrue(s3_results_bucket_handler.exists(s3_key_4))
 
+        dynamo_handler.put_result_cache_table_entry(0, request_hash_1, test_format, s3_key_1, 1, 2 ** 32)
+        dynamo_handler.put_result_cache_table_entry(0, request_hash_2, test_format, s3_key_4, 1, 2 ** 32)
+
         invalidate_cache_entries(request_ids=[request_id_3],
                                  request_hashes=[request_hash_1])
 
@@ -98,3 +102,10 @@ class TestInvalidateCacheEntries(MatrixTestCaseUsingMockAWS):
         self.assertNotEqual(error_2, 0)
         self.assertNotEqual(error_3, 0)
         self.assertEqual(error_4, 0)
+
+        item_1 = dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE,
+                                               DynamoHandler.result_cache_key(0, request_hash_1, test_format))
+        item_2 = dynamo_handler.get_table_item(DynamoTable.RESULT_CACHE_TABLE,
+                                               DynamoHandler.result_cache_key(0, request_hash_2, test_format))
+        self.assertEqual(item_1[ResultCacheTableField.EXPIRATION_TIME.value], 0)
+        self.assertEqual(item_2[ResultCacheTableField.EXPIRATION_TIME.value], 2 ** 32)